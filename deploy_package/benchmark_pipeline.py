@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+特征化 → 批处理 → 前向计算 流水线的可复现基准测试
+分别测量 GraphFeaturizer._featurize、MPNNPOMModel._prepare_batch、
+MPNNPOM.forward / _readout 以及端到端 OdorPredictorCPU.predict_smiles
+在不同批大小和分子大小区间下的吞吐量与p50/p99延迟，结果输出为JSON，
+并可与已保存的基线对比以发现性能回退
+
+使用示例:
+    python benchmark_pipeline.py --output baseline.json
+    python benchmark_pipeline.py --output current.json --compare baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import pandas as pd
+import torch
+from rdkit import Chem
+from rdkit.Chem import rdmolfiles, rdmolops
+
+from openpom.feat.graph_featurizer import GraphFeaturizer, GraphConvConstants
+from openpom.models.mpnn_pom import MPNNPOMModel
+from predict_odor_cpu import (OdorPredictorCPU, DEFAULT_MODEL_PARAMS,
+                              DEFAULT_CHECKPOINT_NAME)
+
+DATASETS = {
+    'curated_GS_LF': 'openpom/data/curated_datasets/curated_GS_LF_merged_4983.csv',
+    'large_test': 'openpom/utils/test/assets/large_test_dataset.csv',
+}
+SMILES_FIELD = 'nonStereoSMILES'
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+# 按重原子数划分的分子大小区间 [下界, 上界]
+SIZE_BUCKETS = [(1, 10), (11, 20), (21, 30), (31, 1000)]
+SIZE_BUCKET_BATCH_SIZE = 32
+N_TASKS = 138
+
+
+def load_molecules(path, max_molecules=None, seed=0):
+    """读取SMILES并解析为按规范顺序编号的RDKit分子（与预测器一致）"""
+    smiles = pd.read_csv(path)[SMILES_FIELD].dropna().astype(str).tolist()
+    if max_molecules is not None and len(smiles) > max_molecules:
+        rng = np.random.RandomState(seed)
+        smiles = [smiles[i] for i in sorted(
+            rng.choice(len(smiles), max_molecules, replace=False))]
+    pairs = []
+    for s in smiles:
+        mol = Chem.MolFromSmiles(s)
+        if mol is None or mol.GetNumAtoms() == 0:
+            continue
+        mol = rdmolops.RenumberAtoms(mol, rdmolfiles.CanonicalRankAtoms(mol))
+        pairs.append((s, mol))
+    return pairs
+
+
+def summarize(times, molecules_per_call):
+    """将每次调用的耗时汇总为延迟分位数与吞吐量"""
+    times = np.asarray(times)
+    return {
+        'calls': int(len(times)),
+        'molecules_per_call': int(molecules_per_call),
+        'p50_ms': round(float(np.percentile(times, 50)) * 1000, 4),
+        'p99_ms': round(float(np.percentile(times, 99)) * 1000, 4),
+        'mean_ms': round(float(times.mean()) * 1000, 4),
+        'molecules_per_second': round(
+            molecules_per_call * len(times) / float(times.sum()), 2),
+    }
+
+
+def time_calls(fn, inputs, warmup=2):
+    """依次对每个输入调用fn并计时，前warmup次不计入"""
+    for x in inputs[:warmup]:
+        fn(x)
+    times = []
+    for x in inputs:
+        start = time.perf_counter()
+        fn(x)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def sample_batches(n_items, batch_size, repeats, rng):
+    """为每次重复生成确定性的随机批次索引"""
+    replace = batch_size > n_items
+    return [rng.choice(n_items, batch_size, replace=replace)
+            for _ in range(repeats)]
+
+
+def build_model(seed=0):
+    """使用生产结构构建随机初始化的模型（权重不影响耗时）"""
+    torch.manual_seed(seed)
+    model = MPNNPOMModel(n_tasks=N_TASKS,
+                         mode='classification',
+                         n_classes=1,
+                         number_atom_features=GraphConvConstants.ATOM_FDIM,
+                         number_bond_features=GraphConvConstants.BOND_FDIM,
+                         device_name='cpu',
+                         **DEFAULT_MODEL_PARAMS)
+    model.model.eval()
+    return model
+
+
+def build_random_ensemble(n_models, seed=0):
+    """在临时目录中生成随机初始化的集成模型，用于没有真实权重时的端到端测试"""
+    root = tempfile.mkdtemp(prefix='odor_bench_')
+    prefix = os.path.join(root, 'experiments_')
+    for i in range(n_models):
+        model = build_model(seed + i)
+        model_dir = f'{prefix}{i+1}'
+        model.save_checkpoint(max_checkpoints_to_keep=1, model_dir=model_dir)
+        os.rename(os.path.join(model_dir, 'checkpoint1.pt'),
+                  os.path.join(model_dir, DEFAULT_CHECKPOINT_NAME))
+    return prefix, root
+
+
+def bench_featurize(mols, repeats, rng):
+    featurizer = GraphFeaturizer()
+    indices = rng.choice(len(mols), min(repeats * 8, len(mols)), replace=False)
+    return summarize(time_calls(featurizer._featurize,
+                                [mols[i] for i in indices]), 1)
+
+
+def bench_model(model, graphs, batch_sizes, repeats, rng):
+    """_prepare_batch、forward与_readout在各批大小下的耗时"""
+    results = {'prepare_batch': {}, 'forward': {}, 'readout': {}}
+    module = model.model
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            batches = [
+                ([graphs[i] for i in idx], None, None)
+                for idx in sample_batches(len(graphs), batch_size, repeats, rng)
+            ]
+            key = f'batch_size={batch_size}'
+            results['prepare_batch'][key] = summarize(
+                time_calls(lambda b: model._prepare_batch(([b[0]], None, None)),
+                           batches), batch_size)
+
+            prepared = [model._prepare_batch(([b[0]], None, None))[0]
+                        for b in batches]
+            results['forward'][key] = summarize(
+                time_calls(module, prepared), batch_size)
+
+            # _readout单独计时：先计算节点编码
+            readout_inputs = []
+            for g in prepared:
+                node_feats = g.ndata[module.nfeat_name]
+                edge_feats = g.edata[module.efeat_name]
+                readout_inputs.append(
+                    (g, module.mpnn(g, node_feats, edge_feats), edge_feats))
+            results['readout'][key] = summarize(
+                time_calls(lambda x: module._readout(*x), readout_inputs),
+                batch_size)
+    return results
+
+
+def bench_size_buckets(model, mols, graphs, repeats, rng):
+    """按分子大小区间测量特征化与前向计算"""
+    featurizer = GraphFeaturizer()
+    heavy_atoms = np.array([mol.GetNumHeavyAtoms() for mol in mols])
+    results = {}
+    with torch.no_grad():
+        for low, high in SIZE_BUCKETS:
+            members = np.where((heavy_atoms >= low) & (heavy_atoms <= high))[0]
+            if len(members) == 0:
+                continue
+            key = f'heavy_atoms={low}-{high}'
+            batch_size = min(SIZE_BUCKET_BATCH_SIZE, len(members))
+            batches = [members[idx] for idx in
+                       sample_batches(len(members), batch_size, repeats, rng)]
+            prepared = [
+                model._prepare_batch(([[graphs[i] for i in b]], None, None))[0]
+                for b in batches
+            ]
+            results[key] = {
+                'n_molecules': int(len(members)),
+                'featurize': summarize(
+                    time_calls(featurizer._featurize,
+                               [mols[i] for i in members[:repeats * 8]]), 1),
+                'forward': summarize(time_calls(model.model, prepared),
+                                     batch_size),
+            }
+    return results
+
+
+def bench_end_to_end(predictor, smiles, batch_sizes, repeats, rng):
+    results = {}
+    for batch_size in batch_sizes:
+        batches = [[smiles[i] for i in idx] for idx in
+                   sample_batches(len(smiles), batch_size, repeats, rng)]
+        results[f'batch_size={batch_size}'] = summarize(
+            time_calls(lambda b: predictor.predict_smiles(b, batch_size=None),
+                       batches), batch_size)
+    return results
+
+
+def run_suite(datasets, batch_sizes, repeats, max_molecules, predictor,
+              seed=0):
+    model = build_model(seed)
+    results = {}
+    for name in datasets:
+        print(f"\n=== 数据集: {name} ===")
+        rng = np.random.RandomState(seed)
+        pairs = load_molecules(DATASETS[name], max_molecules, seed)
+        smiles = [s for s, _ in pairs]
+        mols = [mol for _, mol in pairs]
+        graphs = GraphFeaturizer().featurize(mols)
+        print(f"  分子数: {len(mols)}")
+
+        dataset_results = {}
+        print("  - featurize")
+        dataset_results['featurize'] = bench_featurize(mols, repeats, rng)
+        print("  - prepare_batch / forward / readout")
+        dataset_results.update(
+            bench_model(model, graphs, batch_sizes, repeats, rng))
+        print("  - 分子大小区间")
+        dataset_results['size_buckets'] = bench_size_buckets(
+            model, mols, graphs, repeats, rng)
+        if predictor is not None:
+            print("  - 端到端 predict_smiles")
+            dataset_results['predict_smiles'] = bench_end_to_end(
+                predictor, smiles, batch_sizes, repeats, rng)
+        results[name] = dataset_results
+    return results
+
+
+def flatten_results(results, prefix=''):
+    """将嵌套结果展开为 {路径: 指标} 以便对比"""
+    flat = {}
+    for key, value in results.items():
+        path = f'{prefix}/{key}' if prefix else key
+        if isinstance(value, dict) and 'p50_ms' in value:
+            flat[path] = value
+        elif isinstance(value, dict):
+            flat.update(flatten_results(value, path))
+    return flat
+
+
+def compare(current, baseline, threshold):
+    """
+    与基线对比，p50或p99延迟变慢超过threshold比例即视为回退
+
+    Returns:
+        list: 回退项 (路径, 指标, 基线值, 当前值, 变化比例)
+    """
+    current_flat = flatten_results(current['results'])
+    baseline_flat = flatten_results(baseline['results'])
+    regressions = []
+    print(f"\n=== 与基线对比（阈值 {threshold:.0%}）===")
+    for path in sorted(current_flat):
+        if path not in baseline_flat:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            old = baseline_flat[path][metric]
+            new = current_flat[path][metric]
+            change = (new - old) / old if old > 0 else 0.0
+            if change > threshold:
+                regressions.append((path, metric, old, new, change))
+                print(f"  ❌ {path} {metric}: {old:.3f} -> {new:.3f} ms "
+                      f"({change:+.1%})")
+    if not regressions:
+        print("  ✓ 未发现性能回退")
+    return regressions
+
+
+def environment_info(threads):
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python_version': platform.python_version(),
+        'torch_version': torch.__version__,
+        'torch_threads': threads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流水线基准测试工具')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='结果JSON文件 (默认: benchmark_results.json)')
+    parser.add_argument('--compare', default=None,
+                        help='基线JSON文件，提供时对比并报告性能回退')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='回退判定阈值 (默认: 0.10，即变慢10%%)')
+    parser.add_argument('--datasets', nargs='+', default=list(DATASETS),
+                        choices=list(DATASETS), help='使用的数据集')
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=BATCH_SIZES, help='批大小列表')
+    parser.add_argument('--repeats', type=int, default=20,
+                        help='每项测量的重复次数 (默认: 20)')
+    parser.add_argument('--max-molecules', type=int, default=None,
+                        help='每个数据集最多使用的分子数')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='PyTorch线程数 (默认: 保持当前设置)')
+    parser.add_argument('--model-prefix', default=None,
+                        help='端到端测试使用的集成模型目录前缀 (默认: 自动搜索)')
+    parser.add_argument('--random-ensemble', type=int, default=None,
+                        help='使用N个随机初始化模型进行端到端测试（无需真实权重）')
+    parser.add_argument('--skip-e2e', action='store_true',
+                        help='跳过端到端 predict_smiles 测试')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    predictor = None
+    temp_root = None
+    if not args.skip_e2e:
+        model_prefix = args.model_prefix
+        n_models = None
+        if args.random_ensemble is not None:
+            model_prefix, temp_root = build_random_ensemble(
+                args.random_ensemble, args.seed)
+            n_models = args.random_ensemble
+        predictor = OdorPredictorCPU(model_dir_prefix=model_prefix,
+                                     n_models=n_models, use_cpu_only=True)
+
+    try:
+        results = run_suite(args.datasets, args.batch_sizes, args.repeats,
+                            args.max_molecules, predictor, args.seed)
+    finally:
+        if temp_root is not None:
+            shutil.rmtree(temp_root, ignore_errors=True)
+
+    report = {
+        'environment': environment_info(torch.get_num_threads()),
+        'config': {
+            'datasets': args.datasets,
+            'batch_sizes': args.batch_sizes,
+            'repeats': args.repeats,
+            'max_molecules': args.max_molecules,
+            'seed': args.seed,
+            'n_models': predictor.n_models if predictor is not None else 0,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ 结果已保存到: {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+bfloat16混合精度一致性检查
+在整理好的GS/LF数据集上对比float32与bfloat16的训练与推理：
+- 推理一致性：同一组权重分别以float32与bfloat16推理，对比预测偏差与ROC-AUC
+- 训练一致性：相同初始权重与数据顺序下分别以两种精度训练，对比留出集ROC-AUC
+- 已部署模型（可选）：以两种精度加载OdorPredictorCPU集成模型，对比留出集预测
+结果写入JSON报告，ROC-AUC差异超过容差时返回非零退出码
+"""
+
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import deepchem as dc
+import torch
+
+from openpom.feat.graph_featurizer import GraphFeaturizer, GraphConvConstants
+from openpom.models.mpnn_pom import MPNNPOMModel
+from openpom.utils.data_utils import (get_class_imbalance_ratio,
+                                      IterativeStratifiedSplitter)
+from openpom.utils.metrics import roc_auc_per_task
+from predict_odor_cpu import OdorPredictorCPU, DEFAULT_MODEL_PARAMS, ODOR_TASKS
+
+DATASET = 'openpom/data/curated_datasets/curated_GS_LF_merged_4983.csv'
+SMILES_FIELD = 'nonStereoSMILES'
+
+
+def load_split(dataset_path=DATASET, tasks=ODOR_TASKS, frac_test=0.2,
+               max_molecules=None, seed=0):
+    """读取并特征化数据集，按迭代分层划分训练集与留出集"""
+    loader = dc.data.CSVLoader(tasks=tasks,
+                               feature_field=SMILES_FIELD,
+                               featurizer=GraphFeaturizer())
+    dataset = loader.create_dataset(inputs=[dataset_path])
+    if max_molecules is not None and max_molecules < len(dataset):
+        rng = np.random.RandomState(seed)
+        dataset = dataset.select(
+            np.sort(rng.choice(len(dataset), max_molecules, replace=False)))
+    splitter = IterativeStratifiedSplitter(order=2)
+    return splitter.train_test_split(dataset, frac_train=1 - frac_test)
+
+
+def build_model(n_tasks, train_ratios, precision, batch_size=64,
+                learning_rate=0.001):
+    """按部署时的结构超参数构建MPNNPOMModel"""
+    return MPNNPOMModel(n_tasks=n_tasks,
+                        batch_size=batch_size,
+                        learning_rate=learning_rate,
+                        class_imbalance_ratio=train_ratios,
+                        loss_aggr_type='sum',
+                        mode='classification',
+                        number_atom_features=GraphConvConstants.ATOM_FDIM,
+                        number_bond_features=GraphConvConstants.BOND_FDIM,
+                        n_classes=1,
+                        optimizer_name='adam',
+                        device_name='cpu',
+                        precision=precision,
+                        **DEFAULT_MODEL_PARAMS)
+
+
+def timed(fn, *args, **kwargs):
+    """执行fn并返回(结果, 耗时秒)"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def macro_roc_auc(y_true, y_pred):
+    """按任务计算ROC-AUC并取平均（跳过只有单一类别的任务）"""
+    return float(np.nanmean(roc_auc_per_task(y_true, y_pred)))
+
+
+def compare_predictions(y_true, reference, candidate):
+    """对比两组预测概率"""
+    diff = np.abs(candidate - reference)
+    reference_auc = macro_roc_auc(y_true, reference)
+    candidate_auc = macro_roc_auc(y_true, candidate)
+    return {
+        'roc_auc_float32': reference_auc,
+        'roc_auc_bfloat16': candidate_auc,
+        'roc_auc_delta': candidate_auc - reference_auc,
+        'max_abs_diff': float(diff.max()),
+        'mean_abs_diff': float(diff.mean()),
+    }
+
+
+def model_parity(train, test, nb_epoch=10, batch_size=64, seed=0):
+    """
+    训练与推理一致性
+
+    两个模型使用相同的初始权重与数据顺序，分别以float32与bfloat16训练；
+    float32模型再以bfloat16推理，得到同一权重下的推理一致性
+    """
+    n_tasks = train.y.shape[1]
+    train_ratios = get_class_imbalance_ratio(train)
+
+    torch.manual_seed(seed)
+    models = {'float32': build_model(n_tasks, train_ratios, 'float32',
+                                     batch_size=batch_size)}
+    models['bfloat16'] = build_model(n_tasks, train_ratios, 'bfloat16',
+                                     batch_size=batch_size)
+    models['bfloat16'].model.load_state_dict(
+        models['float32'].model.state_dict())
+
+    report = {'fit_seconds': {}, 'predict_seconds': {}}
+    predictions = {}
+    for precision, model in models.items():
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        print(f"正在以{precision}训练（{nb_epoch}轮）...")
+        _, seconds = timed(model.fit, train, nb_epoch=nb_epoch,
+                           checkpoint_interval=0)
+        report['fit_seconds'][precision] = round(seconds, 3)
+        model.model.eval()
+        predictions[precision], seconds = timed(model.predict, test)
+        report['predict_seconds'][precision] = round(seconds, 3)
+
+    # 同一组float32权重以bfloat16推理
+    fp32_model = models['float32'].model
+    fp32_model.precision = 'bfloat16'
+    bf16_inference = models['float32'].predict(test)
+    fp32_model.precision = 'float32'
+
+    report['inference'] = compare_predictions(test.y, predictions['float32'],
+                                              bf16_inference)
+    report['training'] = compare_predictions(test.y, predictions['float32'],
+                                             predictions['bfloat16'])
+    report['fit_speedup'] = round(report['fit_seconds']['float32'] /
+                                  report['fit_seconds']['bfloat16'], 2)
+    report['predict_speedup'] = round(
+        report['predict_seconds']['float32'] /
+        report['predict_seconds']['bfloat16'], 2)
+    return report
+
+
+def ensemble_parity(test, model_prefix=None, n_models=None):
+    """已部署集成模型以两种精度加载后的推理一致性"""
+    predictions = {}
+    seconds = {}
+    for precision in ('float32', 'bfloat16'):
+        predictor = OdorPredictorCPU(model_dir_prefix=model_prefix,
+                                     n_models=n_models,
+                                     use_cpu_only=True,
+                                     precision=precision)
+        predictions[precision], seconds[precision] = timed(
+            predictor.predict_dataset, test)
+        predictor.close()
+    report = compare_predictions(test.y, predictions['float32'],
+                                 predictions['bfloat16'])
+    report['predict_seconds'] = {k: round(v, 3) for k, v in seconds.items()}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bfloat16混合精度一致性检查')
+    parser.add_argument('--dataset', default=DATASET, help='有标签数据集CSV')
+    parser.add_argument('--max-molecules', type=int, default=None,
+                        help='随机抽取的分子数（默认: 全部）')
+    parser.add_argument('--epochs', type=int, default=10, help='训练轮数')
+    parser.add_argument('--batch-size', type=int, default=64, help='批大小')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='允许的ROC-AUC差异 (默认: 0.01)')
+    parser.add_argument('--ensemble', action='store_true',
+                        help='同时检查已部署的集成模型')
+    parser.add_argument('--model-prefix', default=None,
+                        help='集成模型目录前缀 (默认: 自动搜索)')
+    parser.add_argument('--n-models', type=int, default=None,
+                        help='集成模型数量')
+    parser.add_argument('--output', default='precision_report.json',
+                        help='报告输出路径')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    print("=== bfloat16混合精度一致性检查 ===")
+    print("正在特征化数据集...")
+    train, test = load_split(args.dataset, max_molecules=args.max_molecules,
+                             seed=args.seed)
+    print(f"  训练集: {len(train)} 留出集: {len(test)}")
+
+    report = {'n_train_molecules': len(train), 'n_test_molecules': len(test),
+              'tolerance': args.tolerance}
+    report['model'] = model_parity(train, test, nb_epoch=args.epochs,
+                                   batch_size=args.batch_size, seed=args.seed)
+    checks = {'inference': report['model']['inference'],
+              'training': report['model']['training']}
+    if args.ensemble:
+        report['ensemble'] = ensemble_parity(test, args.model_prefix,
+                                             args.n_models)
+        checks['ensemble'] = report['ensemble']
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+
+    print("\n一致性报告:")
+    passed = True
+    for name, result in checks.items():
+        ok = abs(result['roc_auc_delta']) <= args.tolerance
+        passed = passed and ok
+        print(f"  {'✓' if ok else '✗'} {name}: ROC-AUC "
+              f"{result['roc_auc_float32']:.4f} -> "
+              f"{result['roc_auc_bfloat16']:.4f} "
+              f"(差异 {result['roc_auc_delta']:+.4f}, "
+              f"最大概率偏差 {result['max_abs_diff']:.4f})")
+    print(f"  训练加速比: {report['model']['fit_speedup']}x, "
+          f"推理加速比: {report['model']['predict_speedup']}x")
+    print(f"\n报告已保存到: {args.output}")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
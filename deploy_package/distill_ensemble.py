@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+集成模型蒸馏脚本
+以10模型集成的平均概率作为软标签，训练单个（可更小的）MPNNPOM学生模型，
+输出可被 OdorPredictorCPU(tier='fast') 直接加载的检查点，并生成
+学生模型与集成模型的AUC及延迟对比报告
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import functools
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import deepchem as dc
+import torch
+from sklearn.metrics import roc_auc_score
+
+from openpom.feat.graph_featurizer import GraphFeaturizer, GraphConvConstants
+from openpom.models.mpnn_pom import MPNNPOMModel
+from openpom.utils.data_parallel import DataParallelTrainer
+from openpom.utils.data_utils import (get_class_imbalance_ratio,
+                                      IterativeStratifiedSplitter)
+from predict_odor_cpu import (OdorPredictorCPU, DEFAULT_MODEL_PARAMS,
+                              MODEL_CONFIG_FILE)
+
+DATASET = 'openpom/data/curated_datasets/curated_GS_LF_merged_4983.csv'
+SMILES_FIELD = 'nonStereoSMILES'
+STUDENT_CHECKPOINT = 'checkpoint1.pt'
+
+
+def load_unlabeled_smiles(path, smiles_field=SMILES_FIELD):
+    """
+    读取无标签SMILES语料
+
+    支持CSV（使用smiles_field列，不存在时取第一列）或每行一个SMILES的文本文件
+    """
+    if path.endswith('.csv'):
+        df = pd.read_csv(path)
+        column = smiles_field if smiles_field in df.columns else df.columns[0]
+        smiles = df[column]
+    else:
+        with open(path, 'r') as f:
+            smiles = pd.Series([line.split()[0] for line in f if line.strip()])
+    return smiles.dropna().astype(str).drop_duplicates().tolist()
+
+
+def featurize_smiles(smiles_list, featurizer):
+    """特征化SMILES列表，丢弃无法解析的分子"""
+    features = featurizer.featurize(smiles_list)
+    valid = [i for i, x in enumerate(features)
+             if not (isinstance(x, np.ndarray) and x.size == 0)]
+    X = np.array([features[i] for i in valid], dtype=object)
+    return X, [smiles_list[i] for i in valid]
+
+
+def macro_roc_auc(y_true, y_pred):
+    """按任务计算ROC-AUC并取平均（跳过只有单一类别的任务）"""
+    scores = []
+    for task in range(y_true.shape[1]):
+        if len(np.unique(y_true[:, task])) < 2:
+            continue
+        scores.append(roc_auc_score(y_true[:, task], y_pred[:, task]))
+    return float(np.mean(scores))
+
+
+def measure_latency(predict_fn, dataset, single_dataset, n_repeats=20):
+    """测量整批吞吐与单分子延迟"""
+    start = time.perf_counter()
+    predict_fn(dataset)
+    batch_seconds = time.perf_counter() - start
+
+    single_times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        predict_fn(single_dataset)
+        single_times.append(time.perf_counter() - start)
+    return {
+        'batch_seconds': round(batch_seconds, 4),
+        'molecules_per_second': round(len(dataset) / batch_seconds, 2),
+        'single_molecule_p50_ms': round(
+            float(np.percentile(single_times, 50)) * 1000, 3),
+        'single_molecule_p99_ms': round(
+            float(np.percentile(single_times, 99)) * 1000, 3),
+    }
+
+
+def distill(teacher,
+            dataset_path=DATASET,
+            unlabeled_path=None,
+            output_prefix='./ensemble_models/distilled_',
+            student_params=None,
+            nb_epoch=30,
+            batch_size=64,
+            learning_rate=0.001,
+            frac_test=0.1,
+            seed=0,
+            data_parallel_workers=1):
+    """
+    使用集成模型的软标签训练学生模型
+
+    Args:
+        teacher: 已加载的OdorPredictorCPU（集成模型）
+        dataset_path: 有标签的GS/LF数据集CSV
+        unlabeled_path: 可选的无标签SMILES语料
+        output_prefix: 学生模型目录前缀，模型保存在 f"{output_prefix}1"
+        student_params: 覆盖默认结构的超参数（如node_out_feats, ffn_hidden_list）
+        nb_epoch: 训练轮数
+        batch_size: 训练批大小
+        learning_rate: 初始学习率
+        frac_test: 留出用于评估的有标签数据比例
+        seed: 随机种子
+        data_parallel_workers: 数据并行训练的进程数，每个批次切分到各进程，
+            梯度经gloo all-reduce汇总（全局批大小与学习率衰减不变）
+
+    Returns:
+        dict: 蒸馏报告
+    """
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    featurizer = GraphFeaturizer()
+    tasks = teacher.tasks
+
+    # 有标签数据，留出测试集用于与集成模型对比
+    print("正在特征化有标签数据集...")
+    loader = dc.data.CSVLoader(tasks=tasks,
+                               feature_field=SMILES_FIELD,
+                               featurizer=featurizer)
+    labeled = loader.create_dataset(inputs=[dataset_path])
+    splitter = IterativeStratifiedSplitter(order=2)
+    train_labeled, test_labeled = splitter.train_test_split(
+        labeled, frac_train=1 - frac_test)
+
+    # 训练集 = 有标签训练部分 + 无标签语料
+    train_X = [train_labeled.X]
+    if unlabeled_path is not None:
+        print("正在特征化无标签语料...")
+        known = set(labeled.ids)
+        unlabeled_smiles = [s for s in load_unlabeled_smiles(unlabeled_path)
+                            if s not in known]
+        unlabeled_X, unlabeled_smiles = featurize_smiles(unlabeled_smiles,
+                                                         featurizer)
+        print(f"  无标签分子: {len(unlabeled_smiles)}")
+        if len(unlabeled_smiles) > 0:
+            train_X.append(unlabeled_X)
+    train_X = np.concatenate(train_X)
+
+    # 集成模型的平均概率作为软标签
+    print(f"正在生成软标签（{len(train_X)}个分子）...")
+    soft_labels = teacher.predict_dataset(dc.data.NumpyDataset(train_X))
+    soft_dataset = dc.data.NumpyDataset(train_X, y=soft_labels,
+                                        w=np.ones_like(soft_labels))
+
+    model_params = dict(DEFAULT_MODEL_PARAMS)
+    model_params.update(student_params or {})
+    train_ratios = get_class_imbalance_ratio(train_labeled)
+    model_dir = f'{output_prefix}1'
+    os.makedirs(model_dir, exist_ok=True)
+
+    lr_schedule = dc.models.optimizers.ExponentialDecay(
+        initial_rate=learning_rate, decay_rate=0.5,
+        decay_steps=32 * 20, staircase=True)
+    student_builder = functools.partial(
+        MPNNPOMModel,
+        n_tasks=len(tasks),
+        batch_size=batch_size,
+        learning_rate=lr_schedule,
+        class_imbalance_ratio=train_ratios,
+        loss_aggr_type='sum',
+        mode='classification',
+        number_atom_features=GraphConvConstants.ATOM_FDIM,
+        number_bond_features=GraphConvConstants.BOND_FDIM,
+        n_classes=1,
+        optimizer_name='adam',
+        log_frequency=32,
+        model_dir=model_dir,
+        device_name='cpu',
+        **model_params)
+    student = student_builder()
+
+    print(f"正在训练学生模型（{nb_epoch}轮）...")
+    if data_parallel_workers > 1:
+        # 各进程从磁盘目录读取训练集，避免每轮序列化传输
+        soft_dir = tempfile.mkdtemp(prefix='distill_soft_')
+        try:
+            soft_dataset = dc.data.DiskDataset.from_numpy(
+                soft_dataset.X, soft_dataset.y, soft_dataset.w,
+                data_dir=soft_dir)
+            print(f"  数据并行: {data_parallel_workers}个进程")
+            with DataParallelTrainer(n_workers=data_parallel_workers) as trainer:
+                for epoch in range(1, nb_epoch + 1):
+                    loss = trainer.fit(student, student_builder, soft_dataset,
+                                       nb_epoch=1, checkpoint_interval=0)
+                    print(f"  epoch {epoch}/{nb_epoch}: loss = {loss:.4f}")
+        finally:
+            # 训练失败（副本出错、集合通信超时等）时同样删除软标签副本
+            shutil.rmtree(soft_dir, ignore_errors=True)
+    else:
+        for epoch in range(1, nb_epoch + 1):
+            loss = student.fit(soft_dataset, nb_epoch=1,
+                               checkpoint_interval=0)
+            print(f"  epoch {epoch}/{nb_epoch}: loss = {loss:.4f}")
+    student.save_checkpoint(max_checkpoints_to_keep=1)
+
+    with open(os.path.join(model_dir, MODEL_CONFIG_FILE), 'w') as f:
+        json.dump({
+            'model_params': model_params,
+            'checkpoint': STUDENT_CHECKPOINT,
+            'tasks': tasks,
+            'train_ratios': train_ratios,
+            'distilled_from': teacher.model_dir_prefix,
+            'teacher_models': teacher.n_models,
+        }, f, indent=4)
+
+    # 留出集上的AUC与延迟对比
+    print("正在评估学生模型与集成模型...")
+    ensemble_pred = teacher.predict_dataset(test_labeled)
+    student_pred = student.predict(test_labeled)
+    single = test_labeled.select([0])
+    report = {
+        'n_train_molecules': int(len(train_X)),
+        'n_test_molecules': int(len(test_labeled)),
+        'student_params': model_params,
+        'student_parameters': int(
+            sum(p.numel() for p in student.model.parameters())),
+        'ensemble_parameters': int(
+            sum(p.numel() for m in teacher.models
+                for p in m.model.parameters())),
+        'roc_auc': {
+            'ensemble': macro_roc_auc(test_labeled.y, ensemble_pred),
+            'student': macro_roc_auc(test_labeled.y, student_pred),
+        },
+        'student_vs_ensemble_mae': float(
+            np.abs(student_pred - ensemble_pred).mean()),
+        'latency': {
+            'ensemble': measure_latency(teacher.predict_dataset,
+                                        test_labeled, single),
+            'student': measure_latency(student.predict, test_labeled,
+                                       single),
+        },
+    }
+    report['roc_auc']['delta'] = (report['roc_auc']['student'] -
+                                  report['roc_auc']['ensemble'])
+    report['speedup'] = round(
+        report['latency']['ensemble']['batch_seconds'] /
+        report['latency']['student']['batch_seconds'], 2)
+
+    with open(os.path.join(model_dir, 'distillation_report.json'), 'w') as f:
+        json.dump(report, f, indent=4)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='集成模型蒸馏工具')
+    parser.add_argument('--teacher-prefix', default=None,
+                        help='集成模型目录前缀 (默认: 自动搜索)')
+    parser.add_argument('--n-models', type=int, default=10,
+                        help='集成模型数量 (默认: 10)')
+    parser.add_argument('--dataset', default=DATASET,
+                        help='有标签数据集CSV')
+    parser.add_argument('--unlabeled', default=None,
+                        help='无标签SMILES语料（CSV或每行一个SMILES）')
+    parser.add_argument('--output-prefix',
+                        default='./ensemble_models/distilled_',
+                        help='学生模型目录前缀 (默认: ./ensemble_models/distilled_)')
+    parser.add_argument('--node-out-feats', type=int, default=None,
+                        help='学生模型的node_out_feats')
+    parser.add_argument('--ffn-hidden', type=int, nargs='+', default=None,
+                        help='学生模型的ffn_hidden_list，如 --ffn-hidden 256 256')
+    parser.add_argument('--epochs', type=int, default=30, help='训练轮数')
+    parser.add_argument('--batch-size', type=int, default=64, help='批大小')
+    parser.add_argument('--learning-rate', type=float, default=0.001,
+                        help='初始学习率')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--data-parallel-workers', type=int, default=1,
+                        help='数据并行训练的进程数 (默认: 1，单进程)')
+    args = parser.parse_args()
+
+    student_params = {}
+    if args.node_out_feats is not None:
+        student_params['node_out_feats'] = args.node_out_feats
+    if args.ffn_hidden is not None:
+        student_params['ffn_hidden_list'] = args.ffn_hidden
+
+    print("=== 集成模型蒸馏 ===")
+    teacher = OdorPredictorCPU(model_dir_prefix=args.teacher_prefix,
+                               n_models=args.n_models, use_cpu_only=True)
+    report = distill(teacher,
+                     dataset_path=args.dataset,
+                     unlabeled_path=args.unlabeled,
+                     output_prefix=args.output_prefix,
+                     student_params=student_params,
+                     nb_epoch=args.epochs,
+                     batch_size=args.batch_size,
+                     learning_rate=args.learning_rate,
+                     seed=args.seed,
+                     data_parallel_workers=args.data_parallel_workers)
+
+    print("\n蒸馏报告:")
+    print(f"  ROC-AUC 集成模型: {report['roc_auc']['ensemble']:.4f}")
+    print(f"  ROC-AUC 学生模型: {report['roc_auc']['student']:.4f}")
+    print(f"  学生与集成预测平均偏差: {report['student_vs_ensemble_mae']:.4f}")
+    for name in ('ensemble', 'student'):
+        latency = report['latency'][name]
+        print(f"  {name}: {latency['molecules_per_second']} 分子/秒, "
+              f"单分子p50 {latency['single_molecule_p50_ms']} ms")
+    print(f"  加速比: {report['speedup']}x")
+    print(f"\n✓ 学生模型已保存到: {args.output_prefix}1")
+    print("  加载方式: OdorPredictorCPU(tier='fast') 或 MODEL_TIER=fast")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+# Gunicorn 配置文件（gunicorn 启动时自动加载当前目录下的 gunicorn.conf.py）
+# 命令行参数见 start_production.sh
+
+import os
+
+
+def post_worker_init(worker):
+    """工作进程启动后在后台并行加载模型（线程无法跨fork保留，需在各工作进程中启动）"""
+    import server_deploy
+    server_deploy.init_predictor(background=True)
+
+
+def child_exit(server, worker):
+    """工作进程退出时清理其Prometheus多进程指标"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
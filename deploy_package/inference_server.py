@@ -0,0 +1,790 @@
+#!/usr/bin/env python3
+"""
+共享推理进程
+gunicorn的每个工作进程各自加载集成模型时，内存随工作进程数成倍增长，且无法跨进程组批。
+设置 INFERENCE_SOCKET 后，Web工作进程只负责解析与校验请求，通过本地Unix套接字
+将SMILES交给一个（或少数几个）推理进程；推理进程持有模型注册表，将所有工作进程的
+请求合并成批进行前向计算，概率以float32原始字节返回，客户端用np.frombuffer直接
+引用接收缓冲区而不经过JSON编码。Web工作进程数与模型副本数因此可以独立扩展。
+
+多个副本（--replicas）共享同一个监听套接字，每个副本都在accept()上等待，
+新连接由内核交给其中一个副本；客户端复用持久连接，因此请求按连接分配，
+不感知副本负载。每个副本各自加载模型并独立组批。每个副本另有一个控制套接字
+（<socket>.<序号>），热加载请求由接收它的副本转发给所有其他副本。
+
+使用方法:
+    # 启动推理进程（start_production.sh 在设置 INFERENCE_SOCKET 时自动启动）
+    python inference_server.py --socket /tmp/odor_inference.sock --replicas 1
+    # Web工作进程通过环境变量连接
+    INFERENCE_SOCKET=/tmp/odor_inference.sock gunicorn ... server_deploy:app
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+import struct
+import threading
+import time
+
+import numpy as np
+
+from predict_odor_cpu import (InvalidSmilesError, ModelsNotReadyError,
+                              ReloadInProgressError, prediction_frames,
+                              top_odors_frame)
+from model_registry import UnknownModelError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/odor_inference.sock'
+# 消息头: JSON长度与负载长度（网络字节序）
+_HEADER = struct.Struct('!IQ')
+# 客户端缓存推理进程状态的时间（秒），就绪检查不必每个请求往返一次
+STATUS_TTL = 1.0
+
+
+class InferenceUnavailableError(ConnectionError):
+    """无法连接推理进程或连接中断"""
+
+
+class InferenceError(RuntimeError):
+    """推理进程中发生的其他错误"""
+
+    def __init__(self, error_type, message):
+        self.error_type = error_type
+        super().__init__(f"{error_type}: {message}")
+
+
+def _recv_exactly(sock, n):
+    """读取恰好n个字节到新的缓冲区，连接关闭时返回None"""
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            return None
+        received += count
+    return buffer
+
+
+def send_message(sock, header, payload=b''):
+    """
+    发送一条消息：定长消息头 + JSON + 负载字节
+
+    Args:
+        sock: 已连接的套接字
+        header: 可JSON序列化的字典
+        payload: 负载，bytes或支持缓冲区协议的对象（如C连续的numpy数组，不会复制）
+    """
+    data = json.dumps(header).encode()
+    payload = memoryview(payload).cast('B')
+    sock.sendall(_HEADER.pack(len(data), payload.nbytes) + data)
+    if payload.nbytes:
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    """
+    接收一条消息
+
+    Returns:
+        (header字典, 负载bytearray)；连接已关闭时返回 (None, None)
+    """
+    prefix = _recv_exactly(sock, _HEADER.size)
+    if prefix is None:
+        return None, None
+    header_size, payload_size = _HEADER.unpack(prefix)
+    data = _recv_exactly(sock, header_size)
+    payload = _recv_exactly(sock, payload_size) if payload_size else bytearray()
+    if data is None or payload is None:
+        return None, None
+    return json.loads(data), payload
+
+
+def _error_header(e):
+    """将异常编码到响应头，客户端据此重新抛出同类型的异常"""
+    header = {'ok': False, 'error': type(e).__name__, 'message': str(e)}
+    if isinstance(e, InvalidSmilesError):
+        header['invalid'] = e.invalid_smiles
+    elif isinstance(e, UnknownModelError):
+        header.update(name=e.name, available=e.available)
+    return header
+
+
+def _raise_error(header):
+    """按响应头重新抛出推理进程中的异常"""
+    error = header['error']
+    if error == 'InvalidSmilesError':
+        raise InvalidSmilesError(header['invalid'])
+    if error == 'UnknownModelError':
+        raise UnknownModelError(header['name'], header['available'])
+    if error == 'ModelsNotReadyError':
+        raise ModelsNotReadyError(header['message'])
+    if error == 'ReloadInProgressError':
+        raise ReloadInProgressError(header['message'])
+    raise InferenceError(error, header['message'])
+
+
+class _Connection:
+    """推理进程一侧的客户端连接，批处理线程与读取线程共用，发送加锁"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def send(self, header, payload=b''):
+        try:
+            with self.lock:
+                send_message(self.sock, header, payload)
+        except OSError as e:
+            logger.warning(f"响应发送失败（客户端已断开）: {e}")
+
+
+class _PendingPrediction:
+    """等待组批的预测请求"""
+
+    __slots__ = ('connection', 'id', 'model', 'smiles')
+
+    def __init__(self, connection, request_id, model, smiles):
+        self.connection = connection
+        self.id = request_id
+        self.model = model
+        self.smiles = smiles
+
+
+class InferenceServer:
+    """
+    在Unix套接字上提供预测服务，将所有连接的预测请求合并成批
+
+    批处理线程取出第一个请求后，在batch_wait_ms内继续收集请求，直到分子数达到
+    max_batch_molecules；同一模型的请求合并为一次 predict_proba 调用，
+    结果按请求拆分后返回。合并批次中存在无效SMILES时，只有包含它们的请求返回错误，
+    其余请求重新预测。
+    """
+
+    def __init__(self, registry, listener, max_batch_molecules=256,
+                 batch_wait_ms=2.0, control_listener=None, peers=()):
+        """
+        Args:
+            registry: ModelRegistry，推理进程中的模型注册表
+            listener: 已绑定并监听的Unix套接字（多个副本共享同一个）
+            max_batch_molecules: 每次合并预测的最大分子数
+            batch_wait_ms: 收到第一个请求后等待更多请求的时间（毫秒）
+            control_listener: 可选，本副本独占的控制套接字，接收其他副本转发的热加载
+            peers: 其他副本的控制套接字路径，热加载请求转发给它们
+        """
+        self.registry = registry
+        self.listener = listener
+        self.control_listener = control_listener
+        self.peers = list(peers)
+        self.max_batch_molecules = max_batch_molecules
+        self.batch_wait = batch_wait_ms / 1000.0
+        self._pending = queue.Queue()
+        self._closed = threading.Event()
+
+    def serve_forever(self):
+        """接受连接直到close()，每个连接一个读取线程，另有一个批处理线程"""
+        threading.Thread(target=self._batch_loop, name='inference-batcher',
+                         daemon=True).start()
+        if self.control_listener is not None:
+            threading.Thread(target=self._accept_loop,
+                             args=(self.control_listener,),
+                             name='inference-control', daemon=True).start()
+        self._accept_loop(self.listener)
+
+    def _accept_loop(self, listener):
+        while not self._closed.is_set():
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                if self._closed.is_set():
+                    break
+                raise
+            threading.Thread(target=self._handle_connection,
+                             args=(_Connection(sock),),
+                             name='inference-connection', daemon=True).start()
+
+    def close(self):
+        self._closed.set()
+        self._pending.put(None)
+        for listener in (self.listener, self.control_listener):
+            if listener is None:
+                continue
+            try:
+                listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            listener.close()
+
+    def _handle_connection(self, connection):
+        """读取一个连接上的请求：预测请求排队组批，其他请求直接处理"""
+        try:
+            while True:
+                header, _ = recv_message(connection.sock)
+                if header is None:
+                    break
+                op = header.get('op')
+                if op == 'predict':
+                    self._pending.put(_PendingPrediction(
+                        connection, header['id'], header.get('model'),
+                        header['smiles']))
+                    continue
+                try:
+                    if op == 'status':
+                        response = self._status(header.get('model'))
+                    elif op == 'reload':
+                        response = self._reload(header)
+                    elif op == 'reload_status':
+                        response = self._reload_status(header)
+                    else:
+                        raise ValueError(f"未知的请求类型: {op}")
+                    response['ok'] = True
+                except Exception as e:
+                    response = _error_header(e)
+                response['id'] = header['id']
+                connection.send(response)
+        except OSError as e:
+            logger.debug(f"连接中断: {e}")
+        finally:
+            connection.sock.close()
+
+    def _status(self, name):
+        """注册表与模型的状态，客户端的RemoteRegistry/RemotePredictor据此应答"""
+        predictor = self.registry.get(name)
+        return {
+            'registry': {
+                'default': self.registry.default,
+                'entries': list(self.registry.entries),
+                'max_resident': self.registry.max_resident,
+                'resident': self.registry.resident(),
+                'models': self.registry.describe(),
+            },
+            'predictor': {
+                'name': predictor.name,
+                'tasks': predictor.tasks,
+                'ready': predictor.ready.is_set(),
+                'loading_complete': predictor.loading_complete.is_set(),
+                'load_errors': list(predictor.load_errors),
+                'model_version': predictor.model_version,
+                'min_models_ready': predictor.min_models_ready,
+                'models_loaded': len(predictor.models),
+                'reload_status': predictor.reload_status,
+                'system_info': dict(predictor.get_system_info(),
+                                    inference_pid=os.getpid()),
+            },
+        }
+
+    def _reload(self, header):
+        """
+        在本副本中开始热加载，并转发给其他副本（header['local']为真时不转发）
+
+        本副本正在加载时抛出ReloadInProgressError，不转发；其他副本的结果
+        （包括失败原因）记录在响应的replicas中
+        """
+        predictor = self.registry.get(header.get('model'))
+        predictor.reload_in_background(
+            model_dir_prefix=header.get('model_dir_prefix'),
+            n_models=header.get('n_models'))
+        response = {'model': predictor.name,
+                    'current_version': predictor.model_version,
+                    'pid': os.getpid()}
+        if header.get('local'):
+            return response
+        replicas = [dict(response, status='started')]
+        for peer in self.peers:
+            replicas.append(self._call_peer(peer, dict(header, local=True),
+                                            'started'))
+        response['replicas'] = replicas
+        return response
+
+    def _reload_status(self, header):
+        """本副本最近一次热加载的状态；多副本时附带所有副本的状态"""
+        predictor = self.registry.get(header.get('model'))
+        response = dict(predictor.reload_status,
+                        model=predictor.name,
+                        current_version=predictor.model_version,
+                        pid=os.getpid())
+        if header.get('local') or not self.peers:
+            return response
+        response['replicas'] = [dict(response)] + [
+            self._call_peer(peer, dict(header, local=True))
+            for peer in self.peers
+        ]
+        return response
+
+    def _call_peer(self, peer, header, status=None):
+        """向其他副本的控制套接字发送请求，失败时返回错误信息而不抛出"""
+        client = InferenceClient(peer, timeout=10.0)
+        try:
+            header = {k: v for k, v in header.items() if k != 'id'}
+            response, _ = client.call(header)
+        except Exception as e:
+            logger.warning(f"转发到副本 {peer} 失败: {e}")
+            return {'socket': peer, 'status': 'failed', 'error': str(e)}
+        finally:
+            client.close()
+        response = {k: v for k, v in response.items() if k not in ('ok', 'id')}
+        if status is not None:
+            response['status'] = status
+        return response
+
+    def _collect(self, first):
+        """从第一个请求开始，在等待时间内收集更多请求组成一批"""
+        batch = [first]
+        n_molecules = len(first.smiles)
+        deadline = time.monotonic() + self.batch_wait
+        while n_molecules < self.max_batch_molecules:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._pending.get(timeout=max(timeout, 0)) \
+                    if timeout > 0 else self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._pending.put(None)
+                break
+            batch.append(item)
+            n_molecules += len(item.smiles)
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            first = self._pending.get()
+            if first is None:
+                return
+            groups = {}
+            for item in self._collect(first):
+                groups.setdefault(item.model, []).append(item)
+            for name, requests in groups.items():
+                try:
+                    self._predict(self.registry.get(name), requests)
+                except Exception as e:
+                    logger.error(f"合并预测失败: {e}")
+                    for request in requests:
+                        request.connection.send(dict(_error_header(e),
+                                                     id=request.id))
+
+    def _predict(self, predictor, requests):
+        """合并同一模型的请求进行预测，无效SMILES只影响包含它们的请求"""
+        if not predictor.ready.is_set():
+            raise ModelsNotReadyError("模型尚未加载完成")
+        while requests:
+            smiles = [s for request in requests for s in request.smiles]
+            try:
+                predictions = predictor.predict_proba(smiles)
+                break
+            except InvalidSmilesError as e:
+                invalid = set(e.invalid_smiles)
+                valid = []
+                for request in requests:
+                    bad = [s for s in request.smiles if s in invalid]
+                    if bad:
+                        request.connection.send(dict(
+                            _error_header(InvalidSmilesError(bad)),
+                            id=request.id))
+                    else:
+                        valid.append(request)
+                if len(valid) == len(requests):
+                    raise
+                requests = valid
+        else:
+            return
+
+        start = 0
+        for request in requests:
+            end = start + len(request.smiles)
+            # 客户端按float32解码，其他精度的预测器在此转换
+            rows = np.ascontiguousarray(predictions[start:end],
+                                        dtype=np.float32)
+            request.connection.send({
+                'ok': True,
+                'id': request.id,
+                'model': predictor.name,
+                'model_version': predictor.model_version,
+                'shape': list(rows.shape),
+            }, rows)
+            start = end
+
+
+class InferenceClient:
+    """
+    Web工作进程一侧的客户端，线程安全
+
+    每个线程从空闲连接池中取一个持久连接，请求完成后归还；连接中断时丢弃该连接，
+    下次请求重新连接。
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=300.0):
+        """
+        Args:
+            socket_path: 推理进程的Unix套接字路径
+            timeout: 单个请求的超时时间（秒）
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _connect(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise InferenceUnavailableError(
+                f"无法连接推理进程 {self.socket_path}: {e}") from e
+        return sock
+
+    def call(self, header, payload=b''):
+        """
+        发送请求并等待响应
+
+        Returns:
+            (响应头, 负载bytearray)
+
+        Raises:
+            InferenceUnavailableError: 推理进程不可用
+            推理进程中抛出的 InvalidSmilesError、UnknownModelError 等
+        """
+        with self._lock:
+            self._next_id += 1
+            header = dict(header, id=self._next_id)
+        sock = self._connect()
+        try:
+            send_message(sock, header, payload)
+            response, data = recv_message(sock)
+        except OSError as e:
+            sock.close()
+            raise InferenceUnavailableError(f"推理进程连接中断: {e}") from e
+        if response is None:
+            sock.close()
+            raise InferenceUnavailableError("推理进程关闭了连接")
+        with self._lock:
+            self._idle.append(sock)
+        if not response['ok']:
+            _raise_error(response)
+        return response, data
+
+    def predict(self, smiles_list, model=None):
+        """
+        预测SMILES列表的集成平均概率
+
+        Returns:
+            (概率矩阵, 响应头)；概率矩阵为引用接收缓冲区的float32数组，形状为(分子数, 任务数)
+        """
+        response, data = self.call({'op': 'predict', 'model': model,
+                                    'smiles': list(smiles_list)})
+        predictions = np.frombuffer(data, dtype=np.float32).reshape(
+            response['shape'])
+        return predictions, response
+
+    def status(self, model=None):
+        response, _ = self.call({'op': 'status', 'model': model})
+        return response
+
+    def reload(self, model=None, model_dir_prefix=None, n_models=None):
+        response, _ = self.call({'op': 'reload', 'model': model,
+                                 'model_dir_prefix': model_dir_prefix,
+                                 'n_models': n_models})
+        return response
+
+    def reload_status(self, model=None):
+        response, _ = self.call({'op': 'reload_status', 'model': model})
+        return response
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            sock.close()
+
+
+class _RemoteFlag:
+    """与threading.Event的is_set()接口一致，读取推理进程的状态"""
+
+    def __init__(self, predictor, key):
+        self._predictor = predictor
+        self._key = key
+
+    def is_set(self):
+        return bool(self._predictor._state().get(self._key, False))
+
+
+class RemotePredictor:
+    """
+    推理进程中模型的代理，提供server_deploy使用的OdorPredictorCPU接口
+
+    预测在推理进程中完成，结果数据框在Web工作进程中构建；状态缓存STATUS_TTL秒，
+    推理进程不可用时视为未就绪（/readyz返回503）。
+    """
+
+    def __init__(self, client, name=None):
+        self.client = client
+        self.requested_name = name
+        self.cache = None
+        self.ready = _RemoteFlag(self, 'ready')
+        self.loading_complete = _RemoteFlag(self, 'loading_complete')
+        self._status = None
+        self._status_time = 0.0
+        self._status_lock = threading.Lock()
+
+    def status(self, refresh=False):
+        """推理进程的完整状态（含注册表），缓存STATUS_TTL秒"""
+        with self._status_lock:
+            if (refresh or self._status is None or
+                    time.monotonic() - self._status_time > STATUS_TTL):
+                self._status = self.client.status(self.requested_name)
+                self._status_time = time.monotonic()
+            return self._status
+
+    def _state(self):
+        try:
+            return self.status()['predictor']
+        except InferenceUnavailableError as e:
+            logger.warning(str(e))
+            return {}
+
+    @property
+    def name(self):
+        return self._state().get('name', self.requested_name)
+
+    @property
+    def tasks(self):
+        return self._state().get('tasks', [])
+
+    @property
+    def n_tasks(self):
+        return len(self.tasks)
+
+    @property
+    def models(self):
+        return [None] * self._state().get('models_loaded', 0)
+
+    @property
+    def model_version(self):
+        return self._state().get('model_version')
+
+    @property
+    def min_models_ready(self):
+        return self._state().get('min_models_ready')
+
+    @property
+    def load_errors(self):
+        return self._state().get('load_errors', [])
+
+    @property
+    def reload_status(self):
+        """最近一次热加载的状态；多副本时replicas列出每个副本的状态"""
+        try:
+            response = self.client.reload_status(self.requested_name)
+        except InferenceUnavailableError as e:
+            logger.warning(str(e))
+            return {'state': 'unknown'}
+        return {k: v for k, v in response.items()
+                if k not in ('ok', 'id', 'model', 'current_version', 'pid')}
+
+    def get_system_info(self):
+        info = dict(self._state().get('system_info', {}))
+        info.update(inference_socket=self.client.socket_path,
+                    ready=self.ready.is_set())
+        return info
+
+    def predict_proba(self, smiles_list):
+        predictions, _ = self.client.predict(smiles_list,
+                                             self.requested_name)
+        return predictions
+
+    def predict_smiles(self, smiles_list, threshold=0.5):
+        if isinstance(smiles_list, str):
+            smiles_list = [smiles_list]
+        return prediction_frames(smiles_list, self.predict_proba(smiles_list),
+                                 self.tasks, threshold)
+
+    def get_top_odors(self, smiles, top_k=10):
+        scores = self.predict_proba([smiles])[0]
+        return top_odors_frame(scores, self.tasks, top_k)
+
+    def reload_in_background(self, model_dir_prefix=None, n_models=None):
+        """
+        在所有推理副本中开始热加载
+
+        Returns:
+            list: 每个副本的转发结果（单副本时为None）
+
+        Raises:
+            ReloadInProgressError: 接收请求的副本正在加载或重新加载
+        """
+        response = self.client.reload(self.requested_name, model_dir_prefix,
+                                      n_models)
+        self.status(refresh=True)
+        return response.get('replicas')
+
+
+class RemoteRegistry:
+    """推理进程中模型注册表的代理，提供server_deploy使用的ModelRegistry接口"""
+
+    def __init__(self, client, default=None):
+        """
+        Args:
+            client: InferenceClient
+            default: 推理进程不可用时报告的默认模型名称
+        """
+        self.client = client
+        self._default = default
+        self._predictors = {}
+        self._lock = threading.Lock()
+
+    def get(self, name=None):
+        """
+        获取模型的代理；推理进程不可用时仍返回代理（未就绪）
+
+        Raises:
+            UnknownModelError: 推理进程的注册表中不存在该模型
+        """
+        with self._lock:
+            predictor = self._predictors.get(name)
+            if predictor is None:
+                predictor = RemotePredictor(self.client, name)
+        try:
+            predictor.status()
+        except InferenceUnavailableError as e:
+            logger.warning(str(e))
+        with self._lock:
+            return self._predictors.setdefault(name, predictor)
+
+    def _registry_state(self):
+        try:
+            return self.get().status()['registry']
+        except InferenceUnavailableError:
+            return {}
+
+    @property
+    def default(self):
+        return self._registry_state().get('default', self._default)
+
+    @property
+    def entries(self):
+        return self._registry_state().get('entries', [])
+
+    @property
+    def max_resident(self):
+        return self._registry_state().get('max_resident')
+
+    def resident(self):
+        return self._registry_state().get('resident', [])
+
+    def describe(self):
+        return self._registry_state().get('models', [])
+
+
+def bind_socket(socket_path):
+    """绑定并监听Unix套接字（删除上次运行残留的套接字文件）"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(128)
+    return listener
+
+
+def control_socket_path(socket_path, index):
+    """第index个副本的控制套接字路径"""
+    return f'{socket_path}.{index}'
+
+
+def run_replica(listener, max_batch_molecules, batch_wait_ms,
+                control_paths=(), index=0):
+    """
+    推理副本进程：加载模型注册表并在共享的监听套接字上提供服务
+
+    Args:
+        control_paths: 所有副本的控制套接字路径（单副本时为空）
+        index: 本副本的序号
+    """
+    logging.basicConfig(level=logging.INFO)
+    import server_deploy
+    control_listener = None
+    peers = []
+    if control_paths:
+        control_listener = bind_socket(control_paths[index])
+        peers = [path for i, path in enumerate(control_paths) if i != index]
+    registry = server_deploy.create_registry(background=True)
+    logger.info(f"推理副本 {os.getpid()} 已启动，可用模型: "
+                f"{', '.join(registry.entries)}（默认: {registry.default}）")
+    InferenceServer(registry, listener, max_batch_molecules, batch_wait_ms,
+                    control_listener=control_listener,
+                    peers=peers).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='共享推理进程')
+    parser.add_argument('--socket',
+                        default=os.environ.get('INFERENCE_SOCKET') or DEFAULT_SOCKET,
+                        help=f'Unix套接字路径 (默认: INFERENCE_SOCKET或{DEFAULT_SOCKET})')
+    parser.add_argument('--replicas', type=int,
+                        default=int(os.environ.get('INFERENCE_REPLICAS') or 1),
+                        help='模型副本进程数 (默认: INFERENCE_REPLICAS或1)')
+    parser.add_argument('--max-batch', type=int,
+                        default=int(os.environ.get('INFERENCE_MAX_BATCH') or 256),
+                        help='每次合并预测的最大分子数 (默认: 256)')
+    parser.add_argument('--batch-wait-ms', type=float,
+                        default=float(os.environ.get('INFERENCE_BATCH_WAIT_MS') or 2.0),
+                        help='等待更多请求组批的时间（毫秒） (默认: 2)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # SIGTERM（start_production.sh退出时发送）与Ctrl+C一样停止副本进程
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    listener = bind_socket(args.socket)
+    replicas = []
+    control_paths = []
+    print("=== 共享推理进程 ===")
+    print(f"  套接字: {args.socket}")
+    print(f"  副本数: {args.replicas}")
+    print(f"  组批: 最多 {args.max_batch} 个分子，等待 {args.batch_wait_ms} ms")
+    try:
+        if args.replicas <= 1:
+            run_replica(listener, args.max_batch, args.batch_wait_ms)
+            return
+        # 副本以spawn方式启动（torch线程池无法跨fork保留），共享监听套接字
+        # 每个副本另有控制套接字，热加载请求由接收它的副本转发给其他副本
+        control_paths = [control_socket_path(args.socket, i)
+                         for i in range(args.replicas)]
+        context = multiprocessing.get_context('spawn')
+        replicas = [context.Process(target=run_replica,
+                                    args=(listener, args.max_batch,
+                                          args.batch_wait_ms, control_paths,
+                                          i),
+                                    name=f'inference-replica-{i}',
+                                    daemon=True)
+                    for i in range(args.replicas)]
+        for replica in replicas:
+            replica.start()
+        for replica in replicas:
+            replica.join()
+    except KeyboardInterrupt:
+        print("\n✓ 推理进程已停止")
+    finally:
+        for replica in replicas:
+            replica.terminate()
+        for replica in replicas:
+            replica.join()
+        listener.close()
+        for path in [args.socket] + control_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
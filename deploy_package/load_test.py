@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+预测API负载测试工具
+对本地服务器的 /predict 与 /predict_batch 施加可配置的并发或开环到达负载，
+报告实际RPS、分子/秒、延迟分位数、错误率，并可通过速率扫描找出饱和点
+
+负载模式:
+    closed  固定并发数，每个客户端收到响应后立即发送下一个请求
+    open    按泊松过程以固定速率发送请求（延迟从计划发送时间起算，
+            避免协调遗漏导致低估尾延迟）
+    replay  按gunicorn access.log中的请求时间与接口重放流量
+    sweep   依次以多个速率运行open模式，报告饱和点
+
+使用示例:
+    python load_test.py closed --concurrency 8 --duration 60
+    python load_test.py open --rate 20 --duration 60 --batch-sizes 1 10 50
+    python load_test.py replay --access-log access.log --speedup 2
+    python load_test.py sweep --rates 5 10 20 40 80 --duration 30 --slo-ms 1000
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+DATASET = 'openpom/data/curated_datasets/curated_GS_LF_merged_4983.csv'
+SMILES_FIELD = 'nonStereoSMILES'
+ENDPOINTS = ('/predict', '/predict_batch')
+MAX_BATCH_MOLECULES = 100  # 与服务端 /predict_batch 的上限一致
+
+# gunicorn默认格式: %(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"
+# start_production.sh 在末尾追加了 %(D)s（微秒）与 X-Molecule-Count 响应头
+ACCESS_LOG_PATTERN = re.compile(
+    r'\[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>\S+)[^"]*" '
+    r'(?P<status>\d{3}) \S+(?: "[^"]*" "[^"]*")?'
+    r'(?: (?P<micros>\d+))?(?: (?P<molecules>\d+|-))?\s*$')
+ACCESS_LOG_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+
+class SmilesPool:
+    """从CSV中按原始分布随机抽取SMILES"""
+
+    def __init__(self, path=DATASET, smiles_field=SMILES_FIELD, seed=0):
+        df = pd.read_csv(path)
+        column = smiles_field if smiles_field in df.columns else df.columns[0]
+        self.smiles = df[column].dropna().astype(str).tolist()
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self, n):
+        with self._lock:
+            return [self.rng.choice(self.smiles) for _ in range(n)]
+
+
+class RequestSpec:
+    """一个待发送的请求"""
+
+    __slots__ = ('endpoint', 'n_molecules', 'send_at')
+
+    def __init__(self, endpoint, n_molecules=1, send_at=None):
+        self.endpoint = endpoint
+        self.n_molecules = n_molecules
+        self.send_at = send_at
+
+
+def parse_access_log(path):
+    """
+    解析gunicorn access.log中的预测请求
+
+    access.log不记录请求体，因此分子数来自 X-Molecule-Count 响应头字段
+    （见 start_production.sh 的 --access-logformat）；旧格式日志中该字段缺失，
+    /predict_batch 的分子数将由 --batch-sizes 抽样补齐
+
+    Returns:
+        list[RequestSpec]: send_at为相对第一条请求的秒数
+    """
+    specs = []
+    start = None
+    with open(path, 'r') as f:
+        for line in f:
+            match = ACCESS_LOG_PATTERN.search(line)
+            if match is None or match.group('method') != 'POST':
+                continue
+            endpoint = match.group('path').split('?')[0]
+            if endpoint not in ENDPOINTS:
+                continue
+            timestamp = datetime.strptime(match.group('time'),
+                                          ACCESS_LOG_TIME_FORMAT).timestamp()
+            # access.log记录的是响应完成时间，减去耗时得到到达时间
+            if match.group('micros'):
+                timestamp -= int(match.group('micros')) / 1e6
+            if start is None:
+                start = timestamp
+            molecules = match.group('molecules')
+            if endpoint == '/predict':
+                n_molecules = 1
+            elif molecules and molecules not in ('-', '0'):
+                n_molecules = int(molecules)
+            else:
+                n_molecules = None
+            specs.append(RequestSpec(endpoint, n_molecules, timestamp - start))
+    specs.sort(key=lambda spec: spec.send_at)
+    if specs:
+        offset = specs[0].send_at
+        for spec in specs:
+            spec.send_at -= offset
+    return specs
+
+
+class LoadGenerator:
+    """
+    负载发生器
+
+    Args:
+        base_url: API服务器地址
+        pool: SmilesPool
+        batch_sizes: /predict_batch 的分子数候选（均匀抽取）
+        batch_fraction: 使用 /predict_batch 的请求比例
+        timeout: 单个请求超时（秒）
+        seed: 随机种子
+    """
+
+    def __init__(self,
+                 base_url,
+                 pool,
+                 batch_sizes=(10,),
+                 batch_fraction=0.5,
+                 timeout=60,
+                 seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.pool = pool
+        self.batch_sizes = [min(b, MAX_BATCH_MOLECULES) for b in batch_sizes]
+        self.batch_fraction = batch_fraction
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self._local = threading.local()
+        self._results = []
+        self._results_lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def next_spec(self):
+        """按配置的接口比例与批大小生成下一个请求"""
+        if self.rng.random() < self.batch_fraction:
+            return RequestSpec('/predict_batch', self.rng.choice(self.batch_sizes))
+        return RequestSpec('/predict', 1)
+
+    def _payload(self, spec):
+        if spec.n_molecules is None:
+            spec.n_molecules = self.rng.choice(self.batch_sizes)
+        smiles = self.pool.sample(spec.n_molecules)
+        if spec.endpoint == '/predict':
+            return {'smiles': smiles[0], 'top_k': 10}
+        return {'smiles_list': smiles, 'threshold': 0.5}
+
+    def send(self, spec, scheduled=None):
+        """
+        发送一个请求并记录结果
+
+        Args:
+            spec: RequestSpec
+            scheduled: 计划发送时间（perf_counter），开环模式下延迟从该时间起算
+        """
+        payload = self._payload(spec)
+        start = time.perf_counter()
+        try:
+            response = self._session().post(self.base_url + spec.endpoint,
+                                            json=payload,
+                                            timeout=self.timeout)
+            status = response.status_code
+            error = None if status < 400 else f'HTTP {status}'
+        except requests.RequestException as e:
+            status = None
+            error = type(e).__name__
+        end = time.perf_counter()
+        with self._results_lock:
+            self._results.append({
+                'endpoint': spec.endpoint,
+                'n_molecules': spec.n_molecules,
+                'latency': end - (scheduled if scheduled is not None else start),
+                'end': end,
+                'error': error,
+            })
+
+    def run_closed(self, concurrency, duration):
+        """固定并发：每个客户端线程收到响应后立即发送下一个请求"""
+        self._results = []
+        deadline = time.perf_counter() + duration
+
+        def client():
+            while time.perf_counter() < deadline:
+                self.send(self.next_spec())
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client, daemon=True)
+                   for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self._report(time.perf_counter() - start,
+                            {'mode': 'closed', 'concurrency': concurrency})
+
+    def run_schedule(self, specs, max_outstanding=256, config=None):
+        """按 spec.send_at（相对秒数）开环发送请求"""
+        self._results = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_outstanding) as executor:
+            for spec in specs:
+                scheduled = start + spec.send_at
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, spec, scheduled)
+        return self._report(time.perf_counter() - start, config or {})
+
+    def run_open(self, rate, duration, max_outstanding=256):
+        """泊松到达：请求间隔服从均值为 1/rate 的指数分布"""
+        specs = []
+        t = self.rng.expovariate(rate)
+        while t < duration:
+            spec = self.next_spec()
+            spec.send_at = t
+            specs.append(spec)
+            t += self.rng.expovariate(rate)
+        return self.run_schedule(specs, max_outstanding,
+                                 {'mode': 'open', 'offered_rps': rate})
+
+    def _report(self, elapsed, config):
+        report = dict(config)
+        report['elapsed_seconds'] = round(elapsed, 3)
+        report['overall'] = summarize(self._results, elapsed)
+        report['endpoints'] = {
+            endpoint: summarize(
+                [r for r in self._results if r['endpoint'] == endpoint], elapsed)
+            for endpoint in ENDPOINTS
+        }
+        return report
+
+
+def summarize(results, elapsed):
+    """汇总请求结果：RPS、分子/秒、错误率与成功请求的延迟分位数"""
+    ok = [r for r in results if r['error'] is None]
+    errors = {}
+    for r in results:
+        if r['error'] is not None:
+            errors[r['error']] = errors.get(r['error'], 0) + 1
+    summary = {
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'error_rate': round((len(results) - len(ok)) / len(results), 4)
+        if results else 0.0,
+        'error_types': errors,
+        'rps': round(len(ok) / elapsed, 3) if elapsed > 0 else 0.0,
+        'molecules_per_second': round(
+            sum(r['n_molecules'] for r in ok) / elapsed, 3)
+        if elapsed > 0 else 0.0,
+    }
+    if ok:
+        latencies = np.array([r['latency'] for r in ok]) * 1000
+        for q in (50, 90, 95, 99):
+            summary[f'p{q}_ms'] = round(float(np.percentile(latencies, q)), 2)
+        summary['max_ms'] = round(float(latencies.max()), 2)
+    return summary
+
+
+def find_saturation(reports, slo_ms=None, max_error_rate=0.01,
+                    min_throughput_ratio=0.9):
+    """
+    找出饱和点：第一个满足以下任一条件的速率
+
+    - 实际RPS低于给定速率的 min_throughput_ratio
+    - 错误率超过 max_error_rate
+    - p99延迟超过 slo_ms（如提供）
+
+    Returns:
+        (最大可持续速率, 饱和速率)，未饱和时饱和速率为None
+    """
+    sustainable = None
+    for report in reports:
+        overall = report['overall']
+        saturated = (
+            overall['rps'] < report['offered_rps'] * min_throughput_ratio or
+            overall['error_rate'] > max_error_rate or
+            (slo_ms is not None and overall.get('p99_ms', float('inf')) > slo_ms))
+        if saturated:
+            return sustainable, report['offered_rps']
+        sustainable = report['offered_rps']
+    return sustainable, None
+
+
+def print_report(report):
+    overall = report['overall']
+    print(f"  请求数: {overall['requests']}  错误率: {overall['error_rate']:.2%}")
+    print(f"  RPS: {overall['rps']}  分子/秒: {overall['molecules_per_second']}")
+    for endpoint, summary in report['endpoints'].items():
+        if summary['requests'] == 0:
+            continue
+        latency = ''
+        if 'p50_ms' in summary:
+            latency = (f"p50 {summary['p50_ms']} ms, p99 {summary['p99_ms']} ms, "
+                       f"max {summary['max_ms']} ms")
+        print(f"  {endpoint}: {summary['requests']} 请求, {summary['rps']} RPS, "
+              f"错误 {summary['errors']}  {latency}")
+        if summary['error_types']:
+            print(f"    错误类型: {summary['error_types']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='预测API负载测试工具')
+    parser.add_argument('mode', choices=['closed', 'open', 'replay', 'sweep'],
+                        help='负载模式')
+    parser.add_argument('--url', default='http://localhost:5000',
+                        help='API服务器地址 (默认: http://localhost:5000)')
+    parser.add_argument('--dataset', default=DATASET,
+                        help='SMILES来源CSV（按其分布抽样）')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='每轮测试时长（秒）(默认: 30)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='closed模式的并发客户端数 (默认: 4)')
+    parser.add_argument('--rate', type=float, default=10,
+                        help='open模式的平均请求速率（请求/秒）(默认: 10)')
+    parser.add_argument('--rates', type=float, nargs='+',
+                        default=[1, 2, 5, 10, 20, 50],
+                        help='sweep模式依次测试的速率')
+    parser.add_argument('--access-log', default='access.log',
+                        help='replay模式使用的gunicorn access.log')
+    parser.add_argument('--speedup', type=float, default=1.0,
+                        help='replay模式的时间压缩倍数 (默认: 1.0)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10],
+                        help='/predict_batch 的分子数候选 (默认: 10)')
+    parser.add_argument('--batch-fraction', type=float, default=0.5,
+                        help='使用 /predict_batch 的请求比例 (默认: 0.5)')
+    parser.add_argument('--max-outstanding', type=int, default=256,
+                        help='开环模式下最多同时未完成的请求数')
+    parser.add_argument('--slo-ms', type=float, default=None,
+                        help='sweep模式的p99延迟目标（毫秒）')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='单个请求超时（秒）')
+    parser.add_argument('--output', default=None, help='结果JSON文件')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    try:
+        requests.get(args.url + '/', timeout=10).raise_for_status()
+    except requests.RequestException as e:
+        print(f"❌ 无法连接服务器 {args.url}: {e}")
+        sys.exit(1)
+
+    pool = SmilesPool(args.dataset, seed=args.seed)
+    generator = LoadGenerator(args.url, pool,
+                              batch_sizes=args.batch_sizes,
+                              batch_fraction=args.batch_fraction,
+                              timeout=args.timeout,
+                              seed=args.seed)
+
+    print(f"=== 负载测试: {args.mode} ===")
+    if args.mode == 'closed':
+        report = generator.run_closed(args.concurrency, args.duration)
+        print_report(report)
+    elif args.mode == 'open':
+        report = generator.run_open(args.rate, args.duration,
+                                    args.max_outstanding)
+        print_report(report)
+    elif args.mode == 'replay':
+        specs = parse_access_log(args.access_log)
+        if not specs:
+            print(f"❌ {args.access_log} 中没有可重放的预测请求")
+            sys.exit(1)
+        for spec in specs:
+            spec.send_at /= args.speedup
+        print(f"重放 {len(specs)} 个请求，时长 {specs[-1].send_at:.1f} 秒")
+        report = generator.run_schedule(specs, args.max_outstanding, {
+            'mode': 'replay',
+            'access_log': args.access_log,
+            'speedup': args.speedup,
+        })
+        print_report(report)
+    else:
+        rounds = []
+        for rate in args.rates:
+            print(f"\n--- 速率 {rate} 请求/秒 ---")
+            result = generator.run_open(rate, args.duration,
+                                        args.max_outstanding)
+            print_report(result)
+            rounds.append(result)
+        sustainable, saturation = find_saturation(rounds, args.slo_ms)
+        report = {
+            'mode': 'sweep',
+            'rounds': rounds,
+            'max_sustainable_rps': sustainable,
+            'saturation_rps': saturation,
+        }
+        print(f"\n最大可持续速率: {sustainable} 请求/秒")
+        if saturation is None:
+            print("未达到饱和点，可尝试更高的速率")
+        else:
+            print(f"饱和点: {saturation} 请求/秒")
+
+    report['config'] = {
+        'url': args.url,
+        'batch_sizes': args.batch_sizes,
+        'batch_fraction': args.batch_fraction,
+        'seed': args.seed,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ 结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+数据集合并与去重脚本
+将GoodScents、Leffingwell及自有数据源（如咖啡挥发物）合并为
+curated_GS_LF_merged_*.csv 格式的训练集，等价于
+openpom/data/merge_datasets.ipynb：并行规范化SMILES（去除立体化学），
+按哈希索引去重，并将描述符并集映射到138个任务词表上。
+重复运行时只处理新增或变更的数据行，并输出来源统计信息。
+"""
+
+import os
+import json
+import argparse
+import logging
+import pandas as pd
+
+from openpom.utils.dataset_merge import DatasetMerger, MergeSource
+
+CURATED_DIR = 'openpom/data/curated_datasets'
+VOCABULARY_DATASET = os.path.join(CURATED_DIR,
+                                  'curated_GS_LF_merged_4983.csv')
+# 与合并笔记本相同的顺序：Leffingwell在前，GoodScents在后
+DEFAULT_SOURCES = [
+    MergeSource('leffingwell', os.path.join(CURATED_DIR,
+                                            'curated_leffingwell.csv'),
+                'IsomericSMILES', 'Updated_Desc'),
+    MergeSource('goodscents', os.path.join(CURATED_DIR,
+                                           'curated_goodcents.csv'),
+                'IsomericSMILES', 'Updated_Desc_v2'),
+]
+
+
+def load_vocabulary(path=VOCABULARY_DATASET):
+    """读取任务词表：已合并数据集中SMILES和描述符列之后的标签列"""
+    return pd.read_csv(path, nrows=0).columns[2:].tolist()
+
+
+def print_stats(stats):
+    """打印来源统计信息"""
+    print("\n来源统计:")
+    for name, source in stats['sources'].items():
+        print(f"  {name}: {source['rows']} 行 "
+              f"(新增/变更 {source['new_rows']}, 删除 {source['removed_rows']}, "
+              f"规范化 {source['canonicalized']}), "
+              f"无效SMILES {source['invalid_smiles']}, "
+              f"分子 {source['molecules']} (仅此来源 {source['only_in_source']})")
+        if source['unknown_descriptors']:
+            unknown = list(source['unknown_descriptors'].items())[:10]
+            print(f"    词表外描述符: "
+                  f"{', '.join(f'{d}({n})' for d, n in unknown)}")
+    print(f"  合并后分子数: {stats['molecules']} "
+          f"(新增 {stats['new_molecules']}, 移除 {stats['removed_molecules']})")
+    print(f"  合并的重复行: {stats['duplicate_rows_merged']}, "
+          f"多来源分子: {stats['multi_source_molecules']}")
+    print(f"  移除odorless: {stats['odorless_dropped']}, "
+          f"无词表内标签而丢弃: {stats['unlabeled_molecules_dropped']}")
+    print(f"  耗时: {stats['seconds']} 秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据集合并与去重工具')
+    parser.add_argument('--source', nargs=4, action='append', default=None,
+                        metavar=('NAME', 'CSV', 'SMILES_COLUMN',
+                                 'DESCRIPTORS_COLUMN'),
+                        help='数据源，可重复指定，按顺序合并 '
+                             '(默认: Leffingwell与GoodScents)')
+    parser.add_argument('--output', default='curated_merged.csv',
+                        help='合并后的数据集CSV (默认: curated_merged.csv)')
+    parser.add_argument('--index-dir', default='./.openpom_cache/merge',
+                        help='哈希索引目录 (默认: ./.openpom_cache/merge)')
+    parser.add_argument('--vocabulary', default=VOCABULARY_DATASET,
+                        help='提供任务词表的已合并数据集CSV')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='规范化SMILES的进程数 (默认: 1)')
+    parser.add_argument('--stats', default=None,
+                        help='统计信息JSON输出路径 (默认: <output>.stats.json)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    sources = DEFAULT_SOURCES if args.source is None else \
+        [MergeSource(*source) for source in args.source]
+    tasks = load_vocabulary(args.vocabulary)
+
+    print("=== 数据集合并 ===")
+    print(f"数据源: {', '.join(source.name for source in sources)}")
+    print(f"任务词表: {len(tasks)} 个描述符")
+    merger = DatasetMerger(args.index_dir, tasks, n_workers=args.workers)
+    result = merger.merge(sources, output=args.output)
+    merger.write(result, args.output)
+
+    stats_path = args.stats or args.output + '.stats.json'
+    with open(stats_path, 'w') as f:
+        json.dump(result.stats, f, indent=4, ensure_ascii=False)
+    print_stats(result.stats)
+    print(f"\n✓ 已保存: {args.output} ({len(result.dataset)} 个分子)")
+    print(f"  统计信息: {stats_path}")
+
+
+if __name__ == "__main__":
+    main()
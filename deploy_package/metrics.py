@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Prometheus监控指标
+提供各预测阶段的延迟直方图、吞吐量、批大小、错误计数、并发请求数和进程内存
+
+多进程（gunicorn）部署时需设置环境变量 PROMETHEUS_MULTIPROC_DIR，
+各工作进程的指标写入该目录下的mmap文件，由 /metrics 汇总
+（见 start_production.sh 与 gunicorn.conf.py）
+"""
+
+import os
+import time
+import psutil
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               CONTENT_TYPE_LATEST, REGISTRY, generate_latest,
+                               multiprocess)
+
+MULTIPROCESS_MODE = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+# 单个阶段耗时从几十微秒到数秒不等
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 100, 128, 256)
+
+STAGE_SECONDS = Histogram('odor_stage_duration_seconds',
+                          '预测各阶段耗时（parse/featurize/batch/reduce/serialize）',
+                          ['stage'],
+                          buckets=STAGE_BUCKETS)
+MEMBER_FORWARD_SECONDS = Histogram('odor_member_forward_duration_seconds',
+                                   '每个集成成员的前向计算耗时', ['member'],
+                                   buckets=STAGE_BUCKETS)
+REQUEST_SECONDS = Histogram('odor_request_duration_seconds', '请求总耗时',
+                            ['endpoint'],
+                            buckets=REQUEST_BUCKETS)
+REQUESTS = Counter('odor_requests_total', '请求数', ['endpoint', 'status'])
+MOLECULES = Counter('odor_molecules_total', '已预测的分子数', ['endpoint'])
+BATCH_SIZE = Histogram('odor_request_batch_size', '每个请求的分子数',
+                       ['endpoint'],
+                       buckets=BATCH_SIZE_BUCKETS)
+ERRORS = Counter('odor_errors_total', '按类型统计的错误数', ['endpoint', 'type'])
+IN_FLIGHT = Gauge('odor_in_flight_requests', '正在处理的请求数',
+                  multiprocess_mode='livesum')
+CACHE_LOOKUPS = Counter('odor_prediction_cache_total', '预测缓存查询的分子数',
+                        ['result'])
+MODEL_RELOADS = Counter('odor_model_reloads_total', '模型热加载次数', ['result'])
+RESIDENT_MEMORY = Gauge('odor_process_resident_memory_bytes',
+                        '工作进程常驻内存（RSS）',
+                        multiprocess_mode='liveall')
+
+_process = psutil.Process()
+
+
+class _Timer:
+    """轻量计时器，退出时将耗时写入直方图"""
+
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+def stage_hook(stage, labels):
+    """OdorPredictorCPU 阶段钩子，见 OdorPredictorCPU.add_stage_hook"""
+    if stage == 'forward':
+        return _Timer(MEMBER_FORWARD_SECONDS.labels(str(labels['member'])))
+    return _Timer(STAGE_SECONDS.labels(stage))
+
+
+def stage(name):
+    """对服务端自身的阶段（如序列化）计时"""
+    return _Timer(STAGE_SECONDS.labels(name))
+
+
+def request_started():
+    IN_FLIGHT.inc()
+    return time.perf_counter()
+
+
+def request_finished(endpoint, status, start_time, n_molecules=0):
+    """记录请求完成，n_molecules为0时不计入吞吐与批大小"""
+    IN_FLIGHT.dec()
+    REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start_time)
+    REQUESTS.labels(endpoint, str(status)).inc()
+    if n_molecules:
+        MOLECULES.labels(endpoint).inc(n_molecules)
+        BATCH_SIZE.labels(endpoint).observe(n_molecules)
+    RESIDENT_MEMORY.set(_process.memory_info().rss)
+
+
+def record_error(endpoint, error_type):
+    ERRORS.labels(endpoint, error_type).inc()
+
+
+def record_cache_lookup(hits, misses):
+    """PredictionCache.on_lookup 回调"""
+    if hits:
+        CACHE_LOOKUPS.labels('hit').inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels('miss').inc(misses)
+
+
+def record_reload(status):
+    """OdorPredictorCPU.on_reload 回调"""
+    MODEL_RELOADS.labels(status['state']).inc()
+
+
+def render():
+    """
+    生成Prometheus文本格式的指标
+
+    Returns:
+        (指标文本, Content-Type)
+    """
+    RESIDENT_MEMORY.set(_process.memory_info().rss)
+    if MULTIPROCESS_MODE:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+本地模型注册表
+
+目录布局（MODEL_REGISTRY_DIR，默认 ./model_registry）:
+    model_registry/
+        full/
+            manifest.json
+            member_1/checkpoint.pt
+            ...
+        distilled/
+            manifest.json
+            member_1/checkpoint.pt
+
+manifest.json 记录结构超参数、任务列表、train_ratios及每个成员checkpoint的sha256，
+成员路径相对于清单所在目录（见 predict_odor_cpu.read_manifest）。
+服务端按名称懒加载多个集成模型，常驻内存的集成数量受LRU上限约束。
+未登记到注册表的旧布局（ensemble_models/experiments_N、distilled_N）以
+模型层级名称（full、fast）提供。
+
+使用方法:
+    # 将旧布局的集成模型（或distill_ensemble.py的输出）登记到注册表
+    python model_registry.py register --name full --prefix ./ensemble_models/experiments_ --n-models 10
+    python model_registry.py register --name distilled --prefix ./ensemble_models/distilled_ --n-models 1
+    # 列出已登记的模型 / 校验checkpoint
+    python model_registry.py list
+    python model_registry.py verify --name full
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+
+from predict_odor_cpu import (OdorPredictorCPU, MODEL_TIERS, MANIFEST_FILE,
+                              MODEL_CONFIG_FILE, ODOR_TASKS, file_sha256,
+                              find_model_directory, read_manifest,
+                              read_model_config)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGISTRY_DIR = './model_registry'
+# 请求未知模型时重新扫描注册表目录的最短间隔（秒）
+REFRESH_INTERVAL = 30.0
+
+
+class UnknownModelError(LookupError):
+    """注册表中不存在该模型"""
+
+    def __init__(self, name, available):
+        self.name = name
+        self.available = list(available)
+        super().__init__(f"未知的模型: {name}，可选: {', '.join(self.available)}")
+
+
+class ModelRegistry:
+    """
+    按名称懒加载集成模型，常驻内存的集成数量超过上限时换出最久未使用的模型
+
+    默认模型不会被换出；被换出的模型在进行中的请求结束后释放内存
+    """
+
+    def __init__(self, root=DEFAULT_REGISTRY_DIR, max_resident=2, default=None,
+                 predictor_kwargs=None, on_create=None, background=True,
+                 refresh_interval=REFRESH_INTERVAL):
+        """
+        Args:
+            root: 注册表目录
+            max_resident: 同时常驻内存的集成模型数量上限
+            default: 默认模型名称（请求未指定model时使用），None时为第一个可用模型
+            predictor_kwargs: 创建OdorPredictorCPU的附加参数（批处理预算、缓存等）
+            on_create: 可选回调 on_create(predictor)，每次加载模型后调用（注册监控钩子等）
+            background: 在后台线程中加载模型，get()立即返回
+            refresh_interval: 请求未知模型时重新扫描注册表目录的最短间隔（秒），
+                              避免随意的模型名称在每个请求上触发磁盘扫描
+        """
+        self.root = root
+        self.max_resident = max(1, max_resident)
+        self.predictor_kwargs = dict(predictor_kwargs or {})
+        self.on_create = on_create
+        self.background = background
+        self.refresh_interval = refresh_interval
+        self.default = default
+        self.entries = self._discover()
+        self._refreshed_at = time.monotonic()
+        if default is not None and default not in self.entries:
+            raise UnknownModelError(default, self.entries)
+        self.default = default or next(iter(self.entries), None)
+        self._resident = OrderedDict()
+        # 正在创建的预测器（名称 -> Future），创建期间不持有锁
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def _discover(self):
+        """扫描注册表目录中的清单，并补充未登记的旧布局模型层级"""
+        entries = {}
+        if os.path.isdir(self.root):
+            for dir_name in sorted(os.listdir(self.root)):
+                path = os.path.join(self.root, dir_name, MANIFEST_FILE)
+                if not os.path.exists(path):
+                    continue
+                try:
+                    manifest = read_manifest(path)
+                except Exception as e:
+                    logger.warning(f"跳过无效的模型清单 {path}: {e}")
+                    continue
+                entries[manifest['name']] = {
+                    'manifest_path': path,
+                    'version': manifest.get('version'),
+                    'description': manifest.get('description'),
+                    'n_members': len(manifest['members']),
+                }
+
+        for tier, tier_info in MODEL_TIERS.items():
+            if tier in entries:
+                continue
+            model_dir_prefix = find_model_directory(tier)
+            if model_dir_prefix is not None:
+                entries[tier] = {
+                    'model_dir_prefix': model_dir_prefix,
+                    'tier': tier,
+                    'n_members': tier_info['n_models'],
+                    'legacy': True,
+                }
+
+        # 默认的模型层级未找到时仍然保留，由预测器使用默认路径并报告加载失败
+        if self.default in MODEL_TIERS and self.default not in entries:
+            entries[self.default] = {
+                'model_dir_prefix': None,
+                'tier': self.default,
+                'n_members': MODEL_TIERS[self.default]['n_models'],
+                'legacy': True,
+            }
+        return entries
+
+    def refresh(self):
+        """重新扫描注册表目录（登记新模型后无需重启服务）"""
+        entries = self._discover()
+        with self._lock:
+            self.entries = entries
+            self._refreshed_at = time.monotonic()
+
+    def _refresh_if_stale(self):
+        """距上次扫描超过refresh_interval时重新扫描"""
+        with self._lock:
+            if time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return
+            # 并发的未知模型请求只触发一次扫描
+            self._refreshed_at = time.monotonic()
+        self.refresh()
+
+    def get(self, name=None):
+        """
+        获取模型的预测器，未加载时开始加载（后台模式下需检查 predictor.ready）
+
+        Raises:
+            UnknownModelError: 注册表中不存在该模型
+        """
+        name = name or self.default
+        with self._lock:
+            predictor = self._resident.get(name)
+            if predictor is not None:
+                self._resident.move_to_end(name)
+                return predictor
+
+        if name not in self.entries:
+            self._refresh_if_stale()  # 可能是服务启动后新登记的模型
+        with self._lock:
+            if name not in self.entries:
+                raise UnknownModelError(name, self.entries)
+            predictor = self._resident.get(name)
+            if predictor is not None:
+                self._resident.move_to_end(name)
+                return predictor
+            future = self._loading.get(name)
+            creating = future is None
+            if creating:
+                future = self._loading[name] = Future()
+        if not creating:
+            # 其他线程正在创建该模型的预测器
+            return future.result()
+
+        # 创建预测器（background=False时包括加载模型）不持有锁，
+        # 以免阻塞其他模型的查找
+        try:
+            predictor = self._create(name)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[name]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[name]
+            self._resident[name] = predictor
+            evicted = self._evict(keep=name)
+        future.set_result(predictor)
+        for evicted_predictor in evicted:
+            evicted_predictor.close()
+        if evicted:
+            gc.collect()
+        return predictor
+
+    def _create(self, name):
+        entry = self.entries[name]
+        kwargs = dict(self.predictor_kwargs, load_in_background=self.background)
+        if 'manifest_path' in entry:
+            kwargs['manifest_path'] = entry['manifest_path']
+        else:
+            kwargs.update(model_dir_prefix=entry['model_dir_prefix'], tier=entry['tier'])
+        logger.info(f"加载模型: {name}")
+        predictor = OdorPredictorCPU(**kwargs)
+        if self.on_create is not None:
+            self.on_create(predictor)
+        return predictor
+
+    def _evict(self, keep):
+        """
+        换出最久未使用的模型（默认模型与刚请求的模型除外），直到不超过常驻上限；
+        需持有锁调用
+
+        Returns:
+            list: 被换出的预测器，由调用方在释放锁后关闭
+        """
+        evicted = []
+        while len(self._resident) > self.max_resident:
+            name = next((n for n in self._resident
+                         if n not in (self.default, keep)), None)
+            if name is None:
+                break
+            evicted.append(self._resident.pop(name))
+            logger.info(f"换出模型: {name}")
+        return evicted
+
+    def resident(self):
+        """当前常驻内存的模型名称（最近使用的在后）"""
+        with self._lock:
+            return list(self._resident)
+
+    def describe(self):
+        """所有已登记模型的信息，用于 /models 接口"""
+        with self._lock:
+            resident = dict(self._resident)
+            entries = dict(self.entries)
+        models = []
+        for name, entry in entries.items():
+            info = {
+                'name': name,
+                'default': name == self.default,
+                'resident': name in resident,
+                'n_members': entry['n_members'],
+                'version': entry.get('version'),
+                'description': entry.get('description'),
+                'legacy': entry.get('legacy', False),
+            }
+            predictor = resident.get(name)
+            if predictor is not None:
+                info.update(ready=predictor.ready.is_set(),
+                            models_loaded=len(predictor.models),
+                            model_version=predictor.model_version)
+            models.append(info)
+        return models
+
+
+def register(root, name, model_dir_prefix, n_models, version=None,
+             description=None, copy=True):
+    """
+    将目录布局的集成模型（experiments_N、distill_ensemble.py的输出等）登记到注册表
+
+    Args:
+        root: 注册表目录
+        name: 模型名称
+        model_dir_prefix: 成员目录前缀，成员目录为 {前缀}1 ... {前缀}n_models
+        n_models: 成员数量
+        version: 版本号，None时使用当前时间
+        description: 模型说明
+        copy: 将checkpoint复制到注册表目录；False时清单引用原位置的文件
+
+    Returns:
+        str: 清单文件路径
+    """
+    target = os.path.join(root, name)
+    os.makedirs(target, exist_ok=True)
+
+    members = []
+    shared_params = None
+    tasks = None
+    for i in range(n_models):
+        model_dir = f'{model_dir_prefix}{i+1}'
+        model_params, checkpoint_name, train_ratios = read_model_config(model_dir)
+        source = os.path.join(model_dir, checkpoint_name)
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"模型文件不存在: {source}")
+        config_path = os.path.join(model_dir, MODEL_CONFIG_FILE)
+        if tasks is None and os.path.exists(config_path):
+            with open(config_path, 'r') as f:
+                tasks = json.load(f).get('tasks')
+
+        print(f"登记成员 {i+1}/{n_models}: {source}")
+        if copy:
+            checkpoint = os.path.join(f'member_{i+1}', 'checkpoint.pt')
+            os.makedirs(os.path.join(target, f'member_{i+1}'), exist_ok=True)
+            shutil.copy2(source, os.path.join(target, checkpoint))
+        else:
+            checkpoint = os.path.relpath(os.path.abspath(source), os.path.abspath(target))
+        member = {'checkpoint': checkpoint, 'sha256': file_sha256(source)}
+        # 各成员结构相同时只在清单顶层记录一次
+        if shared_params is None:
+            shared_params = model_params
+        elif model_params != shared_params:
+            member['model_params'] = model_params
+        if train_ratios is not None:
+            member['train_ratios'] = train_ratios
+        members.append(member)
+
+    manifest = {
+        'name': name,
+        'version': version or datetime.now().strftime('%Y%m%d-%H%M%S'),
+        'description': description,
+        'created_at': datetime.now().isoformat(),
+        'source': model_dir_prefix,
+        'model_params': shared_params,
+        'tasks': tasks or ODOR_TASKS,
+        'members': members,
+    }
+    # 先写临时文件再替换，避免服务端读取到写了一半的清单
+    path = os.path.join(target, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def verify(root, name):
+    """
+    校验清单中各成员checkpoint的sha256
+
+    Returns:
+        list: 校验失败的成员描述，全部通过时为空列表
+    """
+    manifest = read_manifest(os.path.join(root, name, MANIFEST_FILE))
+    failures = []
+    for i, member in enumerate(manifest['members']):
+        path = member['checkpoint_path']
+        if not os.path.exists(path):
+            failures.append(f"成员 {i+1}: 文件不存在 {path}")
+        elif member['sha256'] and file_sha256(path) != member['sha256']:
+            failures.append(f"成员 {i+1}: 校验和不匹配 {path}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模型注册表')
+    parser.add_argument('--root', default=os.environ.get('MODEL_REGISTRY_DIR',
+                                                         DEFAULT_REGISTRY_DIR),
+                        help='注册表目录')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    register_parser = subparsers.add_parser('register', help='登记集成模型')
+    register_parser.add_argument('--name', required=True, help='模型名称')
+    register_parser.add_argument('--prefix', required=True,
+                                 help='成员目录前缀，如 ./ensemble_models/experiments_')
+    register_parser.add_argument('--n-models', type=int, required=True, help='成员数量')
+    register_parser.add_argument('--version', help='版本号，默认为当前时间')
+    register_parser.add_argument('--description', help='模型说明')
+    register_parser.add_argument('--no-copy', action='store_true',
+                                 help='不复制checkpoint，清单引用原位置的文件')
+
+    subparsers.add_parser('list', help='列出已登记的模型')
+
+    verify_parser = subparsers.add_parser('verify', help='校验checkpoint的sha256')
+    verify_parser.add_argument('--name', required=True, help='模型名称')
+
+    args = parser.parse_args()
+
+    if args.command == 'register':
+        path = register(args.root, args.name, args.prefix, args.n_models,
+                        version=args.version, description=args.description,
+                        copy=not args.no_copy)
+        print(f"✓ 已登记模型 {args.name}: {path}")
+    elif args.command == 'list':
+        registry = ModelRegistry(args.root, background=False)
+        for info in registry.describe():
+            source = '旧布局' if info['legacy'] else f"版本 {info['version']}"
+            print(f"  {info['name']:12s} {info['n_members']:3d}个成员  {source}"
+                  f"{'  (默认)' if info['default'] else ''}")
+    elif args.command == 'verify':
+        failures = verify(args.root, args.name)
+        for failure in failures:
+            print(f"  ✗ {failure}")
+        if failures:
+            sys.exit(1)
+        print(f"✓ 模型 {args.name} 校验通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -216,17 +216,18 @@ class GraphFeaturizer(MolecularFeaturizer):
         # get atom features
         f_atoms: np.ndarray = np.asarray(
             [atom_features(atom) for atom in datapoint.GetAtoms()],
-            dtype=float)
+            dtype=np.float32)
 
         # get edge(bond) features
         if len(datapoint.GetBonds()) == 0:
-            f_bonds: np.ndarray = np.empty((0, GraphConvConstants.BOND_FDIM))
+            f_bonds: np.ndarray = np.empty((0, GraphConvConstants.BOND_FDIM),
+                                           dtype=np.float32)
         else:
             f_bonds_list = []
             for bond in datapoint.GetBonds():
                 b_feat = 2 * [bond_features(bond)]
                 f_bonds_list.extend(b_feat)
-            f_bonds = np.asarray(f_bonds_list, dtype=float)
+            f_bonds = np.asarray(f_bonds_list, dtype=np.float32)
 
         # get edge index
         edge_index: np.ndarray = self._construct_bond_index(datapoint)
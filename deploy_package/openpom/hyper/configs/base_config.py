@@ -1,5 +1,7 @@
 import os
 import json
+import math
+import random
 import itertools
 import numpy as np
 from typing import Dict, List, Any, Optional, Tuple
@@ -19,12 +21,15 @@ class Config:
     PARAMS_DICT: Dict[str, List] = {
         'sample_param': ['sample_value1', 'sample_value2']
     }
+    # parameter -> (parent parameter, parent value for which it varies)
+    CONDITIONAL_PARAMS: Dict[str, Tuple[str, Any]] = {}
 
     @classmethod
     def generate_hyperparams_random(
             cls,
             n_trials: int = 1,
-            dir: Optional[str] = None) -> Tuple[Dict, str]:
+            dir: Optional[str] = None,
+            seed: Optional[int] = None) -> Tuple[Dict, str]:
         """
         Generate hyperparameter combinations for random trials.
 
@@ -35,6 +40,8 @@ class Config:
         dir: Optional[str]
             Directory path to save json file of generated
             combinations.
+        seed: Optional[int]
+            Random seed, same seed gives the same trials.
 
         Returns
         -------
@@ -45,13 +52,40 @@ class Config:
             combinations.
         """
         hyperparameter_combs: List[Dict[
-            str, Any]] = cls._generate_random_hyperparam_values(n=n_trials)
+            str, Any]] = cls._generate_random_hyperparam_values(n=n_trials,
+                                                                seed=seed)
 
         trials_dict: Dict = {}
         for count, params in enumerate(hyperparameter_combs):
             trials_dict[f'trial_{count+1}'] = params
 
-        file_name: str = f"{n_trials}_trials_params.json"
+        file_path: str = cls.save_trials(trials_dict,
+                                         f"{n_trials}_trials_params.json",
+                                         dir)
+        return trials_dict, file_path
+
+    @staticmethod
+    def save_trials(trials_dict: Dict,
+                    file_name: str,
+                    dir: Optional[str] = None) -> str:
+        """
+        Save trials to a json file, as read by the search scripts.
+
+        Parameters
+        ----------
+        trials_dict: Dict
+            Dictionary of hyperparameter combinations by trial name.
+        file_name: str
+            Name of the json file.
+        dir: Optional[str]
+            Directory to save the file in, default to the current
+            working directory.
+
+        Returns
+        -------
+        file_path: str
+            File path of saved json file.
+        """
         if dir is None:
             cwd: str = os.getcwd()
             file_path: str = os.path.join(cwd, file_name)
@@ -60,47 +94,122 @@ class Config:
 
         with open(file_path, "w") as json_file:
             json.dump(trials_dict, json_file, indent=4)
-
-        return trials_dict, file_path
+        return file_path
 
     @classmethod
-    def _generate_random_hyperparam_values(cls,
-                                           n: int) -> List[Dict[str, Any]]:
+    def _generate_random_hyperparam_values(
+            cls,
+            n: int,
+            seed: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Generates `n` random hyperparameter combinations
         of hyperparameter values
 
+        Combinations are drawn without replacement and without
+        enumerating the search space: `n` distinct indices into the
+        space are sampled (Floyd's algorithm) and decoded as mixed-radix
+        numbers, so memory is O(n) whatever the size of PARAMS_DICT.
+
+        Parameters listed in CONDITIONAL_PARAMS only vary when their
+        parent parameter takes the activating value, otherwise they are
+        fixed to their first value. Equivalent combinations that only
+        differ in an unused parameter are thus never drawn twice.
+
         Parameters
         ----------
         n: int
             Number of random combinations to generate
+        seed: Optional[int]
+            Random seed, same seed gives the same combinations. If None, a
+            seed is drawn from numpy's global random state.
 
         Returns
         -------
         params_subset: List[Dict[str, Any]]
             list of hyperparameter combinations
         """
-        hyperparam_keys: List
-        hyperparam_values: List
-        hyperparam_keys, hyperparam_values = [], []
+        if seed is None:
+            seed = int(np.random.randint(2**31 - 1))
+        rng: random.Random = random.Random(seed)
+
+        hyperparam_values: Dict[str, List] = {}
         for key, values in cls.PARAMS_DICT.items():
             if callable(values):
                 # If callable, sample it for a maximum n times
                 values = [values() for i in range(n)]
-            hyperparam_keys.append(key)
-            hyperparam_values.append(values)
+            hyperparam_values[key] = list(values)
 
-        hyperparam_combs: List = []
-        for iterable_hyperparam_comb in itertools.product(*hyperparam_values):
-            hyperparam_comb: List = list(iterable_hyperparam_comb)
-            hyperparam_combs.append(hyperparam_comb)
-        indices: np.ndarray = np.random.permutation(len(hyperparam_combs))[:n]
+        branches: List[Dict[str, List]] = cls._conditional_branches(
+            hyperparam_values)
+        sizes: List[int] = [
+            math.prod(len(values) for values in branch.values())
+            for branch in branches
+        ]
+        n_combs: int = sum(sizes)
+        n = min(n, n_combs)
+
+        # Floyd's algorithm: n distinct indices out of n_combs
+        chosen: List[int] = []
+        chosen_set: set = set()
+        for j in range(n_combs - n, n_combs):
+            index: int = rng.randrange(j + 1)
+            if index in chosen_set:
+                index = j
+            chosen.append(index)
+            chosen_set.add(index)
+        rng.shuffle(chosen)
 
         params_subset: List = []
-        for index in indices:
+        for index in chosen:
+            for branch, size in zip(branches, sizes):
+                if index < size:
+                    break
+                index -= size
             param: Dict = {}
-            for key, hyperparam_value in zip(hyperparam_keys,
-                                             hyperparam_combs[index]):
-                param[key] = hyperparam_value
-            params_subset.append(param)
+            # mixed-radix decoding, the last parameter varies fastest
+            for key, values in reversed(list(branch.items())):
+                index, digit = divmod(index, len(values))
+                param[key] = values[digit]
+            params_subset.append({key: param[key] for key in branch})
         return params_subset
+
+    @classmethod
+    def _conditional_branches(
+            cls, hyperparam_values: Dict[str, List]) -> List[Dict[str, List]]:
+        """
+        Split the search space into disjoint branches, one per combination
+        of values of the parents in CONDITIONAL_PARAMS, in which every
+        conditional parameter either varies or is fixed to its first value
+
+        Parameters
+        ----------
+        hyperparam_values: Dict[str, List]
+            Values of every hyperparameter
+
+        Returns
+        -------
+        branches: List[Dict[str, List]]
+            Values of every hyperparameter in each branch
+        """
+        parents: List[str] = [
+            key for key in hyperparam_values if any(
+                parent == key
+                for parent, _ in cls.CONDITIONAL_PARAMS.values())
+        ]
+        branches: List[Dict[str, List]] = []
+        for parent_values in itertools.product(
+                *[hyperparam_values[key] for key in parents]):
+            assignment: Dict[str, Any] = dict(zip(parents, parent_values))
+            branch: Dict[str, List] = {}
+            for key, values in hyperparam_values.items():
+                if key in assignment:
+                    branch[key] = [assignment[key]]
+                elif key in cls.CONDITIONAL_PARAMS:
+                    parent, active_value = cls.CONDITIONAL_PARAMS[key]
+                    active: bool = parent not in hyperparam_values or \
+                        assignment[parent] == active_value
+                    branch[key] = values if active else values[:1]
+                else:
+                    branch[key] = values
+            branches.append(branch)
+        return branches
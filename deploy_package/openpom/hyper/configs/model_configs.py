@@ -1,6 +1,6 @@
 # yapf: disable
 import numpy as np
-from typing import Dict
+from typing import Any, Dict, Tuple
 from openpom.hyper.configs.base_config import Config
 
 
@@ -9,9 +9,8 @@ class MPNNPOMConfig(Config):
     Hyperparameter search space for MPNNPOMModel
 
     Note:
-        MPNNPOMConfig.generate_hyperparams_random() method
-        might take a lot of memory during computation of
-        combinations, so tweak the parameter space accordingly.
+        set2set parameters are only sampled when
+        readout_type is 'set2set'.
     """
     PARAMS_DICT: Dict = {
         'batch_size': [128, 256],
@@ -39,3 +38,7 @@ class MPNNPOMConfig(Config):
         'learning_rate': [0.0005, 0.001, 0.005, 0.01],
         'self_loop': [True, False],
         }
+    CONDITIONAL_PARAMS: Dict[str, Tuple[str, Any]] = {
+        'num_step_set2set': ('readout_type', 'set2set'),
+        'num_layer_set2set': ('readout_type', 'set2set'),
+        }
@@ -0,0 +1,128 @@
+import math
+from typing import Dict, Hashable, List, Tuple
+
+
+def rung_budgets(min_epoch: int, max_epoch: int,
+                 reduction_factor: int = 3) -> List[int]:
+    """
+    Epoch budgets of the rungs of successive halving
+
+    Parameters
+    ----------
+    min_epoch: int
+        Budget of the first rung
+    max_epoch: int
+        Budget of the last rung
+    reduction_factor: int
+        Budget grows by this factor from one rung to the next
+
+    Returns
+    -------
+    budgets: List[int]
+        Increasing epoch budgets, the last one is max_epoch
+
+    Example
+    -------
+    >>> rung_budgets(1, 27, 3)
+    [1, 3, 9, 27]
+    >>> rung_budgets(2, 20, 3)
+    [2, 6, 20]
+    """
+    if not 1 <= min_epoch <= max_epoch:
+        raise ValueError("min_epoch should be between 1 and max_epoch")
+    if reduction_factor < 2:
+        raise ValueError("reduction_factor should be at least 2")
+    budgets: List[int] = []
+    budget: int = min_epoch
+    while budget < max_epoch:
+        budgets.append(budget)
+        budget *= reduction_factor
+    # a last rung close to the previous one costs little, merge it upwards
+    if budgets and budgets[-1] * reduction_factor > max_epoch and \
+            max_epoch < budgets[-1] * math.sqrt(reduction_factor):
+        budgets.pop()
+    budgets.append(max_epoch)
+    return budgets
+
+
+def promote(scores: Dict[Hashable, float],
+            reduction_factor: int = 3) -> List[Hashable]:
+    """
+    Select the configurations promoted to the next rung
+
+    Parameters
+    ----------
+    scores: Dict[Hashable, float]
+        Score of every configuration at the current rung, higher is
+        better. NaN scores are ranked last.
+    reduction_factor: int
+        The top 1 / reduction_factor of the configurations are promoted
+
+    Returns
+    -------
+    promoted: List[Hashable]
+        Keys of the promoted configurations, best first. At least one
+        configuration is promoted.
+    """
+    n_promoted: int = max(1, len(scores) // reduction_factor)
+    ranked: List[Hashable] = sorted(
+        scores,
+        key=lambda key: -scores[key]
+        if not math.isnan(scores[key]) else math.inf)
+    return ranked[:n_promoted]
+
+
+def hyperband_brackets(n_trials: int,
+                       min_epoch: int,
+                       max_epoch: int,
+                       reduction_factor: int = 3) -> List[Tuple[int, int]]:
+    """
+    Split trials into Hyperband brackets
+
+    Hyperband hedges against a too aggressive first rung by running
+    successive halving several times with fewer configurations and larger
+    starting budgets. The bracket sizes follow Li et al., scaled so that
+    together they cover the ``n_trials`` configurations.
+
+    Parameters
+    ----------
+    n_trials: int
+        Total number of configurations
+    min_epoch: int
+        Smallest starting budget
+    max_epoch: int
+        Maximum budget per configuration
+    reduction_factor: int
+        Reduction factor of successive halving
+
+    Returns
+    -------
+    brackets: List[Tuple[int, int]]
+        (number of configurations, starting budget) per bracket, the most
+        exploratory bracket first. Brackets without configurations are
+        left out.
+
+    References
+    ----------
+    .. Li, L. et al. "Hyperband: A Novel Bandit-Based Approach to
+       Hyperparameter Optimization" JMLR (2018)
+    """
+    s_max: int = len(rung_budgets(min_epoch, max_epoch, reduction_factor)) - 1
+    weights: List[float] = [
+        math.ceil((s_max + 1) / (s + 1) * reduction_factor**s)
+        for s in range(s_max, -1, -1)
+    ]
+    sizes: List[int] = [
+        int(n_trials * weight / sum(weights)) for weight in weights
+    ]
+    # hand out the remainder to the most exploratory brackets
+    for i in range(n_trials - sum(sizes)):
+        sizes[i % len(sizes)] += 1
+    brackets: List[Tuple[int, int]] = []
+    for s, size in zip(range(s_max, -1, -1), sizes):
+        if size > 0:
+            brackets.append(
+                (size,
+                 max(min_epoch,
+                     int(round(max_epoch / reduction_factor**s)))))
+    return brackets
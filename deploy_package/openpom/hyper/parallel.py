@@ -0,0 +1,145 @@
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                wait)
+from concurrent.futures.process import BrokenProcessPool
+from typing import (Any, Callable, Dict, Hashable, List, NamedTuple, Optional,
+                    Tuple)
+
+logger = logging.getLogger(__name__)
+
+
+class JobResult(NamedTuple):
+    """
+    Outcome of a job run by ``run_jobs``
+
+    Attributes
+    ----------
+    value: Any
+        Return value of the job function, None if the job failed
+    error: Optional[str]
+        Error of the last attempt if all attempts failed
+    attempts: int
+        Number of attempts made
+    duration: float
+        Run time in seconds of the successful attempt
+    """
+    value: Any
+    error: Optional[str]
+    attempts: int
+    duration: float
+
+
+def _run_job(fn: Callable[[Any], Any], job: Any,
+             threads: int) -> Tuple[Any, float]:
+    """Run one job in a worker process with a CPU thread budget"""
+    import torch
+    torch.set_num_threads(threads)
+    start: float = time.perf_counter()
+    value: Any = fn(job)
+    return value, time.perf_counter() - start
+
+
+def default_threads_per_job(n_workers: int) -> int:
+    """Split the CPU cores evenly between worker processes"""
+    return max(1, (os.cpu_count() or 1) // n_workers)
+
+
+def run_jobs(fn: Callable[[Any], Any],
+             jobs: Dict[Hashable, Any],
+             n_workers: int,
+             threads_per_job: Optional[int] = None,
+             max_retries: int = 1,
+             on_result: Optional[Callable[[Hashable, JobResult],
+                                          None]] = None
+             ) -> Dict[Hashable, JobResult]:
+    """
+    Run independent jobs concurrently in a pool of worker processes
+
+    Workers are started with the ``spawn`` method, torch and DGL thread
+    pools do not survive ``fork``. Each job gets ``threads_per_job`` torch
+    threads so the workers together do not oversubscribe the CPU.
+
+    A job that raises is resubmitted up to ``max_retries`` times, after
+    that its error is recorded and the remaining jobs keep running. If a
+    worker process dies (e.g. killed by the OOM killer) the pool is
+    restarted and the unfinished jobs are resubmitted.
+
+    Parameters
+    ----------
+    fn: Callable[[Any], Any]
+        Picklable module level function called as ``fn(job)``
+    jobs: Dict[Hashable, Any]
+        Picklable job arguments by job key
+    n_workers: int
+        Number of worker processes
+    threads_per_job: Optional[int]
+        Torch threads per job, default to cpu_count // n_workers
+    max_retries: int
+        Number of times a failed job is resubmitted. Default to 1.
+    on_result: Optional[Callable[[Hashable, JobResult], None]]
+        Called in the parent process as each job finishes
+
+    Returns
+    -------
+    results: Dict[Hashable, JobResult]
+        Result of every job, in the order of ``jobs``
+    """
+    threads: int = threads_per_job or default_threads_per_job(n_workers)
+    context = multiprocessing.get_context('spawn')
+    attempts: Dict[Hashable, int] = {key: 0 for key in jobs}
+    results: Dict[Hashable, JobResult] = {}
+    queue: List[Hashable] = list(jobs)
+
+    def failed(key: Hashable, error: BaseException) -> bool:
+        """Record a failed attempt, returns whether to retry"""
+        message: str = f"{type(error).__name__}: {error}"
+        if attempts[key] <= max_retries:
+            logger.warning("Job %s failed (attempt %d), retrying: %s" %
+                           (key, attempts[key], message))
+            return True
+        logger.error("Job %s failed after %d attempts: %s" %
+                     (key, attempts[key], message))
+        results[key] = JobResult(None, message, attempts[key], 0.0)
+        if on_result is not None:
+            on_result(key, results[key])
+        return False
+
+    while queue:
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 mp_context=context) as executor:
+            running: Dict[Future, Hashable] = {}
+
+            def submit(key: Hashable) -> None:
+                try:
+                    running[executor.submit(_run_job, fn, jobs[key],
+                                            threads)] = key
+                except BrokenProcessPool:
+                    queue.append(key)
+
+            pending, queue = queue, []
+            for key in pending:
+                submit(key)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    attempts[key] += 1
+                    try:
+                        value, duration = future.result()
+                    except BrokenProcessPool as e:
+                        # the pool is unusable, restart it for the retries
+                        if failed(key, e):
+                            queue.append(key)
+                        continue
+                    except Exception as e:
+                        if failed(key, e):
+                            submit(key)
+                        continue
+                    results[key] = JobResult(value, None, attempts[key],
+                                             duration)
+                    if on_result is not None:
+                        on_result(key, results[key])
+    return {key: results[key] for key in jobs}
@@ -2,14 +2,21 @@ import os
 import json
 import torch
 import tempfile
+import functools
 import numpy as np
 from tqdm import tqdm
 import deepchem as dc
-from datetime import datetime
+from datetime import datetime, timedelta
 from openpom.models.mpnn_pom import MPNNPOMModel
 from openpom.feat.graph_featurizer import GraphFeaturizer, GraphConvConstants
 from openpom.utils.data_utils import get_class_imbalance_ratio
+from openpom.utils.dataset_cache import DatasetCache
+from openpom.utils.metrics import mean_roc_auc
+from openpom.utils.checkpoint import CheckpointWriter, write_checkpoint
+from openpom.utils.data_parallel import DataParallelTrainer
 from openpom.hyper.configs.model_configs import MPNNPOMConfig
+from openpom.hyper.parallel import JobResult, run_jobs
+from openpom.hyper.halving import hyperband_brackets, promote, rung_budgets
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 import logging
 
@@ -18,6 +25,9 @@ logger = logging.getLogger(__name__)
 
 DATASET = 'openpom/data/curated_datasets/curated_GS_LF_merged_4983.csv'
 SMILES_FIELD = 'nonStereoSMILES'
+CACHE_DIR = './.openpom_cache'
+# number of train molecules scored per epoch, None for the full train set
+TRAIN_EVAL_SAMPLES = 1000
 TASKS = [
     'alcoholic', 'aldehydic', 'alliaceous', 'almond', 'amber', 'animal',
     'anisic', 'apple', 'apricot', 'aromatic', 'balsamic', 'banana', 'beefy',
@@ -46,7 +56,8 @@ TASKS = [
 def save_checkpoint(self,
                     max_checkpoints_to_keep: int = 5,
                     model_dir=None,
-                    ckpt_name: str = 'best_checkpoint') -> None:
+                    ckpt_name: str = 'best_checkpoint',
+                    weights_only: bool = False) -> None:
     """
         Save a checkpoint to disk.
 
@@ -56,134 +67,253 @@ def save_checkpoint(self,
             the maximum number of checkpoints to keep.  Older checkpoints are discarded.
         model_dir: str, default None
             Model directory to save checkpoint to. If None, revert to self.model_dir
+        ckpt_name: str
+            Checkpoint file name prefix
+        weights_only: bool
+            Only save the model weights, not the optimizer state
         """
     self._ensure_built()
     if model_dir is None:
         model_dir = self.model_dir
-    if not os.path.exists(model_dir):
-        os.makedirs(model_dir)
-
-    # Save the checkpoint to a file.
 
     data = {
         'model_state_dict': self.model.state_dict(),
-        'optimizer_state_dict': self._pytorch_optimizer.state_dict(),
         'global_step': self._global_step
     }
-    temp_file = os.path.join(model_dir, f'{ckpt_name}.pt')
-    torch.save(data, temp_file)
-
-    # Rename and delete older files.
-    paths = [
-        os.path.join(model_dir, f'{ckpt_name}%d.pt' % (i + 1))
-        for i in range(max_checkpoints_to_keep)
-    ]
-    if os.path.exists(paths[-1]):
-        os.remove(paths[-1])
-    for i in reversed(range(max_checkpoints_to_keep - 1)):
-        if os.path.exists(paths[i]):
-            os.rename(paths[i], paths[i + 1])
-    os.rename(temp_file, paths[0])
+    if not weights_only:
+        data['optimizer_state_dict'] = self._pytorch_optimizer.state_dict()
+
+    # written in the background when the model has a checkpoint writer
+    writer = getattr(self, 'checkpoint_writer', None)
+    if writer is not None:
+        writer.save(data, model_dir, ckpt_name, max_checkpoints_to_keep)
+    else:
+        write_checkpoint(data, model_dir, ckpt_name, max_checkpoints_to_keep)
+
+
+def build_model(n_tasks,
+                max_atoms_per_batch=None,
+                max_edges_per_batch=None,
+                **params):
+    """Build a MPNNPOMModel for a trial (module level so jobs can pickle it)"""
+    return MPNNPOMModel(n_tasks=n_tasks,
+                        mode='classification',
+                        number_atom_features=GraphConvConstants.ATOM_FDIM,
+                        number_bond_features=GraphConvConstants.BOND_FDIM,
+                        n_classes=1,
+                        max_atoms_per_batch=max_atoms_per_batch,
+                        max_edges_per_batch=max_edges_per_batch,
+                        **params)
+
+
+def remove_checkpoint(model_dir):
+    """Remove the last training checkpoint of a fold"""
+    try:
+        os.remove(os.path.join(model_dir, 'checkpoint1.pt'))
+    except:
+        pass
+
+
+def _fold_job(job):
+    """Train one (trial, fold) job in a worker process"""
+    cv = CV(model_builder=job['model_builder'],
+            n_folds=job['n_folds'],
+            device=job['device'])
+    # fold datasets are shared read-only through their directories
+    train_dataset = dc.data.DiskDataset(job['train_dir'])
+    valid_dataset = dc.data.DiskDataset(job['valid_dir'])
+    return cv.fit_fold(model_params=dict(job['model_params']),
+                       fold_num=job['fold_num'],
+                       train_dataset=train_dataset,
+                       valid_dataset=valid_dataset,
+                       logdir=job['logdir'],
+                       max_epoch=job['max_epoch'],
+                       save_best_ckpt=job['save_best_ckpt'],
+                       train_eval_samples=job.get('train_eval_samples',
+                                                  TRAIN_EVAL_SAMPLES),
+                       start_epoch=job.get('start_epoch', 1),
+                       best_scores=job.get('best_scores', (0, 0)),
+                       model_dir=job.get('model_dir'),
+                       keep_checkpoint=job.get('keep_checkpoint', False))
 
 
 class CV:
     """
     K-FOLD CROSS VALIDATION for MPNNPOM model
     with custom stratification splitting
+
+    With a ``data_parallel`` trainer, each fold is trained by the
+    processes of that trainer on shards of every batch.
     """
 
-    def __init__(self, model_builder, n_folds, device=None) -> None:
+    def __init__(self,
+                 model_builder,
+                 n_folds,
+                 device=None,
+                 data_parallel=None) -> None:
         self.model_builder = model_builder
         self.n_folds = n_folds
         self.device = device
+        self.data_parallel = data_parallel
 
-    def _deepchem_splitter(self, dataset):
+    def close(self):
+        """Stop the processes of the data parallel trainer"""
+        if self.data_parallel is not None:
+            self.data_parallel.close()
+
+    def _deepchem_splitter(self, dataset, dataset_cache=None, seed=None):
         randomstratifiedsplitter = dc.splits.RandomStratifiedSplitter()
+        if dataset_cache is not None:
+            return dataset_cache.k_fold_split(dataset,
+                                              randomstratifiedsplitter,
+                                              k=self.n_folds,
+                                              seed=seed)
+        kwargs = {} if seed is None else {'seed': seed}
         return randomstratifiedsplitter.k_fold_split(dataset=dataset,
-                                                     k=self.n_folds)
-
-    def generate_folds(self, dataset, splitter='deepchem'):
+                                                     k=self.n_folds,
+                                                     **kwargs)
+
+    def generate_folds(self,
+                       dataset,
+                       splitter='deepchem',
+                       dataset_cache=None,
+                       seed=None):
         if splitter == 'deepchem':
-            self.folds_list = self._deepchem_splitter(dataset)
+            self.folds_list = self._deepchem_splitter(dataset, dataset_cache,
+                                                      seed)
         elif splitter == 'skmultilearn':
             raise NotImplementedError
         return self.folds_list
 
-    def cross_validation(self,
-                         model_params,
-                         logdir=None,
-                         max_epoch=100,
-                         metric=None,
-                         save_best_ckpt=False):
-        logger.info("hyperparameters: %s" % str(model_params))
-        all_folds_train_scores = []
-        all_folds_val_scores = []
-        if metric is None:
-            metric = dc.metrics.Metric(dc.metrics.roc_auc_score)
-        for fold_num, (train_dataset,
-                       valid_dataset) in enumerate(self.folds_list):
-            logger.info("Fitting model %d/%d folds" %
-                        (fold_num + 1, self.n_folds))
-            folder_name = f"fold_{fold_num + 1}_trial_count_{model_params['trial_count']}_{str(datetime.now())}"
-
-            if logdir is not None:
-                model_dir = os.path.join(logdir, folder_name)
-                logger.info("model_dir is %s" % model_dir)
-                try:
-                    os.makedirs(model_dir)
-                except OSError:
-                    if not os.path.isdir(model_dir):
-                        logger.info(
-                            "Error creating model_dir, using tempfile directory"
-                        )
-                        model_dir = tempfile.mkdtemp()
-            else:
-                model_dir = tempfile.mkdtemp()
-
-            model_params['model_dir'] = model_dir
-            model_params['class_imbalance_ratio'] = get_class_imbalance_ratio(
-                train_dataset)
-            if self.device is not None:
-                model_params['device_name'] = self.device
-            model = self.model_builder(**model_params)
-
-            best_train_score = 0  # train score for best validation
-            best_val_score = 0
-            error = ""
+    def fit_fold(self,
+                 model_params,
+                 fold_num,
+                 train_dataset,
+                 valid_dataset,
+                 logdir=None,
+                 max_epoch=100,
+                 metric=None,
+                 save_best_ckpt=False,
+                 start_epoch=1,
+                 best_scores=(0, 0),
+                 model_dir=None,
+                 keep_checkpoint=False,
+                 train_eval_samples=TRAIN_EVAL_SAMPLES):
+        """
+        Train a model on one fold
+
+        After every epoch the validation set is predicted once and scored
+        with a vectorized mean ROC-AUC over tasks (or ``metric`` if
+        given). The train score is computed on a fixed random subsample of
+        ``train_eval_samples`` molecules, it is only logged and reported,
+        the best epoch is selected on the validation score.
+
+        Training can be resumed: with ``start_epoch > 1`` the model is
+        restored from the last checkpoint in ``model_dir`` (kept by an
+        earlier call with ``keep_checkpoint=True``) and trained from
+        ``start_epoch`` to ``max_epoch``, ``best_scores`` being the
+        (train, validation) scores of the best epoch so far.
+
+        Returns
+        -------
+        (best_train_score, best_val_score, error) where the train score is
+        taken at the epoch with the best validation score
+        """
+        logger.info("Fitting model %d/%d folds" % (fold_num + 1, self.n_folds))
+        folder_name = f"fold_{fold_num + 1}_trial_count_{model_params['trial_count']}_{str(datetime.now())}"
+
+        if model_dir is not None:
+            os.makedirs(model_dir, exist_ok=True)
+        elif logdir is not None:
+            model_dir = os.path.join(logdir, folder_name)
+            logger.info("model_dir is %s" % model_dir)
             try:
-                for epoch in tqdm(range(1, max_epoch + 1)):
+                os.makedirs(model_dir)
+            except OSError:
+                if not os.path.isdir(model_dir):
+                    logger.info(
+                        "Error creating model_dir, using tempfile directory")
+                    model_dir = tempfile.mkdtemp()
+        else:
+            model_dir = tempfile.mkdtemp()
+
+        model_params['model_dir'] = model_dir
+        model_params['class_imbalance_ratio'] = get_class_imbalance_ratio(
+            train_dataset)
+        if self.device is not None:
+            model_params['device_name'] = self.device
+        # checkpoints are written in the background while training goes on
+        checkpoint_writer = CheckpointWriter()
+        model = self.model_builder(checkpoint_writer=checkpoint_writer,
+                                   **model_params)
+        # replicas of the data parallel processes never write checkpoints
+        replica_builder = functools.partial(self.model_builder,
+                                            **model_params)
+
+        train_eval_dataset = train_dataset
+        if train_eval_samples and train_eval_samples < len(train_dataset):
+            # same subsample at every epoch, and when training is resumed
+            indices = np.sort(
+                np.random.RandomState(fold_num).choice(len(train_dataset),
+                                                       train_eval_samples,
+                                                       replace=False))
+            train_eval_dataset = dc.data.NumpyDataset(
+                train_dataset.X[indices], train_dataset.y[indices],
+                train_dataset.w[indices], train_dataset.ids[indices])
+
+        def score(dataset):
+            y_pred = model.predict(dataset)
+            if metric is None:
+                return mean_roc_auc(dataset.y, y_pred)
+            return metric.compute_metric(dataset.y, y_pred, dataset.w)
+
+        # train score for best validation
+        best_train_score, best_val_score = best_scores
+        error = ""
+        try:
+            for epoch in tqdm(range(start_epoch, max_epoch + 1)):
+                restore = epoch == start_epoch and epoch > 1
+                if self.data_parallel is not None:
+                    loss = self.data_parallel.fit(model,
+                                                  replica_builder,
+                                                  train_dataset,
+                                                  nb_epoch=1,
+                                                  max_checkpoints_to_keep=1,
+                                                  deterministic=False,
+                                                  restore=restore)
+                else:
                     loss = model.fit(train_dataset,
                                      nb_epoch=1,
                                      max_checkpoints_to_keep=1,
                                      deterministic=False,
-                                     restore=epoch > 1)
-
-                    train_scores = model.evaluate(train_dataset,
-                                                  [metric])['roc_auc_score']
-                    valid_scores = model.evaluate(valid_dataset,
-                                                  [metric])['roc_auc_score']
-                    if valid_scores > best_val_score:
-                        best_val_score = valid_scores
-                        best_train_score = train_scores
-                        if save_best_ckpt:
-                            save_checkpoint(model, 1, None,
-                                            f'best_ckpt_{fold_num}_')
-                    logger.info(
-                        f"epoch {epoch}/{max_epoch} ; loss = {loss}; train_scores = {train_scores}; test_scores = {valid_scores}"
-                    )
-            except Exception as e:
-                error = f"Training error: {e}"
-
-            all_folds_train_scores.append(best_train_score)
-            all_folds_val_scores.append(best_val_score)
-
-            try:
-                os.remove(os.path.join(model_dir, 'checkpoint1.pt'))
-            except:
-                pass
-            del model
-            torch.cuda.empty_cache()
-
+                                     restore=restore)
+
+                train_scores = score(train_eval_dataset)
+                valid_scores = score(valid_dataset)
+                if valid_scores > best_val_score:
+                    best_val_score = valid_scores
+                    best_train_score = train_scores
+                    if save_best_ckpt:
+                        save_checkpoint(model, 1, None,
+                                        f'best_ckpt_{fold_num}_')
+                logger.info(
+                    f"epoch {epoch}/{max_epoch} ; loss = {loss}; train_scores = {train_scores}; test_scores = {valid_scores}"
+                )
+        except Exception as e:
+            error = f"Training error: {e}"
+
+        try:
+            checkpoint_writer.close()
+        except Exception as e:
+            error = error or f"Checkpoint error: {e}"
+        if not keep_checkpoint:
+            remove_checkpoint(model_dir)
+        del model
+        torch.cuda.empty_cache()
+        return best_train_score, best_val_score, error
+
+    def _summarize(self, model_params, all_folds_train_scores,
+                   all_folds_val_scores):
         mean_train_score = np.asarray(all_folds_train_scores).mean()
         mean_val_score = np.asarray(all_folds_val_scores).mean()
         logger.info("Results:")
@@ -192,78 +322,406 @@ class CV:
         logger.info(f"fold validation scores: {all_folds_val_scores}")
         logger.info(f"mean train score: {mean_train_score}")
         logger.info(f"mean validation score: {mean_val_score}")
-        return mean_train_score, mean_val_score, error
+        return mean_train_score, mean_val_score
+
+    def cross_validation(self,
+                         model_params,
+                         logdir=None,
+                         max_epoch=100,
+                         metric=None,
+                         save_best_ckpt=False,
+                         train_eval_samples=TRAIN_EVAL_SAMPLES):
+        logger.info("hyperparameters: %s" % str(model_params))
+        all_folds_train_scores = []
+        all_folds_val_scores = []
+        errors = []
+        for fold_num, (train_dataset,
+                       valid_dataset) in enumerate(self.folds_list):
+            train_score, val_score, error = self.fit_fold(
+                model_params,
+                fold_num,
+                train_dataset,
+                valid_dataset,
+                logdir=logdir,
+                max_epoch=max_epoch,
+                metric=metric,
+                save_best_ckpt=save_best_ckpt,
+                train_eval_samples=train_eval_samples)
+            all_folds_train_scores.append(train_score)
+            all_folds_val_scores.append(val_score)
+            if error:
+                errors.append(error)
+
+        mean_train_score, mean_val_score = self._summarize(
+            model_params, all_folds_train_scores, all_folds_val_scores)
+        return mean_train_score, mean_val_score, "; ".join(errors)
+
+    def cross_validation_parallel(self,
+                                  trials_dict,
+                                  n_workers,
+                                  logdir=None,
+                                  max_epoch=100,
+                                  save_best_ckpt=False,
+                                  threads_per_job=None,
+                                  max_retries=1,
+                                  train_eval_samples=TRAIN_EVAL_SAMPLES):
+        """
+        Cross validate several trials, running their (trial, fold) jobs
+        concurrently in a pool of worker processes
 
+        Returns
+        -------
+        Dict of trial -> (mean_train_score, mean_val_score, error,
+        trial_time) where trial_time is the summed run time of the folds
+        """
+        jobs = {}
+        for trial_count, model_params in trials_dict.items():
+            for fold_num, (train_dataset,
+                           valid_dataset) in enumerate(self.folds_list):
+                jobs[(trial_count, fold_num)] = {
+                    'model_builder': self.model_builder,
+                    'n_folds': self.n_folds,
+                    'device': self.device,
+                    'model_params': model_params,
+                    'fold_num': fold_num,
+                    'train_dir': train_dataset.data_dir,
+                    'valid_dir': valid_dataset.data_dir,
+                    'logdir': logdir,
+                    'max_epoch': max_epoch,
+                    'save_best_ckpt': save_best_ckpt,
+                    'train_eval_samples': train_eval_samples,
+                }
+        progress = tqdm(total=len(jobs))
+        results = run_jobs(_fold_job,
+                           jobs,
+                           n_workers=n_workers,
+                           threads_per_job=threads_per_job,
+                           max_retries=max_retries,
+                           on_result=lambda key, result: progress.update())
+        progress.close()
+
+        trial_results = {}
+        for trial_count, model_params in trials_dict.items():
+            fold_results = [
+                results[(trial_count, fold_num)]
+                for fold_num in range(len(self.folds_list))
+            ]
+            # failed jobs count as a zero score, like training errors
+            scores = [
+                result.value if result.error is None else (0, 0, "")
+                for result in fold_results
+            ]
+            errors = [score[2] for score in scores if score[2]] + [
+                f"Job error: {result.error}"
+                for result in fold_results
+                if result.error is not None
+            ]
+            mean_train_score, mean_val_score = self._summarize(
+                model_params, [score[0] for score in scores],
+                [score[1] for score in scores])
+            trial_time = timedelta(
+                seconds=sum(result.duration for result in fold_results))
+            trial_results[trial_count] = (mean_train_score, mean_val_score,
+                                          "; ".join(errors), trial_time)
+        return trial_results
+
+    def successive_halving(self,
+                           trials_dict,
+                           min_epoch=1,
+                           max_epoch=100,
+                           reduction_factor=3,
+                           logdir=None,
+                           save_best_ckpt=False,
+                           n_workers=1,
+                           threads_per_job=None,
+                           max_retries=1,
+                           train_eval_samples=TRAIN_EVAL_SAMPLES):
+        """
+        Cross validate several trials with successive halving
+
+        Every trial is trained on all folds for ``min_epoch`` epochs, then
+        only the top 1 / reduction_factor trials by mean validation score
+        are promoted and trained further, until the survivors reach
+        ``max_epoch``. Promoted folds resume from their last checkpoint,
+        pruned trials are not trained any further.
+
+        Returns
+        -------
+        Dict of trial -> (mean_train_score, mean_val_score, error,
+        trial_time, epochs) where epochs is the number of epochs the trial
+        was trained for before being pruned
+        """
+        if logdir is None:
+            logdir = tempfile.mkdtemp()
+        folds = range(len(self.folds_list))
+        # per (trial, fold): [best_train_score, best_val_score, errors]
+        state = {(trial_count, fold_num): [0, 0, []]
+                 for trial_count in trials_dict for fold_num in folds}
+        model_dirs = {
+            (trial_count, fold_num): os.path.join(
+                logdir, f"fold_{fold_num + 1}_trial_count_{trial_count}_"
+                f"{str(datetime.now())}")
+            for trial_count in trials_dict for fold_num in folds
+        }
+        durations = {trial_count: 0.0 for trial_count in trials_dict}
+        epochs = {trial_count: 0 for trial_count in trials_dict}
+
+        alive = list(trials_dict)
+        budgets = rung_budgets(min_epoch, max_epoch, reduction_factor)
+        for rung, budget in enumerate(budgets):
+            last_rung = rung == len(budgets) - 1
+            logger.info("Rung %d/%d: training %d trials to %d epochs" %
+                        (rung + 1, len(budgets), len(alive), budget))
+            jobs = {}
+            for trial_count in alive:
+                for fold_num, (train_dataset,
+                               valid_dataset) in enumerate(self.folds_list):
+                    key = (trial_count, fold_num)
+                    jobs[key] = {
+                        'model_builder': self.model_builder,
+                        'n_folds': self.n_folds,
+                        'device': self.device,
+                        'model_params': trials_dict[trial_count],
+                        'fold_num': fold_num,
+                        'train_dir': train_dataset.data_dir,
+                        'valid_dir': valid_dataset.data_dir,
+                        'logdir': logdir,
+                        'max_epoch': budget,
+                        'save_best_ckpt': save_best_ckpt,
+                        'start_epoch': epochs[trial_count] + 1,
+                        'best_scores': tuple(state[key][:2]),
+                        'model_dir': model_dirs[key],
+                        'keep_checkpoint': not last_rung,
+                        'train_eval_samples': train_eval_samples,
+                    }
+            results = self._run_fold_jobs(jobs, n_workers, threads_per_job,
+                                          max_retries)
+            for (trial_count, fold_num), result in results.items():
+                fold_state = state[(trial_count, fold_num)]
+                durations[trial_count] += result.duration
+                if result.error is not None:
+                    fold_state[2].append(f"Job error: {result.error}")
+                    continue
+                fold_state[0], fold_state[1], error = result.value
+                if error:
+                    fold_state[2].append(error)
+            for trial_count in alive:
+                epochs[trial_count] = budget
+            if last_rung:
+                break
+
+            scores = {
+                trial_count: np.mean([
+                    state[(trial_count, fold_num)][1] for fold_num in folds
+                ]) for trial_count in alive
+            }
+            promoted = promote(scores, reduction_factor)
+            for trial_count in alive:
+                if trial_count not in promoted:
+                    logger.info("Pruning %s after %d epochs" %
+                                (trial_count, budget))
+                    for fold_num in folds:
+                        remove_checkpoint(model_dirs[(trial_count,
+                                                      fold_num)])
+            alive = [
+                trial_count for trial_count in alive
+                if trial_count in promoted
+            ]
+
+        trial_results = {}
+        for trial_count, model_params in trials_dict.items():
+            fold_states = [
+                state[(trial_count, fold_num)] for fold_num in folds
+            ]
+            mean_train_score, mean_val_score = self._summarize(
+                model_params, [fold_state[0] for fold_state in fold_states],
+                [fold_state[1] for fold_state in fold_states])
+            errors = [
+                error for fold_state in fold_states for error in fold_state[2]
+            ]
+            trial_results[trial_count] = (mean_train_score, mean_val_score,
+                                          "; ".join(errors),
+                                          timedelta(
+                                              seconds=durations[trial_count]),
+                                          epochs[trial_count])
+        return trial_results
+
+    def _run_fold_jobs(self, jobs, n_workers, threads_per_job, max_retries):
+        """Run fold jobs in worker processes, or in this process"""
+        if n_workers > 1:
+            return run_jobs(_fold_job,
+                            jobs,
+                            n_workers=n_workers,
+                            threads_per_job=threads_per_job,
+                            max_retries=max_retries)
+        results = {}
+        for key, job in jobs.items():
+            start = datetime.now()
+            train_dataset, valid_dataset = self.folds_list[job['fold_num']]
+            value = self.fit_fold(model_params=dict(job['model_params']),
+                                  fold_num=job['fold_num'],
+                                  train_dataset=train_dataset,
+                                  valid_dataset=valid_dataset,
+                                  logdir=job['logdir'],
+                                  max_epoch=job['max_epoch'],
+                                  save_best_ckpt=job['save_best_ckpt'],
+                                  start_epoch=job['start_epoch'],
+                                  best_scores=job['best_scores'],
+                                  model_dir=job['model_dir'],
+                                  keep_checkpoint=job['keep_checkpoint'],
+                                  train_eval_samples=job['train_eval_samples'])
+            results[key] = JobResult(
+                value, None, 1, (datetime.now() - start).total_seconds())
+        return results
+
+
+def load_cv(tasks=TASKS,
+            dataset=DATASET,
+            smiles_field=SMILES_FIELD,
+            n_folds=2,
+            max_atoms_per_batch=None,
+            max_edges_per_batch=None,
+            cache_dir=CACHE_DIR,
+            seed=None,
+            precision='float32',
+            data_parallel_workers=1,
+            threads_per_worker=None,
+            cache_batches=False):
+    """
+    Featurize the dataset and split it into folds for a search
 
-def random_search_cv(tasks=TASKS,
-                     dataset=DATASET,
-                     smiles_field=SMILES_FIELD,
-                     n_folds=2,
-                     n_trials=1,
-                     logdir='./models',
-                     max_epoch=10,
-                     save_best_ckpt=False):
+    With ``data_parallel_workers > 1`` the folds are trained on CPU by a
+    DataParallelTrainer of that many processes, call ``cv.close()`` to
+    stop them. With ``cache_batches`` the collated training batches of a
+    fold are reused across epochs (see MPNNPOMModel), which is not
+    supported with data parallel training.
+    """
+    check_data_parallel(1, data_parallel_workers, cache_batches)
     # get dataset
     featurizer = GraphFeaturizer()
-    smiles_field = smiles_field
-    loader = dc.data.CSVLoader(tasks=tasks,
-                               feature_field=smiles_field,
-                               featurizer=featurizer)
     input_file = dataset
-    dataset = loader.create_dataset(inputs=[input_file])
+    # featurized dataset and fold splits (when seeded) are cached on disk
+    dataset_cache = DatasetCache(cache_dir) if cache_dir else None
+    if dataset_cache is not None:
+        dataset = dataset_cache.load_csv(input_file, tasks, smiles_field,
+                                         featurizer)
+    else:
+        loader = dc.data.CSVLoader(tasks=tasks,
+                                   feature_field=smiles_field,
+                                   featurizer=featurizer)
+        dataset = loader.create_dataset(inputs=[input_file])
     n_tasks = len(dataset.tasks)
-
-    n_folds = n_folds
-    n_trials = n_trials
-    logdir = logdir
-    max_epoch = max_epoch
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    data_parallel = None
+    if data_parallel_workers > 1:
+        device = 'cpu'
+        data_parallel = DataParallelTrainer(
+            n_workers=data_parallel_workers,
+            threads_per_worker=threads_per_worker)
+
+    model_builder = functools.partial(build_model,
+                                      n_tasks=n_tasks,
+                                      max_atoms_per_batch=max_atoms_per_batch,
+                                      max_edges_per_batch=max_edges_per_batch,
+                                      precision=precision,
+                                      cache_batches=cache_batches)
+
+    cv = CV(model_builder=model_builder,
+            n_folds=n_folds,
+            device=device,
+            data_parallel=data_parallel)
+    cv.generate_folds(dataset=dataset,
+                      splitter='deepchem',
+                      dataset_cache=dataset_cache,
+                      seed=seed)
+    return cv
+
+
+def run_trials(cv,
+               trials_dict,
+               logdir='./models',
+               max_epoch=10,
+               save_best_ckpt=False,
+               n_workers=1,
+               threads_per_job=None,
+               max_retries=1,
+               pruning=None,
+               min_epoch=1,
+               reduction_factor=3,
+               train_eval_samples=TRAIN_EVAL_SAMPLES):
+    """
+    Cross validate trials, writing a results file per trial in logdir
 
-    # Metric
-    metric = dc.metrics.Metric(dc.metrics.roc_auc_score)
-
-    model_builder = lambda **params: MPNNPOMModel(
-        n_tasks=n_tasks,
-        mode='classification',
-        number_atom_features=GraphConvConstants.ATOM_FDIM,
-        number_bond_features=GraphConvConstants.BOND_FDIM,
-        n_classes=1,
-        **params)
-
-    cv = CV(model_builder=model_builder, n_folds=n_folds, device=device)
-    cv.generate_folds(dataset=dataset, splitter='deepchem')
-
-    try:
-        file_name = f"{n_trials}_trials_params.json"
-        file_path = os.path.join('./examples/trials', file_name)
-
-        with open(file_path, 'r') as json_file:
-            trials_dict = json.load(json_file)
-    except:
-        trials_dict, _ = MPNNPOMConfig.generate_hyperparams_random(
-            n_trials=n_trials, dir='./examples/trials')
-
-    logger.info("Starting random search crosss validation:")
-    best_train_score = 0
-    best_validation_score = 0
-    best_hyperparams = {}
-    all_scores = {}
-    for trial_count, model_params in tqdm(trials_dict.items()):
-        logger.info(f"{trial_count} starting:")
+    Returns
+    -------
+    Dict of trial -> (mean_train_score, mean_val_score)
+    """
+    for trial_count, model_params in trials_dict.items():
         model_params['trial_count'] = trial_count
-        trial_start_time = datetime.now()
-        mean_train_score, mean_val_score, error = cv.cross_validation(
-            model_params=model_params,
+
+    # (trial, fold) jobs run concurrently in worker processes
+    trial_results = None
+    if pruning is not None:
+        # trials get a small epoch budget, only the best ones are trained
+        # up to max_epoch
+        if pruning == 'hyperband':
+            brackets = hyperband_brackets(len(trials_dict), min_epoch,
+                                          max_epoch, reduction_factor)
+        elif pruning == 'halving':
+            brackets = [(len(trials_dict), min_epoch)]
+        else:
+            raise ValueError(f"Unknown pruning {pruning}")
+        trial_results = {}
+        trial_counts = list(trials_dict)
+        for bracket_size, bracket_min_epoch in brackets:
+            bracket = {
+                trial_count: trials_dict[trial_count]
+                for trial_count in trial_counts[:bracket_size]
+            }
+            trial_counts = trial_counts[bracket_size:]
+            trial_results.update(
+                cv.successive_halving(bracket,
+                                      min_epoch=bracket_min_epoch,
+                                      max_epoch=max_epoch,
+                                      reduction_factor=reduction_factor,
+                                      logdir=logdir,
+                                      save_best_ckpt=save_best_ckpt,
+                                      n_workers=n_workers,
+                                      threads_per_job=threads_per_job,
+                                      max_retries=max_retries,
+                                      train_eval_samples=train_eval_samples))
+    elif n_workers > 1:
+        trial_results = cv.cross_validation_parallel(
+            trials_dict,
+            n_workers=n_workers,
             logdir=logdir,
             max_epoch=max_epoch,
             save_best_ckpt=save_best_ckpt,
-            metric=metric)
-        trial_end_time = datetime.now()
+            threads_per_job=threads_per_job,
+            max_retries=max_retries,
+            train_eval_samples=train_eval_samples)
 
-        all_scores[trial_count] = {
-            'mean_train_score': mean_train_score,
-            'mean_val_score': mean_val_score
-        }
+    all_scores = {}
+    for trial_count, model_params in tqdm(trials_dict.items()):
+        epochs = max_epoch
+        if pruning is not None:
+            mean_train_score, mean_val_score, error, trial_time, epochs = \
+                trial_results[trial_count]
+        elif trial_results is not None:
+            mean_train_score, mean_val_score, error, trial_time = \
+                trial_results[trial_count]
+        else:
+            logger.info(f"{trial_count} starting:")
+            trial_start_time = datetime.now()
+            mean_train_score, mean_val_score, error = cv.cross_validation(
+                model_params=model_params,
+                logdir=logdir,
+                max_epoch=max_epoch,
+                save_best_ckpt=save_best_ckpt,
+                train_eval_samples=train_eval_samples)
+            trial_time = datetime.now() - trial_start_time
+
+        all_scores[trial_count] = (mean_train_score, mean_val_score)
 
         current_date_time = str(datetime.now())
         log_file = os.path.join(
@@ -272,14 +730,23 @@ def random_search_cv(tasks=TASKS,
             f.write("Hyperparameters dictionary %s\n" % str(model_params))
             f.write("validation score %f\n" % mean_val_score)
             f.write("train_score: %f\n" % mean_train_score)
-            f.write("trial_time: %s\n" %
-                    str(trial_end_time - trial_start_time))
+            f.write("trial_time: %s\n" % str(trial_time))
+            f.write("epochs: %d\n" % epochs)
             f.write("error: %s\n" % error)
+    return all_scores
 
+
+def write_best_results(trials_dict, all_scores, logdir, n_trials):
+    """Log the best trial and write it to a summary results file"""
+    best_train_score = 0
+    best_validation_score = 0
+    best_hyperparams = {}
+    for trial_count, (mean_train_score,
+                      mean_val_score) in all_scores.items():
         if mean_val_score > best_validation_score:
             best_train_score = mean_train_score
             best_validation_score = mean_val_score
-            best_hyperparams = model_params
+            best_hyperparams = trials_dict[trial_count]
 
     logger.info("Best hyperparameters: %s" % str(best_hyperparams))
     logger.info("best train_score: %f" % best_train_score)
@@ -295,18 +762,93 @@ def random_search_cv(tasks=TASKS,
         f.write("Best train_score: %f\n" % best_train_score)
 
 
-if __name__ == "__main__":
-    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+def random_search_cv(tasks=TASKS,
+                     dataset=DATASET,
+                     smiles_field=SMILES_FIELD,
+                     n_folds=2,
+                     n_trials=1,
+                     logdir='./models',
+                     max_epoch=10,
+                     save_best_ckpt=False,
+                     max_atoms_per_batch=None,
+                     max_edges_per_batch=None,
+                     cache_dir=CACHE_DIR,
+                     seed=None,
+                     n_workers=1,
+                     threads_per_job=None,
+                     max_retries=1,
+                     pruning=None,
+                     min_epoch=1,
+                     reduction_factor=3,
+                     train_eval_samples=TRAIN_EVAL_SAMPLES,
+                     precision='float32',
+                     data_parallel_workers=1,
+                     cache_batches=False):
+    check_data_parallel(n_workers, data_parallel_workers, cache_batches)
+    cv = load_cv(tasks=tasks,
+                 dataset=dataset,
+                 smiles_field=smiles_field,
+                 n_folds=n_folds,
+                 max_atoms_per_batch=max_atoms_per_batch,
+                 max_edges_per_batch=max_edges_per_batch,
+                 cache_dir=cache_dir,
+                 seed=seed,
+                 precision=precision,
+                 data_parallel_workers=data_parallel_workers,
+                 threads_per_worker=threads_per_job,
+                 cache_batches=cache_batches)
+
+    try:
+        file_name = f"{n_trials}_trials_params.json"
+        file_path = os.path.join('./examples/trials', file_name)
+
+        with open(file_path, 'r') as json_file:
+            trials_dict = json.load(json_file)
+    except:
+        trials_dict, _ = MPNNPOMConfig.generate_hyperparams_random(
+            n_trials=n_trials, dir='./examples/trials', seed=seed)
+
+    logger.info("Starting random search crosss validation:")
+    try:
+        all_scores = run_trials(cv,
+                                trials_dict,
+                                logdir=logdir,
+                                max_epoch=max_epoch,
+                                save_best_ckpt=save_best_ckpt,
+                                n_workers=n_workers,
+                                threads_per_job=threads_per_job,
+                                max_retries=max_retries,
+                                pruning=pruning,
+                                min_epoch=min_epoch,
+                                reduction_factor=reduction_factor,
+                                train_eval_samples=train_eval_samples)
+    finally:
+        cv.close()
+    write_best_results(trials_dict, all_scores, logdir, n_trials)
+
+
+def check_data_parallel(n_workers, data_parallel_workers,
+                        cache_batches=False):
+    """
+    Jobs run either in a pool of processes or data parallel, not both.
+    Data parallel replicas shard the batches of the model's default
+    generator, so they can not reuse cached batches either.
+    """
+    if n_workers > 1 and data_parallel_workers > 1:
+        raise ValueError("n_workers and data_parallel_workers can not both "
+                         "be larger than 1")
+    if cache_batches and data_parallel_workers > 1:
+        raise ValueError("cache_batches is not supported with "
+                         "data_parallel_workers larger than 1")
+
+
+def add_cv_arguments(parser):
+    """Add the command line arguments shared by the search scripts"""
     parser.add_argument("-f",
                         "--n_folds",
                         default=2,
                         type=int,
                         help="Number of folds for cross-validation")
-    parser.add_argument("-t",
-                        "--n_trials",
-                        default=2,
-                        type=int,
-                        help="Number of trials for random search cv")
     parser.add_argument("-d",
                         "--logdir",
                         default="./models",
@@ -320,6 +862,87 @@ if __name__ == "__main__":
                         "--save_best_ckpt",
                         action="store_true",
                         help="Whether to save best checkpoints?")
+    parser.add_argument("--max_atoms_per_batch",
+                        default=None,
+                        type=int,
+                        help="Pack training batches by total number of atoms")
+    parser.add_argument("--max_edges_per_batch",
+                        default=None,
+                        type=int,
+                        help="Pack training batches by total number of edges")
+    parser.add_argument("--cache_dir",
+                        default=CACHE_DIR,
+                        help="Directory to cache the featurized dataset and "
+                        "fold splits in, empty to disable")
+    parser.add_argument("-s",
+                        "--seed",
+                        default=None,
+                        type=int,
+                        help="Random seed of the fold split and of sampled "
+                        "trials; seeded splits are cached and reused across "
+                        "runs")
+    parser.add_argument("-w",
+                        "--n_workers",
+                        default=1,
+                        type=int,
+                        help="Number of worker processes running (trial, "
+                        "fold) jobs concurrently")
+    parser.add_argument("--threads_per_job",
+                        default=None,
+                        type=int,
+                        help="CPU threads per job (per process with "
+                        "data_parallel_workers), default to the number of "
+                        "cores divided by the number of processes")
+    parser.add_argument("--max_retries",
+                        default=1,
+                        type=int,
+                        help="Number of times a failed job is retried")
+    parser.add_argument("--pruning",
+                        default=None,
+                        choices=['halving', 'hyperband'],
+                        help="Train trials on growing epoch budgets and stop "
+                        "the worst ones early")
+    parser.add_argument("--min_epoch",
+                        default=1,
+                        type=int,
+                        help="Epoch budget of the first rung when pruning")
+    parser.add_argument("--reduction_factor",
+                        default=3,
+                        type=int,
+                        help="Only the top 1/reduction_factor trials of a "
+                        "rung are promoted when pruning")
+    parser.add_argument("--train_eval_samples",
+                        default=TRAIN_EVAL_SAMPLES,
+                        type=int,
+                        help="Number of train molecules scored after each "
+                        "epoch, 0 for the full train set")
+    parser.add_argument("--precision",
+                        default='float32',
+                        choices=['float32', 'bfloat16'],
+                        help="Training precision, bfloat16 runs under "
+                        "autocast on CPUs with native bfloat16 support")
+    parser.add_argument("--data_parallel_workers",
+                        default=1,
+                        type=int,
+                        help="Number of processes training each fold on "
+                        "shards of every batch, with all-reduced gradients "
+                        "(CPU only, requires n_workers 1)")
+    parser.add_argument("--cache_batches",
+                        action="store_true",
+                        help="Collate the training batches of a fold once "
+                        "and only shuffle their order at later epochs "
+                        "(requires data_parallel_workers 1)")
+    return parser
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-t",
+                        "--n_trials",
+                        default=2,
+                        type=int,
+                        help="Number of trials for random search cv")
+    add_cv_arguments(parser)
     args = vars(parser.parse_args())
 
     n_folds = args['n_folds']
@@ -331,4 +954,18 @@ if __name__ == "__main__":
                      n_trials=n_trials,
                      logdir=logdir,
                      max_epoch=max_epoch,
-                     save_best_ckpt=save_best_ckpt)
+                     save_best_ckpt=save_best_ckpt,
+                     max_atoms_per_batch=args['max_atoms_per_batch'],
+                     max_edges_per_batch=args['max_edges_per_batch'],
+                     cache_dir=args['cache_dir'],
+                     seed=args['seed'],
+                     n_workers=args['n_workers'],
+                     threads_per_job=args['threads_per_job'],
+                     max_retries=args['max_retries'],
+                     pruning=args['pruning'],
+                     min_epoch=args['min_epoch'],
+                     reduction_factor=args['reduction_factor'],
+                     train_eval_samples=args['train_eval_samples'],
+                     precision=args['precision'],
+                     data_parallel_workers=args['data_parallel_workers'],
+                     cache_batches=args['cache_batches'])
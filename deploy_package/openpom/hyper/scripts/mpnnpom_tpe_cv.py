@@ -0,0 +1,170 @@
+import os
+import logging
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from openpom.hyper.configs.model_configs import MPNNPOMConfig
+from openpom.hyper.tpe import TPESampler, load_results
+from openpom.hyper.scripts.mpnnpom_random_cv import (
+    CACHE_DIR, DATASET, SMILES_FIELD, TASKS, TRAIN_EVAL_SAMPLES,
+    add_cv_arguments, check_data_parallel, load_cv, run_trials,
+    write_best_results)
+
+logger = logging.getLogger(__name__)
+# logging.basicConfig(level=logging.INFO)
+
+TRIALS_DIR = './examples/trials'
+
+
+def tpe_search_cv(tasks=TASKS,
+                  dataset=DATASET,
+                  smiles_field=SMILES_FIELD,
+                  n_folds=2,
+                  n_trials=10,
+                  batch_size=1,
+                  warm_start=(),
+                  gamma=0.25,
+                  n_startup_trials=10,
+                  logdir='./models',
+                  max_epoch=10,
+                  save_best_ckpt=False,
+                  max_atoms_per_batch=None,
+                  max_edges_per_batch=None,
+                  cache_dir=CACHE_DIR,
+                  seed=None,
+                  n_workers=1,
+                  threads_per_job=None,
+                  max_retries=1,
+                  pruning=None,
+                  min_epoch=1,
+                  reduction_factor=3,
+                  train_eval_samples=TRAIN_EVAL_SAMPLES,
+                  precision='float32',
+                  data_parallel_workers=1,
+                  cache_batches=False):
+    """
+    Model based search cross validation with a Tree-structured Parzen
+    Estimator
+
+    Trials are proposed ``batch_size`` at a time from the scores of the
+    completed ones, and each batch is cross validated like in
+    ``random_search_cv`` (in parallel with ``n_workers > 1``). Each batch
+    is saved as a trials json file in ``./examples/trials`` and every
+    trial gets a results file in ``logdir``, so later searches can warm
+    start from them.
+    """
+    check_data_parallel(n_workers, data_parallel_workers, cache_batches)
+    cv = load_cv(tasks=tasks,
+                 dataset=dataset,
+                 smiles_field=smiles_field,
+                 n_folds=n_folds,
+                 max_atoms_per_batch=max_atoms_per_batch,
+                 max_edges_per_batch=max_edges_per_batch,
+                 cache_dir=cache_dir,
+                 seed=seed,
+                 precision=precision,
+                 data_parallel_workers=data_parallel_workers,
+                 threads_per_worker=threads_per_job,
+                 cache_batches=cache_batches)
+
+    sampler = TPESampler(MPNNPOMConfig,
+                         gamma=gamma,
+                         n_startup_trials=n_startup_trials,
+                         seed=seed)
+    for warm_start_dir in warm_start:
+        sampler.warm_start(warm_start_dir)
+    # number new trials after the ones already logged
+    first_trial = len(load_results(logdir)) + 1
+    os.makedirs(TRIALS_DIR, exist_ok=True)
+
+    logger.info("Starting TPE search cross validation:")
+    all_trials = {}
+    all_scores = {}
+    try:
+        while len(all_trials) < n_trials:
+            proposals = sampler.propose(
+                min(batch_size, n_trials - len(all_trials)))
+            if not proposals:
+                break
+            start = first_trial + len(all_trials)
+            trials_dict = {
+                f'tpe_trial_{start + i}': params
+                for i, params in enumerate(proposals)
+            }
+            MPNNPOMConfig.save_trials(
+                trials_dict,
+                f"tpe_{start}_{start + len(proposals) - 1}_trials_params.json",
+                TRIALS_DIR)
+            scores = run_trials(cv,
+                                trials_dict,
+                                logdir=logdir,
+                                max_epoch=max_epoch,
+                                save_best_ckpt=save_best_ckpt,
+                                n_workers=n_workers,
+                                threads_per_job=threads_per_job,
+                                max_retries=max_retries,
+                                pruning=pruning,
+                                min_epoch=min_epoch,
+                                reduction_factor=reduction_factor,
+                                train_eval_samples=train_eval_samples)
+            for trial_count, params in trials_dict.items():
+                sampler.observe(params, scores[trial_count][1])
+            all_trials.update(trials_dict)
+            all_scores.update(scores)
+    finally:
+        cv.close()
+
+    write_best_results(all_trials, all_scores, logdir, len(all_trials))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-t",
+                        "--n_trials",
+                        default=10,
+                        type=int,
+                        help="Number of trials for TPE search cv")
+    parser.add_argument("-b",
+                        "--batch_size",
+                        default=1,
+                        type=int,
+                        help="Number of trials proposed at a time and cross "
+                        "validated together")
+    parser.add_argument("--warm_start",
+                        nargs="*",
+                        default=[],
+                        help="Log directories of earlier searches to read "
+                        "completed trials from")
+    parser.add_argument("--gamma",
+                        default=0.25,
+                        type=float,
+                        help="Fraction of the trials modelled as good")
+    parser.add_argument("--n_startup_trials",
+                        default=10,
+                        type=int,
+                        help="Number of completed trials before proposals "
+                        "are model based")
+    add_cv_arguments(parser)
+    args = vars(parser.parse_args())
+
+    tpe_search_cv(n_folds=args['n_folds'],
+                  n_trials=args['n_trials'],
+                  batch_size=args['batch_size'],
+                  warm_start=args['warm_start'],
+                  gamma=args['gamma'],
+                  n_startup_trials=args['n_startup_trials'],
+                  logdir=args['logdir'],
+                  max_epoch=args['max_epoch'],
+                  save_best_ckpt=args['save_best_ckpt'],
+                  max_atoms_per_batch=args['max_atoms_per_batch'],
+                  max_edges_per_batch=args['max_edges_per_batch'],
+                  cache_dir=args['cache_dir'],
+                  seed=args['seed'],
+                  n_workers=args['n_workers'],
+                  threads_per_job=args['threads_per_job'],
+                  max_retries=args['max_retries'],
+                  pruning=args['pruning'],
+                  min_epoch=args['min_epoch'],
+                  reduction_factor=args['reduction_factor'],
+                  train_eval_samples=args['train_eval_samples'],
+                  precision=args['precision'],
+                  data_parallel_workers=args['data_parallel_workers'],
+                  cache_batches=args['cache_batches'])
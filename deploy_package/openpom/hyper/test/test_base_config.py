@@ -24,3 +24,58 @@ def test_config():
 
     # remove saved file
     os.remove(path)
+
+
+def test_config_lazy_sampling():
+    """
+    Test combinations are distinct, deterministic for a seed and drawn
+    without enumerating a huge search space
+    """
+
+    class LargeConfig(Config):
+        PARAMS_DICT = {f"param{i}": list(range(10)) for i in range(30)}
+
+    combs = LargeConfig._generate_random_hyperparam_values(n=100, seed=0)
+    assert len(combs) == 100
+    assert len({tuple(comb.values()) for comb in combs}) == 100
+    assert list(combs[0]) == list(LargeConfig.PARAMS_DICT)
+    assert combs == LargeConfig._generate_random_hyperparam_values(n=100,
+                                                                   seed=0)
+    assert combs != LargeConfig._generate_random_hyperparam_values(n=100,
+                                                                   seed=1)
+
+    class SmallConfig(Config):
+        PARAMS_DICT = {"param1": [1, 2], "param2": [3, 4, 5]}
+
+    # more trials than combinations gives every combination once
+    combs = SmallConfig._generate_random_hyperparam_values(n=10, seed=0)
+    assert sorted((comb["param1"], comb["param2"]) for comb in combs) == \
+        [(1, 3), (1, 4), (1, 5), (2, 3), (2, 4), (2, 5)]
+
+
+def test_config_conditional_params():
+    """
+    Test conditional parameters only vary when their parent activates them
+    """
+
+    class ConditionalConfig(Config):
+        PARAMS_DICT = {
+            "readout_type": ["set2set", "global_sum_pooling"],
+            "num_step_set2set": [2, 3, 4, 5],
+            "num_layer_set2set": [1, 2, 3],
+            "learning_rate": [0.001, 0.01],
+        }
+        CONDITIONAL_PARAMS = {
+            "num_step_set2set": ("readout_type", "set2set"),
+            "num_layer_set2set": ("readout_type", "set2set"),
+        }
+
+    combs = ConditionalConfig._generate_random_hyperparam_values(n=100,
+                                                                 seed=0)
+    # 4 * 3 * 2 set2set combinations + 2 global_sum_pooling combinations
+    assert len(combs) == 26
+    assert len({tuple(comb.values()) for comb in combs}) == 26
+    for comb in combs:
+        if comb["readout_type"] == "global_sum_pooling":
+            assert comb["num_step_set2set"] == 2
+            assert comb["num_layer_set2set"] == 1
@@ -0,0 +1,35 @@
+import math
+from openpom.hyper.halving import hyperband_brackets, promote, rung_budgets
+
+
+def test_rung_budgets():
+    """
+    Test rung budgets grow geometrically up to max_epoch
+    """
+    assert rung_budgets(1, 27, 3) == [1, 3, 9, 27]
+    assert rung_budgets(1, 30, 3) == [1, 3, 9, 30]
+    assert rung_budgets(2, 20, 3) == [2, 6, 20]
+    assert rung_budgets(1, 3, 2) == [1, 2, 3]
+    assert rung_budgets(5, 5, 3) == [5]
+
+
+def test_promote():
+    """
+    Test the top 1 / reduction_factor trials are promoted, best first
+    """
+    scores = {'a': 0.5, 'b': 0.9, 'c': math.nan, 'd': 0.7, 'e': 0.1,
+              'f': 0.6}
+    assert promote(scores, 3) == ['b', 'd']
+    assert promote(scores, 2) == ['b', 'd', 'f']
+    assert promote({'a': math.nan, 'b': 0.1}, 3) == ['b']
+
+
+def test_hyperband_brackets():
+    """
+    Test Hyperband brackets cover all trials with growing starting budgets
+    """
+    brackets = hyperband_brackets(9, 1, 9, 3)
+    assert brackets == [(5, 1), (3, 3), (1, 9)]
+    brackets = hyperband_brackets(2, 1, 9, 3)
+    assert sum(size for size, _ in brackets) == 2
+    assert brackets[0][1] == 1
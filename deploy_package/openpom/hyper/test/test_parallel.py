@@ -0,0 +1,63 @@
+import os
+import tempfile
+from openpom.hyper.parallel import run_jobs
+
+
+def _square(job):
+    return job * job
+
+
+def _flaky(job):
+    """Fails or kills its worker process on the first attempt"""
+    marker, mode = job
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        if mode == 'crash':
+            os._exit(1)
+        raise RuntimeError('first attempt')
+    return mode
+
+
+def _always_fails(job):
+    raise ValueError('bad job')
+
+
+def test_run_jobs():
+    """
+    Test jobs run in worker processes and results keep the job order
+    """
+    finished = []
+    results = run_jobs(_square, {key: key for key in range(6)},
+                       n_workers=2,
+                       threads_per_job=1,
+                       on_result=lambda key, result: finished.append(key))
+    assert list(results) == list(range(6))
+    assert [result.value for result in results.values()] == \
+        [0, 1, 4, 9, 16, 25]
+    assert all(result.error is None and result.attempts == 1
+               for result in results.values())
+    assert sorted(finished) == list(range(6))
+
+
+def test_run_jobs_retries():
+    """
+    Test failed jobs and crashed workers are retried, and jobs failing
+    every attempt are recorded without stopping the others
+    """
+    tmp_dir = tempfile.mkdtemp()
+    jobs = {
+        'raise': (os.path.join(tmp_dir, 'raise'), 'raise'),
+        'crash': (os.path.join(tmp_dir, 'crash'), 'crash'),
+    }
+    results = run_jobs(_flaky, jobs, n_workers=2, threads_per_job=1)
+    assert results['raise'].value == 'raise'
+    assert results['raise'].attempts == 2
+    assert results['crash'].value == 'crash'
+
+    results = run_jobs(_always_fails, {'a': None},
+                       n_workers=1,
+                       threads_per_job=1,
+                       max_retries=2)
+    assert results['a'].value is None
+    assert results['a'].attempts == 3
+    assert 'bad job' in results['a'].error
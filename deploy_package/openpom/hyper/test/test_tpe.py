@@ -0,0 +1,87 @@
+import os
+import tempfile
+import numpy as np
+from openpom.hyper.configs.base_config import Config
+from openpom.hyper.tpe import TPESampler, load_results
+
+
+class QuadraticConfig(Config):
+    PARAMS_DICT = {
+        "x": list(range(20)),
+        "y": list(range(20)),
+        "readout_type": ["set2set", "global_sum_pooling"],
+        "num_step_set2set": [2, 3, 4, 5],
+    }
+    CONDITIONAL_PARAMS = {
+        "num_step_set2set": ("readout_type", "set2set"),
+    }
+
+
+def objective(params):
+    return -((params["x"] - 14)**2 + (params["y"] - 5)**2)
+
+
+def test_tpe_beats_random():
+    """
+    Test TPE proposals concentrate around the optimum
+    """
+    sampler = TPESampler(QuadraticConfig, n_startup_trials=10, seed=0)
+    for _ in range(10):
+        for params in sampler.propose(1):
+            sampler.observe(params, objective(params))
+    for _ in range(10):
+        # batches of parallel proposals
+        for params in sampler.propose(3):
+            sampler.observe(params, objective(params))
+    tpe_scores = [score for _, score in sampler.observations[10:]]
+    random_scores = [
+        objective(params) for params in
+        QuadraticConfig._generate_random_hyperparam_values(n=30, seed=0)
+    ]
+    assert np.mean(tpe_scores) > np.mean(random_scores)
+
+    keys = [tuple(params.values()) for params, _ in sampler.observations]
+    assert len(set(keys)) == len(keys) == 40
+    for params, _ in sampler.observations:
+        assert list(params) == list(QuadraticConfig.PARAMS_DICT)
+        if params["readout_type"] == "global_sum_pooling":
+            assert params["num_step_set2set"] == 2
+
+
+def test_tpe_deterministic():
+    """
+    Test proposals are deterministic for a seed
+    """
+    proposals = []
+    for _ in range(2):
+        sampler = TPESampler(QuadraticConfig, n_startup_trials=3, seed=1)
+        for params in sampler.propose(3):
+            sampler.observe(params, objective(params))
+        proposals.append(sampler.propose(2))
+    assert proposals[0] == proposals[1]
+
+
+def test_tpe_warm_start():
+    """
+    Test warm start from results files of earlier searches
+    """
+    logdir = tempfile.mkdtemp()
+    trials = QuadraticConfig._generate_random_hyperparam_values(n=3, seed=0)
+    for i, params in enumerate(trials):
+        params = dict(params, trial_count=f"trial_{i + 1}")
+        path = os.path.join(logdir, f"results_trial_{i + 1}_trial_now.txt")
+        with open(path, "w") as f:
+            f.write("Hyperparameters dictionary %s\n" % str(params))
+            f.write("validation score %f\n" % (0.5 if i else np.nan))
+            f.write("train_score: %f\n" % 0.6)
+    with open(os.path.join(logdir, "results_3_trials_now.txt"), "w") as f:
+        f.write("Best Hyperparameters dictionary %s\n" % str(trials[1]))
+
+    assert len(load_results(logdir)) == 3
+    sampler = TPESampler(QuadraticConfig, seed=0)
+    assert sampler.warm_start(logdir) == 3
+    # the nan trial is not modelled but never proposed again
+    assert len(sampler.observations) == 2
+    assert sampler.observations[0][0] == trials[1]
+    proposals = sampler.propose(10)
+    assert not any(params in trials for params in proposals)
@@ -0,0 +1,293 @@
+import os
+import re
+import ast
+import glob
+import json
+import math
+import logging
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple, Type
+from openpom.hyper.configs.base_config import Config
+
+logger = logging.getLogger(__name__)
+
+RESULTS_PATTERN: str = 'results_*_trial_*.txt'
+
+
+def load_results(logdir: str,
+                 pattern: str = RESULTS_PATTERN
+                 ) -> List[Tuple[Dict[str, Any], float]]:
+    """
+    Read completed trials from the results files written by the search
+    scripts
+
+    Parameters
+    ----------
+    logdir: str
+        Directory with ``results_<trial>_trial_<date>.txt`` files
+    pattern: str
+        Glob pattern of the per trial results files
+
+    Returns
+    -------
+    results: List[Tuple[Dict[str, Any], float]]
+        (hyperparameters, mean validation score) per trial, in file name
+        order. Files that cannot be parsed are skipped.
+    """
+    results: List[Tuple[Dict[str, Any], float]] = []
+    for path in sorted(glob.glob(os.path.join(logdir, pattern))):
+        params: Optional[Dict[str, Any]] = None
+        score: Optional[float] = None
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith('Hyperparameters dictionary '):
+                        params = ast.literal_eval(
+                            line[len('Hyperparameters dictionary '):].strip())
+                    match = re.match(r'validation score (\S+)', line)
+                    if match:
+                        score = float(match.group(1))
+        except (OSError, ValueError, SyntaxError) as e:
+            logger.warning("Skipping unreadable results file %s: %s" %
+                           (path, e))
+            continue
+        if isinstance(params, dict) and score is not None:
+            results.append((params, score))
+    return results
+
+
+class TPESampler(object):
+    """
+    Tree-structured Parzen Estimator over a ``Config`` search space.
+
+    Completed trials are split into the top ``gamma`` fraction by score
+    ("good") and the rest ("bad"). For every hyperparameter a Parzen
+    density is fitted on each group: a smoothed histogram for categorical
+    values and a discrete Gaussian kernel over the positions of ordered
+    numeric values. Candidates are drawn from the good densities and the
+    one maximizing ``l(x) / g(x)``, the expected improvement criterion of
+    Bergstra et al., is proposed.
+
+    The space is tree-structured through ``Config.CONDITIONAL_PARAMS``: a
+    conditional parameter is only modelled on the trials where its parent
+    activates it, and is fixed to its first value otherwise, as in
+    ``Config._generate_random_hyperparam_values``.
+
+    Batches of proposals for parallel evaluation use the "constant liar"
+    strategy: proposals of the batch count as bad trials while the next
+    ones are chosen, which spreads the batch out. Configurations already
+    observed or proposed are never proposed again.
+
+    Example
+    -------
+    >>> sampler = TPESampler(MPNNPOMConfig, seed=0)
+    >>> sampler.warm_start('./models')
+    >>> for params in sampler.propose(4):
+    ...     sampler.observe(params, train_and_score(params))
+
+    References
+    ----------
+    .. Bergstra, J. et al. "Algorithms for Hyper-Parameter Optimization"
+       NeurIPS (2011)
+    """
+
+    def __init__(self,
+                 config: Type[Config],
+                 gamma: float = 0.25,
+                 n_startup_trials: int = 10,
+                 n_ei_candidates: int = 24,
+                 prior_weight: float = 1.0,
+                 seed: Optional[int] = None):
+        """
+        Parameters
+        ----------
+        config: Type[Config]
+            Config class defining the search space
+        gamma: float
+            Fraction of the trials considered good
+        n_startup_trials: int
+            Number of completed trials before proposals are model based,
+            random configurations are proposed until then
+        n_ei_candidates: int
+            Number of candidates drawn from the good densities per proposal
+        prior_weight: float
+            Weight of the uniform prior in every density
+        seed: Optional[int]
+            Random seed
+        """
+        self.config: Type[Config] = config
+        self.gamma: float = gamma
+        self.n_startup_trials: int = n_startup_trials
+        self.n_ei_candidates: int = n_ei_candidates
+        self.prior_weight: float = prior_weight
+        self.rng: np.random.RandomState = np.random.RandomState(seed)
+        self.observations: List[Tuple[Dict[str, Any], float]] = []
+        self._seen: set = set()
+
+    def observe(self, params: Dict[str, Any], score: float) -> None:
+        """
+        Add a completed trial
+
+        Parameters
+        ----------
+        params: Dict[str, Any]
+            Hyperparameters of the trial, keys outside the search space
+            (e.g. trial_count) are ignored
+        score: float
+            Score of the trial, higher is better. NaN scores are ignored.
+        """
+        params = {
+            key: params[key]
+            for key in self.config.PARAMS_DICT if key in params
+        }
+        self._seen.add(self._key(params))
+        if score is None or math.isnan(score):
+            return
+        self.observations.append((params, float(score)))
+
+    def warm_start(self, logdir: str) -> int:
+        """
+        Observe the trials of earlier searches from their results files
+
+        Parameters
+        ----------
+        logdir: str
+            Log directory of earlier searches
+
+        Returns
+        -------
+        n_trials: int
+            Number of trials loaded
+        """
+        results: List[Tuple[Dict[str, Any], float]] = load_results(logdir)
+        for params, score in results:
+            self.observe(params, score)
+        logger.info("Warm started from %d trials in %s" %
+                    (len(results), logdir))
+        return len(results)
+
+    def propose(self, n: int = 1) -> List[Dict[str, Any]]:
+        """
+        Propose configurations to evaluate next
+
+        Parameters
+        ----------
+        n: int
+            Number of configurations, evaluated in parallel
+
+        Returns
+        -------
+        proposals: List[Dict[str, Any]]
+            New hyperparameter combinations
+        """
+        proposals: List[Dict[str, Any]] = []
+        for _ in range(n):
+            if len(self.observations) < self.n_startup_trials:
+                params: Optional[Dict[str, Any]] = self._random()
+            else:
+                params = self._best_candidate(proposals)
+            if params is None:
+                logger.info("Search space exhausted")
+                break
+            self._seen.add(self._key(params))
+            proposals.append(params)
+        return proposals
+
+    def _random(self) -> Optional[Dict[str, Any]]:
+        """Random configuration not seen yet"""
+        for _ in range(100):
+            params: Dict[str, Any] = \
+                self.config._generate_random_hyperparam_values(
+                    n=1, seed=int(self.rng.randint(2**31 - 1)))[0]
+            if self._key(params) not in self._seen:
+                return params
+        return None
+
+    def _best_candidate(
+            self, pending: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Candidate with the highest l(x) / g(x) not seen yet"""
+        ranked: List[Tuple[Dict[str, Any], float]] = sorted(
+            self.observations, key=lambda observation: -observation[1])
+        n_good: int = max(1, int(math.ceil(self.gamma * len(ranked))))
+        good: List[Dict[str, Any]] = [params for params, _ in ranked[:n_good]]
+        # pending proposals are "lies" counted with the bad trials
+        bad: List[Dict[str, Any]] = [params for params, _ in ranked[n_good:]
+                                     ] + pending
+
+        best: Optional[Dict[str, Any]] = None
+        best_score: float = -math.inf
+        for _ in range(self.n_ei_candidates):
+            params, score = self._sample_candidate(good, bad)
+            if score > best_score and self._key(params) not in self._seen:
+                best, best_score = params, score
+        return best if best is not None else self._random()
+
+    def _sample_candidate(
+            self, good: List[Dict[str, Any]],
+            bad: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], float]:
+        """Draw a candidate from the good densities, with its log l/g"""
+        params: Dict[str, Any] = {}
+        log_ratio: float = 0.0
+        for key in self._ordered_keys():
+            values: List = self._values(key)
+            if not self._active(key, params):
+                params[key] = values[0]
+                continue
+            good_density: np.ndarray = self._density(key, values, good)
+            bad_density: np.ndarray = self._density(key, values, bad)
+            index: int = int(self.rng.choice(len(values), p=good_density))
+            params[key] = values[index]
+            log_ratio += math.log(good_density[index]) - math.log(
+                bad_density[index])
+        return {key: params[key] for key in self.config.PARAMS_DICT}, log_ratio
+
+    def _density(self, key: str, values: List,
+                 trials: List[Dict[str, Any]]) -> np.ndarray:
+        """Parzen density of a hyperparameter over its values"""
+        weights: np.ndarray = np.full(len(values),
+                                      self.prior_weight / len(values))
+        numeric: bool = all(
+            isinstance(value, (int, float)) and not isinstance(value, bool)
+            for value in values)
+        positions: np.ndarray = np.arange(len(values))
+        for params in trials:
+            if key not in params or not self._active(key, params):
+                continue
+            try:
+                index: int = values.index(params[key])
+            except ValueError:
+                # value outside the current search space
+                continue
+            if numeric:
+                kernel: np.ndarray = np.exp(-0.5 * (positions - index)**2)
+                weights += kernel / kernel.sum()
+            else:
+                weights[index] += 1
+        return weights / weights.sum()
+
+    def _values(self, key: str) -> List:
+        """Values of a hyperparameter, sampling callables once"""
+        values = self.config.PARAMS_DICT[key]
+        if callable(values):
+            # continuous parameters are not modelled, draw a value
+            return [values()]
+        return list(values)
+
+    def _active(self, key: str, params: Dict[str, Any]) -> bool:
+        """Whether a conditional hyperparameter varies under params"""
+        if key not in self.config.CONDITIONAL_PARAMS:
+            return True
+        parent, active_value = self.config.CONDITIONAL_PARAMS[key]
+        return parent not in params or params[parent] == active_value
+
+    def _ordered_keys(self) -> List[str]:
+        """Hyperparameters with the parents of conditionals first"""
+        parents: List[str] = [
+            parent for parent, _ in self.config.CONDITIONAL_PARAMS.values()
+        ]
+        return sorted(self.config.PARAMS_DICT,
+                      key=lambda key: key not in parents)
+
+    @staticmethod
+    def _key(params: Dict[str, Any]) -> str:
+        return json.dumps(params, sort_keys=True, default=str)
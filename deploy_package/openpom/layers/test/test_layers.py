@@ -90,3 +90,41 @@ def test_custom_mpnn_gnn_no_residual_mean():
 
     node_encodings1 = mpnngnn1(g, node_feats, edge_feats)
     assert node_encodings1.shape == (3, 10)
+
+
+def test_custom_mpnn_gnn_matmul_message_passing():
+    """
+    Test the batched matmul message passing used under bfloat16 autocast
+    against NNConv
+    """
+    featurizer = GraphFeaturizer()
+    graph = featurizer.featurize('CC(=O)OCC')[0]
+    g = graph.to_dgl_graph(self_loop=False)
+    edge_feats = g.edata['edge_attr']
+
+    for aggregator_type in ['sum', 'mean']:
+        torch.manual_seed(0)
+        mpnngnn = CustomMPNNGNN(node_in_feats=134,
+                                edge_in_feats=6,
+                                node_out_feats=8,
+                                edge_hidden_feats=10,
+                                num_step_message_passing=3,
+                                residual=True,
+                                message_aggregator_type=aggregator_type)
+        layer = mpnngnn.gnn_layer
+        node_feats = torch.randn(g.num_nodes(), 8)
+        edge_weights = layer.edge_func(edge_feats).view(-1, 8, 8)
+        expected = layer(g, node_feats, edge_feats)
+        result = mpnngnn._matmul_message_passing(g, node_feats,
+                                                 edge_weights)
+        assert torch.allclose(result, expected, atol=1e-5)
+
+        # bfloat16 autocast keeps float32 outputs close to float32
+        with torch.no_grad():
+            node_encodings = mpnngnn(g, g.ndata['x'], edge_feats)
+            with torch.autocast(device_type='cpu', dtype=torch.bfloat16):
+                bf16_encodings = mpnngnn(g, g.ndata['x'], edge_feats)
+        assert bf16_encodings.shape == node_encodings.shape
+        assert torch.allclose(bf16_encodings.float(),
+                              node_encodings,
+                              atol=5e-2)
@@ -1,14 +1,21 @@
+import os
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from typing import List, Tuple, Union, Optional, Callable, Dict
+from typing import List, Tuple, Union, Optional, Callable, Dict, Iterable
 
+from deepchem.data import Dataset
 from deepchem.models.losses import Loss, L2Loss
 from deepchem.models.torch_models.torch_model import TorchModel
 from deepchem.models.optimizers import Optimizer, LearningRateSchedule
 
 from openpom.layers.pom_ffn import CustomPositionwiseFeedForward
-from openpom.utils.loss import CustomMultiLabelLoss
+from openpom.utils.batch_loader import (BatchCache, PreparedBatch,
+                                        collate_graphs, prefetch)
+from openpom.utils.batch_planner import BatchPlanner, graph_sizes
+from openpom.utils.checkpoint import CheckpointWriter
+from openpom.utils.loss import CustomMultiLabelLoss, l1_l2_penalty
 from openpom.utils.optimizer import get_optimizer
 
 try:
@@ -20,6 +27,9 @@ except (ImportError, ModuleNotFoundError):
     raise ImportError('This module requires dgl and dgllife')
 
 
+PRECISIONS: Tuple[str, ...] = ('float32', 'bfloat16')
+
+
 class MPNNPOM(nn.Module):
     """
     MPNN model computes a principal odor map
@@ -85,7 +95,8 @@ class MPNNPOM(nn.Module):
                  ffn_embeddings: int = 256,
                  ffn_activation: str = 'relu',
                  ffn_dropout_p: float = 0.0,
-                 ffn_dropout_at_input_no_act: bool = True):
+                 ffn_dropout_at_input_no_act: bool = True,
+                 precision: str = 'float32'):
         """
         Parameters
         ----------
@@ -154,10 +165,18 @@ class MPNNPOM(nn.Module):
         ffn_dropout_at_input_no_act: bool
             If true, dropout is applied on the input tensor.
             For single layer, it is not passed to an activation function.
+        precision: str
+            'float32', or 'bfloat16' to run the message passing and
+            feed-forward layers under bfloat16 autocast. Parameters,
+            graph readout, outputs and the loss stay float32.
+            Default to 'float32'.
         """
         if mode not in ['classification', 'regression']:
             raise ValueError(
                 "mode must be either 'classification' or 'regression'")
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"precision must be one of {', '.join(PRECISIONS)}")
 
         super(MPNNPOM, self).__init__()
 
@@ -170,6 +189,7 @@ class MPNNPOM(nn.Module):
         self.ffn_embeddings: int = ffn_embeddings
         self.ffn_activation: str = ffn_activation
         self.ffn_dropout_p: float = ffn_dropout_p
+        self.precision: str = precision
 
         if mode == 'classification':
             self.ffn_output: int = n_tasks * n_classes
@@ -244,37 +264,39 @@ class MPNNPOM(nn.Module):
             Tensor containing batchwise molecule encodings.
         """
 
-        g.ndata['node_emb'] = node_encodings
-        g.edata['edge_emb'] = self.project_edge_feats(edge_feats)
-
-        def message_func(edges) -> Dict:
-            """
-            The message function to generate messages
-            along the edges for DGLGraph.send_and_recv()
-            """
-            src_msg: torch.Tensor = torch.cat(
-                (edges.src['node_emb'], edges.data['edge_emb']), dim=1)
-            return {'src_msg': src_msg}
-
-        def reduce_func(nodes) -> Dict:
-            """
-            The reduce function to aggregate the messages
-            for DGLGraph.send_and_recv()
-            """
-            src_msg_sum: torch.Tensor = torch.sum(nodes.mailbox['src_msg'],
-                                                  dim=1)
-            return {'src_msg_sum': src_msg_sum}
-
-        # radius 0 combination to fold atom and bond embeddings together
-        g.send_and_recv(g.edges(),
-                        message_func=message_func,
-                        reduce_func=reduce_func)
-
-        if self.readout_type == 'set2set':
-            batch_mol_hidden_states: torch.Tensor = self.readout_set2set(
-                g, g.ndata['src_msg_sum'])
-        elif self.readout_type == 'global_sum_pooling':
-            batch_mol_hidden_states = dgl.sum_nodes(g, 'src_msg_sum')
+        # the input graph is left unchanged, so batches can be reused
+        with g.local_scope():
+            g.ndata['node_emb'] = node_encodings
+            g.edata['edge_emb'] = self.project_edge_feats(edge_feats)
+
+            def message_func(edges) -> Dict:
+                """
+                The message function to generate messages
+                along the edges for DGLGraph.send_and_recv()
+                """
+                src_msg: torch.Tensor = torch.cat(
+                    (edges.src['node_emb'], edges.data['edge_emb']), dim=1)
+                return {'src_msg': src_msg}
+
+            def reduce_func(nodes) -> Dict:
+                """
+                The reduce function to aggregate the messages
+                for DGLGraph.send_and_recv()
+                """
+                src_msg_sum: torch.Tensor = torch.sum(nodes.mailbox['src_msg'],
+                                                      dim=1)
+                return {'src_msg_sum': src_msg_sum}
+
+            # radius 0 combination to fold atom and bond embeddings together
+            g.send_and_recv(g.edges(),
+                            message_func=message_func,
+                            reduce_func=reduce_func)
+
+            if self.readout_type == 'set2set':
+                batch_mol_hidden_states: torch.Tensor = self.readout_set2set(
+                    g, g.ndata['src_msg_sum'])
+            elif self.readout_type == 'global_sum_pooling':
+                batch_mol_hidden_states = dgl.sum_nodes(g, 'src_msg_sum')
 
         # batch_size x (node_out_feats + edge_out_feats)
         return batch_mol_hidden_states
@@ -310,7 +332,11 @@ class MPNNPOM(nn.Module):
         node_feats: torch.Tensor = g.ndata[self.nfeat_name]
         edge_feats: torch.Tensor = g.edata[self.efeat_name]
 
-        node_encodings: torch.Tensor = self.mpnn(g, node_feats, edge_feats)
+        with self._autocast(node_feats.device):
+            node_encodings: torch.Tensor = self.mpnn(g, node_feats,
+                                                     edge_feats)
+        # DGL graph frames need a single dtype, readout runs in float32
+        node_encodings = node_encodings.float()
 
         molecular_encodings: torch.Tensor = self._readout(
             g, node_encodings, edge_feats)
@@ -319,7 +345,10 @@ class MPNNPOM(nn.Module):
 
         embeddings: torch.Tensor
         out: torch.Tensor
-        embeddings, out = self.ffn(molecular_encodings)
+        with self._autocast(node_feats.device):
+            embeddings, out = self.ffn(molecular_encodings)
+        # sigmoid and loss are computed in float32
+        embeddings, out = embeddings.float(), out.float()
 
         if self.mode == 'classification':
             if self.n_tasks == 1:
@@ -334,6 +363,12 @@ class MPNNPOM(nn.Module):
         else:
             return out
 
+    def _autocast(self, device: torch.device) -> torch.autocast:
+        """bfloat16 autocast context, disabled in float32 precision"""
+        return torch.autocast(device_type=device.type,
+                              dtype=torch.bfloat16,
+                              enabled=self.precision == 'bfloat16')
+
 
 class MPNNPOMModel(TorchModel):
     """
@@ -407,6 +442,14 @@ class MPNNPOMModel(TorchModel):
                  self_loop: bool = False,
                  optimizer_name: str = 'adam',
                  device_name: Optional[str] = None,
+                 max_atoms_per_batch: Optional[int] = None,
+                 max_edges_per_batch: Optional[int] = None,
+                 sort_batches_by_size: bool = False,
+                 checkpoint_writer: Optional[CheckpointWriter] = None,
+                 precision: str = 'float32',
+                 prefetch_workers: int = 1,
+                 prefetch_depth: int = 2,
+                 cache_batches: bool = False,
                  **kwargs):
         """
         Parameters
@@ -490,6 +533,39 @@ class MPNNPOMModel(TorchModel):
         device_name: Optional[str]
             The device on which to run computations. If None, a device is
             chosen automatically.
+        max_atoms_per_batch: Optional[int]
+            If set, batches are packed by total number of atoms
+            (see BatchPlanner) instead of a fixed ``batch_size``;
+            ``batch_size`` then only caps the number of molecules.
+            Default to None.
+        max_edges_per_batch: Optional[int]
+            If set, batches are packed by total number of directed edges
+            (see BatchPlanner). Default to None.
+        sort_batches_by_size: bool
+            If true, molecules of similar size are grouped together
+            when training with an atom/edge budget. Prediction always
+            keeps the dataset order. Default to False.
+        checkpoint_writer: Optional[CheckpointWriter]
+            If set, checkpoints (including the ones saved by ``fit``) are
+            written on the writer's background thread instead of blocking
+            training. ``restore`` waits for pending writes of the model
+            directory. Default to None.
+        precision: str
+            'float32', or 'bfloat16' for mixed precision training and
+            inference on hardware with native bfloat16 support (see
+            MPNNPOM). Default to 'float32'.
+        prefetch_workers: int
+            Number of background threads collating the graphs of the next
+            training batches while the current one is trained, 0 to
+            collate on the training thread. Default to 1.
+        prefetch_depth: int
+            Number of training batches collated ahead. Default to 2.
+        cache_batches: bool
+            If true, ``fit`` keeps the collated batches of the training
+            dataset and reuses them at later epochs (and later ``fit``
+            calls on the same dataset object): the batch layout is drawn
+            once, only the order of the batches is shuffled per epoch.
+            Default to False.
         kwargs
             This can include any keyword argument of TorchModel.
         """
@@ -512,7 +588,8 @@ class MPNNPOMModel(TorchModel):
             ffn_embeddings=ffn_embeddings,
             ffn_activation=ffn_activation,
             ffn_dropout_p=ffn_dropout_p,
-            ffn_dropout_at_input_no_act=ffn_dropout_at_input_no_act)
+            ffn_dropout_at_input_no_act=ffn_dropout_at_input_no_act,
+            precision=precision)
 
         if class_imbalance_ratio and (len(class_imbalance_ratio) != n_tasks):
             raise Exception("size of class_imbalance_ratio \
@@ -546,31 +623,281 @@ class MPNNPOMModel(TorchModel):
         self.weight_decay: float = weight_decay
         self._self_loop: bool = self_loop
         self.regularization_loss: Callable = self._regularization_loss
+        self._regularized_parameters: Optional[List[torch.Tensor]] = None
+
+        self.batch_planner: Optional[BatchPlanner] = None
+        if max_atoms_per_batch is not None or max_edges_per_batch is not None:
+            self.batch_planner = BatchPlanner(
+                max_atoms=max_atoms_per_batch,
+                max_edges=max_edges_per_batch,
+                max_batch_size=batch_size,
+                sort_by_size=sort_batches_by_size)
+        self.checkpoint_writer: Optional[CheckpointWriter] = \
+            checkpoint_writer
+        self.prefetch_workers: int = prefetch_workers
+        self.prefetch_depth: int = prefetch_depth
+        self.batch_cache: Optional[BatchCache] = \
+            BatchCache() if cache_batches else None
+
+    def save_checkpoint(self,
+                        max_checkpoints_to_keep: int = 5,
+                        model_dir: Optional[str] = None) -> None:
+        """
+        Save a checkpoint to disk, in the background if the model has a
+        checkpoint_writer
+
+        Parameters
+        ----------
+        max_checkpoints_to_keep: int
+            the maximum number of checkpoints to keep.
+            Older checkpoints are discarded.
+        model_dir: Optional[str]
+            Model directory to save checkpoint to.
+            If None, revert to self.model_dir
+        """
+        if self.checkpoint_writer is None:
+            super(MPNNPOMModel, self).save_checkpoint(max_checkpoints_to_keep,
+                                                      model_dir)
+            return
+        if max_checkpoints_to_keep == 0:
+            return
+        self._ensure_built()
+        self.checkpoint_writer.save(
+            {
+                'model_state_dict': self.model.state_dict(),
+                'optimizer_state_dict': self._pytorch_optimizer.state_dict(),
+                'global_step': self._global_step
+            },
+            model_dir or self.model_dir,
+            max_checkpoints_to_keep=max_checkpoints_to_keep)
+
+    def restore(self,
+                checkpoint: Optional[str] = None,
+                model_dir: Optional[str] = None,
+                strict: Optional[bool] = True) -> None:
+        """
+        Reload the values of all variables from a checkpoint file.
+
+        Weights-only checkpoints (without optimizer state, see
+        ``CheckpointWriter``) are supported, the optimizer then keeps its
+        current state.
+
+        Parameters
+        ----------
+        checkpoint: Optional[str]
+            the path to the checkpoint file to load. If this is None,
+            the most recent checkpoint in model_dir is chosen.
+        model_dir: Optional[str]
+            Directory to restore checkpoint from. If None, use
+            self.model_dir. If checkpoint is not None, this is ignored.
+        strict: Optional[bool]
+            Whether or not to strictly enforce that the keys in
+            checkpoint match the keys of the model.
+        """
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush(
+                os.path.dirname(checkpoint) if checkpoint is not None else
+                model_dir or self.model_dir)
+        self._ensure_built()
+        if checkpoint is None:
+            checkpoints: List[str] = sorted(self.get_checkpoints(model_dir))
+            if len(checkpoints) == 0:
+                raise ValueError('No checkpoint found')
+            checkpoint = checkpoints[0]
+        data: Dict = torch.load(checkpoint, map_location=self.device)
+        self.model.load_state_dict(data['model_state_dict'], strict=strict)
+        if 'optimizer_state_dict' in data:
+            self._pytorch_optimizer.load_state_dict(
+                data['optimizer_state_dict'])
+        if 'global_step' in data:
+            self._global_step = data['global_step']
 
     def _regularization_loss(self) -> torch.Tensor:
         """
         L1 and L2-norm losses for regularization
 
+        The penalty of all weights (biases excluded) is computed with
+        fused foreach kernels (see ``l1_l2_penalty``) instead of
+        ``torch.norm`` calls per parameter and norm.
+
         Returns
         -------
         torch.Tensor
             sum of l1_norm and l2_norm
         """
-        l1_regularization: torch.Tensor = torch.tensor(0., requires_grad=True)
-        l2_regularization: torch.Tensor = torch.tensor(0., requires_grad=True)
-        for name, param in self.model.named_parameters():
-            if 'bias' not in name:
-                l1_regularization = l1_regularization + torch.norm(param, p=1)
-                l2_regularization = l2_regularization + torch.norm(param, p=2)
-        l1_norm: torch.Tensor = self.weight_decay * l1_regularization
-        l2_norm: torch.Tensor = self.weight_decay * l2_regularization
-        return l1_norm + l2_norm
+        if self._regularized_parameters is None:
+            self._regularized_parameters = [
+                param for name, param in self.model.named_parameters()
+                if 'bias' not in name
+            ]
+        return l1_l2_penalty(self._regularized_parameters, self.weight_decay)
+
+    def fit(self,
+            dataset: Dataset,
+            nb_epoch: int = 10,
+            max_checkpoints_to_keep: int = 5,
+            checkpoint_interval: int = 1000,
+            deterministic: bool = False,
+            restore: bool = False,
+            variables: Optional[List[torch.nn.Parameter]] = None,
+            loss: Optional[Callable] = None,
+            callbacks: Union[Callable, List[Callable]] = [],
+            all_losses: Optional[List[float]] = None) -> float:
+        """
+        Train this model on a dataset, like ``TorchModel.fit``
+
+        The graphs of the batches are collated on background threads
+        (``prefetch_workers``), or taken from the batch cache when the
+        model has one.
+
+        Returns
+        -------
+        The average loss over the most recent checkpoint interval
+        """
+        return self.fit_generator(
+            self.training_batches(dataset,
+                                  epochs=nb_epoch,
+                                  deterministic=deterministic),
+            max_checkpoints_to_keep, checkpoint_interval, restore, variables,
+            loss, callbacks, all_losses)
+
+    def training_batches(self,
+                         dataset: Dataset,
+                         epochs: int = 1,
+                         deterministic: bool = False
+                        ) -> Iterable[PreparedBatch]:
+        """
+        Prepared training batches of a dataset
+
+        Parameters
+        ----------
+        dataset: Dataset
+            the data to iterate
+        epochs: int
+            the number of times to iterate over the full dataset
+        deterministic: bool
+            whether to iterate over the dataset in order, or randomly
+            shuffle the data (or the cached batches) for each epoch
+
+        Returns
+        -------
+        a generator of PreparedBatch, which ``fit_generator`` trains on
+        """
+        if self.batch_cache is not None:
+            return self.batch_cache.epochs(
+                dataset,
+                lambda: self.default_generator(
+                    dataset, epochs=1, deterministic=deterministic),
+                self._prepare_batch,
+                epochs=epochs,
+                shuffle=not deterministic,
+                num_workers=self.prefetch_workers,
+                depth=self.prefetch_depth)
+        return self.prefetch_batches(
+            self.default_generator(dataset,
+                                   epochs=epochs,
+                                   deterministic=deterministic))
+
+    def prefetch_batches(
+        self, batches: Iterable[Tuple[List, List, List]]
+    ) -> Iterable[PreparedBatch]:
+        """
+        Prepare raw batches on the background threads of the model
+
+        Parameters
+        ----------
+        batches: Iterable[Tuple[List, List, List]]
+            ([inputs], [labels], [weights]) batches, e.g. of
+            ``default_generator``
+
+        Returns
+        -------
+        a generator of PreparedBatch, in the order of ``batches``
+        """
+        return prefetch(batches,
+                        self._prepare_batch,
+                        num_workers=self.prefetch_workers,
+                        depth=self.prefetch_depth)
+
+    def default_generator(
+            self,
+            dataset: Dataset,
+            epochs: int = 1,
+            mode: str = 'fit',
+            deterministic: bool = True,
+            pad_batches: bool = True) -> Iterable[Tuple[List, List, List]]:
+        """Create a generator that iterates batches for a dataset.
+
+        Without an atom/edge budget this is the TorchModel generator.
+        With a budget, batches are planned by BatchPlanner: the number of
+        molecules per batch varies and batches are never padded. Note that
+        the number of steps per epoch then differs from
+        ``len(dataset) / batch_size``, which matters for step-based
+        learning rate schedules.
+
+        Parameters
+        ----------
+        dataset: Dataset
+            the data to iterate
+        epochs: int
+            the number of times to iterate over the full dataset
+        mode: str
+            allowed values are 'fit' (called during training), 'predict'
+            (called during prediction), and 'uncertainty'
+            (called during uncertainty prediction)
+        deterministic: bool
+            whether to iterate over the dataset in order, or randomly
+            shuffle the data for each epoch
+        pad_batches: bool
+            whether to pad each batch up to this model's preferred batch
+            size. Ignored when an atom/edge budget is set.
+
+        Returns
+        -------
+        a generator that iterates batches, each represented as a tuple of
+        lists: ([inputs], [outputs], [weights])
+        """
+        if self.batch_planner is None:
+            yield from super(MPNNPOMModel, self).default_generator(
+                dataset,
+                epochs=epochs,
+                mode=mode,
+                deterministic=deterministic,
+                pad_batches=pad_batches)
+            return
+
+        X: np.ndarray = dataset.X
+        y: np.ndarray = dataset.y
+        w: np.ndarray = dataset.w
+        num_nodes, num_edges = graph_sizes(X)
+        # outputs of predict() are concatenated in batch order,
+        # so only training batches may be reordered
+        # BatchNorm layers in the FFN need at least 2 samples to train
+        reorder: bool = mode == 'fit'
+        planner: BatchPlanner = BatchPlanner(
+            max_atoms=self.batch_planner.max_atoms,
+            max_edges=self.batch_planner.max_edges,
+            max_batch_size=self.batch_planner.max_batch_size,
+            sort_by_size=reorder and self.batch_planner.sort_by_size,
+            min_batch_size=2 if reorder else 1)
+        for epoch in range(epochs):
+            batches: List[np.ndarray] = planner.plan_sizes(
+                num_nodes,
+                num_edges,
+                shuffle=reorder and not deterministic,
+                seed=None if deterministic else np.random.randint(2**31))
+            for indices in batches:
+                yield ([X[indices]], [y[indices] if y is not None else None],
+                       [w[indices] if w is not None else None])
 
     def _prepare_batch(
         self, batch: Tuple[List, List, List]
     ) -> Tuple[DGLGraph, List[torch.Tensor], List[torch.Tensor]]:
         """Create batch data for MPNN.
 
+        The graphs are collated into one DGLGraph by ``collate_graphs``.
+        A PreparedBatch (see ``training_batches``) is returned as is.
+
         Parameters
         ----------
         batch: Tuple[List, List, List]
@@ -590,12 +917,12 @@ class MPNNPOMModel(TorchModel):
         labels: List
         weights: List
 
+        if isinstance(batch, PreparedBatch):
+            return batch
         inputs, labels, weights = batch
-        dgl_graphs: List[DGLGraph] = [
-            graph.to_dgl_graph(self_loop=self._self_loop)
-            for graph in inputs[0]
-        ]
-        g: DGLGraph = dgl.batch(dgl_graphs).to(self.device)
+        g: DGLGraph = collate_graphs(inputs[0],
+                                     self_loop=self._self_loop).to(
+                                         self.device)
         _, labels, weights = super(MPNNPOMModel, self)._prepare_batch(
             ([], labels, weights))
-        return g, labels, weights
+        return PreparedBatch(g, labels, weights)
@@ -92,6 +92,47 @@ def test_mpnnpom_multiple_configs(test_parameters):
     assert output.shape == torch.Size([number_of_molecules, n_tasks])
 
 
+
+@pytest.mark.parametrize('test_parameters',
+                         [Test1_params, Test2_params, Test3_params])
+def test_mpnnpom_bfloat16(test_parameters):
+    """
+    Test MPNNPOM class in bfloat16 precision against float32
+    """
+    torch.manual_seed(0)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    torch.set_default_device(device)
+    input_smile = ["CC(=O)OCC", "c1ccc(cc1)O", "C"]
+    feat = GraphFeaturizer()
+    graphs = feat.featurize(input_smile)
+    dgl_graphs = [graph.to_dgl_graph() for graph in graphs]
+    g = dgl.batch(dgl_graphs).to(device)
+
+    model_params = dict(n_tasks=4,
+                        mode='classification',
+                        number_atom_features=134,
+                        number_bond_features=6,
+                        **test_parameters)
+    model = MPNNPOM(**model_params)
+    bf16_model = MPNNPOM(precision='bfloat16', **model_params)
+    bf16_model.load_state_dict(model.state_dict())
+    model.eval()
+    bf16_model.eval()
+
+    proba, logits, embeddings = model(g)
+    bf16_proba, bf16_logits, bf16_embeddings = bf16_model(g)
+    # parameters, outputs and loss inputs stay float32
+    assert all(p.dtype == torch.float32 for p in bf16_model.parameters())
+    assert bf16_proba.dtype == torch.float32
+    assert bf16_logits.dtype == torch.float32
+    assert bf16_embeddings.shape == embeddings.shape
+    assert np.allclose(bf16_proba.detach().cpu().numpy(),
+                       proba.detach().cpu().numpy(),
+                       atol=0.01)
+
+    with pytest.raises(ValueError):
+        MPNNPOM(precision='float16', **model_params)
+
 def test_mpnnpom_classification_single_task():
     """
     Test MPNNPOM class for single task classification
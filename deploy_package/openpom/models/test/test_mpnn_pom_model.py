@@ -43,6 +43,79 @@ def test_mpnnpom_model_classification():
     assert scores['roc_auc_score'] > 0.9
 
 
+
+def test_mpnnpom_model_bfloat16():
+    """
+    Test MPNNPOMModel class training and inference in bfloat16 precision
+    """
+    torch.manual_seed(0)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    torch.set_default_device(device)
+
+    featurizer = GraphFeaturizer()
+    tasks = ['fruity', 'green', 'herbal', 'sweet', 'woody']
+    loader = CSVLoader(tasks=tasks,
+                       feature_field='smiles',
+                       featurizer=featurizer)
+    input_file = \
+        'openpom/models/test/assets/test_dataset_sample_7.csv'
+    dataset = loader.create_dataset(inputs=[input_file])
+    class_imbalance_ratio = get_class_imbalance_ratio(dataset=dataset)
+
+    model_dir = tempfile.mkdtemp()
+    model_params = dict(n_tasks=len(tasks),
+                        batch_size=2,
+                        class_imbalance_ratio=class_imbalance_ratio,
+                        mode="classification",
+                        n_classes=1,
+                        device_name=device,
+                        model_dir=model_dir)
+    model = MPNNPOMModel(precision='bfloat16', **model_params)
+    loss = model.fit(dataset, nb_epoch=3)
+    assert np.isfinite(loss)
+    bf16_pred = model.predict(dataset)
+    assert bf16_pred.dtype == np.float32
+
+    # bfloat16 checkpoints hold float32 weights
+    reloaded_model = MPNNPOMModel(**model_params)
+    reloaded_model.restore()
+    pred = reloaded_model.predict(dataset)
+    assert np.allclose(bf16_pred, pred, atol=0.01)
+
+
+def test_mpnnpom_model_regularization_loss():
+    """
+    Test the fused L1 and L2 regularization of MPNNPOMModel against
+    per parameter norms, values and gradients
+    """
+    torch.manual_seed(0)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    torch.set_default_device(device)
+    model = MPNNPOMModel(n_tasks=3,
+                         mode="classification",
+                         n_classes=1,
+                         weight_decay=1e-3,
+                         device_name=device)
+
+    weights = [
+        param for name, param in model.model.named_parameters()
+        if 'bias' not in name
+    ]
+    regularization = model.regularization_loss()
+    regularization.backward()
+    grads = [param.grad.clone() for param in weights]
+    model.model.zero_grad()
+
+    reference = torch.tensor(0.)
+    for param in weights:
+        reference = reference + 1e-3 * (torch.norm(param, p=1) +
+                                         torch.norm(param, p=2))
+    reference.backward()
+
+    assert torch.allclose(regularization, reference, rtol=1e-4)
+    for grad, param in zip(grads, weights):
+        assert torch.allclose(grad, param.grad, atol=1e-7)
+
 def test_mpnnpom_model_regression():
     """
     Test MPNNPOMModel class for regression
@@ -116,3 +189,39 @@ def test_mpnnpom_model_reload():
     orig_predict = model.predict(dataset)
     reloaded_predict = reloaded_model.predict(dataset)
     assert np.all(orig_predict == reloaded_predict)
+
+
+def test_mpnnpom_model_batch_budget():
+    """
+    Test MPNNPOMModel with batches packed by an atom/edge budget
+    """
+    torch.manual_seed(0)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    torch.set_default_device(device)
+
+    featurizer = GraphFeaturizer()
+    tasks = ['fruity', 'green', 'herbal', 'sweet', 'woody']
+    loader = CSVLoader(tasks=tasks,
+                       feature_field='smiles',
+                       featurizer=featurizer)
+    input_file = \
+        'openpom/models/test/assets/test_dataset_sample_7.csv'
+    dataset = loader.create_dataset(inputs=[input_file])
+
+    model = MPNNPOMModel(n_tasks=len(tasks),
+                         batch_size=100,
+                         mode="classification",
+                         n_classes=1,
+                         device_name=device,
+                         max_atoms_per_batch=30,
+                         sort_batches_by_size=True)
+
+    batches = list(model.default_generator(dataset, deterministic=False))
+    assert len(batches) > 1
+    assert sum(len(X[0]) for X, _, _ in batches) == len(dataset)
+
+    # prediction keeps the dataset order regardless of packing
+    model.fit(dataset, nb_epoch=1)
+    budget_predict = model.predict(dataset)
+    model.batch_planner = None
+    assert np.allclose(budget_predict, model.predict(dataset), atol=1e-6)
@@ -0,0 +1,226 @@
+import itertools
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (Any, Callable, Deque, Iterable, Iterator, List,
+                    NamedTuple, Optional, Sequence)
+import numpy as np
+import torch
+
+try:
+    import dgl
+    from dgl import DGLGraph
+except (ImportError, ModuleNotFoundError):
+    raise ImportError('This module requires dgl')
+
+
+class PreparedBatch(NamedTuple):
+    """
+    A batch already converted to model inputs, ``_prepare_batch`` of
+    MPNNPOMModel returns it as is
+
+    Attributes
+    ----------
+    inputs: DGLGraph
+        Batched graph of the molecules, on the model device
+    labels: List[torch.Tensor]
+        float32 label tensors
+    weights: List[torch.Tensor]
+        float32 weight tensors
+    """
+    inputs: DGLGraph
+    labels: List[torch.Tensor]
+    weights: List[torch.Tensor]
+
+
+def collate_graphs(graphs: Sequence, self_loop: bool = False) -> DGLGraph:
+    """
+    Build the batched DGLGraph of deepchem GraphData objects
+
+    Equivalent to ``dgl.batch([g.to_dgl_graph(self_loop) for g in graphs])``
+    (same node and edge order, float32 features), but the node features,
+    edge features and offset edge indices are concatenated with numpy and
+    a single graph is built, instead of one DGLGraph per molecule.
+
+    Parameters
+    ---------
+    graphs: Sequence
+        Sequence of deepchem GraphData objects
+    self_loop: bool
+        Whether to add self loops (with zero edge features) to every node
+
+    Returns
+    -------
+    g: DGLGraph
+        Batched graph, with ``ndata['x']`` and ``edata['edge_attr']``
+    """
+    if any(graph.node_pos_features is not None for graph in graphs):
+        return dgl.batch(
+            [graph.to_dgl_graph(self_loop=self_loop) for graph in graphs])
+
+    num_nodes: np.ndarray = np.array([graph.num_nodes for graph in graphs],
+                                     dtype=np.int64)
+    offsets: np.ndarray = np.concatenate([[0], np.cumsum(num_nodes)[:-1]])
+    edges: List[np.ndarray] = []
+    for graph, offset, n in zip(graphs, offsets, num_nodes):
+        edges.append(graph.edge_index + offset)
+        if self_loop:
+            loops: np.ndarray = np.arange(offset, offset + n)
+            edges.append(np.stack([loops, loops]))
+    edge_index: np.ndarray = np.concatenate(edges, axis=1)
+    num_edges: np.ndarray = np.array([graph.num_edges for graph in graphs],
+                                     dtype=np.int64)
+    if self_loop:
+        num_edges = num_edges + num_nodes
+
+    g: DGLGraph = dgl.graph((torch.from_numpy(edge_index[0]).long(),
+                             torch.from_numpy(edge_index[1]).long()),
+                            num_nodes=int(num_nodes.sum()))
+    g.ndata['x'] = torch.from_numpy(
+        np.concatenate([graph.node_features for graph in graphs
+                       ])).to(torch.float32)
+    if graphs[0].edge_features is not None:
+        edge_features: List[np.ndarray] = []
+        for graph in graphs:
+            edge_features.append(graph.edge_features)
+            if self_loop:
+                edge_features.append(
+                    np.zeros((graph.num_nodes, graph.edge_features.shape[1]),
+                             dtype=graph.edge_features.dtype))
+        g.edata['edge_attr'] = torch.from_numpy(
+            np.concatenate(edge_features)).to(torch.float32)
+    g.set_batch_num_nodes(torch.from_numpy(num_nodes))
+    g.set_batch_num_edges(torch.from_numpy(num_edges))
+    return g
+
+
+def prefetch(batches: Iterable[Any],
+             prepare: Callable[[Any], Any],
+             num_workers: int = 1,
+             depth: int = 2) -> Iterator[Any]:
+    """
+    Prepare batches ahead of their use on background threads
+
+    Up to ``depth`` batches are prepared (or being prepared) while the
+    caller trains on the current one, by a pool of ``num_workers``
+    threads. Batches are yielded in order. ``batches`` itself is iterated
+    on the calling thread, so the numpy random state it uses for shuffling
+    is not shared with the workers.
+
+    Parameters
+    ---------
+    batches: Iterable[Any]
+        Raw batches
+    prepare: Callable[[Any], Any]
+        Function converting a raw batch
+    num_workers: int
+        Number of threads preparing batches
+    depth: int
+        Number of batches prepared ahead
+
+    Returns
+    -------
+    batches: Iterator[Any]
+        ``prepare(batch)`` for every batch
+    """
+    if num_workers < 1 or depth < 1:
+        yield from map(prepare, batches)
+        return
+    iterator: Iterator[Any] = iter(batches)
+    pending: Deque[Future] = deque()
+    executor: ThreadPoolExecutor = ThreadPoolExecutor(
+        max_workers=num_workers, thread_name_prefix='batch-prefetch')
+    try:
+        for batch in itertools.islice(iterator, depth):
+            pending.append(executor.submit(prepare, batch))
+        while pending:
+            future: Future = pending.popleft()
+            for batch in itertools.islice(iterator, 1):
+                pending.append(executor.submit(prepare, batch))
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+class BatchCache(object):
+    """
+    Prepared batches of a dataset, reused across epochs.
+
+    Graph collation costs as much as a forward pass for small molecules.
+    With a fixed batch layout (each molecule always in the same batch) the
+    collated batches of the first epoch can be kept, and later epochs only
+    shuffle the order of the batches. The samples of a batch, and the
+    padding of the last one, are then the same at every epoch.
+
+    The cache holds the batches of one dataset, preparing another dataset
+    replaces them.
+
+    Example
+    -------
+    >>> cache = BatchCache()
+    >>> for batch in cache.epochs(dataset, raw_batches, prepare, epochs=10):
+    ...     train_step(batch)
+    """
+
+    def __init__(self):
+        self._dataset: Optional[Any] = None
+        self._batches: List[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def clear(self) -> None:
+        """Drop the cached batches"""
+        self._dataset, self._batches = None, []
+
+    def epochs(self,
+               dataset: Any,
+               batches: Callable[[], Iterable[Any]],
+               prepare: Callable[[Any], Any],
+               epochs: int = 1,
+               shuffle: bool = True,
+               num_workers: int = 1,
+               depth: int = 2) -> Iterator[Any]:
+        """
+        Iterate the prepared batches of a dataset for several epochs
+
+        Parameters
+        ---------
+        dataset: Any
+            Dataset the batches are cached for, compared by identity
+        batches: Callable[[], Iterable[Any]]
+            Function returning the raw batches of one epoch, called when
+            the dataset is not cached yet
+        prepare: Callable[[Any], Any]
+            Function converting a raw batch
+        epochs: int
+            Number of epochs
+        shuffle: bool
+            Whether to shuffle the order of the cached batches at every
+            epoch (with the numpy random state). The epoch filling the
+            cache keeps the order of ``batches``.
+        num_workers: int
+            Number of threads preparing the batches when filling the cache
+        depth: int
+            Number of batches prepared ahead when filling the cache
+
+        Returns
+        -------
+        batches: Iterator[Any]
+            Prepared batches
+        """
+        if epochs > 0 and dataset is not self._dataset:
+            # the first epoch is trained while the cache is filled, in
+            # the order of the raw batches
+            self.clear()
+            for batch in prefetch(batches(), prepare, num_workers, depth):
+                self._batches.append(batch)
+                yield batch
+            self._dataset = dataset
+            epochs -= 1
+        for epoch in range(epochs):
+            order: np.ndarray = np.random.permutation(len(self._batches)) \
+                if shuffle else np.arange(len(self._batches))
+            for i in order:
+                yield self._batches[i]
@@ -0,0 +1,186 @@
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+
+
+def graph_sizes(graphs: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get number of nodes and edges of each graph
+
+    Parameters
+    ---------
+    graphs: Sequence
+        Sequence of deepchem GraphData objects
+
+    Returns
+    -------
+    num_nodes: np.ndarray
+        Number of nodes (atoms) per graph
+    num_edges: np.ndarray
+        Number of directed edges per graph (two per bond)
+    """
+    num_nodes: np.ndarray = np.fromiter((graph.num_nodes for graph in graphs),
+                                        dtype=np.int64,
+                                        count=len(graphs))
+    num_edges: np.ndarray = np.fromiter((graph.num_edges for graph in graphs),
+                                        dtype=np.int64,
+                                        count=len(graphs))
+    return num_nodes, num_edges
+
+
+class BatchPlanner(object):
+    """
+    Pack molecular graphs into batches by a total atom/edge budget.
+
+    A fixed number of molecules per batch gives very different amounts of
+    work depending on molecule size: the NNConv edge network materializes a
+    weight matrix per edge, so a batch of large terpenes or glycosides uses
+    many times the memory of a batch of small esters. The planner instead
+    closes a batch as soon as adding the next graph would exceed
+    ``max_atoms`` or ``max_edges``, which bounds peak memory and keeps the
+    amount of work per batch roughly constant.
+
+    A graph that alone exceeds the budget is put in a batch of its own,
+    unless ``min_batch_size`` is set: batches smaller than it are merged into
+    a neighbouring batch (BatchNorm layers cannot be trained on a single
+    sample), which may exceed the budget.
+
+    Example
+    -------
+    >>> planner = BatchPlanner(max_atoms=2000, max_edges=4000)
+    >>> batches = planner.plan(graphs)  # list of index arrays
+    """
+
+    def __init__(self,
+                 max_atoms: Optional[int] = None,
+                 max_edges: Optional[int] = None,
+                 max_batch_size: Optional[int] = None,
+                 sort_by_size: bool = False,
+                 min_batch_size: int = 1):
+        """
+        Parameters
+        ----------
+        max_atoms: Optional[int]
+            Maximum total number of atoms per batch.
+        max_edges: Optional[int]
+            Maximum total number of directed edges per batch.
+        max_batch_size: Optional[int]
+            Maximum number of graphs per batch.
+        sort_by_size: bool
+            If true, group graphs of similar size together
+            (by number of edges) before packing, which reduces the
+            variance of batch cost and the number of batches.
+            Default to False.
+        min_batch_size: int
+            Batches with fewer graphs are merged into a neighbouring
+            batch. Default to 1.
+        """
+        if max_atoms is None and max_edges is None and max_batch_size is None:
+            raise ValueError(
+                "At least one of max_atoms, max_edges or max_batch_size "
+                "should be set")
+        self.max_atoms: Optional[int] = max_atoms
+        self.max_edges: Optional[int] = max_edges
+        self.max_batch_size: Optional[int] = max_batch_size
+        self.sort_by_size: bool = sort_by_size
+        self.min_batch_size: int = min_batch_size
+
+    def plan_sizes(self,
+                   num_nodes: np.ndarray,
+                   num_edges: np.ndarray,
+                   shuffle: bool = False,
+                   seed: Optional[int] = None) -> List[np.ndarray]:
+        """
+        Plan batches from precomputed graph sizes
+
+        Parameters
+        ----------
+        num_nodes: np.ndarray
+            Number of nodes per graph
+        num_edges: np.ndarray
+            Number of edges per graph
+        shuffle: bool
+            If true, shuffle graphs before packing and shuffle the order
+            of the resulting batches. Default to False.
+        seed: Optional[int]
+            Random seed used when shuffle is true
+
+        Returns
+        -------
+        batches: List[np.ndarray]
+            Indices of the graphs in each batch. Every graph appears
+            in exactly one batch.
+        """
+        rng: np.random.RandomState = np.random.RandomState(seed)
+        order: np.ndarray = np.arange(len(num_nodes))
+        if shuffle:
+            order = rng.permutation(order)
+        if self.sort_by_size:
+            # stable sort keeps the shuffled order among equal sizes
+            order = order[np.argsort(num_edges[order], kind='stable')]
+
+        batches: List[np.ndarray] = []
+        start: int = 0
+        atoms: int = 0
+        edges: int = 0
+        for position, index in enumerate(order):
+            n_atoms: int = int(num_nodes[index])
+            n_edges: int = int(num_edges[index])
+            if position > start and (
+                (self.max_atoms is not None and
+                 atoms + n_atoms > self.max_atoms) or
+                (self.max_edges is not None and
+                 edges + n_edges > self.max_edges) or
+                (self.max_batch_size is not None and
+                 position - start >= self.max_batch_size)):
+                batches.append(order[start:position])
+                start, atoms, edges = position, 0, 0
+            atoms += n_atoms
+            edges += n_edges
+        if start < len(order):
+            batches.append(order[start:])
+        if self.min_batch_size > 1:
+            batches = self._merge_small_batches(batches)
+
+        if shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def _merge_small_batches(self,
+                             batches: List[np.ndarray]) -> List[np.ndarray]:
+        """Merge batches smaller than min_batch_size into a neighbour"""
+        merged: List[np.ndarray] = []
+        for batch in batches:
+            if merged and (len(batch) < self.min_batch_size or
+                           len(merged[-1]) < self.min_batch_size):
+                merged[-1] = np.concatenate([merged[-1], batch])
+            else:
+                merged.append(batch)
+        return merged
+
+    def plan(self,
+             graphs: Sequence,
+             shuffle: bool = False,
+             seed: Optional[int] = None) -> List[np.ndarray]:
+        """
+        Plan batches for a sequence of GraphData objects
+
+        Parameters
+        ----------
+        graphs: Sequence
+            Sequence of deepchem GraphData objects
+        shuffle: bool
+            If true, shuffle graphs before packing and shuffle the order
+            of the resulting batches. Default to False.
+        seed: Optional[int]
+            Random seed used when shuffle is true
+
+        Returns
+        -------
+        batches: List[np.ndarray]
+            Indices of the graphs in each batch
+        """
+        num_nodes, num_edges = graph_sizes(graphs)
+        return self.plan_sizes(num_nodes,
+                               num_edges,
+                               shuffle=shuffle,
+                               seed=seed)
@@ -0,0 +1,227 @@
+import os
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_state(obj: Any) -> Any:
+    """
+    Copy the tensors of a (nested) state dict to CPU memory
+
+    The copy is taken on the calling thread, so training can keep
+    updating the parameters while the snapshot is serialized.
+
+    Parameters
+    ---------
+    obj: Any
+        state_dict, or dict/list/tuple nesting tensors and python values
+
+    Returns
+    -------
+    snapshot: Any
+        Same structure with every tensor copied to CPU
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, snapshot_state(value))
+                         for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_state(value) for value in obj)
+    return obj
+
+
+def write_checkpoint(state: Dict[str, Any],
+                     model_dir: str,
+                     ckpt_name: str = 'checkpoint',
+                     max_checkpoints_to_keep: int = 1) -> str:
+    """
+    Write a checkpoint atomically, rotating older ones like deepchem's
+    ``TorchModel.save_checkpoint``
+
+    The newest checkpoint is ``<ckpt_name>1.pt``, older ones are renamed
+    to ``<ckpt_name>2.pt`` ... up to ``max_checkpoints_to_keep``. The file
+    is written under a temporary name and moved into place with
+    ``os.replace``, so readers never see a partial checkpoint.
+
+    Parameters
+    ---------
+    state: Dict[str, Any]
+        Checkpoint content
+    model_dir: str
+        Directory to write the checkpoint in
+    ckpt_name: str
+        Checkpoint file name prefix
+    max_checkpoints_to_keep: int
+        Number of checkpoints to keep
+
+    Returns
+    -------
+    path: str
+        Path of the new checkpoint
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    temp_file: str = os.path.join(model_dir,
+                                  f'.{ckpt_name}_{uuid.uuid4().hex}.pt.tmp')
+    torch.save(state, temp_file)
+
+    paths = [
+        os.path.join(model_dir, f'{ckpt_name}%d.pt' % (i + 1))
+        for i in range(max_checkpoints_to_keep)
+    ]
+    if os.path.exists(paths[-1]):
+        os.remove(paths[-1])
+    for i in reversed(range(max_checkpoints_to_keep - 1)):
+        if os.path.exists(paths[i]):
+            os.rename(paths[i], paths[i + 1])
+    os.replace(temp_file, paths[0])
+    return paths[0]
+
+
+class CheckpointWriter(object):
+    """
+    Write checkpoints on a background thread.
+
+    ``torch.save`` of the model and optimizer state, followed by the
+    rename chain of checkpoint rotation, stalls the training loop on slow
+    disks. ``save`` only copies the state to CPU memory and queues it, a
+    daemon thread serializes and writes it with ``write_checkpoint``.
+
+    The queue is bounded: a save to a checkpoint that still has an
+    unwritten snapshot replaces that snapshot (only the newest state is
+    worth writing), so the queue holds at most one snapshot per
+    checkpoint name. Only when ``max_pending`` different checkpoints are
+    waiting does ``save`` block until one is written.
+
+    A write error is logged and raised by the next ``flush`` or ``save``.
+
+    Example
+    -------
+    >>> writer = CheckpointWriter()
+    >>> model = MPNNPOMModel(..., checkpoint_writer=writer)
+    >>> model.fit(dataset, nb_epoch=10)  # checkpoints written in background
+    >>> writer.flush()  # checkpoints are on disk
+    """
+
+    def __init__(self, max_pending: int = 2):
+        """
+        Parameters
+        ----------
+        max_pending: int
+            Maximum number of snapshots waiting to be written
+        """
+        self.max_pending: int = max_pending
+        self._pending: OrderedDict = OrderedDict()
+        self._writing: Optional[Tuple[str, str]] = None
+        self._error: Optional[BaseException] = None
+        self._closed: bool = False
+        self._condition: threading.Condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def save(self,
+             state: Dict[str, Any],
+             model_dir: str,
+             ckpt_name: str = 'checkpoint',
+             max_checkpoints_to_keep: int = 1) -> None:
+        """
+        Snapshot a checkpoint and queue it for writing
+
+        Parameters
+        ---------
+        state: Dict[str, Any]
+            Checkpoint content, e.g. ``{'model_state_dict': ...}``
+        model_dir: str
+            Directory to write the checkpoint in
+        ckpt_name: str
+            Checkpoint file name prefix
+        max_checkpoints_to_keep: int
+            Number of checkpoints to keep
+        """
+        snapshot: Dict[str, Any] = snapshot_state(state)
+        key: Tuple[str, str] = (os.path.abspath(model_dir), ckpt_name)
+        with self._condition:
+            self._raise_error()
+            if self._closed:
+                raise RuntimeError("CheckpointWriter is closed")
+            if key in self._pending:
+                logger.debug("Replacing unwritten checkpoint %s/%s" % key)
+            else:
+                while len(self._pending) >= self.max_pending:
+                    self._condition.wait()
+            self._pending[key] = (snapshot, max_checkpoints_to_keep)
+            self._start()
+            self._condition.notify_all()
+
+    def flush(self, model_dir: Optional[str] = None) -> None:
+        """
+        Wait until queued checkpoints are written
+
+        Parameters
+        ---------
+        model_dir: Optional[str]
+            Only wait for the checkpoints of this directory
+        """
+        directory: Optional[str] = None if model_dir is None else \
+            os.path.abspath(model_dir)
+
+        def busy() -> bool:
+            keys = list(self._pending)
+            if self._writing is not None:
+                keys.append(self._writing)
+            return any(directory is None or key[0] == directory
+                       for key in keys)
+
+        with self._condition:
+            while busy():
+                self._condition.wait()
+            self._raise_error()
+
+    def close(self) -> None:
+        """Write the queued checkpoints and stop the writer thread"""
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name='checkpoint-writer',
+                                            daemon=True)
+            self._thread.start()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Checkpoint write failed: {error}") from error
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                key, (snapshot, max_checkpoints_to_keep) = \
+                    self._pending.popitem(last=False)
+                self._writing = key
+                self._condition.notify_all()
+            try:
+                write_checkpoint(snapshot, key[0], key[1],
+                                 max_checkpoints_to_keep)
+            except Exception as e:
+                logger.error("Failed to write checkpoint %s/%s: %s" %
+                             (key[0], key[1], e))
+                with self._condition:
+                    self._error = e
+            finally:
+                with self._condition:
+                    self._writing = None
+                    self._condition.notify_all()
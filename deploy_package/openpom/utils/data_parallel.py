@@ -0,0 +1,430 @@
+import os
+import pickle
+import shutil
+import logging
+import datetime
+import tempfile
+import multiprocessing
+from collections import deque
+import numpy as np
+import torch
+import torch.distributed as dist
+from typing import (Any, Callable, Deque, Dict, Iterable, List, Optional,
+                    Tuple)
+from deepchem.data import Dataset, DiskDataset
+from deepchem.models import TorchModel
+from openpom.utils.checkpoint import snapshot_state
+
+logger = logging.getLogger(__name__)
+
+Batch = Tuple[List, List, List]
+
+
+def shard_batches(batches: Iterable[Batch], rank: int, world_size: int,
+                  fractions: Deque[float]) -> Iterable[Batch]:
+    """
+    Split every batch of a generator between the ranks of a process group
+
+    Rank ``rank`` gets a contiguous slice of each batch, and the size of
+    the slice over the size of the batch, the weight of its gradient in
+    the all-reduce, is appended to ``fractions``. Batches may be prepared
+    ahead of training, so the optimizer pops the weights in order. Batches with
+    fewer than two molecules per rank (BatchNorm needs two) are not split,
+    every rank computes them with a weight of ``1 / world_size``.
+
+    Parameters
+    ----------
+    batches: Iterable[Batch]
+        ([inputs], [labels], [weights]) batches, the same on every rank
+    rank: int
+        Rank of this process
+    world_size: int
+        Number of processes
+    fractions: Deque[float]
+        Queue the gradient weight of each slice is appended to
+
+    Returns
+    -------
+    batches: Iterable[Batch]
+        The slices of this rank
+    """
+    for inputs, labels, weights in batches:
+        size: int = len(inputs[0])
+        if size < 2 * world_size:
+            fractions.append(1.0 / world_size)
+            yield inputs, labels, weights
+            continue
+        bounds: np.ndarray = np.linspace(0, size,
+                                         world_size + 1).round().astype(int)
+        start, stop = bounds[rank], bounds[rank + 1]
+        fractions.append((stop - start) / size)
+        yield ([x[start:stop] for x in inputs],
+               [None if y is None else y[start:stop] for y in labels],
+               [None if w is None else w[start:stop] for w in weights])
+
+
+def all_reduce_gradients(params: List[torch.Tensor], scale: float) -> None:
+    """
+    Replace the gradients of every rank by their weighted sum over ranks
+
+    The gradients are flattened into one buffer so a single all-reduce is
+    sent per step.
+
+    Parameters
+    ----------
+    params: List[torch.Tensor]
+        Parameters, in the same order on every rank
+    scale: float
+        Weight of the gradients of this rank
+    """
+    grads: List[torch.Tensor] = [
+        param.grad for param in params if param.grad is not None
+    ]
+    if not grads:
+        return
+    flat: torch.Tensor = torch._utils._flatten_dense_tensors(grads)
+    flat.mul_(scale)
+    dist.all_reduce(flat)
+    for grad, reduced in zip(
+            grads, torch._utils._unflatten_dense_tensors(flat, grads)):
+        grad.copy_(reduced)
+
+
+def training_state(model: TorchModel) -> Dict[str, Any]:
+    """Weights, optimizer, learning rate schedule and step of a model"""
+    model._ensure_built()
+    state: Dict[str, Any] = {
+        'model_state_dict': model.model.state_dict(),
+        'optimizer_state_dict': model._pytorch_optimizer.state_dict(),
+        'global_step': model._global_step
+    }
+    if model._lr_schedule is not None:
+        state['lr_schedule_state_dict'] = model._lr_schedule.state_dict()
+    return snapshot_state(state)
+
+
+def load_training_state(model: TorchModel, state: Dict[str, Any]) -> None:
+    """Load the output of ``training_state`` into a model"""
+    model._ensure_built()
+    model.model.load_state_dict(state['model_state_dict'])
+    model._pytorch_optimizer.load_state_dict(state['optimizer_state_dict'])
+    model._global_step = state['global_step']
+    if model._lr_schedule is not None and \
+            'lr_schedule_state_dict' in state:
+        model._lr_schedule.load_state_dict(state['lr_schedule_state_dict'])
+
+
+def fit_shard(model: TorchModel,
+              dataset: Dataset,
+              nb_epoch: int,
+              rank: int,
+              world_size: int,
+              seed: int,
+              deterministic: bool = False,
+              max_checkpoints_to_keep: int = 5,
+              checkpoint_interval: int = 0) -> float:
+    """
+    Train the replica of one rank on its slices of the batches
+
+    Every rank iterates the same batches (the shuffling is seeded with
+    ``seed``), trains on its slice, and the gradients are all-reduced
+    before each optimizer step. The replicas stay identical and each step
+    is the step single process training takes on the whole batch.
+
+    Returns
+    -------
+    loss: float
+        Average loss of this rank, as returned by ``TorchModel.fit``
+    """
+    model._ensure_built()
+    params: List[torch.Tensor] = list(model.model.parameters())
+    fractions: Deque[float] = deque()
+
+    def all_reduce(optimizer, args, kwargs) -> None:
+        all_reduce_gradients(params, fractions.popleft())
+
+    np.random.seed(seed)
+    batches: Iterable[Batch] = shard_batches(
+        model.default_generator(dataset,
+                                epochs=nb_epoch,
+                                deterministic=deterministic), rank,
+        world_size, fractions)
+    # slices are collated on the background threads of the model
+    prefetch_batches = getattr(model, 'prefetch_batches', None)
+    if prefetch_batches is not None:
+        batches = prefetch_batches(batches)
+    handle = model._pytorch_optimizer.register_step_pre_hook(all_reduce)
+    try:
+        return model.fit_generator(
+            batches,
+            max_checkpoints_to_keep=max_checkpoints_to_keep,
+            checkpoint_interval=checkpoint_interval)
+    finally:
+        handle.remove()
+
+
+def _check_all_ranks(ok: bool) -> bool:
+    """Whether every rank is ok, a collective call"""
+    flag: torch.Tensor = torch.tensor([1.0 if ok else 0.0])
+    dist.all_reduce(flag, op=dist.ReduceOp.MIN)
+    return bool(flag.item() == 1.0)
+
+
+def _worker(rank: int, world_size: int, init_method: str, threads: int,
+            timeout: float, commands, results) -> None:
+    """Replica process of a DataParallelTrainer"""
+    torch.set_num_threads(threads)
+    dist.init_process_group('gloo',
+                            init_method=init_method,
+                            rank=rank,
+                            world_size=world_size,
+                            timeout=datetime.timedelta(seconds=timeout))
+    model: Optional[TorchModel] = None
+    builder_key: Optional[bytes] = None
+    try:
+        while True:
+            command = commands.get()
+            if command is None:
+                break
+            builder, state, dataset, kwargs = command
+            error: Optional[str] = None
+            try:
+                key: bytes = pickle.dumps(builder)
+                if model is None or key != builder_key:
+                    model, builder_key = builder(), key
+                if isinstance(dataset, str):
+                    dataset = DiskDataset(dataset)
+                load_training_state(model, state)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            if not _check_all_ranks(error is None):
+                results.put((rank, None, error or "another rank failed"))
+                continue
+            try:
+                loss: Optional[float] = fit_shard(model, dataset, rank=rank,
+                                                  world_size=world_size,
+                                                  **kwargs)
+            except Exception as e:
+                loss, error = None, f"{type(e).__name__}: {e}"
+            results.put((rank, loss, error))
+    finally:
+        dist.destroy_process_group()
+
+
+class DataParallelTrainer(object):
+    """
+    Synchronous data parallel training of a deepchem TorchModel on CPU.
+
+    Small molecular graph batches do not scale over intra-op threads, so
+    the batch is split over processes instead. The calling process is rank
+    0 and trains the model it passes to ``fit``; ``n_workers - 1`` replica
+    processes are spawned once and kept for all ``fit`` calls. Gradients
+    are all-reduced with the gloo backend before every optimizer step.
+
+    The batch size is the global batch size: every step consumes
+    ``model.batch_size`` molecules split over the processes, so an epoch
+    has as many steps as in single process training. Step based learning
+    rate schedules (e.g. ``ExponentialDecay``) and the loss scale are
+    unchanged, and training matches single process training up to float
+    rounding, dropout masks and BatchNorm statistics, which are computed
+    per process.
+
+    Checkpoints are only written by rank 0, from the model passed to
+    ``fit``, so they are ordinary deepchem checkpoints. The replicas load
+    the weights, optimizer and schedule state of that model at the start
+    of every ``fit`` call, so it can be restored or modified in between.
+
+    Example
+    -------
+    >>> builder = functools.partial(MPNNPOMModel, n_tasks=138, ...)
+    >>> model = builder()
+    >>> with DataParallelTrainer(n_workers=4) as trainer:
+    ...     for epoch in range(10):
+    ...         loss = trainer.fit(model, builder, dataset, nb_epoch=1)
+    ...         score = evaluate(model)
+    """
+
+    def __init__(self,
+                 n_workers: int,
+                 threads_per_worker: Optional[int] = None,
+                 timeout: float = 1800.0):
+        """
+        Parameters
+        ----------
+        n_workers: int
+            Number of processes, including the calling process
+        threads_per_worker: Optional[int]
+            Torch threads per process, default to cpu_count // n_workers
+        timeout: float
+            Seconds a collective waits for the other processes before
+            failing, e.g. when a replica process died
+        """
+        if n_workers < 1:
+            raise ValueError("n_workers must be at least 1")
+        self.n_workers: int = n_workers
+        self.threads_per_worker: int = threads_per_worker or max(
+            1, (os.cpu_count() or 1) // n_workers)
+        self.timeout: float = timeout
+        self._processes: List = []
+        self._commands: List = []
+        self._results = None
+        self._init_dir: Optional[str] = None
+
+    def __enter__(self) -> 'DataParallelTrainer':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def start(self) -> None:
+        """Spawn the replica processes and join the process group"""
+        if self._processes or self.n_workers == 1:
+            return
+        context = multiprocessing.get_context('spawn')
+        self._init_dir = tempfile.mkdtemp(prefix='openpom_dp_')
+        init_method: str = 'file://' + os.path.join(self._init_dir, 'store')
+        self._results = context.Queue()
+        for rank in range(1, self.n_workers):
+            commands = context.Queue()
+            process = context.Process(target=_worker,
+                                      args=(rank, self.n_workers,
+                                            init_method,
+                                            self.threads_per_worker,
+                                            self.timeout, commands,
+                                            self._results),
+                                      name=f'data-parallel-{rank}',
+                                      daemon=True)
+            process.start()
+            self._commands.append(commands)
+            self._processes.append(process)
+        dist.init_process_group(
+            'gloo',
+            init_method=init_method,
+            rank=0,
+            world_size=self.n_workers,
+            timeout=datetime.timedelta(seconds=self.timeout))
+        logger.info("Started %d data parallel replicas" %
+                    (self.n_workers - 1))
+
+    def fit(self,
+            model: TorchModel,
+            model_builder: Callable[[], TorchModel],
+            dataset: Dataset,
+            nb_epoch: int = 10,
+            max_checkpoints_to_keep: int = 5,
+            checkpoint_interval: int = 1000,
+            deterministic: bool = False,
+            restore: bool = False) -> float:
+        """
+        Train a model on a dataset, like ``TorchModel.fit``
+
+        Parameters
+        ----------
+        model: TorchModel
+            Model to train, in this process
+        model_builder: Callable[[], TorchModel]
+            Picklable function building a model with the architecture of
+            ``model``, called in the replica processes
+        dataset: Dataset
+            Training data. A DiskDataset is reopened from its directory by
+            the replicas, other datasets are pickled to them.
+        nb_epoch: int
+            the number of epochs to train for
+        max_checkpoints_to_keep: int
+            the maximum number of checkpoints to keep
+        checkpoint_interval: int
+            the frequency at which to write checkpoints, measured in
+            training steps. Set this to 0 to disable automatic
+            checkpointing.
+        deterministic: bool
+            if True, the samples are processed in order
+        restore: bool
+            if True, restore the model from the most recent checkpoint
+            first
+
+        Returns
+        -------
+        loss: float
+            The average loss over the processes of the last logged steps
+        """
+        if restore:
+            model.restore()
+        seed: int = np.random.randint(2**31)
+        kwargs: Dict[str, Any] = dict(
+            nb_epoch=nb_epoch,
+            seed=seed,
+            deterministic=deterministic,
+            max_checkpoints_to_keep=max_checkpoints_to_keep)
+        if self.n_workers == 1:
+            return fit_shard(model, dataset, rank=0, world_size=1,
+                             checkpoint_interval=checkpoint_interval,
+                             **kwargs)
+
+        self.start()
+        state: Dict[str, Any] = training_state(model)
+        reference = dataset.data_dir if isinstance(dataset,
+                                                   DiskDataset) else dataset
+        for commands in self._commands:
+            commands.put((model_builder, state, reference,
+                          dict(kwargs, checkpoint_interval=0)))
+        if not _check_all_ranks(True):
+            self._collect()
+            raise RuntimeError("Data parallel replicas failed to start")
+
+        threads: int = torch.get_num_threads()
+        torch.set_num_threads(self.threads_per_worker)
+        try:
+            loss: float = fit_shard(model,
+                                    dataset,
+                                    rank=0,
+                                    world_size=self.n_workers,
+                                    checkpoint_interval=checkpoint_interval,
+                                    **kwargs)
+        except Exception:
+            # the replicas are left waiting in a collective, start over
+            self.close(terminate=True)
+            raise
+        finally:
+            torch.set_num_threads(threads)
+        losses: List[float] = [loss] + self._collect()
+        return float(np.mean(losses))
+
+    def _collect(self) -> List[float]:
+        """Wait for the result of every replica, raise their errors"""
+        losses: List[float] = []
+        errors: List[str] = []
+        for _ in self._processes:
+            rank, loss, error = self._results.get()
+            if error is not None:
+                errors.append(f"rank {rank}: {error}")
+            else:
+                losses.append(loss)
+        if errors:
+            raise RuntimeError("Data parallel training failed, " +
+                               "; ".join(errors))
+        return losses
+
+    def close(self, terminate: bool = False) -> None:
+        """
+        Stop the replica processes and leave the process group
+
+        Parameters
+        ----------
+        terminate: bool
+            Kill the replicas instead of waiting for their current command
+        """
+        if not self._processes:
+            return
+        for commands in self._commands:
+            commands.put(None)
+        for process in self._processes:
+            if not terminate:
+                process.join(timeout=self.timeout)
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        dist.destroy_process_group()
+        if self._init_dir is not None:
+            shutil.rmtree(self._init_dir, ignore_errors=True)
+        self._processes, self._commands = [], []
+        self._results, self._init_dir = None, None
@@ -1,9 +1,11 @@
+import shutil
+import itertools
+import weakref
 import tempfile
 import pandas as pd
 import numpy as np
-from typing import List, Optional, Tuple, Iterator
-from deepchem.data.datasets import DiskDataset, NumpyDataset
-from skmultilearn.model_selection import IterativeStratification
+from typing import Dict, List, Optional, Sequence, Tuple
+from deepchem.data.datasets import Dataset, DiskDataset, NumpyDataset
 from deepchem.splits import Splitter
 
 
@@ -43,6 +45,170 @@ def get_class_imbalance_ratio(dataset: DiskDataset) -> List:
     return class_imbalance_ratio
 
 
+def _combination_positions(n_labels: int, order: int) -> np.ndarray:
+    """Positions of the order-th label combinations (with repetition)
+    of a sample with n_labels labels, (n_combinations, order) array"""
+    return np.array(list(
+        itertools.combinations_with_replacement(range(n_labels), order)),
+                    dtype=np.int64).reshape(-1, order)
+
+
+def iterative_stratification(y: np.ndarray,
+                             fractions: Sequence[float],
+                             order: int = 2,
+                             seed: Optional[int] = None) -> List[np.ndarray]:
+    """
+    Iterative stratification of a multi-label matrix into parts
+
+    NumPy implementation of the iterative stratification of Sechidis et
+    al. extended to label combinations by Szymanski and Kajdanowicz: the
+    label combination (all order-th combinations of the labels of a
+    sample, with repetition, so order 2 covers single labels and pairs)
+    with the fewest unassigned samples is distributed first. Each of its
+    samples goes to the part with the largest relative shortfall
+    (missing count over the count of the combination) summed over all the
+    combinations of the sample and the part size, rather than the
+    shortfall of the current combination only, which balances single
+    labels and part sizes better on sparse 138 label data. Ties are
+    broken at random.
+    Samples without labels fill the parts up to their sizes.
+
+    Rows are bit-packed to group samples with the same label set, whose
+    combinations are enumerated once. The desired counts of every
+    (combination, part) are kept in one array and updated with a fancy
+    indexed subtraction per assigned sample.
+
+    Parameters
+    ---------
+    y: np.ndarray
+        (n_samples, n_tasks) binary label matrix
+    fractions: Sequence[float]
+        Fraction of the samples in each part
+    order: int
+        Order of the label combinations to stratify (default: 2)
+    seed: Optional[int]
+        Random seed of the tie breaks, None to use the numpy random state
+
+    Returns
+    -------
+    parts: List[np.ndarray]
+        Sorted row indices of each part
+
+    References
+    ----------
+    .. Sechidis K. et al. "On the Stratification of Multi-label Data"
+       ECML PKDD (2011)
+    .. Szymanski P., Kajdanowicz T. "A Network Perspective on
+       Stratification of Multi-Label Data" LIDTA (2017)
+    """
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    labels: np.ndarray = np.asarray(y) > 0
+    n_samples, n_tasks = labels.shape
+    fractions = np.asarray(fractions, dtype=np.float64)
+    n_parts: int = len(fractions)
+    if n_samples == 0:
+        return [np.array([], dtype=np.int64) for _ in range(n_parts)]
+
+    # samples with the same label set share their combinations
+    packed: np.ndarray = np.packbits(labels, axis=1)
+    unique_rows: np.ndarray
+    row_of_sample: np.ndarray
+    unique_rows, row_of_sample = np.unique(packed,
+                                           axis=0,
+                                           return_inverse=True)
+    row_of_sample = row_of_sample.reshape(-1)
+    unique_labels: np.ndarray = np.unpackbits(unique_rows,
+                                              axis=1)[:, :n_tasks]
+
+    positions: Dict[int, np.ndarray] = {}
+    row_combinations: List[np.ndarray] = []
+    for row in unique_labels:
+        row_label_indices: np.ndarray = np.flatnonzero(row)
+        n: int = len(row_label_indices)
+        if n not in positions:
+            positions[n] = _combination_positions(n, order)
+        combinations: np.ndarray = row_label_indices[positions[n]]
+        row_combinations.append(
+            np.ravel_multi_index(combinations.T, (n_tasks,) * order)
+            if len(combinations) else np.zeros(0, dtype=np.int64))
+    row_ptr: np.ndarray = np.concatenate(
+        [[0], np.cumsum([len(c) for c in row_combinations])])
+    combination_ids: np.ndarray
+    row_combination_index: np.ndarray
+    combination_ids, row_combination_index = np.unique(
+        np.concatenate(row_combinations), return_inverse=True)
+    n_combinations: int = len(combination_ids)
+
+    # samples of every unique row, and unique rows of every combination
+    sample_order: np.ndarray = np.argsort(row_of_sample, kind='stable')
+    sample_ptr: np.ndarray = np.concatenate(
+        [[0], np.cumsum(np.bincount(row_of_sample,
+                                    minlength=len(unique_rows)))])
+    rows_of_combination_order: np.ndarray = np.argsort(row_combination_index,
+                                                       kind='stable')
+    row_of_combination_entry: np.ndarray = np.repeat(
+        np.arange(len(unique_rows)), np.diff(row_ptr))
+    combination_rows: np.ndarray = \
+        row_of_combination_entry[rows_of_combination_order]
+    combination_ptr: np.ndarray = np.concatenate(
+        [[0], np.cumsum(np.bincount(row_combination_index,
+                                    minlength=n_combinations))])
+
+    remaining: np.ndarray = np.bincount(
+        row_combination_index,
+        weights=np.diff(sample_ptr)[row_of_combination_entry],
+        minlength=n_combinations)
+    desired: np.ndarray = remaining[:, None] * fractions[None, :]
+    inverse_counts: np.ndarray = 1.0 / remaining
+    desired_samples: np.ndarray = fractions * n_samples
+    part_of_sample: np.ndarray = np.full(n_samples, -1, dtype=np.int64)
+    # random tie break between combinations with as many samples
+    tie_break: np.ndarray = rng.random_sample(n_combinations)
+
+    while n_combinations:
+        key: np.ndarray = np.where(remaining > 0, remaining + tie_break,
+                                   np.inf)
+        combination: int = int(np.argmin(key))
+        if not np.isfinite(key[combination]):
+            break
+        rows: np.ndarray = combination_rows[
+            combination_ptr[combination]:combination_ptr[combination + 1]]
+        samples: np.ndarray = np.concatenate(
+            [sample_order[sample_ptr[r]:sample_ptr[r + 1]] for r in rows])
+        samples = samples[part_of_sample[samples] < 0]
+        for sample in rng.permutation(samples):
+            row: int = row_of_sample[sample]
+            sample_combinations: np.ndarray = \
+                row_combination_index[row_ptr[row]:row_ptr[row + 1]]
+            shortfall: np.ndarray = (
+                inverse_counts[sample_combinations] @
+                desired[sample_combinations] + len(sample_combinations) *
+                desired_samples / n_samples) / fractions
+            parts: np.ndarray = np.flatnonzero(shortfall == shortfall.max())
+            part: int = parts[0] if len(parts) == 1 else rng.choice(parts)
+            desired[sample_combinations, part] -= 1
+            remaining[sample_combinations] -= 1
+            desired_samples[part] -= 1
+            part_of_sample[sample] = part
+
+    # samples without labels fill the parts up to their sizes
+    unlabeled: np.ndarray = rng.permutation(
+        np.flatnonzero(part_of_sample < 0))
+    if len(unlabeled):
+        need: np.ndarray = np.maximum(desired_samples, 0)
+        if need.sum() == 0:
+            need = fractions.copy()
+        quota: np.ndarray = need * len(unlabeled) / need.sum()
+        counts: np.ndarray = np.floor(quota).astype(np.int64)
+        extra: np.ndarray = np.argsort(counts - quota,
+                                       kind='stable')[:len(unlabeled) -
+                                                      counts.sum()]
+        counts[extra] += 1
+        part_of_sample[unlabeled] = np.repeat(np.arange(n_parts), counts)
+
+    return [np.flatnonzero(part_of_sample == part) for part in range(n_parts)]
+
+
 class IterativeStratifiedSplitter(Splitter):
     """
     Iteratively stratify a multi-label data set into folds/splits.
@@ -51,26 +217,63 @@ class IterativeStratifiedSplitter(Splitter):
     trying to maintain balanced representation with respect to
     order-th label combinations.
 
+    The stratification only reads the label matrix ``dataset.y``:
+    ``split`` and ``k_fold_indices`` return index arrays without touching
+    the features or writing to disk. The dataset splits select these
+    indices into DiskDatasets, written to the given directories or to
+    temporary directories removed with the returned datasets, or, with
+    ``in_memory=True``, into NumpyDataset views sharing the feature
+    objects of the dataset.
+
     Available splits:
         - train_valid_test_split()
         - train_test_split()
+        - k_fold_split()
 
-    Note:
-        Requires `skmultilearn` library to be installed.
+    The stratification runs on the bit-packed label matrix with
+    ``iterative_stratification``, without `skmultilearn`.
     """
 
-    def __init__(self, order: int = 2) -> None:
+    def __init__(self, order: int = 2, in_memory: bool = False) -> None:
         """
         Parameters
         ---------
         order: int
             order for iterative stratification (default: 2)
+        in_memory: bool
+            return NumpyDataset views instead of DiskDatasets when no
+            directory is given (default: False)
         """
         self.order: int = order
+        self.in_memory: bool = in_memory
+
+    def stratify(self,
+                 y: np.ndarray,
+                 fractions: Sequence[float],
+                 seed: Optional[int] = None) -> List[np.ndarray]:
+        """
+        Split the rows of a label matrix into stratified parts
+
+        Parameters
+        ----------
+        y: np.ndarray
+            (n_samples, n_tasks) binary label matrix
+        fractions: Sequence[float]
+            Fraction of the samples in each part
+        seed: int, optional (default None)
+            Random seed of the tie breaks, None to use the numpy
+            random state
+
+        Returns
+        -------
+        List[np.ndarray]
+            Sorted row indices of each part
+        """
+        return iterative_stratification(y, fractions, self.order, seed)
 
     def split(
         self,
-        dataset: DiskDataset,
+        dataset: Dataset,
         frac_train: float = 0.8,
         frac_valid: float = 0.1,
         frac_test: float = 0.1,
@@ -80,6 +283,9 @@ class IterativeStratifiedSplitter(Splitter):
         """
         Return indices for iterative stratified split
 
+        The train part is stratified against the rest first, the rest is
+        then stratified into the validation and test parts.
+
         Parameters
         ----------
         dataset: dc.data.Dataset
@@ -102,92 +308,212 @@ class IterativeStratifiedSplitter(Splitter):
             A tuple `(train_indices, valid_indices, test_indices)`
             for the various splits.
         """
-        X1: pd.DataFrame
-        y1: pd.DataFrame
-        X1, y1 = pd.DataFrame(dataset.X), pd.DataFrame(dataset.y)
-        stratifier1: IterativeStratification = IterativeStratification(
-            n_splits=2,
-            order=self.order,
-            sample_distribution_per_fold=[frac_test + frac_valid, frac_train],
-            # shuffle=True,
-            random_state=seed,
-        )
-
-        train_indices: np.ndarray
+        y: np.ndarray = dataset.y
         other_indices: np.ndarray
-        train_indices, other_indices = next(stratifier1.split(X1, y1))
-
-        temp_dir: str = tempfile.mkdtemp()
-        other_dataset: DiskDataset = dataset.select(other_indices.tolist(),
-                                                    temp_dir)
+        train_indices: np.ndarray
+        other_indices, train_indices = self.stratify(
+            y, [frac_test + frac_valid, frac_train], seed)
+        if frac_valid == 0 or frac_test == 0:
+            empty: np.ndarray = np.array([], dtype=other_indices.dtype)
+            if frac_valid == 0:
+                return train_indices, empty, other_indices
+            return train_indices, other_indices, empty
 
-        X2: pd.DataFrame
-        y2: pd.DataFrame
-        X2, y2 = pd.DataFrame(other_dataset.X), pd.DataFrame(other_dataset.y)
         new_split_ratio: float = round(frac_test / (frac_test + frac_valid), 2)
-        stratifier2: IterativeStratification = IterativeStratification(
-            n_splits=2,
-            order=self.order,
-            sample_distribution_per_fold=[
-                new_split_ratio, 1 - new_split_ratio
-            ],
-            random_state=seed,
-        )
-
-        valid_indices: np.ndarray
-        test_indices: np.ndarray
-        valid_indices, test_indices = next(stratifier2.split(X2, y2))
-        return train_indices, valid_indices, test_indices
-
-    def k_fold_split(
-        self,
-        dataset: DiskDataset,
-        k: int,
-        directories: Optional[List[str]] = None
-    ) -> List[Tuple[DiskDataset, DiskDataset]]:
+        test_part: np.ndarray
+        valid_part: np.ndarray
+        test_part, valid_part = self.stratify(
+            y[other_indices], [new_split_ratio, 1 - new_split_ratio], seed)
+        # parts of the second split index the rows of the rest
+        return (train_indices, other_indices[valid_part],
+                other_indices[test_part])
+
+    def k_fold_indices(
+            self,
+            dataset: Dataset,
+            k: int,
+            seed: Optional[int] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Return indices for an iterative stratified k-fold split
+
+        Parameters
+        ----------
+        dataset: dc.data.Dataset
+            Dataset to be split, only its labels are read
+        k: int
+            Number of folds (k>1)
+        seed: int, optional (default None)
+            Random seed to use.
+
+        Returns
+        -------
+        List[Tuple[np.ndarray, np.ndarray]]
+            List of k `(train_indices, cv_indices)` tuples
+        """
+        assert k > 1
+        folds: List[np.ndarray] = self.stratify(dataset.y, [1 / k] * k, seed)
+        return [(np.sort(np.concatenate(folds[:i] + folds[i + 1:])), fold)
+                for i, fold in enumerate(folds)]
+
+    def train_valid_test_split(self,
+                               dataset: Dataset,
+                               train_dir: Optional[str] = None,
+                               valid_dir: Optional[str] = None,
+                               test_dir: Optional[str] = None,
+                               frac_train: float = 0.8,
+                               frac_valid: float = 0.1,
+                               frac_test: float = 0.1,
+                               seed: Optional[int] = None,
+                               log_every_n: int = 1000
+                               ) -> Tuple[Dataset, Dataset, Dataset]:
         """
+        Split a dataset into train, validation and test datasets
+
         Parameters
         ----------
-        dataset: DiskDataset
-            DiskDataset to do a k-fold split
+        dataset: dc.data.Dataset
+            Dataset to be split.
+        train_dir: str, optional (default None)
+            Directory to write the train dataset to
+        valid_dir: str, optional (default None)
+            Directory to write the validation dataset to
+        test_dir: str, optional (default None)
+            Directory to write the test dataset to
+        frac_train: float, optional (default 0.8)
+            The fraction of data to be used for the training split.
+        frac_valid: float, optional (default 0.1)
+            The fraction of data to be used for the validation split.
+        frac_test: float, optional (default 0.1)
+            The fraction of data to be used for the test split.
+        seed: int, optional (default None)
+            Random seed to use.
+        log_every_n: int, optional (default 1000)
+            Unused, for compatibility with deepchem splitters.
+
+        Returns
+        -------
+        Tuple[Dataset, Dataset, Dataset]
+            A tuple of train, valid and test datasets.
+        """
+        train_indices, valid_indices, test_indices = self.split(
+            dataset,
+            frac_train=frac_train,
+            frac_valid=frac_valid,
+            frac_test=frac_test,
+            seed=seed)
+        return (self.select(dataset, train_indices, train_dir),
+                self.select(dataset, valid_indices, valid_dir),
+                self.select(dataset, test_indices, test_dir))
+
+    def train_test_split(self,
+                         dataset: Dataset,
+                         train_dir: Optional[str] = None,
+                         test_dir: Optional[str] = None,
+                         frac_train: float = 0.8,
+                         seed: Optional[int] = None,
+                         **kwargs) -> Tuple[Dataset, Dataset]:
+        """
+        Split a dataset into train and test datasets
+
+        Parameters
+        ----------
+        dataset: dc.data.Dataset
+            Dataset to be split.
+        train_dir: str, optional (default None)
+            Directory to write the train dataset to
+        test_dir: str, optional (default None)
+            Directory to write the test dataset to
+        frac_train: float, optional (default 0.8)
+            The fraction of data to be used for the training split.
+        seed: int, optional (default None)
+            Random seed to use.
+
+        Returns
+        -------
+        Tuple[Dataset, Dataset]
+            A tuple of train and test datasets.
+        """
+        train_indices, _, test_indices = self.split(dataset,
+                                                    frac_train=frac_train,
+                                                    frac_valid=0.,
+                                                    frac_test=1 - frac_train,
+                                                    seed=seed)
+        return (self.select(dataset, train_indices, train_dir),
+                self.select(dataset, test_indices, test_dir))
+
+    def k_fold_split(self,
+                     dataset: Dataset,
+                     k: int,
+                     directories: Optional[List[str]] = None,
+                     seed: Optional[int] = None,
+                     **kwargs) -> List[Tuple[Dataset, Dataset]]:
+        """
+        Parameters
+        ----------
+        dataset: dc.data.Dataset
+            Dataset to do a k-fold split
         k: int
             Number of folds to split `DiskDataset` into. (k>1)
         directories: List[str], optional (default None)
             List of length 2*k filepaths to save the result disk-datasets.
+        seed: int, optional (default None)
+            Random seed to use.
 
         Returns
         -------
-        List[Tuple[DiskDataset, DiskDataset]]
+        List[Tuple[Dataset, Dataset]]
             List of length k tuples of (train, cv)
-            where `train` and `cv` are both `DiskDataset`.
+            where `train` and `cv` are both `DiskDataset`, or both
+            `NumpyDataset` in memory mode without directories.
         """
         assert k != 1
-        if directories is None:
-            directories = [tempfile.mkdtemp() for _ in range(2 * k)]
-        else:
+        if directories is not None:
             assert len(directories) == 2 * k
+        else:
+            directories = [None] * (2 * k)
 
-        X: pd.DataFrame
-        y: pd.DataFrame
-        X, y = pd.DataFrame(dataset.X), pd.DataFrame(dataset.y)
-        stratifier: IterativeStratification = IterativeStratification(
-            n_splits=k,
-            order=self.order,
-        )
-
-        train_datasets: List = []
-        cv_datasets: List = []
-        split_gen: Iterator = stratifier.split(X, y)
-        for fold in range(k):
-            train_dir, cv_dir = directories[2 * fold], directories[2 * fold +
-                                                                   1]
-            train_indices: np.ndarray
-            cv_indices: np.ndarray
-            train_indices, cv_indices = next(split_gen)
-            train_dataset: DiskDataset = dataset.select(
-                train_indices.tolist(), train_dir)
-            cv_dataset: DiskDataset = dataset.select(cv_indices.tolist(),
-                                                     cv_dir)
-            train_datasets.append(train_dataset)
-            cv_datasets.append(cv_dataset)
-        return list(zip(train_datasets, cv_datasets))
+        folds: List[Tuple[Dataset, Dataset]] = []
+        for fold, (train_indices, cv_indices) in enumerate(
+                self.k_fold_indices(dataset, k, seed)):
+            folds.append(
+                (self.select(dataset, train_indices, directories[2 * fold]),
+                 self.select(dataset, cv_indices, directories[2 * fold + 1])))
+        return folds
+
+    def select(self,
+               dataset: Dataset,
+               indices: np.ndarray,
+               directory: Optional[str] = None) -> Dataset:
+        """
+        Select samples of a dataset
+
+        Parameters
+        ----------
+        dataset: dc.data.Dataset
+            Dataset to select from
+        indices: np.ndarray
+            Indices of the samples
+        directory: str, optional (default None)
+            Directory to write the selected DiskDataset to. Without it,
+            a NumpyDataset view is returned in memory mode, or the
+            DiskDataset is written to a temporary directory that is
+            removed when the dataset is garbage collected.
+
+        Returns
+        -------
+        dc.data.Dataset
+            The selected samples
+        """
+        if directory is None and self.in_memory:
+            return NumpyDataset(dataset.X[indices],
+                                dataset.y[indices],
+                                dataset.w[indices],
+                                dataset.ids[indices],
+                                n_tasks=dataset.y.shape[1])
+        if directory is not None or not isinstance(dataset, DiskDataset):
+            return dataset.select(indices, directory)
+        temp_dir: str = tempfile.mkdtemp()
+        selected: DiskDataset = dataset.select(indices, temp_dir)
+        weakref.finalize(selected, shutil.rmtree, temp_dir, True)
+        return selected
@@ -0,0 +1,348 @@
+import os
+import json
+import uuid
+import pickle
+import shutil
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from deepchem.data import DiskDataset
+from deepchem.feat import Featurizer
+from deepchem.splits import Splitter
+
+logger = logging.getLogger(__name__)
+
+# cache format version, bump when the on-disk layout or the featurizer
+# output changes (2: float32 graph features)
+CACHE_VERSION: int = 2
+COMPLETE_FILE: str = 'cache_complete.json'
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Get sha256 hash of a file's content
+
+    Parameters
+    ---------
+    path: str
+        Path of the file
+    chunk_size: int
+        Number of bytes read at a time
+
+    Returns
+    -------
+    digest: str
+        Hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def featurizer_key(featurizer: Featurizer) -> str:
+    """
+    Get a key identifying a featurizer configuration
+
+    The key covers the featurizer class and its constructor attributes,
+    so e.g. ``GraphFeaturizer(is_adding_hs=True)`` gets its own cache.
+
+    Parameters
+    ---------
+    featurizer: Featurizer
+        Deepchem featurizer object
+
+    Returns
+    -------
+    key: str
+        Hex digest of the featurizer configuration
+    """
+    config: Dict[str, Any] = {
+        'class': type(featurizer).__module__ + '.' + type(featurizer).__name__,
+        'params': {
+            name: repr(value)
+            for name, value in sorted(vars(featurizer).items())
+        },
+        'version': CACHE_VERSION,
+    }
+    return _hash_json(config)
+
+
+def _hash_json(obj: Any) -> str:
+    """Hash of a json serializable object"""
+    return hashlib.sha256(
+        json.dumps(obj, sort_keys=True).encode()).hexdigest()[:24]
+
+
+class DatasetCache(object):
+    """
+    On-disk cache of featurized datasets and their k-fold splits.
+
+    Featurizing the curated CSV and re-splitting it into folds takes
+    longer than starting training on small search budgets, and the result
+    only depends on the CSV content and the featurizer. The cache stores:
+
+    - featurized rows, content-addressed by SMILES per featurizer
+      configuration, so appending molecules to a CSV only featurizes the
+      new rows;
+    - the assembled ``DiskDataset``, keyed by CSV content hash,
+      featurizer configuration, task list and SMILES/id columns;
+    - k-fold splits of a dataset, keyed by the dataset key, splitter,
+      k and seed.
+
+    Layout::
+
+        cache_dir/
+            rows/<featurizer_key>/shard_<uuid>.pkl
+            datasets/<dataset_key>/
+            folds/<folds_key>/fold_<i>_train/, fold_<i>_valid/
+
+    Every cache entry is written to a temporary location and marked
+    complete last, so an interrupted run never leaves a partial entry that
+    later runs would read.
+
+    Example
+    -------
+    >>> cache = DatasetCache('./.openpom_cache')
+    >>> dataset = cache.load_csv('data.csv', tasks, 'nonStereoSMILES',
+    ...                          GraphFeaturizer())
+    >>> folds = cache.k_fold_split(dataset, RandomStratifiedSplitter(), k=5,
+    ...                            seed=0)
+    """
+
+    def __init__(self, cache_dir: str):
+        """
+        Parameters
+        ----------
+        cache_dir: str
+            Directory to store the cache in
+        """
+        self.cache_dir: str = cache_dir
+        # dataset directory -> dataset key, to key fold splits
+        self._dataset_keys: Dict[str, str] = {}
+
+    def load_csv(self,
+                 csv_file: str,
+                 tasks: List[str],
+                 feature_field: str,
+                 featurizer: Featurizer,
+                 id_field: Optional[str] = None) -> DiskDataset:
+        """
+        Load a featurized dataset from a CSV file, equivalent to
+        ``CSVLoader(tasks, featurizer, feature_field, id_field)
+        .create_dataset(csv_file)``
+
+        Parameters
+        ----------
+        csv_file: str
+            Path of the CSV file
+        tasks: List[str]
+            Task columns
+        feature_field: str
+            Column with SMILES to featurize
+        featurizer: Featurizer
+            Featurizer to use
+        id_field: Optional[str]
+            Column with sample ids, default to feature_field
+
+        Returns
+        -------
+        dataset: DiskDataset
+            Featurized dataset. Rows that fail featurization are dropped.
+        """
+        id_field = id_field or feature_field
+        feat_key: str = featurizer_key(featurizer)
+        dataset_key: str = _hash_json({
+            'csv': file_hash(csv_file),
+            'featurizer': feat_key,
+            'tasks': list(tasks),
+            'feature_field': feature_field,
+            'id_field': id_field,
+        })
+        data_dir: str = os.path.join(self.cache_dir, 'datasets', dataset_key)
+        if _is_complete(data_dir):
+            logger.info("Loading cached dataset %s" % data_dir)
+            dataset = DiskDataset(data_dir)
+        else:
+            df: pd.DataFrame = pd.read_csv(csv_file)
+            features = self.featurize(df[feature_field].tolist(), featurizer,
+                                      feat_key)
+            valid: np.ndarray = np.array([f is not None for f in features],
+                                         dtype=bool)
+            df = df[valid]
+            y, w = _labels_and_weights(df, tasks)
+            _write_complete(
+                data_dir, lambda tmp_dir: DiskDataset.from_numpy(
+                    np.array([f for f in features if f is not None]),
+                    y,
+                    w,
+                    df[id_field].values,
+                    tasks=tasks,
+                    data_dir=tmp_dir))
+            dataset = DiskDataset(data_dir)
+        self._dataset_keys[os.path.abspath(dataset.data_dir)] = dataset_key
+        return dataset
+
+    def featurize(self,
+                  smiles: Sequence[str],
+                  featurizer: Featurizer,
+                  feat_key: Optional[str] = None) -> List[Any]:
+        """
+        Featurize molecules, reusing rows cached by earlier runs
+
+        Parameters
+        ----------
+        smiles: Sequence[str]
+            SMILES strings to featurize
+        featurizer: Featurizer
+            Featurizer to use
+        feat_key: Optional[str]
+            Precomputed featurizer key
+
+        Returns
+        -------
+        features: List[Any]
+            Features per molecule, None where featurization failed
+        """
+        feat_key = feat_key or featurizer_key(featurizer)
+        rows_dir: str = os.path.join(self.cache_dir, 'rows', feat_key)
+        rows: Dict[str, Any] = _load_rows(rows_dir)
+
+        missing: List[str] = list(
+            dict.fromkeys(s for s in smiles if s not in rows))
+        logger.info("Featurizing %d of %d molecules (%d cached)" %
+                    (len(missing), len(smiles), len(smiles) - len(missing)))
+        if missing:
+            new_rows: Dict[str, Any] = {}
+            for s, feature in zip(missing, featurizer.featurize(missing)):
+                # deepchem featurizers return an empty array on failure
+                new_rows[s] = None if np.array(feature).size == 0 else feature
+            _write_rows(rows_dir, new_rows)
+            rows.update(new_rows)
+        return [rows[s] for s in smiles]
+
+    def k_fold_split(self,
+                     dataset: DiskDataset,
+                     splitter: Splitter,
+                     k: int,
+                     seed: Optional[int] = None
+                     ) -> List[Tuple[DiskDataset, DiskDataset]]:
+        """
+        k-fold split of a dataset loaded by ``load_csv``, cached on disk
+
+        Parameters
+        ----------
+        dataset: DiskDataset
+            Dataset returned by ``load_csv``
+        splitter: Splitter
+            Deepchem splitter, e.g. ``RandomStratifiedSplitter()``
+        k: int
+            Number of folds
+        seed: Optional[int]
+            Random seed passed to the splitter. Splits are only cached
+            when a seed is given, otherwise every call draws new folds.
+
+        Returns
+        -------
+        folds: List[Tuple[DiskDataset, DiskDataset]]
+            List of k (train, valid) tuples
+        """
+        dataset_key: Optional[str] = self._dataset_keys.get(
+            os.path.abspath(dataset.data_dir))
+        if seed is None or dataset_key is None:
+            kwargs: Dict[str, Any] = {} if seed is None else {'seed': seed}
+            return splitter.k_fold_split(dataset, k, **kwargs)
+
+        folds_key: str = _hash_json({
+            'dataset': dataset_key,
+            'splitter': type(splitter).__module__ + '.' +
+                        type(splitter).__name__,
+            'splitter_params': {
+                name: repr(value)
+                for name, value in sorted(vars(splitter).items())
+            },
+            'k': k,
+            'seed': seed,
+        })
+        folds_dir: str = os.path.join(self.cache_dir, 'folds', folds_key)
+        names: List[str] = [
+            f'fold_{fold}_{part}' for fold in range(k)
+            for part in ('train', 'valid')
+        ]
+        if not _is_complete(folds_dir):
+            logger.info("Computing %d-fold split" % k)
+            _write_complete(
+                folds_dir, lambda tmp_dir: splitter.k_fold_split(
+                    dataset,
+                    k,
+                    directories=[os.path.join(tmp_dir, n) for n in names],
+                    seed=seed))
+        else:
+            logger.info("Loading cached %d-fold split %s" % (k, folds_dir))
+        datasets: List[DiskDataset] = [
+            DiskDataset(os.path.join(folds_dir, n)) for n in names
+        ]
+        return list(zip(datasets[0::2], datasets[1::2]))
+
+
+def _labels_and_weights(df: pd.DataFrame,
+                        tasks: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Labels and weights as built by deepchem's CSVLoader"""
+    y: np.ndarray = np.hstack(
+        [np.reshape(np.array(df[task].values), (-1, 1)) for task in tasks])
+    w: np.ndarray = np.ones((len(df), len(tasks)))
+    if y.dtype.kind in ['O', 'U']:
+        missing: np.ndarray = (y == '')
+        y[missing] = 0
+        w[missing] = 0
+    return y.astype(float), w.astype(float)
+
+
+def _load_rows(rows_dir: str) -> Dict[str, Any]:
+    """Load all cached row shards of a featurizer"""
+    rows: Dict[str, Any] = {}
+    if not os.path.isdir(rows_dir):
+        return rows
+    for name in sorted(os.listdir(rows_dir)):
+        if not name.endswith('.pkl'):
+            continue
+        try:
+            with open(os.path.join(rows_dir, name), 'rb') as f:
+                rows.update(pickle.load(f))
+        except Exception as e:
+            logger.warning("Skipping unreadable cache shard %s: %s" %
+                           (name, e))
+    return rows
+
+
+def _write_rows(rows_dir: str, rows: Dict[str, Any]) -> None:
+    """Write newly featurized rows as a new shard"""
+    os.makedirs(rows_dir, exist_ok=True)
+    path: str = os.path.join(rows_dir, f'shard_{uuid.uuid4().hex}.pkl')
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def _is_complete(path: str) -> bool:
+    return os.path.exists(os.path.join(path, COMPLETE_FILE))
+
+
+def _write_complete(path: str, write: Any) -> None:
+    """
+    Write a cache entry into a temporary directory with ``write(tmp_dir)``,
+    then move it into place and mark it complete
+    """
+    tmp_dir: str = f'{path}.tmp_{uuid.uuid4().hex}'
+    os.makedirs(tmp_dir)
+    write(tmp_dir)
+    with open(os.path.join(tmp_dir, COMPLETE_FILE), 'w') as f:
+        json.dump({'version': CACHE_VERSION}, f)
+    try:
+        os.replace(tmp_dir, path)
+    except OSError:
+        # another process wrote the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
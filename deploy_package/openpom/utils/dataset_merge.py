@@ -0,0 +1,391 @@
+import os
+import time
+import pickle
+import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set
+import numpy as np
+import pandas as pd
+from openpom.utils.dataset_cache import _hash_json, file_hash
+
+logger = logging.getLogger(__name__)
+
+# index format version, bump when the canonical SMILES change
+INDEX_VERSION: int = 1
+SMILES_FIELD: str = 'nonStereoSMILES'
+DESCRIPTORS_FIELD: str = 'descriptors'
+ODORLESS: str = 'odorless'
+
+
+class MergeSource(NamedTuple):
+    """
+    A labelled odor dataset to merge
+
+    Attributes
+    ----------
+    name: str
+        Name of the source in the provenance statistics
+    path: str
+        Path of the CSV file
+    smiles_field: str
+        SMILES column
+    descriptors_field: str
+        Column of the descriptors, separated by ``separator``
+    separator: str
+        Descriptor separator
+    """
+    name: str
+    path: str
+    smiles_field: str
+    descriptors_field: str
+    separator: str = ';'
+
+
+class MergeResult(NamedTuple):
+    """
+    Outcome of ``DatasetMerger.merge``
+
+    Attributes
+    ----------
+    dataset: pd.DataFrame
+        Merged dataset, a SMILES column, a descriptors column and one 0/1
+        column per task, like ``curated_GS_LF_merged_4983.csv``
+    stats: Dict[str, Any]
+        Provenance statistics
+    """
+    dataset: pd.DataFrame
+    stats: Dict[str, Any]
+
+
+def nonstereo_smiles(smiles: str) -> Optional[str]:
+    """
+    Canonical SMILES without stereochemistry, as built by the merge
+    notebook: stereo marks are removed and the SMILES is canonicalized
+    by RDKit
+
+    Parameters
+    ---------
+    smiles: str
+        SMILES string
+
+    Returns
+    -------
+    smiles: Optional[str]
+        Canonical SMILES, None when RDKit cannot parse it
+    """
+    from rdkit import Chem
+    for mark in ('@', '/', '\\'):
+        smiles = smiles.replace(mark, '')
+    mol = Chem.MolFromSmiles(smiles)
+    return None if mol is None else Chem.MolToSmiles(mol,
+                                                     isomericSmiles=True)
+
+
+def _nonstereo_chunk(smiles: List[str]) -> List[Optional[str]]:
+    """Canonicalize a chunk of SMILES in a worker process"""
+    from rdkit import RDLogger
+    RDLogger.DisableLog('rdApp.*')
+    return [nonstereo_smiles(s) for s in smiles]
+
+
+def canonicalize_smiles(smiles: Sequence[str],
+                        n_workers: int = 1,
+                        chunk_size: int = 500) -> List[Optional[str]]:
+    """
+    Canonicalize SMILES with ``nonstereo_smiles``, in parallel
+
+    Parameters
+    ---------
+    smiles: Sequence[str]
+        SMILES strings
+    n_workers: int
+        Number of worker processes, 1 to canonicalize in this process
+    chunk_size: int
+        Number of SMILES sent to a worker at a time
+
+    Returns
+    -------
+    smiles: List[Optional[str]]
+        Canonical SMILES, None where RDKit cannot parse the SMILES
+    """
+    chunks: List[List[str]] = [
+        list(smiles[start:start + chunk_size])
+        for start in range(0, len(smiles), chunk_size)
+    ]
+    if n_workers <= 1 or len(chunks) <= 1:
+        return [s for chunk in chunks for s in _nonstereo_chunk(chunk)]
+    # workers only run RDKit, the default start method (fork on Linux)
+    # does not re-import deepchem and torch like spawn
+    with ProcessPoolExecutor(
+            max_workers=min(n_workers, len(chunks))) as executor:
+        return [
+            s for chunk in executor.map(_nonstereo_chunk, chunks)
+            for s in chunk
+        ]
+
+
+def row_hashes(df: pd.DataFrame, fields: Sequence[str]) -> np.ndarray:
+    """64 bit hashes of the content of the given columns of every row"""
+    return pd.util.hash_pandas_object(df[list(fields)].astype(str),
+                                      index=False).to_numpy()
+
+
+class DatasetMerger(object):
+    """
+    Incremental merge and deduplication of labelled odor datasets.
+
+    Scripted version of ``openpom/data/merge_datasets.ipynb``: the SMILES
+    of every source row are canonicalized without stereochemistry, rows
+    of the same molecule are merged with the union of their descriptors,
+    'odorless' is dropped from molecules with other descriptors, and the
+    descriptors are encoded on a fixed task vocabulary (descriptors
+    outside of it are counted and dropped).
+
+    The merger keeps a hash index in ``index_dir``:
+
+    - per source, the content hash of the CSV and, by row hash (SMILES
+      and descriptors), the canonical SMILES of every row. An unchanged
+      source is not read again, and only new or changed rows of a changed
+      source are canonicalized;
+    - the molecule order of the last merge. Molecules keep their row
+      across reruns and new molecules are appended, so seeded splits of
+      the existing molecules do not move when a source grows. Without an
+      index the order is seeded from the existing output, if any.
+
+    Example
+    -------
+    >>> merger = DatasetMerger('./.openpom_cache/merge', tasks, n_workers=4)
+    >>> result = merger.merge([
+    ...     MergeSource('leffingwell', 'curated_leffingwell.csv',
+    ...                 'IsomericSMILES', 'Updated_Desc'),
+    ...     MergeSource('goodscents', 'curated_goodcents.csv',
+    ...                 'IsomericSMILES', 'Updated_Desc_v2')])
+    >>> merger.write(result, 'merged.csv')
+    """
+
+    def __init__(self,
+                 index_dir: str,
+                 tasks: Sequence[str],
+                 n_workers: int = 1,
+                 chunk_size: int = 500):
+        """
+        Parameters
+        ----------
+        index_dir: str
+            Directory of the hash index
+        tasks: Sequence[str]
+            Task vocabulary, the label columns of the merged dataset
+        n_workers: int
+            Number of processes canonicalizing SMILES
+        chunk_size: int
+            Number of SMILES sent to a worker at a time
+        """
+        self.index_dir: str = index_dir
+        self.tasks: List[str] = list(tasks)
+        self.n_workers: int = n_workers
+        self.chunk_size: int = chunk_size
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name + '.pkl')
+
+    def _load(self, name: str) -> Optional[Dict[str, Any]]:
+        """Load an index entry, None if missing or of another version"""
+        try:
+            with open(self._path(name), 'rb') as f:
+                entry: Dict[str, Any] = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable index entry %s: %s" %
+                           (name, e))
+            return None
+        return entry if entry.get('version') == INDEX_VERSION else None
+
+    def _save(self, name: str, entry: Dict[str, Any]) -> None:
+        """Write an index entry atomically"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        path: str = self._path(name)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(dict(entry, version=INDEX_VERSION),
+                        f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def _source_rows(self, source: MergeSource,
+                     stats: Dict[str, Any]) -> pd.DataFrame:
+        """
+        Canonical SMILES and descriptors of the rows of a source, reusing
+        the rows indexed by earlier merges
+        """
+        name: str = 'source_' + _hash_json(
+            [source.name, source.smiles_field, source.descriptors_field])
+        content_hash: str = file_hash(source.path)
+        entry: Optional[Dict[str, Any]] = self._load(name)
+        if entry is not None and entry['file_hash'] == content_hash:
+            stats.update(rows=len(entry['rows']),
+                         new_rows=0,
+                         removed_rows=0,
+                         canonicalized=0)
+            return entry['rows']
+
+        df: pd.DataFrame = pd.read_csv(source.path)
+        rows: pd.DataFrame = pd.DataFrame({
+            'smiles': df[source.smiles_field].astype(str).to_numpy(),
+            'descriptors': df[source.descriptors_field].fillna('').astype(
+                str).to_numpy(),
+            'hash': row_hashes(df, [source.smiles_field,
+                                    source.descriptors_field]),
+        })
+        indexed: Dict[int, Optional[str]] = {} if entry is None else dict(
+            zip(entry['rows']['hash'].tolist(),
+                entry['rows']['key'].tolist()))
+        known: np.ndarray = rows['hash'].isin(indexed).to_numpy()
+        keys: List[Optional[str]] = [indexed.get(h) for h in rows['hash']]
+        # only new or changed rows are canonicalized, once per SMILES
+        missing: List[str] = list(dict.fromkeys(rows['smiles'][~known]))
+        canonical: Dict[str, Optional[str]] = dict(
+            zip(missing,
+                canonicalize_smiles(missing, self.n_workers,
+                                    self.chunk_size)))
+        for i in np.flatnonzero(~known):
+            keys[i] = canonical[rows['smiles'][i]]
+        rows['key'] = keys
+
+        stats.update(rows=len(rows),
+                     new_rows=int((~known).sum()),
+                     removed_rows=0 if entry is None else int(
+                         (~entry['rows']['hash'].isin(rows['hash'])).sum()),
+                     canonicalized=len(missing))
+        self._save(name, {'file_hash': content_hash, 'rows': rows})
+        return rows
+
+    def _previous_order(self, output: Optional[str]) -> List[str]:
+        """Molecule order of the last merge, or of the existing output"""
+        entry: Optional[Dict[str, Any]] = self._load('order')
+        if entry is not None:
+            return entry['keys']
+        if output is None or not os.path.exists(output):
+            return []
+        smiles: List[str] = pd.read_csv(
+            output, usecols=[SMILES_FIELD])[SMILES_FIELD].astype(str).tolist()
+        # the output may come from another RDKit version
+        return [
+            key for key in canonicalize_smiles(smiles, self.n_workers,
+                                               self.chunk_size)
+            if key is not None
+        ]
+
+    def merge(self,
+              sources: Sequence[MergeSource],
+              output: Optional[str] = None) -> MergeResult:
+        """
+        Merge the sources into one dataset with a molecule per row
+
+        Parameters
+        ---------
+        sources: Sequence[MergeSource]
+            Sources to merge, molecules new to the merge are added in the
+            order of the sources and of their rows
+        output: Optional[str]
+            Path of the previous merged dataset, its molecule order is
+            kept when the index has no order yet
+
+        Returns
+        -------
+        result: MergeResult
+            Merged dataset and provenance statistics
+        """
+        start: float = time.perf_counter()
+        vocabulary: Set[str] = set(self.tasks)
+        descriptors: Dict[str, Set[str]] = {}
+        provenance: Dict[str, Set[str]] = {}
+        source_stats: Dict[str, Dict[str, Any]] = {}
+        for source in sources:
+            stats: Dict[str, Any] = {}
+            rows: pd.DataFrame = self._source_rows(source, stats)
+            unknown: Counter = Counter()
+            invalid: int = 0
+            for key, row_descriptors in zip(rows['key'],
+                                            rows['descriptors']):
+                if key is None:
+                    invalid += 1
+                    continue
+                row_labels: Set[str] = set()
+                for descriptor in row_descriptors.split(source.separator):
+                    descriptor = descriptor.strip().lower()
+                    if descriptor in vocabulary:
+                        row_labels.add(descriptor)
+                    elif descriptor:
+                        unknown[descriptor] += 1
+                descriptors.setdefault(key, set()).update(row_labels)
+                provenance.setdefault(key, set()).add(source.name)
+            stats.update(invalid_smiles=invalid,
+                         unknown_descriptors=dict(unknown.most_common()))
+            source_stats[source.name] = stats
+
+        odorless_dropped: int = 0
+        for molecule_labels in descriptors.values():
+            if ODORLESS in molecule_labels and len(molecule_labels) > 1:
+                molecule_labels.discard(ODORLESS)
+                odorless_dropped += 1
+        unlabeled: List[str] = [k for k, v in descriptors.items() if not v]
+        for key in unlabeled:
+            del descriptors[key]
+
+        previous: List[str] = self._previous_order(output)
+        previous_keys: Set[str] = set(previous)
+        keys: List[str] = [k for k in dict.fromkeys(previous)
+                           if k in descriptors] + \
+            [k for k in descriptors if k not in previous_keys]
+        self._save('order', {'keys': keys})
+
+        labels: np.ndarray = np.zeros((len(keys), len(self.tasks)),
+                                      dtype=np.int64)
+        column: Dict[str, int] = {t: i for i, t in enumerate(self.tasks)}
+        for i, key in enumerate(keys):
+            labels[i, [column[t] for t in descriptors[key]]] = 1
+        dataset: pd.DataFrame = pd.concat([
+            pd.DataFrame({
+                SMILES_FIELD: keys,
+                DESCRIPTORS_FIELD: [
+                    ';'.join(t for t in self.tasks if t in descriptors[k])
+                    for k in keys
+                ],
+            }),
+            pd.DataFrame(labels, columns=self.tasks)
+        ], axis=1)
+
+        for source in sources:
+            in_source: List[str] = [
+                k for k in keys if source.name in provenance[k]
+            ]
+            source_stats[source.name].update(
+                molecules=len(in_source),
+                only_in_source=sum(
+                    len(provenance[k]) == 1 for k in in_source))
+        n_rows: int = sum(s['rows'] - s['invalid_smiles']
+                          for s in source_stats.values())
+        stats = {
+            'sources': source_stats,
+            'molecules': len(keys),
+            'new_molecules': len(keys) - len(previous_keys & set(keys)),
+            'removed_molecules': len(previous_keys - set(keys)),
+            'duplicate_rows_merged': n_rows - len(keys) - len(unlabeled),
+            'multi_source_molecules': sum(
+                len(provenance[k]) > 1 for k in keys),
+            'unlabeled_molecules_dropped': len(unlabeled),
+            'odorless_dropped': odorless_dropped,
+            'label_counts': dict(zip(self.tasks,
+                                     labels.sum(axis=0).tolist())),
+            'seconds': round(time.perf_counter() - start, 3),
+        }
+        logger.info("Merged %d rows into %d molecules (%d new)" %
+                    (n_rows, len(keys), stats['new_molecules']))
+        return MergeResult(dataset, stats)
+
+    @staticmethod
+    def write(result: MergeResult, output: str) -> None:
+        """Write the merged dataset to a CSV file, atomically"""
+        result.dataset.to_csv(output + '.tmp', index=False)
+        os.replace(output + '.tmp', output)
@@ -0,0 +1,420 @@
+import os
+import json
+import shutil
+import logging
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Sequence
+from deepchem.data import NumpyDataset
+from deepchem.feat import Featurizer
+from deepchem.feat.graph_data import GraphData
+from openpom.utils.dataset_cache import (_is_complete, _write_complete,
+                                         featurizer_key, file_hash)
+
+logger = logging.getLogger(__name__)
+
+# store format version, bump when the on-disk layout changes
+STORE_VERSION: int = 1
+META_FILE: str = 'meta.json'
+
+
+def write_label_store(csv_file: str,
+                      store_dir: str,
+                      smiles_field: Optional[str] = None,
+                      tasks: Optional[List[str]] = None,
+                      canonicalize: bool = False,
+                      featurizer: Optional[Featurizer] = None) -> str:
+    """
+    Convert a curated odor CSV into a columnar label store
+
+    The CSV is parsed once. The store keeps the SMILES, the labels
+    bit-packed to ``ceil(n_tasks / 8)`` bytes per molecule (18 bytes for
+    the 138 tasks), and optionally canonical SMILES and featurized
+    graphs. The descriptor string column is not kept, it is the list of
+    the positive tasks.
+
+    Layout::
+
+        store_dir/
+            meta.json                 tasks, sizes, source CSV hash
+            labels.npy                (n, ceil(n_tasks / 8)) uint8
+            smiles.npy, smiles_offsets.npy
+            canonical.npy, canonical_offsets.npy          (canonicalize)
+            node_features.npy, edge_index.npy, edge_features.npy,
+            node_offsets.npy, edge_offsets.npy, featurized.npy  (featurizer)
+
+    Strings are stored as one utf-8 byte array with (n + 1) int64 offsets.
+    Graphs are stored as concatenated node features, edge features and
+    per molecule edge indices, with (n + 1) int64 node and edge offsets.
+    The store is written to a temporary directory and moved into place.
+
+    Parameters
+    ---------
+    csv_file: str
+        Path of the CSV file
+    store_dir: str
+        Directory of the store, replaced if it exists
+    smiles_field: Optional[str]
+        SMILES column, default to the first column
+    tasks: Optional[List[str]]
+        Task columns, default to all the integer columns
+    canonicalize: bool
+        Whether to store RDKit canonical SMILES
+    featurizer: Optional[Featurizer]
+        Featurizer of the graphs to store, e.g. ``GraphFeaturizer()``
+
+    Returns
+    -------
+    store_dir: str
+        Directory of the store
+    """
+    df: pd.DataFrame = pd.read_csv(csv_file)
+    smiles_field = smiles_field or df.columns[0]
+    if tasks is None:
+        tasks = [
+            column for column in df.columns
+            if column != smiles_field and df[column].dtype.kind in 'iub'
+        ]
+    labels: np.ndarray = df[tasks].to_numpy()
+    if not np.isin(labels, (0, 1)).all():
+        raise ValueError("Task columns of %s should only contain 0/1 labels" %
+                         csv_file)
+    smiles: List[str] = df[smiles_field].astype(str).tolist()
+
+    meta: Dict[str, Any] = {
+        'version': STORE_VERSION,
+        'csv': file_hash(csv_file),
+        'smiles_field': smiles_field,
+        'tasks': list(tasks),
+        'n_molecules': len(df),
+        'canonical': canonicalize,
+        'featurizer': featurizer_key(featurizer) if featurizer else None,
+    }
+
+    def write(tmp_dir: str) -> None:
+        np.save(os.path.join(tmp_dir, 'labels.npy'),
+                np.packbits(labels.astype(bool), axis=1))
+        _save_strings(tmp_dir, 'smiles', smiles)
+        if canonicalize:
+            _save_strings(tmp_dir, 'canonical', canonical_smiles(smiles))
+        if featurizer is not None:
+            _save_graphs(tmp_dir, featurizer.featurize(smiles))
+        with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    _write_complete(store_dir, write)
+    logger.info("Wrote label store %s (%d molecules, %d tasks)" %
+                (store_dir, len(df), len(tasks)))
+    return store_dir
+
+
+def canonical_smiles(smiles: Sequence[str]) -> List[str]:
+    """RDKit canonical SMILES, the input SMILES when it does not parse"""
+    from rdkit import Chem
+    canonical: List[str] = []
+    for s in smiles:
+        mol = Chem.MolFromSmiles(s)
+        canonical.append(s if mol is None else Chem.MolToSmiles(mol))
+    return canonical
+
+
+def _save_strings(store_dir: str, name: str, strings: Sequence[str]) -> None:
+    """Save strings as a utf-8 byte array and offsets"""
+    encoded: List[bytes] = [s.encode() for s in strings]
+    offsets: np.ndarray = np.concatenate(
+        [[0], np.cumsum([len(e) for e in encoded])]).astype(np.int64)
+    np.save(os.path.join(store_dir, f'{name}.npy'),
+            np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(os.path.join(store_dir, f'{name}_offsets.npy'), offsets)
+
+
+def _save_graphs(store_dir: str, features: Sequence[Any]) -> None:
+    """Save featurized graphs as concatenated arrays and offsets"""
+    # deepchem featurizers return an empty array on failure
+    graphs: List[Optional[GraphData]] = [
+        None if np.array(feature).size == 0 else feature
+        for feature in features
+    ]
+    valid: List[GraphData] = [g for g in graphs if g is not None]
+    if not valid:
+        raise ValueError("No molecule could be featurized")
+    if any(g.node_pos_features is not None for g in valid):
+        raise ValueError("Graphs with node positions are not supported")
+    num_nodes: np.ndarray = np.array(
+        [0 if g is None else g.num_nodes for g in graphs], dtype=np.int64)
+    num_edges: np.ndarray = np.array(
+        [0 if g is None else g.num_edges for g in graphs], dtype=np.int64)
+    arrays: Dict[str, np.ndarray] = {
+        'featurized': np.array([g is not None for g in graphs]),
+        'node_offsets': np.concatenate([[0], np.cumsum(num_nodes)]),
+        'edge_offsets': np.concatenate([[0], np.cumsum(num_edges)]),
+        'node_features': np.concatenate([g.node_features for g in valid]),
+        'edge_index': np.concatenate([g.edge_index for g in valid], axis=1),
+    }
+    if valid[0].edge_features is not None:
+        arrays['edge_features'] = np.concatenate(
+            [g.edge_features for g in valid])
+    for name, array in arrays.items():
+        np.save(os.path.join(store_dir, f'{name}.npy'), array)
+
+
+class LabelStore(object):
+    """
+    Memory-mapped reader of a label store written by ``write_label_store``.
+
+    Label matrices, co-occurrence counts and task subsets are computed
+    from the bit-packed labels, the CSV is not parsed. Arrays are opened
+    with ``np.load(mmap_mode='r')`` so opening a store does not read it,
+    and processes reading the same store share the pages.
+
+    Example
+    -------
+    >>> store = LabelStore.from_csv('curated_GS_LF_merged_4983.csv',
+    ...                             './.openpom_cache/gs_lf')
+    >>> y = store.y()
+    >>> counts = store.cooccurrence(['fruity', 'green', 'sweet'])
+    >>> parts = IterativeStratifiedSplitter().stratify(y, [0.8, 0.2], seed=0)
+    """
+
+    def __init__(self, store_dir: str):
+        """
+        Parameters
+        ----------
+        store_dir: str
+            Directory of the store
+        """
+        if not _is_complete(store_dir):
+            raise FileNotFoundError("No label store in %s" % store_dir)
+        with open(os.path.join(store_dir, META_FILE)) as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        if self.meta['version'] != STORE_VERSION:
+            raise ValueError("Label store %s has version %s, expected %d" %
+                             (store_dir, self.meta['version'], STORE_VERSION))
+        self.store_dir: str = store_dir
+        self.tasks: List[str] = self.meta['tasks']
+        self.labels: np.ndarray = self._load('labels')
+        self._task_index: Dict[str, int] = {
+            task: i for i, task in enumerate(self.tasks)
+        }
+
+    @classmethod
+    def from_csv(cls,
+                 csv_file: str,
+                 store_dir: str,
+                 smiles_field: Optional[str] = None,
+                 tasks: Optional[List[str]] = None,
+                 canonicalize: bool = False,
+                 featurizer: Optional[Featurizer] = None) -> 'LabelStore':
+        """
+        Open the store of a CSV file, converting the CSV when the store
+        is missing or was written from another content or configuration
+
+        Parameters are those of ``write_label_store``.
+
+        Returns
+        -------
+        store: LabelStore
+            Store of the CSV
+        """
+        if _is_complete(store_dir):
+            store: LabelStore = cls(store_dir)
+            meta: Dict[str, Any] = store.meta
+            if (meta['csv'] == file_hash(csv_file) and
+                (smiles_field is None or
+                 meta['smiles_field'] == smiles_field) and
+                (tasks is None or meta['tasks'] == list(tasks)) and
+                (meta['canonical'] or not canonicalize) and
+                (featurizer is None or
+                 meta['featurizer'] == featurizer_key(featurizer))):
+                return store
+            logger.info("Label store %s is outdated, converting %s" %
+                        (store_dir, csv_file))
+        return cls(
+            write_label_store(csv_file, store_dir, smiles_field, tasks,
+                              canonicalize, featurizer))
+
+    def __len__(self) -> int:
+        return self.meta['n_molecules']
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.store_dir, f'{name}.npy'),
+                       mmap_mode='r')
+
+    def _has(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.store_dir, f'{name}.npy'))
+
+    def task_indices(self,
+                     tasks: Optional[Sequence[str]] = None) -> np.ndarray:
+        """Column indices of tasks, all the tasks when None"""
+        if tasks is None:
+            return np.arange(len(self.tasks))
+        missing: List[str] = [t for t in tasks if t not in self._task_index]
+        if missing:
+            raise KeyError("Tasks not in the store: %s" % missing)
+        return np.array([self._task_index[t] for t in tasks], dtype=np.int64)
+
+    def y(self,
+          tasks: Optional[Sequence[str]] = None,
+          indices: Optional[np.ndarray] = None,
+          dtype: Any = np.float64) -> np.ndarray:
+        """
+        Label matrix of the molecules
+
+        Parameters
+        ---------
+        tasks: Optional[Sequence[str]]
+            Task columns, in the given order, all the tasks when None
+        indices: Optional[np.ndarray]
+            Molecule indices, all the molecules when None
+        dtype: Any
+            dtype of the matrix, float64 like deepchem datasets
+
+        Returns
+        -------
+        y: np.ndarray
+            (n_molecules, n_tasks) 0/1 matrix
+        """
+        packed: np.ndarray = self.labels if indices is None else \
+            self.labels[np.asarray(indices)]
+        if tasks is None:
+            return np.unpackbits(packed, axis=1,
+                                 count=len(self.tasks)).astype(dtype)
+        # read the bit of every task from its byte
+        columns: np.ndarray = self.task_indices(tasks)
+        bits: np.ndarray = (packed[:, columns // 8] >>
+                            (7 - columns % 8).astype(np.uint8)) & 1
+        return bits.astype(dtype)
+
+    def cooccurrence(self,
+                     tasks: Optional[Sequence[str]] = None,
+                     indices: Optional[np.ndarray] = None,
+                     chunk_size: int = 65536) -> np.ndarray:
+        """
+        Label co-occurrence counts
+
+        Parameters
+        ---------
+        tasks: Optional[Sequence[str]]
+            Task columns, all the tasks when None
+        indices: Optional[np.ndarray]
+            Molecule indices, all the molecules when None
+        chunk_size: int
+            Number of molecules unpacked at a time
+
+        Returns
+        -------
+        counts: np.ndarray
+            (n_tasks, n_tasks) int64 matrix, ``counts[i, j]`` molecules
+            with both tasks i and j, the diagonal are the label counts
+        """
+        indices = np.arange(len(self)) if indices is None else \
+            np.asarray(indices)
+        n_tasks: int = len(self.task_indices(tasks))
+        counts: np.ndarray = np.zeros((n_tasks, n_tasks), dtype=np.int64)
+        for start in range(0, len(indices), chunk_size):
+            y: np.ndarray = self.y(tasks,
+                                   indices[start:start + chunk_size],
+                                   dtype=np.float32)
+            # exact, a chunk count is below 2 ** 24
+            counts += (y.T @ y).astype(np.int64)
+        return counts
+
+    def _strings(self, name: str,
+                 indices: Optional[Sequence[int]]) -> List[str]:
+        if not self._has(name):
+            raise ValueError("The store has no %s table, rewrite it with "
+                             "write_label_store" % name)
+        data: np.ndarray = self._load(name)
+        offsets: np.ndarray = self._load(f'{name}_offsets')
+        indices = range(len(self)) if indices is None else indices
+        return [
+            bytes(data[offsets[i]:offsets[i + 1]]).decode() for i in indices
+        ]
+
+    def smiles(self, indices: Optional[Sequence[int]] = None) -> List[str]:
+        """SMILES of the molecules, all the molecules when None"""
+        return self._strings('smiles', indices)
+
+    def canonical_smiles(self,
+                         indices: Optional[Sequence[int]] = None
+                         ) -> List[str]:
+        """Cached canonical SMILES, requires ``canonicalize=True``"""
+        return self._strings('canonical', indices)
+
+    def graphs(self,
+               indices: Optional[Sequence[int]] = None
+               ) -> List[Optional[GraphData]]:
+        """
+        Featurized graphs of the molecules, requires a featurizer
+
+        Parameters
+        ---------
+        indices: Optional[Sequence[int]]
+            Molecule indices, all the molecules when None
+
+        Returns
+        -------
+        graphs: List[Optional[GraphData]]
+            Graph per molecule, None where featurization failed
+        """
+        if not self._has('featurized'):
+            raise ValueError("The store has no graphs, rewrite it with a "
+                             "featurizer")
+        featurized: np.ndarray = self._load('featurized')
+        node_offsets: np.ndarray = self._load('node_offsets')
+        edge_offsets: np.ndarray = self._load('edge_offsets')
+        node_features: np.ndarray = self._load('node_features')
+        edge_index: np.ndarray = self._load('edge_index')
+        edge_features: Optional[np.ndarray] = self._load('edge_features') \
+            if self._has('edge_features') else None
+        # offsets count failed molecules as empty graphs
+        indices = range(len(self)) if indices is None else indices
+        graphs: List[Optional[GraphData]] = []
+        for i in indices:
+            if not featurized[i]:
+                graphs.append(None)
+                continue
+            nodes: slice = slice(node_offsets[i], node_offsets[i + 1])
+            edges: slice = slice(edge_offsets[i], edge_offsets[i + 1])
+            graphs.append(
+                GraphData(node_features=np.array(node_features[nodes]),
+                          edge_index=np.array(edge_index[:, edges]),
+                          edge_features=None if edge_features is None else
+                          np.array(edge_features[edges])))
+        return graphs
+
+    def to_dataset(self,
+                   tasks: Optional[Sequence[str]] = None,
+                   indices: Optional[np.ndarray] = None) -> NumpyDataset:
+        """
+        Dataset of the stored graphs, like ``CSVLoader`` loads the CSV:
+        molecules that failed featurization are dropped and ids are the
+        SMILES
+
+        Parameters
+        ---------
+        tasks: Optional[Sequence[str]]
+            Task columns, all the tasks when None
+        indices: Optional[np.ndarray]
+            Molecule indices, all the molecules when None
+
+        Returns
+        -------
+        dataset: NumpyDataset
+            Dataset of the graphs
+        """
+        indices = np.arange(len(self)) if indices is None else \
+            np.asarray(indices)
+        graphs: List[Optional[GraphData]] = self.graphs(indices)
+        valid: np.ndarray = np.array([g is not None for g in graphs],
+                                     dtype=bool)
+        indices = indices[valid]
+        X: np.ndarray = np.empty(len(indices), dtype=object)
+        X[:] = [g for g in graphs if g is not None]
+        y: np.ndarray = self.y(tasks, indices)
+        return NumpyDataset(X,
+                            y,
+                            np.ones_like(y),
+                            ids=np.array(self.smiles(indices), dtype=object))
@@ -1,5 +1,6 @@
 import torch
-from typing import Optional, Callable, List
+import torch.nn.functional as F
+from typing import Optional, Callable, List, Tuple
 from deepchem.models.losses import Loss
 
 
@@ -17,9 +18,11 @@ class CustomMultiLabelLoss(Loss):
     preprint <https://www.biorxiv.org/content/10.1101/2022.09.01.504602v4>`_.
 
     The labels should have shape (batch_size) or (batch_size, tasks), and be
-    integer class labels.  The outputs have shape (batch_size, classes) or
-    (batch_size, tasks, classes) and be logits that are converted to
-    probabilities using a softmax function.
+    either integer class labels or soft target probabilities in [0, 1]
+    (e.g. averaged ensemble predictions used for distillation). The outputs
+    have shape (batch_size, classes) or (batch_size, tasks, classes) and be
+    logits that are converted to probabilities using a softmax function
+    over ``[1 - logit, logit]`` of the first class.
     """
 
     def __init__(self,
@@ -41,8 +44,11 @@ class CustomMultiLabelLoss(Loss):
         if class_imbalance_ratio is None:
             print(Warning("No class imbalance ratio provided!"))
             self.class_imbalance_ratio: Optional[torch.Tensor] = None
+            self.balancing_factors: Optional[torch.Tensor] = None
         else:
             self.class_imbalance_ratio = torch.Tensor(class_imbalance_ratio)
+            # log(1+ class_imbalance_ratio), computed once
+            self.balancing_factors = torch.log1p(self.class_imbalance_ratio)
 
         if loss_aggr_type not in ['sum', 'mean']:
             raise ValueError(f"Invalid loss aggregate type: {loss_aggr_type}")
@@ -52,14 +58,13 @@ class CustomMultiLabelLoss(Loss):
             if self.class_imbalance_ratio is not None:
                 self.class_imbalance_ratio = self.class_imbalance_ratio.to(
                     device)
+                self.balancing_factors = self.balancing_factors.to(device)
 
     def _create_pytorch_loss(
             self) -> Callable[[torch.Tensor, torch.Tensor], torch.Tensor]:
         """
         Returns loss function for pytorch backend
         """
-        ce_loss_fn: torch.nn.CrossEntropyLoss = torch.nn.CrossEntropyLoss(
-            reduction='none')
 
         def loss(output: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
             """
@@ -68,6 +73,11 @@ class CustomMultiLabelLoss(Loss):
             by a factor of log(1+ class_imbalance_ratio), such that rarer
             tasks were given a higher weighting.
 
+            The two-class cross-entropy over the logits ``[1 - z, z]``
+            of every task equals a binary cross-entropy on ``2z - 1``,
+            which is computed in one fused, numerically stable
+            ``binary_cross_entropy_with_logits`` call.
+
             Parameters
             ---------
             output: torch.Tensor
@@ -80,53 +90,92 @@ class CustomMultiLabelLoss(Loss):
             loss: torch.Tensor
                 total or mean loss depending on loss aggregation type
             """
-            # Convert (batch_size, tasks, classes)
-            # to (batch_size, classes, tasks)
-            # CrossEntropyLoss only supports (batch_size, classes, tasks)
-            # This is for API consistency
-            if len(output.shape) == 3:
-                output = output.permute(0, 2, 1)
-
-            if len(labels.shape) == len(output.shape):
-                labels = labels.squeeze(-1)
-
-            # handle multilabel
-            # output shape => (batch_size, classes=1, tasks)
-            # binary_output shape => (batch_size, classes=2, tasks)
-            # where now we have (1 - probabilities) for ce loss calculation
-            probabilities: torch.Tensor = output[:, 0, :]
-            complement_probabilities: torch.Tensor = 1 - probabilities
-            binary_output: torch.Tensor = torch.stack(
-                [complement_probabilities, probabilities], dim=1)
-
-            ce_loss: torch.Tensor = ce_loss_fn(binary_output, labels.long())
-
-            if self.class_imbalance_ratio is None:
-                if self.loss_aggr_type == 'sum':
-                    loss: torch.Tensor = ce_loss.sum(dim=1)
-                else:
-                    loss = ce_loss.mean(dim=1)
+            # (batch_size, tasks, classes=1) => (batch_size, tasks)
+            logits: torch.Tensor = output[..., 0] if output.dim() == 3 \
+                else output[:, :1]
+            # class probability targets; identical to integer class
+            # targets for hard 0/1 labels, and also allows soft labels
+            labels = labels.reshape(logits.shape).to(logits.dtype)
+
+            # loss being weighted by a factor of
+            # log(1+ class_imbalance_ratio); shape => (batch_size, tasks)
+            ce_loss: torch.Tensor = F.binary_cross_entropy_with_logits(
+                2 * logits - 1,
+                labels,
+                weight=self.balancing_factors,
+                reduction='none')
+
+            if self.loss_aggr_type == 'sum':
+                # sum (balanced) loss across all tasks; shape => (batch_size)
+                loss: torch.Tensor = ce_loss.sum(dim=1)
             else:
-                balancing_factors: torch.Tensor = torch.log(
-                    1 + self.class_imbalance_ratio)
-
-                # loss being weighted by a factor of
-                # log(1+ class_imbalance_ratio)
-                balanced_losses: torch.Tensor = torch.mul(
-                    ce_loss, balancing_factors)
-
-                if self.loss_aggr_type == 'sum':
-                    # sum balanced loss across all tasks;
-                    # shape => (batch_size)
-                    loss = balanced_losses.sum(dim=1)
-                else:
-                    # mean balanced loss across all tasks;
-                    # shape => (batch_size)
-                    loss = balanced_losses.mean(dim=1)
-
-            # duplicate loss across all tasks in a batch;
+                # mean (balanced) loss across all tasks; shape => (batch_size)
+                loss = ce_loss.mean(dim=1)
+
+            # broadcast view of the loss across all tasks in a batch;
             # shape => (batch_size, n_tasks)
             # This is for API consistency
-            return loss.unsqueeze(-1).repeat(1, output.shape[-1])
+            return loss.unsqueeze(-1).expand(-1, logits.shape[-1])
 
         return loss
+
+
+class _L1L2Penalty(torch.autograd.Function):
+    """
+    weight_decay * sum(||p||_1 + ||p||_2) with a fused backward
+
+    The gradient ``weight_decay * (sign(p) + p / ||p||_2)`` is written in
+    place with foreach kernels instead of autograd building one graph
+    node per parameter and norm.
+    """
+
+    @staticmethod
+    def forward(ctx, weight_decay: float,
+                *params: torch.Tensor) -> torch.Tensor:
+        # linalg_vector_norm(ord=1) has a slow CPU kernel, abs().sum() not
+        l1_norms: torch.Tensor = torch.stack(
+            [param.abs().sum() for param in params])
+        l2_norms: List[torch.Tensor] = list(torch._foreach_norm(params, 2))
+        ctx.save_for_backward(*params)
+        ctx.l2_norms = l2_norms
+        ctx.weight_decay = weight_decay
+        return weight_decay * (l1_norms.sum() + torch.stack(l2_norms).sum())
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor):
+        params: Tuple[torch.Tensor, ...] = ctx.saved_tensors
+        grads: List[torch.Tensor] = list(torch._foreach_sign(params))
+        # zero weights have a zero l2 gradient, as in torch.norm
+        l2_norms: List[torch.Tensor] = torch._foreach_clamp_min(
+            ctx.l2_norms,
+            torch.finfo(params[0].dtype).tiny)
+        torch._foreach_addcdiv_(grads, params, [
+            norm.expand_as(param) for norm, param in zip(l2_norms, params)
+        ])
+        torch._foreach_mul_(grads, grad_output * ctx.weight_decay)
+        return (None, *grads)
+
+
+def l1_l2_penalty(params: List[torch.Tensor],
+                  weight_decay: float) -> torch.Tensor:
+    """
+    L1 and L2-norm penalty of a list of parameters
+
+    Same value and gradients as ``weight_decay * sum(torch.norm(p, p=1) +
+    torch.norm(p, p=2) for p in params)``, in a few fused kernels.
+
+    Parameters
+    ---------
+    params: List[torch.Tensor]
+        Parameters to regularize
+    weight_decay: float
+        Weight of the penalty
+
+    Returns
+    -------
+    penalty: torch.Tensor
+        Scalar penalty
+    """
+    if not params:
+        return torch.zeros(())
+    return _L1L2Penalty.apply(weight_decay, *params)
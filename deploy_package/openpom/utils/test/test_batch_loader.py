@@ -0,0 +1,133 @@
+import threading
+import numpy as np
+import pytest
+import torch
+import dgl
+from deepchem.data.data_loader import CSVLoader
+from openpom.feat.graph_featurizer import GraphFeaturizer
+from openpom.models.mpnn_pom import MPNNPOMModel
+from openpom.utils.batch_loader import (BatchCache, PreparedBatch,
+                                        collate_graphs, prefetch)
+
+TASKS = ['fruity', 'green', 'herbal', 'sweet', 'woody']
+INPUT_FILE = 'openpom/models/test/assets/test_dataset_sample_7.csv'
+
+
+def load_dataset():
+    loader = CSVLoader(tasks=TASKS,
+                       feature_field='smiles',
+                       featurizer=GraphFeaturizer())
+    return loader.create_dataset(inputs=[INPUT_FILE])
+
+
+@pytest.mark.parametrize('self_loop', [False, True])
+def test_collate_graphs(self_loop):
+    """
+    Test collated graphs match the dgl.batch of per molecule graphs
+    """
+    graphs = load_dataset().X
+    expected = dgl.batch(
+        [graph.to_dgl_graph(self_loop=self_loop) for graph in graphs])
+    g = collate_graphs(graphs, self_loop=self_loop)
+
+    assert g.num_nodes() == expected.num_nodes()
+    assert torch.equal(g.batch_num_nodes(), expected.batch_num_nodes())
+    assert torch.equal(g.batch_num_edges(), expected.batch_num_edges())
+    for edges, expected_edges in zip(g.edges(), expected.edges()):
+        assert torch.equal(edges, expected_edges)
+    assert g.ndata['x'].dtype == torch.float32
+    assert torch.equal(g.ndata['x'], expected.ndata['x'])
+    assert torch.equal(g.edata['edge_attr'], expected.edata['edge_attr'])
+
+
+def test_prefetch():
+    """
+    Test batches are prepared in order on background threads and
+    errors are raised to the caller
+    """
+    threads = set()
+
+    def prepare(batch):
+        threads.add(threading.current_thread().name)
+        return batch * 2
+
+    assert list(prefetch(range(10), prepare, num_workers=2, depth=3)) == \
+        list(range(0, 20, 2))
+    assert all(name.startswith('batch-prefetch') for name in threads)
+    assert list(prefetch(range(3), prepare, num_workers=0)) == [0, 2, 4]
+
+    def fail(batch):
+        if batch == 2:
+            raise ValueError("bad batch")
+        return batch
+
+    prepared = []
+    with pytest.raises(ValueError):
+        for batch in prefetch(range(5), fail):
+            prepared.append(batch)
+    assert prepared == [0, 1]
+
+
+def test_batch_cache():
+    """
+    Test cached batches are prepared once and reshuffled at each epoch
+    """
+    cache = BatchCache()
+    dataset = object()
+    calls = []
+
+    def prepare(batch):
+        calls.append(batch)
+        return [batch]
+
+    np.random.seed(0)
+    epochs = list(cache.epochs(dataset, lambda: range(6), prepare, epochs=4))
+    assert sorted(calls) == list(range(6))
+    assert len(epochs) == 24
+    assert [batch[0] for batch in epochs[:6]] == list(range(6))
+    assert all(
+        sorted(batch[0] for batch in epochs[i:i + 6]) == list(range(6))
+        for i in range(0, 24, 6))
+    assert any(epochs[i:i + 6] != epochs[:6] for i in range(6, 24, 6))
+    # the prepared objects are reused
+    assert all(any(batch is cached for cached in epochs[:6])
+               for batch in epochs[6:])
+
+    list(cache.epochs(dataset, lambda: range(6), prepare, epochs=2))
+    assert len(calls) == 6
+    list(cache.epochs(object(), lambda: range(3), prepare))
+    assert len(calls) == 9 and len(cache) == 3
+
+
+def test_mpnnpom_model_cache_batches():
+    """
+    Test MPNNPOMModel trains on prefetched and cached batches
+    """
+    torch.manual_seed(0)
+    dataset = load_dataset()
+    model = MPNNPOMModel(n_tasks=len(TASKS),
+                         batch_size=3,
+                         mode='classification',
+                         n_classes=1,
+                         device_name='cpu',
+                         cache_batches=True)
+    prepared = []
+    prepare_batch = model._prepare_batch
+
+    def count(batch):
+        if not isinstance(batch, PreparedBatch):
+            prepared.append(batch)
+        return prepare_batch(batch)
+
+    model._prepare_batch = count
+    model.fit(dataset, nb_epoch=3)
+    model.fit(dataset, nb_epoch=2)
+    # 2 batches per epoch, collated at the first epoch only
+    assert len(prepared) == 2
+    assert model._global_step == 10
+
+    batch = model._prepare_batch(
+        ([dataset.X[:2]], [dataset.y[:2]], [dataset.w[:2]]))
+    assert isinstance(batch, PreparedBatch)
+    assert batch.inputs.batch_size == 2
+    assert batch.labels[0].dtype == torch.float32
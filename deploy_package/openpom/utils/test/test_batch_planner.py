@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from openpom.feat.graph_featurizer import GraphFeaturizer
+from openpom.utils.batch_planner import BatchPlanner, graph_sizes
+
+
+def test_batch_planner_budget():
+    """
+    Test BatchPlanner packs graphs within the atom/edge budget
+    """
+    rng = np.random.RandomState(0)
+    num_nodes = rng.randint(1, 60, size=200)
+    num_edges = 2 * num_nodes
+    planner = BatchPlanner(max_atoms=200, max_edges=300)
+    batches = planner.plan_sizes(num_nodes, num_edges)
+
+    # every graph appears exactly once, order is kept without sorting
+    assert np.array_equal(np.concatenate(batches), np.arange(200))
+    for batch in batches:
+        if len(batch) > 1:
+            assert num_nodes[batch].sum() <= 200
+            assert num_edges[batch].sum() <= 300
+
+
+def test_batch_planner_oversized_graph():
+    """
+    Test a graph larger than the budget gets a batch of its own
+    """
+    planner = BatchPlanner(max_atoms=10)
+    batches = planner.plan_sizes(np.array([3, 50, 3, 3, 3]),
+                                 np.array([4, 100, 4, 4, 4]))
+    assert [b.tolist() for b in batches] == [[0], [1], [2, 3, 4]]
+
+
+def test_batch_planner_sort_and_shuffle():
+    """
+    Test sorting by size and seeded shuffling of batch order
+    """
+    rng = np.random.RandomState(0)
+    num_nodes = rng.randint(1, 60, size=100)
+    num_edges = 2 * num_nodes
+    planner = BatchPlanner(max_edges=400, max_batch_size=16, sort_by_size=True)
+
+    batches = planner.plan_sizes(num_nodes, num_edges)
+    sizes = np.concatenate([num_edges[b] for b in batches])
+    assert np.all(np.diff(sizes) >= 0)
+    assert max(len(b) for b in batches) <= 16
+
+    first = planner.plan_sizes(num_nodes, num_edges, shuffle=True, seed=1)
+    second = planner.plan_sizes(num_nodes, num_edges, shuffle=True, seed=1)
+    assert all(np.array_equal(a, b) for a, b in zip(first, second))
+    assert np.array_equal(np.sort(np.concatenate(first)), np.arange(100))
+
+    with pytest.raises(ValueError):
+        BatchPlanner()
+
+
+def test_batch_planner_graphs():
+    """
+    Test planning directly from featurized molecules
+    """
+    featurizer = GraphFeaturizer()
+    graphs = featurizer.featurize(['C', 'CCO', 'CCCCCCCCCC', 'c1ccccc1', 'O'])
+    num_nodes, num_edges = graph_sizes(graphs)
+    assert num_nodes.tolist() == [1, 3, 10, 6, 1]
+    assert num_edges.tolist() == [0, 4, 18, 12, 0]
+
+    batches = BatchPlanner(max_atoms=10).plan(graphs)
+    assert [b.tolist() for b in batches] == [[0, 1], [2], [3, 4]]
+
+
+def test_batch_planner_min_batch_size():
+    """
+    Test batches smaller than min_batch_size are merged into a neighbour
+    """
+    planner = BatchPlanner(max_atoms=10, min_batch_size=2)
+    batches = planner.plan_sizes(np.array([50, 3, 3, 3, 3, 3, 3, 3, 30]),
+                                 np.array([100, 4, 4, 4, 4, 4, 4, 4, 60]))
+    assert [b.tolist() for b in batches] == [[0, 1, 2, 3], [4, 5, 6, 7, 8]]
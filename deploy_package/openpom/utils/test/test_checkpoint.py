@@ -0,0 +1,128 @@
+import os
+import time
+import shutil
+import tempfile
+import torch
+from deepchem.data.data_loader import CSVLoader
+from openpom.feat.graph_featurizer import GraphFeaturizer
+from openpom.models.mpnn_pom import MPNNPOMModel
+from openpom.utils import checkpoint
+from openpom.utils.checkpoint import CheckpointWriter, write_checkpoint
+
+TASKS = ['fruity', 'green', 'herbal', 'sweet', 'woody']
+INPUT_FILE = 'openpom/models/test/assets/test_dataset_sample_7.csv'
+
+
+def test_checkpoint_writer():
+    """
+    Test checkpoints are snapshotted, written atomically and rotated
+    """
+    model_dir = tempfile.mkdtemp()
+    try:
+        writer = CheckpointWriter()
+        weights = torch.zeros(3)
+        for step in range(3):
+            weights += 1
+            writer.save({'w': weights, 'step': step}, model_dir,
+                        max_checkpoints_to_keep=2)
+            # training keeps updating the tensor after the save
+            weights += 100
+            writer.flush()
+            weights -= 100
+        writer.close()
+
+        assert sorted(os.listdir(model_dir)) == \
+            ['checkpoint1.pt', 'checkpoint2.pt']
+        newest = torch.load(os.path.join(model_dir, 'checkpoint1.pt'))
+        assert newest['step'] == 2
+        assert torch.equal(newest['w'], torch.full((3,), 3.))
+        older = torch.load(os.path.join(model_dir, 'checkpoint2.pt'))
+        assert older['step'] == 1
+    finally:
+        shutil.rmtree(model_dir)
+
+
+def test_checkpoint_writer_bounded(monkeypatch):
+    """
+    Test pending saves of a checkpoint are coalesced and write errors are
+    raised on flush
+    """
+    model_dir = tempfile.mkdtemp()
+    written = []
+
+    def slow_write(state, *args):
+        time.sleep(0.2)
+        written.append(state['step'])
+        return write_checkpoint(state, *args)
+
+    monkeypatch.setattr(checkpoint, 'write_checkpoint', slow_write)
+    try:
+        writer = CheckpointWriter(max_pending=1)
+        start = time.perf_counter()
+        for step in range(10):
+            writer.save({'step': step}, model_dir)
+        # saves never waited for the disk
+        assert time.perf_counter() - start < 0.2
+        writer.flush()
+        assert written[-1] == 9 and len(written) < 10
+
+        monkeypatch.setattr(checkpoint, 'write_checkpoint',
+                            lambda *args: 1 / 0)
+        writer.save({'step': 10}, model_dir)
+        try:
+            writer.flush()
+            assert False, "write error not raised"
+        except RuntimeError as e:
+            assert 'division by zero' in str(e)
+        writer.close()
+    finally:
+        shutil.rmtree(model_dir)
+
+
+def test_model_checkpoint_writer():
+    """
+    Test MPNNPOMModel checkpoints through a writer and restores full and
+    weights-only checkpoints
+    """
+    model_dir = tempfile.mkdtemp()
+    try:
+        dataset = CSVLoader(tasks=TASKS,
+                            feature_field='smiles',
+                            featurizer=GraphFeaturizer()).create_dataset(
+                                INPUT_FILE)
+        writer = CheckpointWriter()
+        model = MPNNPOMModel(n_tasks=len(TASKS),
+                             batch_size=2,
+                             mode='classification',
+                             device_name='cpu',
+                             model_dir=model_dir,
+                             checkpoint_writer=writer)
+        model.fit(dataset, nb_epoch=1, max_checkpoints_to_keep=1)
+
+        restored = MPNNPOMModel(n_tasks=len(TASKS),
+                                batch_size=2,
+                                mode='classification',
+                                device_name='cpu',
+                                model_dir=model_dir)
+        # restore from a model sharing the writer waits for the write
+        model.restore()
+        restored.restore()
+        assert restored._global_step == model._global_step
+        for (name, param), restored_param in zip(
+                model.model.state_dict().items(),
+                restored.model.state_dict().values()):
+            assert torch.equal(param, restored_param), name
+
+        torch.save({'model_state_dict': model.model.state_dict()},
+                   os.path.join(model_dir, 'weights.pt'))
+        weights_only = MPNNPOMModel(n_tasks=len(TASKS),
+                                    batch_size=2,
+                                    mode='classification',
+                                    device_name='cpu')
+        weights_only.restore(os.path.join(model_dir, 'weights.pt'))
+        for param, restored_param in zip(
+                model.model.parameters(), weights_only.model.parameters()):
+            assert torch.equal(param, restored_param)
+        writer.close()
+    finally:
+        shutil.rmtree(model_dir)
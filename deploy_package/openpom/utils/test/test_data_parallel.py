@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import functools
+from collections import deque
+import numpy as np
+import torch
+import deepchem as dc
+from deepchem.data.data_loader import CSVLoader
+from openpom.feat.graph_featurizer import GraphFeaturizer
+from openpom.models.mpnn_pom import MPNNPOMModel
+from openpom.utils.data_utils import get_class_imbalance_ratio
+from openpom.utils.data_parallel import DataParallelTrainer, shard_batches
+
+TASKS = ['fruity', 'green', 'herbal', 'sweet', 'woody']
+INPUT_FILE = 'openpom/models/test/assets/test_dataset_sample_7.csv'
+
+
+def test_shard_batches():
+    """
+    Test batches are split in contiguous slices covering the batch once,
+    and small batches are replicated
+    """
+    X = np.arange(10)
+    y = np.arange(10) * 2
+    batches = [([X], [y], [None]), ([X[:3]], [y[:3]], [None])]
+    slices = {0: [], 1: []}
+    for rank in range(3):
+        fractions = deque()
+        for i, (inputs, labels, weights) in enumerate(
+                shard_batches(batches, rank, 3, fractions)):
+            slices[i].append((inputs[0], labels[0], fractions.popleft()))
+            assert weights == [None]
+
+    assert np.array_equal(np.concatenate([s[0] for s in slices[0]]), X)
+    assert np.array_equal(np.concatenate([s[1] for s in slices[0]]), y)
+    assert np.isclose(sum(s[2] for s in slices[0]), 1.0)
+    # the 3 molecule batch is too small to split over 3 ranks
+    for inputs, labels, fraction in slices[1]:
+        assert np.array_equal(inputs, X[:3])
+        assert np.isclose(fraction, 1 / 3)
+
+
+def test_data_parallel_trainer():
+    """
+    Test data parallel training takes the steps of single process training
+    and writes checkpoints the model can restore
+    """
+    loader = CSVLoader(tasks=TASKS,
+                       feature_field='smiles',
+                       featurizer=GraphFeaturizer())
+    dataset = loader.create_dataset(inputs=[INPUT_FILE])
+    model_dir = tempfile.mkdtemp()
+    # batches of 3 molecules are replicated on both processes, each
+    # gradient is averaged back to the single process gradient
+    builder = functools.partial(
+        MPNNPOMModel,
+        n_tasks=len(TASKS),
+        batch_size=3,
+        learning_rate=dc.models.optimizers.ExponentialDecay(0.001,
+                                                            0.5,
+                                                            2,
+                                                            staircase=True),
+        class_imbalance_ratio=get_class_imbalance_ratio(dataset),
+        mode='classification',
+        n_classes=1,
+        device_name='cpu')
+    try:
+        torch.manual_seed(0)
+        reference = builder()
+        model = builder(model_dir=model_dir)
+        model.model.load_state_dict(reference.model.state_dict())
+
+        reference.fit(dataset,
+                      nb_epoch=3,
+                      deterministic=True,
+                      checkpoint_interval=0)
+        with DataParallelTrainer(n_workers=2,
+                                 threads_per_worker=1) as trainer:
+            loss = trainer.fit(model,
+                               builder,
+                               dataset,
+                               nb_epoch=2,
+                               deterministic=True,
+                               checkpoint_interval=1)
+            # replicas pick up the state of the model between calls
+            loss = trainer.fit(model,
+                               builder,
+                               dataset,
+                               nb_epoch=1,
+                               deterministic=True,
+                               checkpoint_interval=1)
+        assert np.isfinite(loss)
+
+        assert model._global_step == reference._global_step
+        assert model._lr_schedule.get_last_lr() == \
+            reference._lr_schedule.get_last_lr()
+        for param, reference_param in zip(model.model.parameters(),
+                                          reference.model.parameters()):
+            assert torch.allclose(param, reference_param, atol=1e-5)
+
+        assert os.path.exists(os.path.join(model_dir, 'checkpoint1.pt'))
+        restored = builder(model_dir=model_dir)
+        restored.restore()
+        assert restored._global_step == model._global_step
+        assert np.allclose(restored.predict(dataset),
+                           model.predict(dataset),
+                           atol=1e-6)
+    finally:
+        shutil.rmtree(model_dir)
@@ -1,8 +1,14 @@
+import os
+import gc
+import time
+import numpy as np
+import pytest
 from deepchem.data.data_loader import CSVLoader
-from deepchem.data.datasets import DiskDataset
+from deepchem.data.datasets import DiskDataset, NumpyDataset
 from openpom.feat.graph_featurizer import GraphFeaturizer
 from openpom.utils.data_utils import get_class_imbalance_ratio
 from openpom.utils.data_utils import IterativeStratifiedSplitter
+from openpom.utils.data_utils import iterative_stratification
 
 TASKS = [
     'alcoholic', 'aldehydic', 'alliaceous', 'almond', 'amber', 'animal',
@@ -110,3 +116,137 @@ def test_IS_split_kfold():
     assert len(folds_list[0]) == 2
     assert isinstance(folds_list[0][0], DiskDataset)
     assert isinstance(folds_list[0][1], DiskDataset)
+
+
+def make_label_dataset(n_samples=600, n_tasks=20, seed=0):
+    """NumpyDataset with random sparse labels and integer features"""
+    rng = np.random.RandomState(seed)
+    y = (rng.rand(n_samples, n_tasks) < rng.uniform(0.02, 0.3,
+                                                    n_tasks)).astype(float)
+    return NumpyDataset(np.arange(n_samples), y, ids=np.arange(n_samples))
+
+
+def test_IS_split_indices():
+    """
+    Test split indices cover the dataset once and are reproducible with
+    a seed
+    """
+    dataset = make_label_dataset()
+    splitter = IterativeStratifiedSplitter(order=2)
+
+    train, valid, test = splitter.split(dataset,
+                                        frac_train=0.7,
+                                        frac_valid=0.2,
+                                        frac_test=0.1,
+                                        seed=0)
+    assert np.array_equal(np.sort(np.concatenate([train, valid, test])),
+                          np.arange(len(dataset)))
+    assert round(len(train) / len(dataset), 1) == 0.7
+    assert round(len(valid) / len(dataset), 1) == 0.2
+    # labels of every task are spread like the samples
+    positives = dataset.y.sum(axis=0)
+    assert np.all(np.abs(dataset.y[train].sum(axis=0) - 0.7 * positives)
+                  <= np.maximum(2, 0.1 * positives))
+
+    again = splitter.split(dataset,
+                           frac_train=0.7,
+                           frac_valid=0.2,
+                           frac_test=0.1,
+                           seed=0)
+    assert all(np.array_equal(a, b) for a, b in zip(again,
+                                                     (train, valid, test)))
+
+    folds = splitter.k_fold_indices(dataset, k=3, seed=0)
+    assert np.array_equal(np.sort(np.concatenate([cv for _, cv in folds])),
+                          np.arange(len(dataset)))
+    for train_indices, cv_indices in folds:
+        assert len(np.intersect1d(train_indices, cv_indices)) == 0
+        assert len(train_indices) + len(cv_indices) == len(dataset)
+
+
+def test_IS_split_in_memory():
+    """
+    Test memory mode returns views and disk mode removes its temporary
+    directories with the datasets
+    """
+    dataset = make_label_dataset(n_samples=200)
+    splitter = IterativeStratifiedSplitter(order=2, in_memory=True)
+    folds = splitter.k_fold_split(dataset, k=2, seed=0)
+    assert isinstance(folds[0][0], NumpyDataset)
+    assert np.array_equal(folds[0][1].y, dataset.y[folds[0][1].X])
+
+    disk_dataset = DiskDataset.from_numpy(dataset.X, dataset.y)
+    splitter = IterativeStratifiedSplitter(order=2)
+    train, test = splitter.train_test_split(disk_dataset,
+                                            frac_train=0.8,
+                                            seed=0)
+    assert isinstance(train, DiskDataset)
+    assert np.array_equal(train.y, dataset.y[train.X])
+    data_dir = train.data_dir
+    assert os.path.isdir(data_dir)
+    del train
+    gc.collect()
+    assert not os.path.exists(data_dir)
+
+
+def pair_deviation(y, parts, fractions):
+    """Sum of the absolute deviations of the label pair counts of the
+    parts from their expected counts"""
+    y = y.astype(float)
+    total = np.triu(y.T @ y)
+    return sum(
+        np.abs(np.triu(y[part].T @ y[part]) - fraction * total).sum()
+        for part, fraction in zip(parts, fractions))
+
+
+def test_iterative_stratification():
+    """
+    Test parts cover the samples once, with the requested sizes, and are
+    reproducible with a seed
+    """
+    y = make_label_dataset(n_samples=500).y
+    y[:20] = 0
+    fractions = [0.5, 0.3, 0.2]
+    parts = iterative_stratification(y, fractions, seed=1)
+    assert np.array_equal(np.sort(np.concatenate(parts)), np.arange(500))
+    for part, fraction in zip(parts, fractions):
+        assert abs(len(part) - fraction * 500) <= 3
+        assert np.array_equal(part, np.sort(part))
+    again = iterative_stratification(y, fractions, seed=1)
+    assert all(np.array_equal(a, b) for a, b in zip(parts, again))
+
+    # only unlabeled samples
+    parts = iterative_stratification(np.zeros((10, 3)), [0.8, 0.2], seed=0)
+    assert [len(part) for part in parts] == [8, 2]
+
+    # no samples
+    parts = iterative_stratification(np.zeros((0, 3)), [0.8, 0.2], seed=0)
+    assert [len(part) for part in parts] == [0, 0]
+
+
+def test_iterative_stratification_balance():
+    """
+    Test label pairs are spread at least as evenly as by skmultilearn
+    """
+    model_selection = pytest.importorskip('skmultilearn.model_selection')
+    y = make_label_dataset(n_samples=1000, n_tasks=30).y
+    fractions = [0.2] * 5
+    np.random.seed(0)
+    stratifier = model_selection.IterativeStratification(
+        n_splits=5, order=2, sample_distribution_per_fold=fractions)
+    reference = [part for _, part in stratifier.split(y, y)]
+    parts = iterative_stratification(y, fractions, seed=0)
+    assert pair_deviation(y, parts, fractions) <= \
+        pair_deviation(y, reference, fractions)
+
+
+def test_iterative_stratification_scale():
+    """
+    Test 10^5 molecules with 138 sparse labels are stratified in seconds
+    """
+    rng = np.random.RandomState(0)
+    y = rng.rand(100000, len(TASKS)) < rng.uniform(0.001, 0.05, len(TASKS))
+    start = time.time()
+    parts = iterative_stratification(y, [0.8, 0.2], seed=0)
+    assert time.time() - start < 60
+    assert [len(part) for part in parts] == [80000, 20000]
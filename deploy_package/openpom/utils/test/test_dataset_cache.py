@@ -0,0 +1,96 @@
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import deepchem as dc
+from deepchem.data.data_loader import CSVLoader
+from openpom.feat.graph_featurizer import GraphFeaturizer
+from openpom.utils.dataset_cache import DatasetCache, featurizer_key
+
+TASKS = ['fruity', 'green', 'herbal', 'sweet', 'woody']
+INPUT_FILE = 'openpom/utils/test/assets/test_dataset_sample_7.csv'
+
+
+def test_dataset_cache_matches_csv_loader():
+    """
+    Test cached featurization gives the same dataset as CSVLoader
+    """
+    cache_dir = tempfile.mkdtemp()
+    try:
+        featurizer = GraphFeaturizer()
+        expected = CSVLoader(tasks=TASKS,
+                             feature_field='smiles',
+                             featurizer=featurizer).create_dataset(INPUT_FILE)
+        for _ in range(2):  # featurized, then loaded from cache
+            dataset = DatasetCache(cache_dir).load_csv(INPUT_FILE, TASKS,
+                                                       'smiles', featurizer)
+            assert dataset.tasks.tolist() == TASKS
+            assert np.array_equal(dataset.ids, expected.ids)
+            assert np.array_equal(dataset.y, expected.y)
+            assert np.array_equal(dataset.w, expected.w)
+            for graph, expected_graph in zip(dataset.X, expected.X):
+                assert np.array_equal(graph.node_features,
+                                      expected_graph.node_features)
+                assert np.array_equal(graph.edge_index,
+                                      expected_graph.edge_index)
+                assert graph.node_features.dtype == np.float32
+                assert graph.edge_features.dtype == np.float32
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_dataset_cache_appended_rows():
+    """
+    Test appending molecules only featurizes the new rows
+    """
+    cache_dir = tempfile.mkdtemp()
+    try:
+        df = pd.read_csv(INPUT_FILE)
+        first_file = f'{cache_dir}/first.csv'
+        df.iloc[:4].to_csv(first_file, index=False)
+        cache = DatasetCache(cache_dir)
+        cache.load_csv(first_file, TASKS, 'smiles', GraphFeaturizer())
+
+        class CountingFeaturizer(GraphFeaturizer):
+            featurized = []
+
+            def featurize(self, datapoints, **kwargs):
+                self.featurized.extend(datapoints)
+                return super().featurize(datapoints, **kwargs)
+
+        featurizer = CountingFeaturizer()
+        # same configuration as the cached rows, only the class differs
+        features = cache.featurize(df['smiles'].tolist(),
+                                   featurizer,
+                                   feat_key=featurizer_key(GraphFeaturizer()))
+        assert len(features) == len(df)
+        assert featurizer.featurized == df['smiles'].tolist()[4:]
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_dataset_cache_folds():
+    """
+    Test fold splits are cached by seed
+    """
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = DatasetCache(cache_dir)
+        dataset = cache.load_csv(INPUT_FILE, TASKS, 'smiles',
+                                 GraphFeaturizer())
+        splitter = dc.splits.RandomStratifiedSplitter()
+        folds = cache.k_fold_split(dataset, splitter, k=2, seed=0)
+        cached = DatasetCache(cache_dir)
+        dataset = cached.load_csv(INPUT_FILE, TASKS, 'smiles',
+                                  GraphFeaturizer())
+        cached_folds = cached.k_fold_split(dataset, splitter, k=2, seed=0)
+
+        assert len(folds) == len(cached_folds) == 2
+        for (train, valid), (cached_train, cached_valid) in zip(
+                folds, cached_folds):
+            assert np.array_equal(train.ids, cached_train.ids)
+            assert np.array_equal(valid.ids, cached_valid.ids)
+            assert sorted(train.ids.tolist() +
+                          valid.ids.tolist()) == sorted(dataset.ids.tolist())
+    finally:
+        shutil.rmtree(cache_dir)
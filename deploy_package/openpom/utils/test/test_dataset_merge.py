@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import pandas as pd
+from openpom.utils.dataset_merge import (DatasetMerger, MergeSource,
+                                         canonicalize_smiles,
+                                         nonstereo_smiles)
+
+TASKS = ['fruity', 'green', 'herbal', 'odorless', 'sweet', 'woody']
+
+
+def test_canonicalize_smiles():
+    """
+    Test stereo marks are removed and workers give the serial result
+    """
+    assert nonstereo_smiles('C[C@@H](O)CN') == nonstereo_smiles('CC(O)CN')
+    assert nonstereo_smiles('CC/C=C\\CC') == 'CCC=CCC'
+    assert nonstereo_smiles('not a smiles') is None
+    smiles = ['C[C@@H](O)CN', 'OCC', 'xx', 'c1ccccc1O', 'CCC/C=C(\\C)/C=O']
+    assert canonicalize_smiles(smiles, n_workers=2, chunk_size=2) == \
+        [nonstereo_smiles(s) for s in smiles]
+
+
+def test_dataset_merger():
+    """
+    Test sources are merged by molecule, and reruns only process new or
+    changed rows and keep the molecule order
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        first = os.path.join(tmp_dir, 'first.csv')
+        second = os.path.join(tmp_dir, 'second.csv')
+        pd.DataFrame({
+            'smiles': ['C[C@@H](O)CN', 'OCC', 'CCCC', 'xx'],
+            'desc': ['green;odorless', 'fruity', 'unknown', 'sweet'],
+        }).to_csv(first, index=False)
+        pd.DataFrame({
+            'SMILES': ['C[C@H](O)CN', 'CCOC(C)=O', 'CC(O)CN'],
+            'labels': ['Sweet', 'fruity;sweet', 'woody'],
+        }).to_csv(second, index=False)
+        sources = [
+            MergeSource('first', first, 'smiles', 'desc'),
+            MergeSource('second', second, 'SMILES', 'labels'),
+        ]
+        merger = DatasetMerger(os.path.join(tmp_dir, 'index'), TASKS)
+        result = merger.merge(sources)
+        dataset = result.dataset
+        assert dataset.columns.tolist() == \
+            ['nonStereoSMILES', 'descriptors'] + TASKS
+        assert dataset['nonStereoSMILES'].tolist() == \
+            ['CC(O)CN', 'CCO', 'CCOC(C)=O']
+        assert dataset['descriptors'].tolist() == \
+            ['green;sweet;woody', 'fruity', 'fruity;sweet']
+        assert dataset[TASKS].to_numpy().sum() == 6
+
+        stats = result.stats
+        assert stats['sources']['first']['invalid_smiles'] == 1
+        assert stats['sources']['first']['unknown_descriptors'] == \
+            {'unknown': 1}
+        assert stats['sources']['second']['canonicalized'] == 3
+        assert stats['unlabeled_molecules_dropped'] == 1
+        assert stats['odorless_dropped'] == 1
+        assert stats['multi_source_molecules'] == 1
+        assert stats['duplicate_rows_merged'] == 2
+
+        # unchanged sources are not read again
+        result = merger.merge(sources)
+        assert result.dataset.equals(dataset)
+        assert result.stats['sources']['first']['canonicalized'] == 0
+
+        # a changed and a new row are canonicalized, the others reused,
+        # new molecules go after the existing ones
+        pd.DataFrame({
+            'SMILES': ['CCCCCC', 'CCOC(C)=O', 'CC(O)CN'],
+            'labels': ['herbal', 'fruity', 'woody'],
+        }).to_csv(second, index=False)
+        result = merger.merge(sources)
+        stats = result.stats['sources']['second']
+        assert (stats['new_rows'], stats['removed_rows'],
+                stats['canonicalized']) == (2, 2, 2)
+        assert result.dataset['nonStereoSMILES'].tolist() == \
+            dataset['nonStereoSMILES'].tolist() + ['CCCCCC']
+        assert result.dataset['descriptors'].tolist()[:3] == \
+            ['green;woody', 'fruity', 'fruity']
+        assert result.stats['new_molecules'] == 1
+
+        # without an index, the order is taken from the existing output
+        output = os.path.join(tmp_dir, 'merged.csv')
+        DatasetMerger.write(
+            result._replace(dataset=result.dataset.iloc[::-1]), output)
+        merger = DatasetMerger(os.path.join(tmp_dir, 'new_index'), TASKS)
+        reordered = merger.merge(sources, output=output).dataset
+        assert reordered['nonStereoSMILES'].tolist() == \
+            result.dataset['nonStereoSMILES'].tolist()[::-1]
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pytest
+from deepchem.data.data_loader import CSVLoader
+from openpom.feat.graph_featurizer import GraphFeaturizer
+from openpom.utils.label_store import LabelStore, write_label_store
+
+TASKS = ['fruity', 'green', 'herbal', 'sweet', 'woody']
+INPUT_FILE = 'openpom/utils/test/assets/test_dataset_sample_7.csv'
+CURATED_FILE = \
+    'openpom/data/curated_datasets/curated_GS_LF_merged_4983.csv'
+
+
+def test_label_store_labels():
+    """
+    Test label matrices, task subsets and co-occurrence counts match the
+    CSV, with 138 tasks packed to 18 bytes per molecule
+    """
+    store_dir = tempfile.mkdtemp()
+    try:
+        df = pd.read_csv(CURATED_FILE)
+        tasks = df.columns[2:].tolist()
+        store = LabelStore.from_csv(CURATED_FILE, store_dir)
+        assert store.tasks == tasks
+        assert len(store) == len(df)
+        assert store.labels.shape == (len(df), 18)
+        assert isinstance(store.labels, np.memmap)
+
+        y = df[tasks].to_numpy().astype(float)
+        assert np.array_equal(store.y(), y)
+        subset = ['woody', 'fruity', 'musk']
+        indices = np.array([4, 0, 100, 4982])
+        assert np.array_equal(store.y(subset, indices),
+                              df.loc[indices, subset].to_numpy())
+        assert np.array_equal(store.cooccurrence(), (y.T @ y).astype(int))
+        assert np.array_equal(
+            store.cooccurrence(subset, chunk_size=1000),
+            (y[:, [tasks.index(t) for t in subset]].T @
+             y[:, [tasks.index(t) for t in subset]]).astype(int))
+        assert store.smiles([0, 4982]) == \
+            df['nonStereoSMILES'].iloc[[0, 4982]].tolist()
+        with pytest.raises(KeyError):
+            store.y(['not a task'])
+        with pytest.raises(ValueError):
+            store.graphs()
+    finally:
+        shutil.rmtree(store_dir)
+
+
+def test_label_store_graphs():
+    """
+    Test stored graphs and canonical SMILES, and the store is converted
+    again only when the CSV changes
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        featurizer = GraphFeaturizer()
+        csv_file = os.path.join(tmp_dir, 'data.csv')
+        df = pd.read_csv(INPUT_FILE)
+        df.loc[len(df)] = ['not a smiles', 1, 0, 0, 0, 0]
+        df.to_csv(csv_file, index=False)
+        store_dir = os.path.join(tmp_dir, 'store')
+        store = LabelStore.from_csv(csv_file,
+                                    store_dir,
+                                    canonicalize=True,
+                                    featurizer=featurizer)
+        assert store.tasks == TASKS
+        assert store.canonical_smiles([0]) == ['CC(O)C1CCCCC1']
+
+        expected = CSVLoader(tasks=TASKS,
+                             feature_field='smiles',
+                             featurizer=featurizer).create_dataset(csv_file)
+        dataset = store.to_dataset()
+        assert len(dataset) == len(df) - 1
+        assert store.graphs([len(df) - 1]) == [None]
+        assert np.array_equal(dataset.ids, expected.ids)
+        assert np.array_equal(dataset.y, expected.y)
+        for graph, expected_graph in zip(dataset.X, expected.X):
+            assert np.array_equal(graph.node_features,
+                                  expected_graph.node_features)
+            assert np.array_equal(graph.edge_index, expected_graph.edge_index)
+            assert np.array_equal(graph.edge_features,
+                                  expected_graph.edge_features)
+        assert np.array_equal(
+            store.to_dataset(['sweet'], np.array([1, 0])).y,
+            expected.y[[1, 0]][:, [3]])
+
+        written = os.path.getmtime(os.path.join(store_dir, 'meta.json'))
+        store = LabelStore.from_csv(csv_file, store_dir)
+        assert os.path.getmtime(os.path.join(store_dir,
+                                             'meta.json')) == written
+        assert store.meta['canonical']
+
+        df.iloc[:3].to_csv(csv_file, index=False)
+        store = LabelStore.from_csv(csv_file, store_dir)
+        assert len(store) == 3
+        assert np.array_equal(store.y(), df[TASKS].iloc[:3].to_numpy())
+
+        df.loc[0, 'fruity'] = 2
+        df.to_csv(csv_file, index=False)
+        with pytest.raises(ValueError):
+            write_label_store(csv_file, store_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -1,5 +1,5 @@
 import torch
-from openpom.utils.loss import CustomMultiLabelLoss
+from openpom.utils.loss import CustomMultiLabelLoss, l1_l2_penalty
 
 
 def test_custom_multilabel_loss_sum():
@@ -53,3 +53,90 @@ def test_custom_multilabel_no_class_imbalance():
     assert torch.allclose(computed_loss,
                           torch.Tensor([[0.7064, 0.7064, 0.7064]]),
                           atol=0.001)
+
+
+def test_custom_multilabel_loss_soft_labels():
+    """
+    Test CustomMultiLabelLoss with soft target probabilities
+    """
+    class_imbalance_ratio = [1.0, 0.5, 0.25]
+    loss = CustomMultiLabelLoss(class_imbalance_ratio, loss_aggr_type='sum')
+    loss_fn = loss._create_pytorch_loss()
+    sample_output = torch.Tensor([[[0.75], [0.25],
+                                   [0.90]]])  # shape: (1, 3, 1)
+
+    # hard labels given as probabilities match integer labels
+    hard_target = torch.Tensor([[1.0, 0.0, 0.0]])
+    assert torch.allclose(loss_fn(sample_output, hard_target),
+                          torch.Tensor([[0.7822, 0.7822, 0.7822]]),
+                          atol=0.001)
+
+    # soft labels interpolate between the two hard targets
+    soft_target = torch.Tensor([[0.5, 0.5, 0.5]])
+    ones_loss = loss_fn(sample_output, torch.ones(1, 3))
+    zeros_loss = loss_fn(sample_output, torch.zeros(1, 3))
+    computed_loss = loss_fn(sample_output, soft_target)
+    assert computed_loss.shape == (1, 3)
+    assert torch.allclose(computed_loss, (ones_loss + zeros_loss) / 2)
+
+
+def test_custom_multilabel_loss_gradients():
+    """
+    Test CustomMultiLabelLoss against the two-class cross-entropy it fuses,
+    values and gradients
+    """
+    torch.manual_seed(0)
+    class_imbalance_ratio = [1.0, 0.5, 0.25, 0.1]
+    logits = torch.randn(6, 4, 1)
+    labels = torch.rand(6, 4)
+    ce_loss_fn = torch.nn.CrossEntropyLoss(reduction='none')
+
+    for loss_aggr_type in ['sum', 'mean']:
+        loss = CustomMultiLabelLoss(class_imbalance_ratio,
+                                    loss_aggr_type=loss_aggr_type)
+        loss_fn = loss._create_pytorch_loss()
+
+        output = logits.clone().requires_grad_(True)
+        computed_loss = loss_fn(output, labels)
+        computed_loss.mean().backward()
+
+        reference_output = logits.clone().requires_grad_(True)
+        positive = reference_output.permute(0, 2, 1)[:, 0, :]
+        ce_loss = ce_loss_fn(torch.stack([1 - positive, positive], dim=1),
+                             torch.stack([1 - labels, labels], dim=1))
+        balanced_losses = ce_loss * torch.log(
+            1 + torch.Tensor(class_imbalance_ratio))
+        reference_loss = balanced_losses.sum(dim=1) \
+            if loss_aggr_type == 'sum' else balanced_losses.mean(dim=1)
+        reference_loss = reference_loss.unsqueeze(-1).repeat(1, 4)
+        reference_loss.mean().backward()
+
+        assert computed_loss.shape == (6, 4)
+        assert torch.allclose(computed_loss, reference_loss, atol=1e-6)
+        assert torch.allclose(output.grad, reference_output.grad, atol=1e-6)
+
+
+def test_l1_l2_penalty():
+    """
+    Test l1_l2_penalty against torch.norm, values and gradients
+    """
+    torch.manual_seed(0)
+    params = [
+        torch.randn(4, 3, requires_grad=True),
+        torch.randn(5, requires_grad=True),
+        torch.zeros(2, 2, requires_grad=True)
+    ]
+    penalty = l1_l2_penalty(params, weight_decay=0.1)
+    penalty.backward()
+    grads = [param.grad.clone() for param in params]
+    for param in params:
+        param.grad = None
+
+    reference = sum(0.1 * (torch.norm(param, p=1) + torch.norm(param, p=2))
+                    for param in params)
+    reference.backward()
+
+    assert torch.allclose(penalty, reference)
+    for grad, param in zip(grads, params):
+        assert torch.allclose(grad, param.grad)
+    assert l1_l2_penalty([], weight_decay=0.1) == 0
@@ -0,0 +1,41 @@
+import warnings
+import numpy as np
+import deepchem as dc
+from sklearn.metrics import roc_auc_score
+from openpom.utils.metrics import mean_roc_auc, roc_auc_per_task
+
+
+def test_roc_auc_per_task():
+    """
+    Test vectorized ROC-AUC matches sklearn on every task, with ties
+    """
+    rng = np.random.RandomState(0)
+    y_true = (rng.rand(200, 138) < 0.1).astype(float)
+    # rounded predictions give many tied scores
+    y_pred = np.round(rng.rand(200, 138) * 0.5 + 0.5 * y_true, 1)
+    expected = [
+        roc_auc_score(y_true[:, task], y_pred[:, task]) for task in range(138)
+    ]
+    assert np.allclose(roc_auc_per_task(y_true, y_pred), expected)
+    assert np.allclose(roc_auc_per_task(y_true, y_pred[:, :, None]),
+                       expected)
+
+
+def test_mean_roc_auc_matches_deepchem():
+    """
+    Test mean ROC-AUC matches deepchem's roc_auc_score metric, including
+    NaN for tasks with a single class
+    """
+    rng = np.random.RandomState(1)
+    y_true = (rng.rand(50, 5) < 0.3).astype(float)
+    y_pred = rng.rand(50, 5)
+    metric = dc.metrics.Metric(dc.metrics.roc_auc_score)
+    assert np.isclose(mean_roc_auc(y_true, y_pred),
+                      metric.compute_metric(y_true, y_pred))
+
+    y_true[:, 2] = 0
+    assert np.isnan(roc_auc_per_task(y_true, y_pred)[2])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        assert np.isnan(metric.compute_metric(y_true, y_pred))
+    assert np.isnan(mean_roc_auc(y_true, y_pred))
@@ -7,191 +7,1046 @@
 import deepchem as dc
 from openpom.feat.graph_featurizer import GraphFeaturizer, GraphConvConstants
 from openpom.utils.data_utils import get_class_imbalance_ratio
-from openpom.models.mpnn_pom import MPNNPOMModel
+from openpom.utils.batch_planner import BatchPlanner
+from openpom.models.mpnn_pom import MPNNPOMModel, PRECISIONS
+import dgl
 import torch
 import numpy as np
 import pandas as pd
 import os
+import gc
+import json
+import hashlib
+import logging
 import warnings
+import time
+import threading
+import platform
+import psutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, ExitStack
+from datetime import datetime
+from rdkit import Chem
+from rdkit.Chem import rdmolfiles, rdmolops
+
+logger = logging.getLogger(__name__)
+
+# 集成模型的网络结构超参数（与训练时保持一致）
+DEFAULT_MODEL_PARAMS = {
+    'node_out_feats': 100,
+    'edge_hidden_feats': 75,
+    'edge_out_feats': 100,
+    'num_step_message_passing': 5,
+    'mpnn_residual': True,
+    'message_aggregator_type': 'sum',
+    'readout_type': 'set2set',
+    'num_step_set2set': 3,
+    'num_layer_set2set': 2,
+    'ffn_hidden_list': [392, 392],
+    'ffn_embeddings': 256,
+    'ffn_activation': 'relu',
+    'ffn_dropout_p': 0.12,
+    'ffn_dropout_at_input_no_act': False,
+    'weight_decay': 1e-5,
+    'self_loop': False,
+}
+
+# 模型目录中可选的配置文件，用于覆盖默认结构（如蒸馏得到的小模型）
+MODEL_CONFIG_FILE = 'model_config.json'
+DEFAULT_CHECKPOINT_NAME = 'checkpoint2.pt'
+
+# 模型层级: full为10模型集成，fast为蒸馏得到的单个学生模型
+MODEL_TIERS = {
+    'full': {'dir_name': 'experiments_', 'n_models': 10},
+    'fast': {'dir_name': 'distilled_', 'n_models': 1},
+}
+
+# 模型注册表中每个集成模型的清单文件（见model_registry.py）
+MANIFEST_FILE = 'manifest.json'
+
+# 旧布局（未使用注册表）时搜索模型目录的位置
+MODEL_SEARCH_ROOTS = [
+    './ensemble_models/',
+    '../ensemble_models/',
+    './examples/ensemble_models/',
+    '../examples/ensemble_models/',
+    '../../ensemble_models/',
+    '/opt/models/ensemble_models/',  # 服务器常用路径
+    '/app/models/ensemble_models/',   # Docker容器常用路径
+]
+
+# 138个气味任务 (完整版本)
+ODOR_TASKS = [
+    'alcoholic', 'aldehydic', 'alliaceous', 'almond', 'amber', 'animal',
+    'anisic', 'apple', 'apricot', 'aromatic', 'balsamic', 'banana', 'beefy',
+    'bergamot', 'berry', 'bitter', 'black currant', 'brandy', 'burnt',
+    'buttery', 'cabbage', 'camphoreous', 'caramellic', 'cedar', 'celery',
+    'chamomile', 'cheesy', 'cherry', 'chocolate', 'cinnamon', 'citrus', 'clean',
+    'clove', 'cocoa', 'coconut', 'coffee', 'cognac', 'cooked', 'cooling',
+    'cortex', 'coumarinic', 'creamy', 'cucumber', 'dairy', 'dry', 'earthy',
+    'ethereal', 'fatty', 'fermented', 'fishy', 'floral', 'fresh', 'fruit skin',
+    'fruity', 'garlic', 'gassy', 'geranium', 'grape', 'grapefruit', 'grassy',
+    'green', 'hawthorn', 'hay', 'hazelnut', 'herbal', 'honey', 'hyacinth',
+    'jasmin', 'juicy', 'ketonic', 'lactonic', 'lavender', 'leafy', 'leathery',
+    'lemon', 'lily', 'malty', 'meaty', 'medicinal', 'melon', 'metallic',
+    'milky', 'mint', 'muguet', 'mushroom', 'musk', 'musty', 'natural', 'nutty',
+    'odorless', 'oily', 'onion', 'orange', 'orangeflower', 'orris', 'ozone',
+    'peach', 'pear', 'phenolic', 'pine', 'pineapple', 'plum', 'popcorn',
+    'potato', 'powdery', 'pungent', 'radish', 'raspberry', 'ripe', 'roasted',
+    'rose', 'rummy', 'sandalwood', 'savory', 'sharp', 'smoky', 'soapy',
+    'solvent', 'sour', 'spicy', 'strawberry', 'sulfurous', 'sweaty', 'sweet',
+    'tea', 'terpenic', 'tobacco', 'tomato', 'tropical', 'vanilla', 'vegetable',
+    'vetiver', 'violet', 'warm', 'waxy', 'weedy', 'winey', 'woody'
+]
+
+# 热加载时用于验证新集成模型的冒烟测试分子
+SMOKE_TEST_SMILES = [
+    'CCO',  # 乙醇
+    'CC(=O)OCC',  # 乙酸乙酯
+    'c1ccc(cc1)O',  # 苯酚
+    'CC(C)=CCCC(C)=CC=O',  # 柠檬醛
+    'COc1cc(C=O)ccc1O',  # 香兰素
+    'CC1=CCC(CC1)C(C)=C',  # 柠檬烯
+    'CCCCCCCCCC(=O)O',  # 癸酸
+    'CSC',  # 二甲硫醚
+]
+
+# 预测流水线的各个阶段，供监控与性能分析钩子使用
+# batch阶段包含to_dgl_graph与dgl_batch两个子阶段
+PREDICTION_STAGES = ('parse', 'featurize', 'batch', 'to_dgl_graph', 'dgl_batch',
+                     'forward', 'reduce')
+
+
+_cpu_mode_lock = threading.Lock()
+_cpu_mode_set = False
+
+
+def force_cpu_mode():
+    """
+    禁用CUDA并将PyTorch默认设备设为CPU
+
+    每个进程只设置一次：注册表在请求线程中创建其他模型的预测器时，
+    重复调用torch.set_default_device会因设备上下文属于其他线程而失败
+    """
+    global _cpu_mode_set
+    with _cpu_mode_lock:
+        if _cpu_mode_set:
+            return
+        # 设置环境变量，禁用CUDA
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+        # 确保PyTorch使用CPU
+        torch.set_default_device('cpu')
+        _cpu_mode_set = True
+        print("✓ 强制使用CPU模式")
+
+
+def read_model_config(model_dir):
+    """
+    读取模型目录中的model_config.json（可选）
+
+    Returns:
+        (结构超参数, checkpoint文件名, train_ratios或None)
+    """
+    model_params = dict(DEFAULT_MODEL_PARAMS)
+    config_path = os.path.join(model_dir, MODEL_CONFIG_FILE)
+    if not os.path.exists(config_path):
+        return model_params, DEFAULT_CHECKPOINT_NAME, None
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+    model_params.update(config.get('model_params', {}))
+    checkpoint_name = config.get('checkpoint', DEFAULT_CHECKPOINT_NAME)
+    return model_params, checkpoint_name, config.get('train_ratios')
+
+
+def find_model_directory(tier):
+    """
+    在MODEL_SEARCH_ROOTS中搜索旧布局的模型目录
+
+    Returns:
+        模型目录前缀（如 ./ensemble_models/experiments_），未找到时返回None
+    """
+    dir_name = MODEL_TIERS[tier]['dir_name']
+    for root in MODEL_SEARCH_ROOTS:
+        path = f"{root}{dir_name}"
+        try:
+            _, checkpoint_name, _ = read_model_config(f"{path}1")
+        except Exception:
+            continue
+        if os.path.exists(f"{path}1/{checkpoint_name}"):
+            return path
+    return None
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """计算文件的sha256校验和"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    """
+    读取模型注册表清单
+
+    成员checkpoint路径相对于清单所在目录，解析为绝对路径；
+    结构超参数按 默认值 → 清单 → 成员 的顺序覆盖
+
+    Returns:
+        dict: 清单内容，members中每个成员包含model_dir、checkpoint_path、
+              model_params、train_ratios和sha256
+    """
+    path = os.path.abspath(path)
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    root = os.path.dirname(path)
+    if not manifest.get('members'):
+        raise ValueError(f"清单中没有集成成员: {path}")
+
+    members = []
+    for member in manifest['members']:
+        checkpoint_path = os.path.normpath(os.path.join(root, member['checkpoint']))
+        model_params = dict(DEFAULT_MODEL_PARAMS)
+        model_params.update(manifest.get('model_params', {}))
+        model_params.update(member.get('model_params', {}))
+        members.append({
+            'model_dir': os.path.dirname(checkpoint_path),
+            'checkpoint_path': checkpoint_path,
+            'model_params': model_params,
+            'train_ratios': member.get('train_ratios', manifest.get('train_ratios')),
+            'sha256': member.get('sha256'),
+        })
+    manifest['name'] = manifest.get('name', os.path.basename(root))
+    manifest['path'] = path
+    manifest['members'] = members
+    return manifest
+
+
+def prediction_frames(smiles_list, predictions, tasks, threshold=0.5):
+    """
+    将集成平均概率转换为预测结果数据框（本地预测与推理进程共用）
+    
+    Args:
+        smiles_list: SMILES字符串列表
+        predictions: 概率矩阵，形状为(分子数, 任务数)
+        tasks: 任务名称列表
+        threshold: 预测阈值，大于该值认为具有对应气味
+        
+    Returns:
+        (概率数据框, 二值预测数据框)
+    """
+    results = pd.DataFrame({
+        'SMILES': smiles_list,
+        **{task: predictions[:, i] for i, task in enumerate(tasks)}
+    })
+    # 添加二进制预测（基于阈值）
+    binary_results = pd.DataFrame({
+        'SMILES': smiles_list,
+        **{f'{task}_binary': (predictions[:, i] > threshold).astype(int)
+           for i, task in enumerate(tasks)}
+    })
+    return results, binary_results
+
+
+def top_odors_frame(scores, tasks, top_k=10):
+    """按概率从高到低取前k个气味，返回包含odor和probability列的数据框"""
+    sorted_indices = np.argsort(scores)[::-1][:top_k]
+    return pd.DataFrame({
+        'odor': [tasks[i] for i in sorted_indices],
+        'probability': [scores[i] for i in sorted_indices]
+    })
+
+
+class InvalidSmilesError(ValueError):
+    """输入中包含无法解析的SMILES"""
+
+    def __init__(self, invalid_smiles):
+        self.invalid_smiles = list(invalid_smiles)
+        super().__init__(f"无法解析的SMILES: {', '.join(self.invalid_smiles)}")
+
+
+class ModelsNotReadyError(RuntimeError):
+    """集成模型尚未加载完成（后台加载模式）"""
+
+
+class ReloadInProgressError(RuntimeError):
+    """模型正在加载或重新加载"""
+
+
+class ModelEnsemble:
+    """
+    一个版本的集成模型
+    
+    预测期间通过acquire()持有引用；热加载替换版本后，
+    旧版本在所有进行中的请求结束后释放
+    """
+    
+    def __init__(self, models, fingerprint, model_dir_prefix):
+        self.models = list(models)
+        self.fingerprint = fingerprint
+        # 初始加载期间成员逐个加入，成员数也是版本的一部分
+        self.version = f'{fingerprint}.{len(self.models)}' if fingerprint else None
+        self.model_dir_prefix = model_dir_prefix
+        self.loaded_at = datetime.now().isoformat()
+        self._in_flight = 0
+        self._drained = threading.Condition()
+    
+    @contextmanager
+    def acquire(self):
+        """在预测期间持有该版本"""
+        with self._drained:
+            self._in_flight += 1
+        try:
+            yield self
+        finally:
+            with self._drained:
+                self._in_flight -= 1
+                if self._in_flight == 0:
+                    self._drained.notify_all()
+    
+    def wait_drained(self, timeout=None):
+        """等待所有使用该版本的请求结束，超时返回False"""
+        with self._drained:
+            return self._drained.wait_for(lambda: self._in_flight == 0, timeout)
+
+
+class PredictionCache:
+    """
+    按 (模型版本, SMILES) 缓存集成预测概率的LRU缓存
+    
+    模型热加载后版本变化，旧版本的结果不会再被命中
+    """
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # 可选回调 on_lookup(命中数, 未命中数)，用于监控指标
+        self.on_lookup = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_many(self, version, smiles_list):
+        """
+        Returns:
+            dict: {下标: 概率向量}，只包含命中的SMILES
+        """
+        found = {}
+        with self._lock:
+            for i, smiles in enumerate(smiles_list):
+                key = (version, smiles)
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    found[i] = value
+        if self.on_lookup is not None:
+            self.on_lookup(len(found), len(smiles_list) - len(found))
+        return found
+    
+    def put_many(self, version, smiles_list, predictions):
+        with self._lock:
+            for smiles, value in zip(smiles_list, predictions):
+                key = (version, smiles)
+                self._entries[key] = value.copy()
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def drop_other_versions(self, version):
+        """版本替换后清理旧版本的结果"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] != version]:
+                del self._entries[key]
+    
+    def __len__(self):
+        return len(self._entries)
+
 
 class OdorPredictorCPU:
-    def __init__(self, model_dir_prefix=None, n_models=10, use_cpu_only=True):
+    def __init__(self, model_dir_prefix=None, n_models=None, use_cpu_only=True,
+                 tier='full', max_atoms_per_batch=None, max_edges_per_batch=None,
+                 load_in_background=False, min_models_ready=None, load_workers=None,
+                 cache_size=0, manifest_path=None, verify_checksums=True,
+                 precision=None):
         """
         初始化气味预测器 - CPU专用版本
         
         Args:
             model_dir_prefix: 模型目录前缀，如果为None则自动搜索
-            n_models: 集成模型数量
+            n_models: 集成模型数量，None时使用模型层级的默认值
             use_cpu_only: 强制只使用CPU，默认True
+            tier: 模型层级，'full'（集成模型）或'fast'（蒸馏学生模型）
+            max_atoms_per_batch: 每批最多原子数，设置后按原子/边预算组批（见BatchPlanner）
+            max_edges_per_batch: 每批最多（有向）边数
+            load_in_background: 在后台线程中加载模型，构造函数立即返回；
+                                可通过 ready 事件或 wait_until_ready() 等待
+            min_models_ready: 加载到多少个成员后即可开始预测（其余成员在后台继续加载），
+                              None时等待全部成员
+            load_workers: 并行加载模型的线程数，None时为 min(模型数, CPU核心数)
+            cache_size: 预测结果LRU缓存的最大分子数，0表示不缓存
+            manifest_path: 模型注册表清单路径（见model_registry.py）；提供时按清单加载
+                           成员、结构超参数与任务列表，忽略model_dir_prefix和n_models
+            verify_checksums: 加载时校验清单中记录的checkpoint sha256
+            precision: 推理精度，'float32'或'bfloat16'（需CPU原生支持bf16，如AVX512-BF16/AMX）；
+                       None时按每个模型的model_params（model_config.json或注册表清单）中的
+                       precision，未指定则为float32
         """
+        if tier not in MODEL_TIERS:
+            raise ValueError(f"未知的模型层级: {tier}，可选: {list(MODEL_TIERS)}")
+        if precision is not None and precision not in PRECISIONS:
+            raise ValueError(f"未知的推理精度: {precision}，可选: {list(PRECISIONS)}")
         # 强制使用CPU
         if use_cpu_only:
-            # 设置环境变量，禁用CUDA
-            os.environ['CUDA_VISIBLE_DEVICES'] = ''
-            # 确保PyTorch使用CPU
-            torch.set_default_device('cpu')
-            print("✓ 强制使用CPU模式")
+            force_cpu_mode()
         
-        self.n_models = n_models
+        self.tier = tier
+        self.manifest_path = manifest_path
+        self.manifest = read_manifest(manifest_path) if manifest_path else None
+        self.verify_checksums = verify_checksums
+        self.precision = precision
+        if self.manifest is not None:
+            n_models = len(self.manifest['members'])
+        # 模型名称：注册表中的名称，旧布局时为模型层级
+        self.name = self.manifest['name'] if self.manifest is not None else tier
+        self.n_models = n_models if n_models is not None else MODEL_TIERS[tier]['n_models']
         self.featurizer = GraphFeaturizer()
         self.use_cpu_only = use_cpu_only
         
-        # 138个气味任务 (完整版本)
-        self.tasks = [
-            'alcoholic', 'aldehydic', 'alliaceous', 'almond', 'amber', 'animal',
-            'anisic', 'apple', 'apricot', 'aromatic', 'balsamic', 'banana', 'beefy',
-            'bergamot', 'berry', 'bitter', 'black currant', 'brandy', 'burnt',
-            'buttery', 'cabbage', 'camphoreous', 'caramellic', 'cedar', 'celery',
-            'chamomile', 'cheesy', 'cherry', 'chocolate', 'cinnamon', 'citrus', 'clean',
-            'clove', 'cocoa', 'coconut', 'coffee', 'cognac', 'cooked', 'cooling',
-            'cortex', 'coumarinic', 'creamy', 'cucumber', 'dairy', 'dry', 'earthy',
-            'ethereal', 'fatty', 'fermented', 'fishy', 'floral', 'fresh', 'fruit skin',
-            'fruity', 'garlic', 'gassy', 'geranium', 'grape', 'grapefruit', 'grassy',
-            'green', 'hawthorn', 'hay', 'hazelnut', 'herbal', 'honey', 'hyacinth',
-            'jasmin', 'juicy', 'ketonic', 'lactonic', 'lavender', 'leafy', 'leathery',
-            'lemon', 'lily', 'malty', 'meaty', 'medicinal', 'melon', 'metallic',
-            'milky', 'mint', 'muguet', 'mushroom', 'musk', 'musty', 'natural', 'nutty',
-            'odorless', 'oily', 'onion', 'orange', 'orangeflower', 'orris', 'ozone',
-            'peach', 'pear', 'phenolic', 'pine', 'pineapple', 'plum', 'popcorn',
-            'potato', 'powdery', 'pungent', 'radish', 'raspberry', 'ripe', 'roasted',
-            'rose', 'rummy', 'sandalwood', 'savory', 'sharp', 'smoky', 'soapy',
-            'solvent', 'sour', 'spicy', 'strawberry', 'sulfurous', 'sweaty', 'sweet',
-            'tea', 'terpenic', 'tobacco', 'tomato', 'tropical', 'vanilla', 'vegetable',
-            'vetiver', 'violet', 'warm', 'waxy', 'weedy', 'winey', 'woody'
-        ]
+        # 按原子/边预算组批，避免大分子批次占用过多内存；按大小排序以降低批间差异
+        self.batch_planner = None
+        if max_atoms_per_batch is not None or max_edges_per_batch is not None:
+            self.batch_planner = BatchPlanner(max_atoms=max_atoms_per_batch,
+                                              max_edges=max_edges_per_batch,
+                                              sort_by_size=True)
+        
+        # 任务列表，注册表清单中可指定（默认为138个气味任务）
+        self.tasks = list((self.manifest or {}).get('tasks') or ODOR_TASKS)
         
         self.n_tasks = len(self.tasks)
-        self.models = []
+        self.stage_hooks = []
+        self.model_hooks = []
+        self.cache = PredictionCache(cache_size) if cache_size else None
+        
+        # 加载状态：达到min_models_ready个成员后ready，全部成员处理完后loading_complete
+        self.min_models_ready = min(min_models_ready or self.n_models, self.n_models)
+        self.load_workers = load_workers
+        self.ready = threading.Event()
+        self.loading_complete = threading.Event()
+        self.load_errors = []
+        self._loaded_members = {}
+        self._models_lock = threading.Lock()
+        self._system_info = None
+        
+        # 热加载状态；on_reload(状态)在每次热加载结束时调用
+        self.requested_models = self.n_models
+        self.reload_status = {'state': 'idle'}
+        self.on_reload = None
+        self._reload_lock = threading.Lock()
+        self._closed = threading.Event()
         
         # 自动搜索模型目录
-        if model_dir_prefix is None:
+        if self.manifest is not None:
+            self.model_dir_prefix = os.path.dirname(self.manifest['path'])
+        elif model_dir_prefix is None:
             self.model_dir_prefix = self._find_model_directory()
         else:
             self.model_dir_prefix = model_dir_prefix
+        self.ensemble = ModelEnsemble([], None, self.model_dir_prefix)
         
         # 从原始训练集加载类别不平衡比例（这里用默认值，如果有保存的话可以加载）
         self.train_ratios = [1.0] * self.n_tasks  # 占位符，建议保存真实的train_ratios
         
-        print(f"使用模型目录: {self.model_dir_prefix}")
+        if self.manifest is not None:
+            print(f"使用注册表模型: {self.manifest['name']} ({self.manifest_path})")
+        else:
+            print(f"使用模型目录: {self.model_dir_prefix}")
         print(f"设备信息: {'CPU Only' if use_cpu_only else 'Auto-detect'}")
         print(f"CUDA可用: {torch.cuda.is_available() and not use_cpu_only}")
         
-        self._load_models()
+        if load_in_background:
+            threading.Thread(target=self._load_models_in_background,
+                             name='model-loader', daemon=True).start()
+        else:
+            self._load_models()
     
     def _find_model_directory(self):
         """自动搜索模型目录"""
-        possible_paths = [
-            './ensemble_models/experiments_',
-            '../ensemble_models/experiments_',
-            './examples/ensemble_models/experiments_',
-            '../examples/ensemble_models/experiments_',
-            '../../ensemble_models/experiments_',
-            '/opt/models/ensemble_models/experiments_',  # 服务器常用路径
-            '/app/models/ensemble_models/experiments_',   # Docker容器常用路径
-        ]
-        
-        for path in possible_paths:
-            test_path = f"{path}1/checkpoint2.pt"
-            if os.path.exists(test_path):
-                print(f"找到模型文件: {test_path}")
-                return path
+        path = find_model_directory(self.tier)
+        if path is not None:
+            print(f"找到模型文件: {path}1")
+            return path
         
         # 如果都找不到，返回默认路径并给出提示
         print("警告: 未找到模型文件，使用默认路径")
-        return './ensemble_models/experiments_'
+        return f'./ensemble_models/{MODEL_TIERS[self.tier]["dir_name"]}'
+    
+    _read_model_config = staticmethod(read_model_config)
+    
+    @property
+    def models(self):
+        """当前版本集成模型的成员列表"""
+        return self.ensemble.models
+    
+    @property
+    def model_version(self):
+        return self.ensemble.version
+    
+    def _member_specs(self, model_dir_prefix, n_models):
+        """
+        集成成员列表：注册表清单中的成员，或按目录前缀逐个读取model_config.json（旧布局）
+        
+        Returns:
+            list: 每个成员的dict(model_dir, checkpoint_path, model_params, train_ratios,
+                  sha256)；配置读取失败的成员为dict(model_dir, error)
+        """
+        if self.manifest is not None:
+            return self.manifest['members']
+        specs = []
+        for i in range(n_models):
+            model_dir = f'{model_dir_prefix}{i+1}'
+            try:
+                model_params, checkpoint_name, train_ratios = \
+                    self._read_model_config(model_dir)
+            except Exception as e:
+                specs.append({'model_dir': model_dir, 'error': str(e)})
+                continue
+            specs.append({
+                'model_dir': model_dir,
+                'checkpoint_path': os.path.join(model_dir, checkpoint_name),
+                'model_params': model_params,
+                'train_ratios': train_ratios,
+                'sha256': None,
+            })
+        return specs
+    
+    def _fingerprint(self, specs):
+        """根据清单与各成员的配置、checkpoint文件（路径、大小、修改时间）计算模型指纹"""
+        digest = hashlib.sha1()
+        paths = [self.manifest_path] if self.manifest_path else []
+        for spec in specs:
+            paths.append(os.path.join(spec['model_dir'], MODEL_CONFIG_FILE))
+            if 'checkpoint_path' in spec:
+                paths.append(spec['checkpoint_path'])
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        return digest.hexdigest()[:12]
     
     def _load_models(self):
-        """加载所有集成模型 - CPU优化版本"""
-        print(f"正在加载{self.n_models}个集成模型（CPU模式）...")
+        """初始加载：并行加载所有集成成员，每个成员加载并预热后立即加入集成"""
+        specs = self._member_specs(self.model_dir_prefix, self.n_models)
+        fingerprint = self._fingerprint(specs)
+        try:
+            self._load_members(
+                specs, self.load_errors,
+                on_member=lambda i, model: self._add_member(i, model, fingerprint))
+        finally:
+            # 成员只需在初始加载期间按序号暂存，之后由self.ensemble持有，
+            # 热加载替换版本后旧模型才能被释放
+            with self._models_lock:
+                self._loaded_members = {}
+            self.loading_complete.set()
+        
+        successfully_loaded = len(self.models)
+        if successfully_loaded == 0:
+            raise RuntimeError("没有成功加载任何模型！请检查模型文件路径。")
+        
+        print(f"成功加载 {successfully_loaded}/{self.n_models} 个模型")
+        self.n_models = successfully_loaded  # 更新实际可用的模型数量
+        # 部分成员加载失败时，以实际加载的模型为准
+        self.ready.set()
+    
+    def _load_models_in_background(self):
+        try:
+            self._load_models()
+        except Exception as e:
+            logger.error(f"模型加载失败: {e}")
+            self.load_errors.append(str(e))
+    
+    def _load_members(self, specs, errors, on_member=None):
+        """
+        使用线程池并行加载集成成员
+        
+        Args:
+            specs: 成员列表（见_member_specs）
+            errors: 记录加载错误的列表
+            on_member: 可选回调 on_member(成员序号, 模型)，每个成员加载完成后调用
+            
+        Returns:
+            list: 按成员序号排列的已加载模型
+        """
+        n_models = len(specs)
+        workers = self.load_workers or min(n_models, os.cpu_count() or 1)
+        print(f"正在加载{n_models}个集成模型（CPU模式，{workers}个线程）...")
         
         # 禁用不必要的警告
         warnings.filterwarnings('ignore', category=UserWarning)
         
+        loaded = {}
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='model-load') as executor:
+            futures = {
+                executor.submit(self._load_member, spec, i, n_models, errors): i
+                for i, spec in enumerate(specs)
+            }
+            for future in as_completed(futures):
+                model = future.result()
+                if model is not None:
+                    loaded[futures[future]] = model
+                    if on_member is not None:
+                        on_member(futures[future], model)
+        return [loaded[i] for i in sorted(loaded)]
+    
+    def _load_member(self, spec, i, n_models, errors):
+        """
+        加载并预热第i个集成成员
+        
+        Returns:
+            MPNNPOMModel，加载失败时返回None（错误记录在errors中）
+        """
+        print(f"加载模型 {i+1}/{n_models}")
+        
+        # 模型配置（蒸馏模型等使用非默认结构）
+        if 'error' in spec:
+            print(f"  ✗ 模型配置读取失败: {spec['error']}")
+            errors.append(f"模型 {i+1}: {spec['error']}")
+            return None
+        model_dir = spec['model_dir']
+        checkpoint_path = spec['checkpoint_path']
+        
+        # 检查模型文件是否存在
+        if not os.path.exists(checkpoint_path):
+            print(f"警告: 模型文件不存在: {checkpoint_path}")
+            errors.append(f"模型 {i+1}: 模型文件不存在")
+            return None
+        
+        # 注册表清单记录了校验和，防止加载损坏或被替换的checkpoint
+        if spec['sha256'] and self.verify_checksums and \
+                file_sha256(checkpoint_path) != spec['sha256']:
+            print(f"  ✗ 模型 {i+1} 校验和不匹配: {checkpoint_path}")
+            errors.append(f"模型 {i+1}: checkpoint校验和不匹配")
+            return None
+        
         learning_rate = dc.models.optimizers.ExponentialDecay(
             initial_rate=0.001, decay_rate=0.5, decay_steps=32*20, staircase=True
         )
+        model_params = dict(spec['model_params'])
+        if self.precision is not None:
+            model_params['precision'] = self.precision
+        try:
+            model = MPNNPOMModel(
+                n_tasks=self.n_tasks,
+                batch_size=64,  # 减少batch_size以节省内存
+                learning_rate=learning_rate,
+                class_imbalance_ratio=spec['train_ratios'] or self.train_ratios,
+                loss_aggr_type='sum',
+                mode='classification',
+                number_atom_features=GraphConvConstants.ATOM_FDIM,
+                number_bond_features=GraphConvConstants.BOND_FDIM,
+                n_classes=1,
+                optimizer_name='adam',
+                log_frequency=32,
+                model_dir=model_dir,
+                device_name='cpu',  # 强制使用CPU
+                **model_params
+            )
+            
+            # 恢复模型权重
+            model.restore(checkpoint_path)
+            
+            # 设置模型为评估模式以提升推理速度
+            if hasattr(model.model, 'eval'):
+                model.model.eval()
+        except Exception as e:
+            print(f"  ✗ 模型 {i+1} 加载失败: {e}")
+            errors.append(f"模型 {i+1}: {e}")
+            return None
         
-        successfully_loaded = 0
-        for i in range(self.n_models):
-            print(f"加载模型 {i+1}/{self.n_models}")
+        # 进行一次小的预热预测以优化后续推理速度
+        self._warmup_model(model)
+        print(f"  ✓ 模型 {i+1} 加载成功（CPU模式）")
+        return model
+    
+    def _add_member(self, i, model, fingerprint):
+        """将已加载的成员加入集成（按成员序号排列，替换为新版本以免影响进行中的预测）"""
+        with self._models_lock:
+            for hook in self.model_hooks:
+                hook(model)
+            self._loaded_members[i] = model
+            models = [self._loaded_members[j] for j in sorted(self._loaded_members)]
+            self.ensemble = ModelEnsemble(models, fingerprint, self.model_dir_prefix)
+            if len(models) >= self.min_models_ready:
+                self.ready.set()
+    
+    def _acquire_reload(self):
+        if not self.loading_complete.is_set() or \
+                not self._reload_lock.acquire(blocking=False):
+            raise ReloadInProgressError("模型正在加载或重新加载，请稍后重试")
+    
+    def reload(self, model_dir_prefix=None, n_models=None, drain_timeout=60):
+        """
+        热加载集成模型
+        
+        构建新版本 → 冒烟测试 → 原子替换 → 等待旧版本的进行中请求结束后释放；
+        加载或冒烟测试失败时继续使用当前版本。按注册表清单加载时重新读取清单，
+        忽略model_dir_prefix和n_models
+        
+        Args:
+            model_dir_prefix: 新模型目录前缀，None时重新加载当前目录
+            n_models: 新集成模型数量，None时与初始配置相同
+            drain_timeout: 等待旧版本进行中请求结束的最长时间（秒）
             
-            # 检查模型文件是否存在
-            checkpoint_path = f"{self.model_dir_prefix}{i+1}/checkpoint2.pt"
-            if not os.path.exists(checkpoint_path):
-                print(f"警告: 模型文件不存在: {checkpoint_path}")
-                continue
+        Returns:
+            dict: 热加载状态（同reload_status）
             
-            try:
-                model = MPNNPOMModel(
-                    n_tasks=self.n_tasks,
-                    batch_size=64,  # 减少batch_size以节省内存
-                    learning_rate=learning_rate,
-                    class_imbalance_ratio=self.train_ratios,
-                    loss_aggr_type='sum',
-                    node_out_feats=100,
-                    edge_hidden_feats=75,
-                    edge_out_feats=100,
-                    num_step_message_passing=5,
-                    mpnn_residual=True,
-                    message_aggregator_type='sum',
-                    mode='classification',
-                    number_atom_features=GraphConvConstants.ATOM_FDIM,
-                    number_bond_features=GraphConvConstants.BOND_FDIM,
-                    n_classes=1,
-                    readout_type='set2set',
-                    num_step_set2set=3,
-                    num_layer_set2set=2,
-                    ffn_hidden_list=[392, 392],
-                    ffn_embeddings=256,
-                    ffn_activation='relu',
-                    ffn_dropout_p=0.12,
-                    ffn_dropout_at_input_no_act=False,
-                    weight_decay=1e-5,
-                    self_loop=False,
-                    optimizer_name='adam',
-                    log_frequency=32,
-                    model_dir=f'{self.model_dir_prefix}{i+1}',
-                    device_name='cpu'  # 强制使用CPU
-                )
-                
-                # 恢复模型权重
-                model.restore(checkpoint_path)
-                
-                # 设置模型为评估模式以提升推理速度
-                if hasattr(model.model, 'eval'):
-                    model.model.eval()
-                
-                self.models.append(model)
-                successfully_loaded += 1
-                print(f"  ✓ 模型 {i+1} 加载成功（CPU模式）")
-                
-            except Exception as e:
-                print(f"  ✗ 模型 {i+1} 加载失败: {e}")
-                continue
+        Raises:
+            ReloadInProgressError: 模型正在加载或重新加载
+        """
+        self._acquire_reload()
+        try:
+            return self._reload(model_dir_prefix, n_models, drain_timeout)
+        finally:
+            self._reload_lock.release()
+    
+    def reload_in_background(self, model_dir_prefix=None, n_models=None,
+                             drain_timeout=60):
+        """
+        在后台线程中热加载，立即返回；进度见reload_status
         
-        if successfully_loaded == 0:
-            raise RuntimeError("没有成功加载任何模型！请检查模型文件路径。")
+        Raises:
+            ReloadInProgressError: 模型正在加载或重新加载
+        """
+        self._acquire_reload()
         
-        print(f"成功加载 {successfully_loaded}/{self.n_models} 个模型")
-        self.n_models = successfully_loaded  # 更新实际可用的模型数量
+        def run():
+            try:
+                self._reload(model_dir_prefix, n_models, drain_timeout)
+            finally:
+                self._reload_lock.release()
+        
+        threading.Thread(target=run, name='model-reload', daemon=True).start()
+    
+    def _reload(self, model_dir_prefix, n_models, drain_timeout):
+        if self.manifest is not None:
+            model_dir_prefix = self.model_dir_prefix
+        else:
+            model_dir_prefix = model_dir_prefix or self.model_dir_prefix
+        n_models = n_models or self.requested_models
+        old = self.ensemble
+        status = {
+            'state': 'loading',
+            'model_dir_prefix': model_dir_prefix,
+            'previous_version': old.version,
+            'started_at': datetime.now().isoformat(),
+        }
+        self.reload_status = status
+        logger.info(f"开始热加载模型: {model_dir_prefix}")
         
-        # 进行一次小的预热预测以优化后续推理速度
         try:
-            print("正在预热模型...")
-            self._warmup_models()
-            print("✓ 模型预热完成")
+            manifest = None
+            if self.manifest is not None:
+                manifest = read_manifest(self.manifest_path)
+                self._check_tasks(manifest)
+                n_models = len(manifest['members'])
+                specs = manifest['members']
+            else:
+                specs = self._member_specs(model_dir_prefix, n_models)
+            fingerprint = self._fingerprint(specs)
+            errors = []
+            models = self._load_members(specs, errors)
+            status['load_errors'] = errors
+            if not models:
+                raise RuntimeError("没有成功加载任何模型")
+            new = ModelEnsemble(models, fingerprint, model_dir_prefix)
+            status['state'] = 'smoke_test'
+            status['smoke_test'] = self._smoke_test(new, old)
         except Exception as e:
-            print(f"模型预热失败（可忽略）: {e}")
+            logger.error(f"热加载失败，继续使用当前模型: {e}")
+            status.update(state='failed', error=str(e),
+                          finished_at=datetime.now().isoformat())
+            if self.on_reload is not None:
+                self.on_reload(status)
+            return status
+        
+        # 原子替换：之后开始的请求使用新版本
+        with self._models_lock:
+            for model in models:
+                for hook in self.model_hooks:
+                    hook(model)
+            self.ensemble = new
+            if manifest is not None:
+                self.manifest = manifest
+            self.model_dir_prefix = model_dir_prefix
+            self.n_models = len(models)
+            self.requested_models = n_models
+        if self.cache is not None:
+            self.cache.drop_other_versions(new.version)
+        status.update(state='draining', version=new.version)
+        logger.info(f"模型版本已切换: {old.version} -> {new.version}")
+        
+        # 旧版本在进行中的请求结束后释放
+        drained = old.wait_drained(drain_timeout)
+        del old
+        gc.collect()
+        status.update(state='succeeded', drained=drained,
+                      finished_at=datetime.now().isoformat())
+        if self.on_reload is not None:
+            self.on_reload(status)
+        return status
+    
+    def _check_tasks(self, manifest):
+        """热加载不能改变任务列表（缓存、监控与客户端都依赖任务的顺序）"""
+        tasks = list(manifest.get('tasks') or ODOR_TASKS)
+        if tasks != self.tasks:
+            raise RuntimeError("新清单的任务列表与当前模型不一致，请使用新的模型名称注册")
+    
+    def _smoke_test(self, new, old):
+        """新版本必须对冒烟测试分子给出有效概率；同时报告与当前版本的差异"""
+        graphs = self.featurize_smiles(SMOKE_TEST_SMILES)
+        predictions = self._predict_graphs(new.models, graphs)
+        if (predictions.shape != (len(graphs), self.n_tasks) or
+                not np.all(np.isfinite(predictions)) or
+                predictions.min() < 0 or predictions.max() > 1):
+            raise RuntimeError("冒烟测试失败：预测结果形状或取值异常")
+        report = {'molecules': len(graphs)}
+        if old.models:
+            with old.acquire():
+                previous = self._predict_graphs(old.models, graphs)
+            diff = np.abs(predictions - previous)
+            report['mean_abs_diff'] = round(float(diff.mean()), 6)
+            report['max_abs_diff'] = round(float(diff.max()), 6)
+        return report
+    
+    def start_watching(self, interval=30):
+        """
+        轮询模型文件，检测到变化时自动热加载
+        
+        指纹需在连续两次轮询中保持一致才会触发，避免在文件复制过程中加载
+        """
+        threading.Thread(target=self._watch, args=(interval,),
+                         name='model-watcher', daemon=True).start()
+    
+    def close(self):
+        """停止文件轮询（模型从注册表中换出时调用），进行中的预测不受影响"""
+        self._closed.set()
+    
+    def _watch(self, interval):
+        self.loading_complete.wait()
+        pending = None
+        failed = None
+        while not self._closed.wait(interval):
+            if self.manifest is not None:
+                try:
+                    specs = read_manifest(self.manifest_path)['members']
+                except Exception:
+                    continue  # 清单正在写入或已损坏，下次轮询再检查
+            else:
+                specs = self._member_specs(self.model_dir_prefix,
+                                           self.requested_models)
+            fingerprint = self._fingerprint(specs)
+            if fingerprint in (self.ensemble.fingerprint, failed):
+                pending = None
+                continue
+            if fingerprint != pending:
+                pending = fingerprint
+                continue
+            logger.info("检测到模型文件变化，开始热加载")
+            try:
+                status = self.reload()
+            except ReloadInProgressError:
+                continue
+            pending = None
+            failed = fingerprint if status['state'] == 'failed' else None
     
-    def _warmup_models(self):
-        """预热模型以提升后续推理速度"""
+    def _warmup_model(self, model):
+        """预热单个模型以提升后续推理速度"""
         warmup_smiles = 'CCO'  # 简单的乙醇分子
         try:
             with torch.no_grad():  # 禁用梯度计算以节省内存
-                self.get_top_odors(warmup_smiles, top_k=1)
+                graph = self.featurizer.featurize([warmup_smiles])[0]
+                g = dgl.batch([graph.to_dgl_graph(self_loop=model._self_loop)])
+                model.model(g.to(model.device))
         except Exception:
             pass  # 预热失败不影响正常使用
     
+    def wait_until_ready(self, timeout=None):
+        """
+        等待达到可预测的模型数量
+        
+        Returns:
+            bool: 是否已就绪（超时或全部加载失败时为False）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.ready.wait(0.1):
+            if self.loading_complete.is_set() or (
+                    deadline is not None and time.monotonic() >= deadline):
+                return self.ready.is_set()
+        return True
+    
+    def add_model_hook(self, hook):
+        """
+        注册模型钩子，对每个已加载和之后加载（包括热加载）的集成成员调用
+        hook(model.model)，在成员参与预测之前执行（如安装性能分析钩子）
+        """
+        with self._models_lock:
+            self.model_hooks.append(lambda model: hook(model.model))
+            for model in self.models:
+                hook(model.model)
+    
+    def add_stage_hook(self, hook):
+        """
+        注册预测阶段钩子，用于监控指标和性能分析
+        
+        Args:
+            hook: 可调用对象 hook(stage, labels)，返回包裹该阶段执行的上下文管理器；
+                  stage取值见PREDICTION_STAGES，labels为附加标签（如forward阶段的member）
+        """
+        self.stage_hooks.append(hook)
+    
+    @contextmanager
+    def _stage(self, name, **labels):
+        """将一个预测阶段包裹在所有已注册的钩子中"""
+        if not self.stage_hooks:
+            yield
+            return
+        with ExitStack() as stack:
+            for hook in self.stage_hooks:
+                stack.enter_context(hook(name, labels))
+            yield
+    
+    def _parse_smiles(self, smiles_list):
+        """解析SMILES并按规范顺序重排原子（与CSVLoader特征化保持一致）"""
+        mols = []
+        invalid = []
+        for smiles in smiles_list:
+            mol = Chem.MolFromSmiles(smiles)
+            if mol is None:
+                invalid.append(smiles)
+                continue
+            mols.append(rdmolops.RenumberAtoms(
+                mol, rdmolfiles.CanonicalRankAtoms(mol)))
+        if invalid:
+            raise InvalidSmilesError(invalid)
+        return mols
+    
+    def featurize_smiles(self, smiles_list):
+        """
+        将SMILES列表转换为GraphData数组
+        
+        Raises:
+            InvalidSmilesError: 存在无法解析或无法特征化的SMILES
+        """
+        with self._stage('parse'):
+            mols = self._parse_smiles(smiles_list)
+        with self._stage('featurize'):
+            graphs = self.featurizer.featurize(mols)
+        failed = [smiles for smiles, graph in zip(smiles_list, graphs)
+                  if isinstance(graph, np.ndarray)]
+        if failed:
+            raise InvalidSmilesError(failed)
+        return graphs
+    
+    def predict_graphs(self, graphs, batch_size=None):
+        """
+        对已特征化的分子图进行集成预测
+        
+        每个批次只构建一次DGL批图，由所有集成成员共享
+        
+        Args:
+            graphs: GraphData序列
+            batch_size: 批处理大小；None时使用原子/边预算组批（如已配置），否则为64
+            
+        Returns:
+            np.ndarray: 集成平均概率，形状为(分子数, 任务数)，顺序与输入一致
+        """
+        with self.ensemble.acquire() as ensemble:
+            return self._predict_graphs(ensemble.models, graphs, batch_size)
+    
+    def _predict_graphs(self, models, graphs, batch_size=None):
+        """使用给定的集成成员进行预测，见predict_graphs"""
+        if not models:
+            raise ModelsNotReadyError("模型尚未加载完成")
+        if batch_size is None and self.batch_planner is not None:
+            batches = self.batch_planner.plan(graphs)
+        else:
+            batch_size = batch_size or 64
+            batches = [np.arange(start, min(start + batch_size, len(graphs)))
+                       for start in range(0, len(graphs), batch_size)]
+        
+        predictions = np.empty((len(graphs), self.n_tasks), dtype=np.float32)
+        with torch.no_grad():  # 禁用梯度计算以节省内存和提升速度
+            for indices in batches:
+                batch_graphs = [graphs[i] for i in indices]
+                with self._stage('batch'):
+                    with self._stage('to_dgl_graph'):
+                        dgl_graphs = [
+                            graph.to_dgl_graph(self_loop=models[0]._self_loop)
+                            for graph in batch_graphs
+                        ]
+                    with self._stage('dgl_batch'):
+                        g = dgl.batch(dgl_graphs).to(models[0].device)
+                
+                ensemble_sum = None
+                for i, model in enumerate(models):
+                    with self._stage('forward', member=i):
+                        proba = model.model(g)[0]
+                    with self._stage('reduce'):
+                        ensemble_sum = proba if ensemble_sum is None \
+                            else ensemble_sum + proba
+                
+                # 计算集成平均
+                with self._stage('reduce'):
+                    predictions[indices] = (ensemble_sum / len(models)).cpu().numpy()
+        return predictions
+    
+    def predict_proba(self, smiles_list, batch_size=None):
+        """
+        预测SMILES列表的集成平均概率（使用预测缓存）
+        
+        Args:
+            smiles_list: SMILES字符串列表
+            batch_size: 批处理大小，None时按原子/边预算组批（如已配置）或自动设置
+            
+        Returns:
+            np.ndarray: float32概率，形状为(分子数, 任务数)，顺序与输入一致
+            
+        Raises:
+            InvalidSmilesError: 存在无法解析的SMILES
+        """
+        logger.debug(f"正在预测{len(smiles_list)}个分子的气味（CPU模式）...")
+        
+        with self.ensemble.acquire() as ensemble:
+            if not ensemble.models:
+                raise ModelsNotReadyError("模型尚未加载完成")
+            
+            # 已缓存的分子无需特征化和前向计算
+            ensemble_predictions = np.empty((len(smiles_list), self.n_tasks),
+                                            dtype=np.float32)
+            cached = {}
+            if self.cache is not None:
+                cached = self.cache.get_many(ensemble.version, smiles_list)
+                for i, value in cached.items():
+                    ensemble_predictions[i] = value
+            missing = [i for i in range(len(smiles_list)) if i not in cached]
+            
+            if missing:
+                missing_smiles = [smiles_list[i] for i in missing]
+                # 自动设置batch_size以优化CPU性能
+                if batch_size is None and self.batch_planner is None:
+                    batch_size = min(32, len(missing))  # CPU模式使用较小的batch_size
+                
+                graphs = self.featurize_smiles(missing_smiles)
+                predictions = self._predict_graphs(ensemble.models, graphs,
+                                                   batch_size)
+                ensemble_predictions[missing] = predictions
+                if self.cache is not None:
+                    self.cache.put_many(ensemble.version, missing_smiles,
+                                        predictions)
+        return ensemble_predictions
+    
     def predict_smiles(self, smiles_list, threshold=0.5, batch_size=None):
         """
         预测SMILES列表的气味 - CPU优化版本
@@ -199,67 +1054,32 @@ class OdorPredictorCPU:
         Args:
             smiles_list: SMILES字符串列表
             threshold: 预测阈值，大于该值认为具有对应气味
-            batch_size: 批处理大小，None时自动设置
+            batch_size: 批处理大小，None时按原子/边预算组批（如已配置）或自动设置
             
         Returns:
             DataFrame: 包含预测结果的数据框
+            
+        Raises:
+            InvalidSmilesError: 存在无法解析的SMILES
         """
         if isinstance(smiles_list, str):
             smiles_list = [smiles_list]
+        ensemble_predictions = self.predict_proba(smiles_list, batch_size)
+        with self._stage('reduce'):
+            return prediction_frames(smiles_list, ensemble_predictions,
+                                     self.tasks, threshold)
+    
+    def predict_dataset(self, dataset):
+        """
+        对已特征化的数据集进行集成预测
         
-        print(f"正在预测{len(smiles_list)}个分子的气味（CPU模式）...")
-        
-        # 自动设置batch_size以优化CPU性能
-        if batch_size is None:
-            batch_size = min(32, len(smiles_list))  # CPU模式使用较小的batch_size
-        
-        # 创建临时数据集
-        temp_data = pd.DataFrame({
-            'nonStereoSMILES': smiles_list,
-            **{task: [0] * len(smiles_list) for task in self.tasks}  # 占位符标签
-        })
-        temp_file = 'temp_predict_cpu.csv'
-        temp_data.to_csv(temp_file, index=False)
-        
-        try:
-            # 使用featurizer处理数据
-            loader = dc.data.CSVLoader(
-                tasks=self.tasks,
-                feature_field='nonStereoSMILES',
-                featurizer=self.featurizer
-            )
-            dataset = loader.create_dataset(inputs=[temp_file])
-            
-            # 获取每个模型的预测（使用torch.no_grad()优化内存）
-            all_predictions = []
-            with torch.no_grad():  # 禁用梯度计算以节省内存和提升速度
-                for i, model in enumerate(self.models):
-                    print(f"使用模型 {i+1}/{len(self.models)} 进行预测")
-                    preds = model.predict(dataset)
-                    all_predictions.append(preds)
-            
-            # 计算集成平均
-            ensemble_predictions = np.mean(np.array(all_predictions), axis=0)
-            
-            # 创建结果DataFrame
-            results = pd.DataFrame({
-                'SMILES': smiles_list,
-                **{task: ensemble_predictions[:, i] for i, task in enumerate(self.tasks)}
-            })
-            
-            # 添加二进制预测（基于阈值）
-            binary_results = pd.DataFrame({
-                'SMILES': smiles_list,
-                **{f'{task}_binary': (ensemble_predictions[:, i] > threshold).astype(int) 
-                   for i, task in enumerate(self.tasks)}
-            })
-            
-            return results, binary_results
+        Args:
+            dataset: deepchem数据集（X为GraphData）
             
-        finally:
-            # 清理临时文件
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+        Returns:
+            np.ndarray: 集成平均概率，形状为(分子数, 任务数)
+        """
+        return self.predict_graphs(dataset.X)
     
     def get_top_odors(self, smiles, top_k=10):
         """
@@ -273,37 +1093,32 @@ class OdorPredictorCPU:
             DataFrame: 包含top-k气味及其概率的数据框
         """
         with torch.no_grad():  # 禁用梯度计算
-            results, _ = self.predict_smiles([smiles])
-            
-            # 获取除SMILES外的所有预测分数
-            scores = results.iloc[0, 1:].values
-            task_names = self.tasks
-            
-            # 排序并获取top-k
-            sorted_indices = np.argsort(scores)[::-1][:top_k]
-            
-            top_odors = pd.DataFrame({
-                'odor': [task_names[i] for i in sorted_indices],
-                'probability': [scores[i] for i in sorted_indices]
-            })
-            
-            return top_odors
+            scores = self.predict_proba([smiles])[0]
+            return top_odors_frame(scores, self.tasks, top_k)
     
     def get_system_info(self):
-        """获取系统信息，用于部署监控"""
-        import psutil
-        import platform
-        
-        info = {
-            'platform': platform.system(),
-            'cpu_count': psutil.cpu_count(),
-            'memory_total_gb': round(psutil.virtual_memory().total / (1024**3), 2),
-            'python_version': platform.python_version(),
-            'torch_version': torch.__version__,
-            'device_mode': 'CPU Only' if self.use_cpu_only else 'Auto',
-            'cuda_available': torch.cuda.is_available() and not self.use_cpu_only,
-            'models_loaded': self.n_models
-        }
+        """获取系统信息，用于部署监控（静态部分只计算一次）"""
+        if self._system_info is None:
+            self._system_info = {
+                'platform': platform.system(),
+                'cpu_count': psutil.cpu_count(),
+                'memory_total_gb': round(psutil.virtual_memory().total / (1024**3), 2),
+                'python_version': platform.python_version(),
+                'torch_version': torch.__version__,
+                'device_mode': 'CPU Only' if self.use_cpu_only else 'Auto',
+                'model_tier': self.tier,
+                'model_name': self.name,
+                'cuda_available': torch.cuda.is_available() and not self.use_cpu_only,
+            }
+        info = dict(self._system_info)
+        info.update({
+            'models_loaded': len(self.models),
+            'models_expected': self.n_models,
+            'model_version': self.model_version,
+            'manifest_version': (self.manifest or {}).get('version'),
+            'ready': self.ready.is_set(),
+            'loading_complete': self.loading_complete.is_set(),
+        })
         return info
 
 def main():
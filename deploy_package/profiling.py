@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+按需请求性能分析
+通过请求头 X-Profile: 1 或查询参数 ?profile=1 开启（需配置 PROFILING_ENABLED=true），
+对单个请求记录Python层计时树（GraphFeaturizer、to_dgl_graph/dgl.batch、
+每个集成成员的CustomMPNNGNN、_readout、Set2Set、FFN）以及torch.profiler
+算子级耗时前N项，结果保存在有界环形缓冲区中，可通过 /admin/profiles 查看
+
+注意: torch.profiler 会记录整个进程的算子，同一时刻只允许一个请求进行分析，
+并发的普通请求也可能计入算子统计
+"""
+
+import os
+import time
+import uuid
+import threading
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime
+
+from torch.profiler import ProfilerActivity, profile, record_function
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED',
+                                   'False').lower() == 'true'
+# 设置后，开启分析与访问管理接口都需要携带 X-Admin-Token 请求头
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', 50))
+PROFILE_TOP_N = int(os.environ.get('PROFILE_TOP_N', 20))
+
+# MPNNPOM中需要单独计时的子模块
+PROFILED_MODULES = ('mpnn', 'readout_set2set', 'ffn')
+
+_local = threading.local()
+_profiler_lock = threading.Lock()
+_profiles = deque(maxlen=PROFILE_BUFFER_SIZE)
+_profiles_lock = threading.Lock()
+_NULL_CONTEXT = nullcontext()
+
+
+class TimerNode:
+    """计时树节点"""
+
+    __slots__ = ('name', 'labels', 'duration', 'children')
+
+    def __init__(self, name, labels=None):
+        self.name = name
+        self.labels = labels or {}
+        self.duration = 0.0
+        self.children = []
+
+    @property
+    def key(self):
+        if not self.labels:
+            return self.name
+        labels = ','.join(f'{k}={v}' for k, v in self.labels.items())
+        return f'{self.name}[{labels}]'
+
+    def to_dict(self):
+        return {
+            'name': self.key,
+            'seconds': round(self.duration, 6),
+            'children': [child.to_dict() for child in self.children],
+        }
+
+    def flatten(self, prefix='', totals=None):
+        """按路径汇总耗时（多个批次中的同名阶段合并）"""
+        if totals is None:
+            totals = {}
+        for child in self.children:
+            path = f'{prefix}/{child.key}' if prefix else child.key
+            totals[path] = totals.get(path, 0.0) + child.duration
+            child.flatten(path, totals)
+        return totals
+
+
+class ProfileSession:
+    """单个请求的分析会话"""
+
+    def __init__(self, endpoint):
+        self.id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.root = TimerNode('request')
+        self.stack = [self.root]
+        self.module_timers = {}
+        self.operators = []
+
+    def result(self):
+        totals = self.root.flatten()
+        return {
+            'id': self.id,
+            'endpoint': self.endpoint,
+            'timestamp': datetime.now().isoformat(),
+            'total_seconds': round(self.root.duration, 6),
+            'breakdown': {path: round(seconds, 6)
+                          for path, seconds in totals.items()},
+            'timer_tree': self.root.to_dict(),
+            'top_operators': self.operators,
+        }
+
+
+class _NodeTimer:
+    """在当前会话的计时树中记录一个节点，同时标注torch.profiler区间"""
+
+    __slots__ = ('_session', '_node', '_record', '_start')
+
+    def __init__(self, session, name, labels):
+        self._session = session
+        self._node = TimerNode(name, labels)
+        self._record = record_function(self._node.key)
+
+    def __enter__(self):
+        self._session.stack[-1].children.append(self._node)
+        self._session.stack.append(self._node)
+        self._record.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._node.duration += time.perf_counter() - self._start
+        self._record.__exit__(*exc)
+        self._session.stack.pop()
+        return False
+
+
+def _timer(name, labels=None):
+    session = getattr(_local, 'session', None)
+    if session is None:
+        return _NULL_CONTEXT
+    return _NodeTimer(session, name, labels)
+
+
+def stage_hook(stage, labels):
+    """OdorPredictorCPU 阶段钩子，见 OdorPredictorCPU.add_stage_hook"""
+    return _timer(stage, labels)
+
+
+def instrument_model(module):
+    """
+    为MPNNPOM模型的子模块安装计时钩子
+
+    未开启分析的请求中，钩子只做一次线程局部变量检查
+    """
+    for name in PROFILED_MODULES:
+        submodule = getattr(module, name, None)
+        if submodule is None:
+            continue
+        submodule.register_forward_pre_hook(_make_pre_hook(name))
+        submodule.register_forward_hook(_post_hook)
+
+    readout = module._readout
+
+    def timed_readout(*args, **kwargs):
+        with _timer('_readout'):
+            return readout(*args, **kwargs)
+
+    module._readout = timed_readout
+
+
+def _make_pre_hook(name):
+
+    def pre_hook(module, inputs):
+        session = getattr(_local, 'session', None)
+        if session is None:
+            return
+        timer = _NodeTimer(session, name, None)
+        timer.__enter__()
+        session.module_timers.setdefault(id(module), []).append(timer)
+
+    return pre_hook
+
+
+def _post_hook(module, inputs, outputs):
+    session = getattr(_local, 'session', None)
+    if session is None:
+        return
+    timers = session.module_timers.get(id(module))
+    if timers:
+        timers.pop().__exit__(None, None, None)
+
+
+def is_requested(headers, args):
+    """请求是否要求进行性能分析"""
+    flag = headers.get('X-Profile') or args.get('profile')
+    return flag is not None and flag.lower() in ('1', 'true', 'yes')
+
+
+def is_authorized(headers):
+    return ADMIN_TOKEN is None or headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+
+class ProfilerBusyError(RuntimeError):
+    """已有其他请求正在进行分析"""
+
+
+class ProfiledRequest:
+    """
+    上下文管理器：对当前线程中的预测进行分析，结束后存入环形缓冲区
+
+    Raises:
+        ProfilerBusyError: 已有其他请求正在进行分析
+    """
+
+    def __init__(self, endpoint, top_n=PROFILE_TOP_N):
+        self.session = ProfileSession(endpoint)
+        self.top_n = top_n
+        self._profiler = None
+
+    def __enter__(self):
+        if not _profiler_lock.acquire(blocking=False):
+            raise ProfilerBusyError('已有请求正在进行性能分析，请稍后重试')
+        try:
+            self._profiler = profile(activities=[ProfilerActivity.CPU])
+            self._profiler.__enter__()
+        except Exception:
+            # 例如本线程已有profiler在运行；释放锁，避免之后的请求一直返回忙
+            _profiler_lock.release()
+            raise
+        _local.session = self.session
+        self._start = time.perf_counter()
+        return self.session
+
+    def __exit__(self, *exc):
+        try:
+            self.session.root.duration = time.perf_counter() - self._start
+            _local.session = None
+            self._profiler.__exit__(*exc)
+            events = sorted(self._profiler.key_averages(),
+                            key=lambda e: e.self_cpu_time_total,
+                            reverse=True)
+            self.session.operators = [{
+                'name': event.key,
+                'calls': event.count,
+                'self_cpu_ms': round(event.self_cpu_time_total / 1000, 3),
+                'cpu_total_ms': round(event.cpu_time_total / 1000, 3),
+            } for event in events[:self.top_n]]
+            with _profiles_lock:
+                _profiles.append(self.session.result())
+        finally:
+            _profiler_lock.release()
+        return False
+
+
+def list_profiles():
+    """环形缓冲区中所有分析结果的摘要（从新到旧）"""
+    with _profiles_lock:
+        profiles = list(_profiles)
+    return [{
+        'id': p['id'],
+        'endpoint': p['endpoint'],
+        'timestamp': p['timestamp'],
+        'total_seconds': p['total_seconds'],
+    } for p in reversed(profiles)]
+
+
+def get_profile(profile_id):
+    with _profiles_lock:
+        for p in _profiles:
+            if p['id'] == profile_id:
+                return p
+    return None
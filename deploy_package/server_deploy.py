@@ -4,11 +4,16 @@
 提供HTTP REST API接口，专为服务器部署设计
 """
 
-from flask import Flask, request, jsonify
-from predict_odor_cpu import OdorPredictorCPU
+from flask import Flask, Response, g, request, jsonify
+from predict_odor_cpu import InvalidSmilesError, ReloadInProgressError
+from model_registry import (ModelRegistry, UnknownModelError,
+                            DEFAULT_REGISTRY_DIR, REFRESH_INTERVAL)
+import metrics
+import profiling
 import os
 import logging
 import time
+import threading
 from functools import wraps
 
 # 设置日志
@@ -18,162 +23,443 @@ logger = logging.getLogger(__name__)
 # 创建Flask应用
 app = Flask(__name__)
 
-# 全局预测器实例
+# 模型注册表，按请求的model参数选择集成模型；predictor为默认模型的预测器
+registry = None
 predictor = None
+_init_lock = threading.Lock()
 
-def init_predictor():
-    """初始化预测器"""
-    global predictor
-    try:
-        logger.info("正在初始化气味预测器...")
-        predictor = OdorPredictorCPU(use_cpu_only=True)
-        logger.info("预测器初始化完成")
-        return True
-    except Exception as e:
-        logger.error(f"预测器初始化失败: {e}")
-        return False
+# 健康检查快照的缓存时间（秒），探针不会每次重新计算
+HEALTH_CACHE_SECONDS = float(os.environ.get('HEALTH_CACHE_SECONDS', 5))
+_health_cache = {'time': 0.0, 'key': None, 'payload': None}
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+def configure_predictor(new_predictor):
+    """为注册表加载的每个模型注册监控钩子、缓存回调与文件监测"""
+    new_predictor.add_stage_hook(metrics.stage_hook)
+    new_predictor.on_reload = metrics.record_reload
+    if new_predictor.cache is not None:
+        new_predictor.cache.on_lookup = metrics.record_cache_lookup
+    if profiling.PROFILING_ENABLED:
+        new_predictor.add_stage_hook(profiling.stage_hook)
+        new_predictor.add_model_hook(profiling.instrument_model)
+    # 轮询模型文件，变化时自动热加载（每个工作进程各自检测）
+    watch_interval = _env_int('MODEL_WATCH_INTERVAL')
+    if watch_interval:
+        new_predictor.start_watching(watch_interval)
+
+def create_registry(background=False):
+    """
+    创建模型注册表并加载默认模型（Web工作进程或共享推理进程中调用）
+
+    Args:
+        background: 在后台线程中并行加载模型，立即返回
+
+    Returns:
+        ModelRegistry
+    """
+    # DEFAULT_MODEL未设置时沿用MODEL_TIER（旧布局的full/fast）
+    default = os.environ.get('DEFAULT_MODEL') or \
+        os.environ.get('MODEL_TIER', 'full')
+    new_registry = ModelRegistry(
+        root=os.environ.get('MODEL_REGISTRY_DIR', DEFAULT_REGISTRY_DIR),
+        max_resident=_env_int('MAX_RESIDENT_MODELS') or 2,
+        default=default,
+        predictor_kwargs=dict(
+            use_cpu_only=True,
+            max_atoms_per_batch=_env_int('MAX_ATOMS_PER_BATCH'),
+            max_edges_per_batch=_env_int('MAX_EDGES_PER_BATCH'),
+            min_models_ready=_env_int('MIN_MODELS_READY'),
+            load_workers=_env_int('MODEL_LOAD_WORKERS'),
+            cache_size=_env_int('PREDICTION_CACHE_SIZE') or 0,
+            precision=os.environ.get('MODEL_PRECISION') or None),
+        on_create=configure_predictor,
+        background=background,
+        refresh_interval=float(os.environ.get('REGISTRY_REFRESH_INTERVAL') or
+                               REFRESH_INTERVAL))
+    new_registry.get()
+    return new_registry
+
+def init_predictor(background=False):
+    """
+    初始化模型注册表并加载默认模型，其他模型在首次请求时懒加载；
+    设置INFERENCE_SOCKET时不在本进程加载模型，预测交给共享推理进程（inference_server.py）
+    
+    Args:
+        background: 在后台线程中并行加载模型，立即返回；
+                    达到MIN_MODELS_READY个成员后 /readyz 返回就绪
+    """
+    global registry, predictor
+    with _init_lock:
+        if registry is not None:
+            return True
+        try:
+            logger.info("正在初始化气味预测器...")
+            socket_path = os.environ.get('INFERENCE_SOCKET')
+            if socket_path:
+                from inference_server import InferenceClient, RemoteRegistry
+                new_registry = RemoteRegistry(
+                    InferenceClient(socket_path),
+                    default=os.environ.get('DEFAULT_MODEL') or
+                    os.environ.get('MODEL_TIER', 'full'))
+                logger.info(f"预测由共享推理进程处理: {socket_path}")
+            else:
+                new_registry = create_registry(background)
+            predictor = new_registry.get()
+            registry = new_registry
+            logger.info(f"可用模型: {', '.join(registry.entries)}（默认: {registry.default}）")
+            logger.info("预测器初始化完成" if not background else "模型正在后台加载")
+            return True
+        except Exception as e:
+            logger.error(f"预测器初始化失败: {e}")
+            return False
+
+def error_response(error, message, status, error_type=None):
+    """返回错误响应并按类型计数"""
+    metrics.record_error(request.endpoint, error_type or error)
+    return jsonify({
+        'error': error,
+        'message': message
+    }), status
+
+def track_request(f):
+    """装饰器：记录请求耗时、状态码、分子数和并发请求数"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        start_time = metrics.request_started()
+        g.molecule_count = 0
+        status = 500
+        try:
+            response = app.make_response(f(*args, **kwargs))
+            status = response.status_code
+            # 写入access.log（见start_production.sh），供load_test.py重放流量
+            response.headers['X-Molecule-Count'] = str(g.molecule_count)
+            return response
+        finally:
+            # 只有成功的请求计入分子吞吐量
+            metrics.request_finished(request.endpoint, status, start_time,
+                                     g.molecule_count if status < 400 else 0)
+    return decorated_function
+
+def profile_if_requested(f):
+    """装饰器：请求携带 X-Profile: 1 或 ?profile=1 时对预测进行性能分析"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not profiling.is_requested(request.headers, request.args):
+            return f(*args, **kwargs)
+        if os.environ.get('INFERENCE_SOCKET'):
+            # 预测在共享推理进程中执行，本进程的分析器看不到各阶段与算子
+            return error_response('Profiling not available',
+                                  '使用共享推理进程（INFERENCE_SOCKET）时不支持单请求性能分析',
+                                  501)
+        if not profiling.PROFILING_ENABLED:
+            return error_response('Profiling disabled',
+                                  '性能分析未开启，请设置PROFILING_ENABLED=true', 403)
+        if not profiling.is_authorized(request.headers):
+            return error_response('Unauthorized', '管理令牌无效', 403)
+        try:
+            with profiling.ProfiledRequest(request.endpoint) as session:
+                response = app.make_response(f(*args, **kwargs))
+        except profiling.ProfilerBusyError as e:
+            return error_response('Profiler busy', str(e), 429)
+        
+        # 在成功的响应中附带分析结果
+        if response.status_code == 200 and response.is_json:
+            data = response.get_json()
+            data['profile'] = profiling.get_profile(session.id)
+            response = jsonify(data)
+        return response
+    return decorated_function
+
+def require_admin(f):
+    """装饰器：管理接口需开启性能分析并通过令牌校验"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not profiling.PROFILING_ENABLED:
+            return error_response('Profiling disabled',
+                                  '性能分析未开启，请设置PROFILING_ENABLED=true', 403)
+        if not profiling.is_authorized(request.headers):
+            return error_response('Unauthorized', '管理令牌无效', 403)
+        return f(*args, **kwargs)
+    return decorated_function
+
+def require_admin_token(f):
+    """装饰器：模型管理接口必须配置ADMIN_TOKEN并携带 X-Admin-Token 请求头"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if profiling.ADMIN_TOKEN is None:
+            return error_response('Admin disabled',
+                                  '未配置ADMIN_TOKEN，模型管理接口已禁用', 403)
+        if not profiling.is_authorized(request.headers):
+            return error_response('Unauthorized', '管理令牌无效', 403)
+        return f(*args, **kwargs)
+    return decorated_function
 
 def require_predictor(f):
-    """装饰器：确保预测器已初始化"""
+    """
+    装饰器：按请求的model参数（JSON请求体或查询参数，缺省为默认模型）选择模型，
+    确保预测器已初始化且模型已就绪；选中的预测器保存在 g.predictor
+    """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if predictor is None:
-            return jsonify({
-                'error': 'Predictor not initialized',
-                'message': '预测器未初始化，请重启服务'
-            }), 500
+        if registry is None:
+            return error_response('Predictor not initialized',
+                                  '预测器未初始化，请重启服务', 500)
+        data = request.get_json(silent=True)
+        name = data.get('model') if isinstance(data, dict) else None
+        name = name or request.args.get('model')
+        if name is not None and not isinstance(name, str):
+            return error_response('Invalid model', 'model必须是字符串', 400)
+        try:
+            g.predictor = registry.get(name)
+        except UnknownModelError as e:
+            return error_response('Unknown model', str(e), 404)
+        if not g.predictor.ready.is_set():
+            response, status = error_response('Predictor not ready',
+                                              '模型正在加载，请稍后重试', 503)
+            response.headers['Retry-After'] = '5'
+            return response, status
         return f(*args, **kwargs)
     return decorated_function
 
-@app.route('/', methods=['GET'])
-def health_check():
-    """健康检查接口"""
-    status = 'healthy' if predictor is not None else 'unhealthy'
+def health_snapshot():
+    """健康状态快照，模型版本、常驻模型变化或缓存过期时才重新生成"""
+    now = time.monotonic()
+    key = None
+    if registry is not None:
+        key = (predictor.model_version, tuple(registry.resident()))
+    cache = _health_cache
+    if (cache['payload'] is not None and
+            cache['key'] == key and
+            now - cache['time'] < HEALTH_CACHE_SECONDS):
+        return cache['payload']
+    
+    if predictor is None:
+        status = 'unhealthy'
+    elif predictor.ready.is_set():
+        status = 'healthy'
+    elif predictor.loading_complete.is_set():
+        status = 'unhealthy'  # 全部成员加载失败
+    else:
+        status = 'loading'
     info = {
         'status': status,
         'service': 'Odor Prediction API',
         'version': '1.0.0',
         'cpu_only': True
     }
-    
     if predictor is not None:
         try:
-            sys_info = predictor.get_system_info()
-            info.update(sys_info)
+            info.update(predictor.get_system_info())
+            if predictor.load_errors:
+                info['load_errors'] = list(predictor.load_errors)
+            info['models'] = registry.describe()
         except Exception as e:
             logger.warning(f"获取系统信息失败: {e}")
     
-    return jsonify(info)
+    cache.update(time=now, key=key, payload=info)
+    return info
+
+@app.route('/', methods=['GET'])
+def health_check():
+    """健康检查接口（缓存快照）"""
+    return jsonify(health_snapshot())
+
+@app.route('/livez', methods=['GET'])
+def livez():
+    """存活探针：进程能够响应请求即可"""
+    return jsonify({'status': 'alive'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """就绪探针：已加载足够的集成成员，可以处理预测请求"""
+    info = health_snapshot()
+    ready = predictor is not None and predictor.ready.is_set()
+    return jsonify({
+        'status': 'ready' if ready else info['status'],
+        'models_loaded': info.get('models_loaded', 0),
+        'models_expected': info.get('models_expected', 0),
+        'min_models_ready': predictor.min_models_ready if predictor else None,
+    }), 200 if ready else 503
 
 @app.route('/predict', methods=['POST'])
+@track_request
 @require_predictor
+@profile_if_requested
 def predict_single():
     """预测单个分子的气味"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
         if not data or 'smiles' not in data:
-            return jsonify({
-                'error': 'Missing SMILES',
-                'message': '请提供SMILES字符串'
-            }), 400
+            return error_response('Missing SMILES', '请提供SMILES字符串', 400)
         
         smiles = data['smiles']
         top_k = data.get('top_k', 10)
         
         if not isinstance(smiles, str) or not smiles.strip():
-            return jsonify({
-                'error': 'Invalid SMILES',
-                'message': 'SMILES必须是非空字符串'
-            }), 400
+            return error_response('Invalid SMILES', 'SMILES必须是非空字符串', 400)
         
         if not isinstance(top_k, int) or top_k <= 0:
-            return jsonify({
-                'error': 'Invalid top_k',
-                'message': 'top_k必须是正整数'
-            }), 400
+            return error_response('Invalid top_k', 'top_k必须是正整数', 400)
         
+        g.molecule_count = 1
         start_time = time.time()
-        top_odors = predictor.get_top_odors(smiles, top_k=min(top_k, 50))
+        top_odors = g.predictor.get_top_odors(smiles, top_k=min(top_k, 50))
         prediction_time = time.time() - start_time
         
-        result = {
-            'smiles': smiles,
-            'top_odors': top_odors.to_dict('records'),
-            'prediction_time_seconds': round(prediction_time, 3)
-        }
-        
-        return jsonify(result)
+        with metrics.stage('serialize'):
+            result = {
+                'smiles': smiles,
+                'model': g.predictor.name,
+                'top_odors': top_odors.to_dict('records'),
+                'prediction_time_seconds': round(prediction_time, 3)
+            }
+            return jsonify(result)
         
+    except InvalidSmilesError as e:
+        return error_response('Invalid SMILES', str(e), 400)
     except Exception as e:
         logger.error(f"预测失败: {e}")
-        return jsonify({
-            'error': 'Prediction failed',
-            'message': str(e)
-        }), 500
+        return error_response('Prediction failed', str(e), 500,
+                              error_type=type(e).__name__)
 
 @app.route('/predict_batch', methods=['POST'])
+@track_request
 @require_predictor
+@profile_if_requested
 def predict_batch():
     """批量预测多个分子的气味"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
         if not data or 'smiles_list' not in data:
-            return jsonify({
-                'error': 'Missing SMILES list',
-                'message': '请提供SMILES字符串列表'
-            }), 400
+            return error_response('Missing SMILES list', '请提供SMILES字符串列表', 400)
         
         smiles_list = data['smiles_list']
         threshold = data.get('threshold', 0.5)
         
         if not isinstance(smiles_list, list) or len(smiles_list) == 0:
-            return jsonify({
-                'error': 'Invalid SMILES list',
-                'message': 'smiles_list必须是非空列表'
-            }), 400
+            return error_response('Invalid SMILES list', 'smiles_list必须是非空列表', 400)
         
         if len(smiles_list) > 100:
-            return jsonify({
-                'error': 'Too many molecules',
-                'message': '单次最多预测100个分子'
-            }), 400
+            return error_response('Too many molecules', '单次最多预测100个分子', 400)
         
         if not isinstance(threshold, (int, float)) or not (0 <= threshold <= 1):
-            return jsonify({
-                'error': 'Invalid threshold',
-                'message': 'threshold必须在0-1之间'
-            }), 400
+            return error_response('Invalid threshold', 'threshold必须在0-1之间', 400)
         
+        g.molecule_count = len(smiles_list)
         start_time = time.time()
-        results, binary_results = predictor.predict_smiles(smiles_list, threshold=threshold)
+        results, binary_results = g.predictor.predict_smiles(smiles_list,
+                                                             threshold=threshold)
         prediction_time = time.time() - start_time
         
-        result = {
-            'molecule_count': len(smiles_list),
-            'threshold': threshold,
-            'predictions': results.to_dict('records'),
-            'binary_predictions': binary_results.to_dict('records'),
-            'prediction_time_seconds': round(prediction_time, 3)
-        }
-        
-        return jsonify(result)
+        with metrics.stage('serialize'):
+            result = {
+                'molecule_count': len(smiles_list),
+                'model': g.predictor.name,
+                'threshold': threshold,
+                'predictions': results.to_dict('records'),
+                'binary_predictions': binary_results.to_dict('records'),
+                'prediction_time_seconds': round(prediction_time, 3)
+            }
+            return jsonify(result)
         
+    except InvalidSmilesError as e:
+        return error_response('Invalid SMILES', str(e), 400)
     except Exception as e:
         logger.error(f"批量预测失败: {e}")
-        return jsonify({
-            'error': 'Batch prediction failed',
-            'message': str(e)
-        }), 500
+        return error_response('Batch prediction failed', str(e), 500,
+                              error_type=type(e).__name__)
 
 @app.route('/tasks', methods=['GET'])
 @require_predictor
 def get_tasks():
     """获取所有支持的气味任务"""
     return jsonify({
-        'tasks': predictor.tasks,
-        'task_count': predictor.n_tasks
+        'model': g.predictor.name,
+        'tasks': g.predictor.tasks,
+        'task_count': g.predictor.n_tasks
+    })
+
+@app.route('/models', methods=['GET'])
+def list_models():
+    """列出注册表中的模型及其加载状态"""
+    if registry is None:
+        return error_response('Predictor not initialized',
+                              '预测器未初始化，请重启服务', 500)
+    return jsonify({
+        'default': registry.default,
+        'max_resident': registry.max_resident,
+        'models': registry.describe()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus监控指标"""
+    data, content_type = metrics.render()
+    return Response(data, content_type=content_type)
+
+@app.route('/admin/profiles', methods=['GET'])
+@require_admin
+def list_profiles():
+    """列出环形缓冲区中的性能分析结果"""
+    profiles = profiling.list_profiles()
+    return jsonify({
+        'profiles': profiles,
+        'count': len(profiles),
+        'capacity': profiling.PROFILE_BUFFER_SIZE
+    })
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+@require_admin
+def get_profile(profile_id):
+    """获取单个性能分析结果"""
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        return error_response('Profile not found', '性能分析结果不存在或已被覆盖', 404)
+    return jsonify(profile)
+
+@app.route('/admin/reload', methods=['POST'])
+@require_admin_token
+@require_predictor
+def reload_models():
+    """
+    在后台热加载集成模型（请求体的model参数选择模型；只作用于处理该请求的工作进程，
+    多进程部署请使用 MODEL_WATCH_INTERVAL 文件监测；使用共享推理进程时作用于所有推理副本）
+    """
+    data = request.get_json(silent=True) or {}
+    model_dir_prefix = data.get('model_dir_prefix')
+    n_models = data.get('n_models')
+    if n_models is not None and (not isinstance(n_models, int) or n_models <= 0):
+        return error_response('Invalid n_models', 'n_models必须是正整数', 400)
+    try:
+        replicas = g.predictor.reload_in_background(
+            model_dir_prefix=model_dir_prefix, n_models=n_models)
+    except ReloadInProgressError as e:
+        return error_response('Reload in progress', str(e), 409)
+    response = {
+        'status': 'started',
+        'model': g.predictor.name,
+        'current_version': g.predictor.model_version,
+        'pid': os.getpid()
+    }
+    if replicas is not None:
+        response['replicas'] = replicas  # 共享推理进程各副本的转发结果
+    return jsonify(response), 202
+
+@app.route('/admin/reload', methods=['GET'])
+@require_admin_token
+@require_predictor
+def reload_status():
+    """最近一次热加载的状态"""
+    return jsonify({
+        'model': g.predictor.name,
+        'current_version': g.predictor.model_version,
+        'pid': os.getpid(),
+        **g.predictor.reload_status
     })
 
 @app.errorhandler(404)
@@ -194,12 +480,12 @@ def main():
     """启动服务器"""
     print("=== 分子气味预测 API 服务器 ===")
     
-    # 初始化预测器
-    if not init_predictor():
+    # 初始化预测器（模型在后台并行加载，服务器立即开始监听）
+    if not init_predictor(background=True):
         print("❌ 预测器初始化失败，服务器启动中止")
         return
     
-    print("✓ 预测器初始化成功")
+    print("✓ 预测器初始化成功，模型正在后台加载（就绪状态见 /readyz）")
     
     # 服务器配置
     host = os.environ.get('HOST', '0.0.0.0')
@@ -213,14 +499,18 @@ def main():
     
     print(f"\nAPI接口:")
     print(f"  健康检查: http://{host}:{port}/")
+    print(f"  存活/就绪探针: http://{host}:{port}/livez, http://{host}:{port}/readyz")
     print(f"  单分子预测: http://{host}:{port}/predict")
     print(f"  批量预测: http://{host}:{port}/predict_batch")
     print(f"  气味任务: http://{host}:{port}/tasks")
+    print(f"  模型列表: http://{host}:{port}/models")
+    print(f"  监控指标: http://{host}:{port}/metrics")
+    print(f"  模型热加载: http://{host}:{port}/admin/reload (需ADMIN_TOKEN)")
     
     print(f"\n使用示例:")
     print(f"  curl -X POST http://{host}:{port}/predict \\")
     print(f"       -H 'Content-Type: application/json' \\")
-    print(f"       -d '{{\"smiles\": \"CCO\", \"top_k\": 5}}'")
+    print(f"       -d '{{\"smiles\": \"CCO\", \"top_k\": 5, \"model\": \"full\"}}'")
     
     print(f"\n✓ 启动服务器...")
     
@@ -22,6 +22,11 @@ HOST=${HOST:-"0.0.0.0"}
 PORT=${PORT:-"5000"}
 TIMEOUT=${TIMEOUT:-300}  # 超时时间(秒)
 
+# Prometheus多进程指标目录（各工作进程的指标在/metrics中汇总）
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-"/tmp/odor_prometheus"}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 # CPU优化
 export OMP_NUM_THREADS=${OMP_NUM_THREADS:-"4"}
 export MKL_NUM_THREADS=${MKL_NUM_THREADS:-"4"}
@@ -31,15 +36,58 @@ echo "   工作进程数: $WORKERS"
 echo "   绑定地址: $HOST:$PORT"
 echo "   超时时间: $TIMEOUT 秒"
 echo "   CPU线程数: $OMP_NUM_THREADS"
+echo "   指标目录: $PROMETHEUS_MULTIPROC_DIR"
+
+GUNICORN_ARGS=(
+    --workers $WORKERS
+    --bind $HOST:$PORT
+    --timeout $TIMEOUT
+    --worker-class sync
+    --access-logfile access.log
+    --access-logformat '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" %(D)s %({x-molecule-count}o)s'
+    --error-logfile error.log
+    --log-level info
+    --preload
+    server_deploy:app
+)
+
+# 启动Gunicorn（未使用共享推理进程时直接替换为gunicorn进程）
+if [ -z "$INFERENCE_SOCKET" ]; then
+    exec gunicorn "${GUNICORN_ARGS[@]}"
+fi
+
+# 共享推理进程：模型只在推理副本中加载，Web工作进程通过Unix套接字提交预测
+INFERENCE_REPLICAS=${INFERENCE_REPLICAS:-1}
+echo "   推理套接字: $INFERENCE_SOCKET (副本数: $INFERENCE_REPLICAS)"
+rm -f "$INFERENCE_SOCKET"
+python inference_server.py --socket "$INFERENCE_SOCKET" \
+    --replicas "$INFERENCE_REPLICAS" >> inference.log 2>&1 &
+INFERENCE_PID=$!
+GUNICORN_PID=
+trap 'kill $GUNICORN_PID $INFERENCE_PID 2>/dev/null' EXIT
+trap 'exit 143' INT TERM
+for _ in $(seq 1 100); do
+    [ -S "$INFERENCE_SOCKET" ] && break
+    if ! kill -0 $INFERENCE_PID 2>/dev/null; then
+        echo "❌ 错误: 推理进程启动失败，见 inference.log"
+        exit 1
+    fi
+    sleep 0.1
+done
 
-# 启动Gunicorn
-exec gunicorn \
-    --workers $WORKERS \
-    --bind $HOST:$PORT \
-    --timeout $TIMEOUT \
-    --worker-class sync \
-    --access-logfile access.log \
-    --error-logfile error.log \
-    --log-level info \
-    --preload \
-    server_deploy:app 
\ No newline at end of file
+# gunicorn在后台运行，脚本在wait中才能及时处理信号：
+# TERM/INT转发给gunicorn，待其处理完进行中的请求后再停止推理进程
+gunicorn "${GUNICORN_ARGS[@]}" &
+GUNICORN_PID=$!
+trap 'kill -TERM $GUNICORN_PID 2>/dev/null' INT TERM
+# 收到信号时wait提前返回，继续等待gunicorn退出
+wait $GUNICORN_PID
+STATUS=$?
+while kill -0 $GUNICORN_PID 2>/dev/null; do
+    wait $GUNICORN_PID
+    STATUS=$?
+done
+kill -TERM $INFERENCE_PID 2>/dev/null
+wait $INFERENCE_PID
+trap - EXIT
+exit $STATUS
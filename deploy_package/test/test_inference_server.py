@@ -0,0 +1,245 @@
+import os
+import socket
+import tempfile
+import threading
+import numpy as np
+import pytest
+from inference_server import (InferenceClient, InferenceServer,
+                              RemoteRegistry, bind_socket, recv_message,
+                              send_message)
+from model_registry import UnknownModelError
+from predict_odor_cpu import (InvalidSmilesError, ModelsNotReadyError,
+                              ReloadInProgressError)
+
+TASKS = ['fruity', 'green', 'sweet']
+
+
+class FakePredictor(object):
+    """Scores a SMILES by its length, 'x...' SMILES are invalid"""
+
+    def __init__(self, name, ready=True):
+        self.name = name
+        self.tasks = TASKS
+        self.models = [None, None]
+        self.model_version = 'v1'
+        self.min_models_ready = 2
+        self.load_errors = []
+        self.reload_status = {'state': 'idle'}
+        self.ready = threading.Event()
+        self.loading_complete = threading.Event()
+        if ready:
+            self.ready.set()
+            self.loading_complete.set()
+        self.batches = []
+
+    def predict_proba(self, smiles_list):
+        invalid = [s for s in smiles_list if s.startswith('x')]
+        if invalid:
+            raise InvalidSmilesError(invalid)
+        self.batches.append(len(smiles_list))
+        # float64 on purpose, the server sends float32 rows
+        lengths = np.array([len(s) for s in smiles_list], dtype=np.float64)
+        return lengths[:, None] * np.arange(1, len(TASKS) + 1)
+
+    def get_system_info(self):
+        return {'models_loaded': len(self.models)}
+
+    def reload_in_background(self, model_dir_prefix=None, n_models=None):
+        if self.reload_status['state'] == 'loading':
+            raise ReloadInProgressError('busy')
+        self.reload_status = {'state': 'loading'}
+
+
+class FakeRegistry(object):
+
+    def __init__(self):
+        self.predictors = {
+            'full': FakePredictor('full'),
+            'cold': FakePredictor('cold', ready=False)
+        }
+        self.default = 'full'
+        self.entries = {name: {} for name in self.predictors}
+        self.max_resident = 2
+
+    def get(self, name=None):
+        name = name or self.default
+        if name not in self.predictors:
+            raise UnknownModelError(name, self.entries)
+        return self.predictors[name]
+
+    def resident(self):
+        return list(self.predictors)
+
+    def describe(self):
+        return [{'name': name} for name in self.predictors]
+
+
+@pytest.fixture
+def socket_dir():
+    with tempfile.TemporaryDirectory() as path:
+        yield path
+
+
+def start_server(path, **kwargs):
+    registry = FakeRegistry()
+    server = InferenceServer(registry, bind_socket(path), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, registry
+
+
+def test_message_framing():
+    """
+    Test headers and float32 payloads round-trip over a socket pair
+    """
+    left, right = socket.socketpair()
+    try:
+        rows = np.arange(6, dtype=np.float32).reshape(2, 3)
+        send_message(left, {'op': 'x', 'shape': [2, 3]}, rows)
+        send_message(left, {'op': 'empty'})
+        header, payload = recv_message(right)
+        assert header == {'op': 'x', 'shape': [2, 3]}
+        assert np.array_equal(
+            np.frombuffer(payload, dtype=np.float32).reshape(2, 3), rows)
+        assert recv_message(right) == ({'op': 'empty'}, bytearray())
+        left.close()
+        assert recv_message(right) == (None, None)
+    finally:
+        right.close()
+
+
+def test_inference_server(socket_dir):
+    """
+    Test concurrent requests are batched, invalid SMILES only fail their
+    own request, and errors are raised as the predictor's exceptions
+    """
+    path = os.path.join(socket_dir, 'inference.sock')
+    server, registry = start_server(path, batch_wait_ms=200)
+    client = InferenceClient(path, timeout=10)
+    try:
+        requests = [['CC'], ['CCO', 'C'], ['xx'], ['CCCC', 'xy']]
+        results = {}
+
+        def run(i):
+            try:
+                results[i] = client.predict(requests[i])[0]
+            except InvalidSmilesError as e:
+                results[i] = e.invalid_smiles
+
+        threads = [
+            threading.Thread(target=run, args=(i,))
+            for i in range(len(requests))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert registry.predictors['full'].batches == [3]
+        assert results[0].dtype == np.float32
+        assert np.array_equal(results[0], [[2, 4, 6]])
+        assert np.array_equal(results[1], [[3, 6, 9], [1, 2, 3]])
+        assert results[2] == ['xx']
+        assert results[3] == ['xy']
+
+        with pytest.raises(UnknownModelError) as e:
+            client.predict(['C'], model='missing')
+        assert e.value.available == ['full', 'cold']
+        with pytest.raises(ModelsNotReadyError):
+            client.predict(['C'], model='cold')
+
+        client.reload()
+        with pytest.raises(ReloadInProgressError):
+            client.reload()
+    finally:
+        client.close()
+        server.close()
+
+
+def test_remote_registry(socket_dir):
+    """
+    Test the registry proxy reports the server state, and a predictor
+    that is not ready while the server is unreachable
+    """
+    path = os.path.join(socket_dir, 'inference.sock')
+    registry = RemoteRegistry(InferenceClient(path, timeout=10),
+                              default='full')
+    predictor = registry.get()
+    assert not predictor.ready.is_set()
+    assert registry.default == 'full'
+    assert registry.entries == []
+
+    server, _ = start_server(path)
+    try:
+        predictor.status(refresh=True)
+        assert predictor.ready.is_set()
+        assert predictor.tasks == TASKS
+        assert registry.entries == ['full', 'cold']
+        assert not registry.get('cold').ready.is_set()
+        with pytest.raises(UnknownModelError):
+            registry.get('missing')
+        results, binary = predictor.predict_smiles(['C', 'CCO'],
+                                                   threshold=4)
+        assert results[TASKS].to_numpy().tolist() == [[1, 2, 3], [3, 6, 9]]
+        assert binary[[f'{t}_binary' for t in TASKS]].to_numpy().tolist() \
+            == [[0, 0, 0], [0, 1, 1]]
+        top = predictor.get_top_odors('CC', top_k=2)
+        assert top['odor'].tolist() == ['sweet', 'green']
+    finally:
+        server.close()
+
+
+def test_reload_reaches_every_replica(socket_dir):
+    """
+    Test a reload received by one replica is forwarded to the others
+    """
+    controls = [os.path.join(socket_dir, f'control.{i}') for i in range(2)]
+    shared = bind_socket(os.path.join(socket_dir, 'inference.sock'))
+    servers = []
+    for i, control in enumerate(controls):
+        server = InferenceServer(FakeRegistry(),
+                                 shared,
+                                 control_listener=bind_socket(control),
+                                 peers=[p for p in controls if p != control])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    client = InferenceClient(os.path.join(socket_dir, 'inference.sock'),
+                             timeout=10)
+    try:
+        response = client.reload()
+        assert [r['status'] for r in response['replicas']] == \
+            ['started', 'started']
+        for server in servers:
+            predictor = server.registry.get()
+            assert predictor.reload_status['state'] == 'loading'
+        status = client.reload_status()
+        assert [r['state'] for r in status['replicas']] == \
+            ['loading', 'loading']
+    finally:
+        client.close()
+        # the servers share the listener, stop them all before closing it
+        for server in servers:
+            server._closed.set()
+        for server in servers:
+            server.close()
+
+
+def test_server_deploy_remote_mode(socket_dir, monkeypatch):
+    """
+    Test the API predicts through the inference process and rejects
+    per-request profiling, which cannot see the inference process
+    """
+    server_deploy = pytest.importorskip('server_deploy')
+    path = os.path.join(socket_dir, 'inference.sock')
+    server, _ = start_server(path)
+    registry = RemoteRegistry(InferenceClient(path, timeout=10))
+    monkeypatch.setenv('INFERENCE_SOCKET', path)
+    monkeypatch.setattr(server_deploy, 'registry', registry)
+    monkeypatch.setattr(server_deploy, 'predictor', registry.get())
+    try:
+        client = server_deploy.app.test_client()
+        response = client.post('/predict', json={'smiles': 'CCO'})
+        assert response.status_code == 200
+        assert response.get_json()['top_odors'][0]['odor'] == 'sweet'
+        response = client.post('/predict?profile=1', json={'smiles': 'CCO'})
+        assert response.status_code == 501
+    finally:
+        server.close()
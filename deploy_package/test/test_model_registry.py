@@ -0,0 +1,80 @@
+import threading
+import pytest
+from model_registry import ModelRegistry, UnknownModelError
+
+
+class FakePredictor(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_registry_loads_without_blocking_lookups(tmp_path):
+    """
+    Test a model being created does not block lookups of resident models,
+    concurrent requests for it share one predictor, and evicted predictors
+    are closed
+    """
+    registry = ModelRegistry(root=str(tmp_path), max_resident=2,
+                             default='full', background=False)
+    registry.entries = {name: {} for name in ('full', 'fast', 'distilled')}
+    started = threading.Event()
+    release = threading.Event()
+    created = []
+
+    def create(name):
+        created.append(name)
+        if name == 'fast':
+            started.set()
+            assert release.wait(10)
+        return FakePredictor(name)
+
+    registry._create = create
+    full = registry.get()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        registry.get('fast'))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(10)
+    assert registry.get('full') is full
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert created == ['full', 'fast']
+    assert results[0] is results[1]
+
+    fast = results[0]
+    registry.get('distilled')
+    assert registry.resident() == ['full', 'distilled']
+    assert fast.closed and not full.closed
+    with pytest.raises(UnknownModelError):
+        registry.get('missing')
+
+
+def test_registry_refresh_is_throttled(tmp_path):
+    """
+    Test unknown model names rescan the registry at most once per
+    refresh interval
+    """
+    registry = ModelRegistry(root=str(tmp_path), default='full',
+                             refresh_interval=60)
+    scans = []
+    discover = registry._discover
+    registry._discover = lambda: scans.append(1) or discover()
+    for name in ('a', 'b', 'c'):
+        with pytest.raises(UnknownModelError):
+            registry.get(name)
+    assert scans == []
+
+    registry._refreshed_at -= 60
+    for name in ('a', 'b'):
+        with pytest.raises(UnknownModelError):
+            registry.get(name)
+    assert scans == [1]
+    registry.refresh()
+    assert scans == [1, 1]
@@ -0,0 +1,27 @@
+import gc
+import shutil
+import weakref
+from benchmark_pipeline import build_random_ensemble
+from predict_odor_cpu import OdorPredictorCPU
+
+
+def test_reload_releases_old_models():
+    """
+    Test a hot reload swaps the ensemble and the models of the previous
+    version are freed once it is drained
+    """
+    prefix, root = build_random_ensemble(2)
+    try:
+        predictor = OdorPredictorCPU(model_dir_prefix=prefix, n_models=2)
+        old_version = predictor.model_version
+        old_models = [weakref.ref(model) for model in predictor.models]
+        status = predictor.reload()
+        assert status['state'] == 'succeeded'
+        assert status['drained']
+        assert status['previous_version'] == old_version
+        assert len(predictor.models) == 2
+        gc.collect()
+        assert all(ref() is None for ref in old_models)
+        assert predictor.predict_proba(['CCO']).shape == (1, predictor.n_tasks)
+    finally:
+        shutil.rmtree(root)